@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This script measures the throughput of DumpReader on a synthetic
+# MediaWiki XML dump.
+#
+# Usage: benchmark_dumpreader.py [--size=MIB] [--page-size=BYTES]
+#            [--compress=none|gz|bz2] [--dump=FILE] [--keep=yes]
+#            [--namespaces=N,N,...] [--prefixes=TITLE,...]
+#            [--categories=NAME,...] [--cache=FILE]
+#
+# By default, a dump of about --size MiB of XML (2 GiB) is generated in a
+# temporary file, compressed as given by --compress, and deleted after
+# the run unless --keep=yes is given. With --dump, an existing dump is
+# read instead. The pages are spread over the namespaces 0 and 2, the
+# prefixes 'Fakeplag/' and 'Andereplag/' and the categories of
+# Corpus.synthetic(), so the filter options select parts of the dump.
+# With --cache, the matching pages are also stored in a PageCache.
+#
+# Reported are the dump size, the time, the throughput in MB/s of the
+# dump file and of the uncompressed XML, the pages per second and the
+# peak resident memory of the process.
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../pym')
+
+from plagwiki.fakewiki.corpus import Corpus
+from plagwiki.fakewiki.dump import DumpWriter
+from plagwiki.loaders.dumpreader import DumpReader
+from plagwiki.loaders.pagecache import PageCache
+import bz2
+import gzip
+import resource
+import tempfile
+import time
+
+
+def generate(f, size, page_size):
+    # the texts of a small synthetic corpus, repeated under new titles
+    corpus = Corpus.synthetic(200, page_size)
+    templates = [corpus.get_page(title) for title in corpus.get_titles()
+            if title.startswith('Fakeplag/Fragment')]
+    writer = DumpWriter(f)
+    num = 0
+    while writer.get_bytes_written() < size:
+        page = dict(templates[num % len(templates)])
+        prefix = ('Fakeplag/', 'Andereplag/')[num // len(templates) % 2]
+        if num % 3 == 2:
+            page['ns'] = 2
+            prefix = 'Benutzer:' + prefix
+        else:
+            page['ns'] = 0
+        page['title'] = '%sFragment %d %02d' % (prefix, num // 10 + 1, num % 10 + 1)
+        page['pageid'] = num + 1
+        page['revid'] = num + 1
+        writer.write_page(page)
+        num += 1
+    writer.close()
+    return num
+
+def split_option(value):
+    if not value:
+        return None
+    return value.split(',')
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+options = {'size': '2048', 'page-size': '4000', 'compress': 'none',
+        'dump': None, 'keep': 'no', 'namespaces': None, 'prefixes': None,
+        'categories': None, 'cache': None}
+for arg in sys.argv[1:]:
+    name, sep, value = arg.partition('=')
+    if name[0:2] != '--' or name[2:] not in options or not sep:
+        print('Unknown option: ' + arg, file=sys.stdout)
+        sys.exit(1)
+    options[name[2:]] = value
+if options['compress'] not in ('none', 'gz', 'bz2'):
+    print('Unknown compression: ' + options['compress'], file=sys.stdout)
+    sys.exit(1)
+
+filename = options['dump']
+generated = False
+try:
+    if filename is None:
+        suffix = {'none': '.xml', 'gz': '.xml.gz', 'bz2': '.xml.bz2'}[options['compress']]
+        fd, filename = tempfile.mkstemp(suffix=suffix, prefix='dump-')
+        os.close(fd)
+        generated = True
+        started = time.time()
+        if options['compress'] == 'gz':
+            f = gzip.GzipFile(filename, 'wb', compresslevel=1)
+        elif options['compress'] == 'bz2':
+            f = bz2.BZ2File(filename, 'wb', compresslevel=1)
+        else:
+            f = open(filename, 'wb')
+        with f:
+            pages = generate(f, int(options['size']) * 1024 * 1024,
+                    int(options['page-size']))
+        print('Generated %s: %d pages, %.1f MB in %.1f s' % (filename, pages,
+                os.path.getsize(filename) / 1e6, time.time() - started))
+
+    cache = None
+    if options['cache']:
+        cache = PageCache(options['cache'])
+    namespaces = split_option(options['namespaces'])
+    if namespaces is not None:
+        namespaces = [int(ns) for ns in namespaces]
+    started = time.time()
+    with DumpReader(filename, namespaces, split_option(options['prefixes']),
+            split_option(options['categories'])) as reader:
+        if cache is not None:
+            matched = reader.import_pages(cache, 'http://localhost/api.php')
+        else:
+            matched = sum(1 for page in reader.iter_pages())
+        elapsed = time.time() - started
+        print('%-10s %10s %10s %9s %10s %10s %10s %10s' % ('file', 'MB',
+                'XML MB', 'seconds', 'MB/s', 'XML MB/s', 'pages/s', 'peak MiB'))
+        print('%-10s %10.1f %10.1f %9.1f %10.1f %10.1f %10.0f %10.1f' % (
+                options['compress'] if generated else 'given',
+                reader.get_bytes_read() / 1e6, reader.get_xml_bytes_read() / 1e6,
+                elapsed, reader.get_bytes_read() / 1e6 / elapsed,
+                reader.get_xml_bytes_read() / 1e6 / elapsed,
+                reader.get_pages_read() / elapsed, peak_rss_mib()))
+        print('%d of %d pages matched' % (matched, reader.get_pages_read()))
+    if cache is not None:
+        cache.close()
+except(KeyboardInterrupt) as err:
+    print()
+    print("Interrupted.")
+finally:
+    if generated and options['keep'] != 'yes':
+        os.remove(filename)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This script measures the throughput of WikiClient against a local
+# stand-in MediaWiki API server (see plagwiki.fakewiki).
+#
+# Usage: benchmark_wikiclient.py [--pages=N] [--page-size=BYTES]
+#            [--latency=SECONDS] [--parallel=N] [--repeat=N]
+#            [--methods=NAME,NAME,...] [--api=URL] [--metrics=FILE]
+#            [--incremental=yes]
+#
+# By default, a FakeWikiServer with a synthetic corpus is started in a
+# separate process. With --api, an already running server is used
+# instead (see fakewiki_server.py). For each benchmarked method, the
+# number of calls, API requests per second, response bytes per second,
+# the 50th and 99th percentile of the call latency and the peak resident
+# memory of the process during the calls are reported, followed by the
+# client-side breakdown of the mean request time (see ClientMetrics).
+# With --incremental=yes, responses are decoded while they arrive (see
+# WikiClient.set_incremental_decoding()). With --metrics, the client
+# metrics are also written to FILE in the Prometheus text format.
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../pym')
+
+from plagwiki.fakewiki.corpus import Corpus
+from plagwiki.fakewiki.server import FakeWikiServer
+from plagwiki.loaders.wikiclient import WikiClient
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+import urllib2
+
+
+def serve(options, urls):
+    corpus = Corpus.synthetic(int(options['pages']), int(options['page-size']))
+    server = FakeWikiServer(corpus, latency=float(options['latency']))
+    urls.put((server.get_api_url(), server.get_stats_url()))
+    server.serve_forever()
+
+def get_totals(stats_url):
+    stats = json.loads(urllib2.urlopen(stats_url).read())
+    return (sum(action['requests'] for action in stats.values()),
+            sum(action['bytes_out'] for action in stats.values()))
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def reset_peak_rss():
+    # On Linux, this resets the peak that ru_maxrss reports, so that it
+    # can be measured per method. Elsewhere, the peak of the whole run
+    # is reported.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except(IOError):
+        pass
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def make_benchmarks(client, titles, upload_filename):
+    def window(i, size):
+        start = (i * size) % max(1, len(titles) - size)
+        return titles[start : start + size]
+    return [
+        ('get_page_text', lambda i: client.get_page_text(titles[i % len(titles)])),
+        ('get_page_info', lambda i: client.get_page_info(titles[i % len(titles)])),
+        ('get_multi_page_info', lambda i: client.get_multi_page_info(window(i, 200))),
+        ('iter_pages', lambda i: list(client.iter_pages(window(i, 200), prop=('revisions',)))),
+        ('get_prefix_list', lambda i: client.get_prefix_list('Fakeplag/')),
+        ('iter_prefix_list', lambda i: sum(1 for page in
+                client.iter_prefix_list('Fakeplag/'))),
+        ('get_category_members', lambda i: client.get_category_members('Kategorie:Gesichtet')),
+        ('iter_category_pages', lambda i: list(client.iter_category_pages(
+                'Kategorie:Quelle %d' % (i % 20 + 1)))),
+        ('get_all_categories', lambda i: client.get_all_categories()),
+        ('parse_page', lambda i: client.parse_page(titles[i % len(titles)])),
+        ('expandtemplates_page', lambda i: client.expandtemplates_page(titles[i % len(titles)])),
+        ('purge_multi', lambda i: client.purge_multi(window(i, 10))),
+        ('edit', lambda i: client.edit('Benutzer:FakeBot/Benchmark %d' % (i % 10),
+                'Benchmark edit %d' % i, 'Benchmark')),
+        ('upload', lambda i: client.upload(upload_filename,
+                'Benchmark %d.png' % (i % 10), 'Benchmark upload', 'Benchmark')),
+    ]
+
+
+options = {'pages': '1000', 'page-size': '4000', 'latency': '0.02',
+        'parallel': '4', 'repeat': '20', 'methods': None, 'api': None,
+        'metrics': None, 'incremental': 'no'}
+for arg in sys.argv[1:]:
+    name, sep, value = arg.partition('=')
+    if name[0:2] != '--' or name[2:] not in options or not sep:
+        print('Unknown option: ' + arg, file=sys.stdout)
+        sys.exit(1)
+    options[name[2:]] = value
+
+process = None
+if options['api']:
+    api_url = options['api']
+    stats_url = api_url.rsplit('/', 1)[0] + '/stats'
+else:
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(options, urls))
+    process.daemon = True
+    process.start()
+    api_url, stats_url = urls.get()
+
+upload_file = tempfile.NamedTemporaryFile(suffix='.png')
+upload_file.write(os.urandom(64 * 1024))
+upload_file.flush()
+
+try:
+    client = WikiClient(api_url)
+    client.set_max_parallel_requests(int(options['parallel']))
+    client.set_incremental_decoding(options['incremental'] == 'yes')
+    client.login('FakeBot', 'benchmark')
+    titles = client.get_prefix_list('Fakeplag/')
+    benchmarks = make_benchmarks(client, titles, upload_file.name)
+    if options['methods']:
+        methods = options['methods'].split(',')
+        benchmarks = [b for b in benchmarks if b[0] in methods]
+    repeat = int(options['repeat'])
+
+    print('%-22s %6s %8s %8s %10s %9s %9s %9s' % ('method', 'calls',
+            'requests', 'req/s', 'KiB/s', 'p50 ms', 'p99 ms', 'peak MiB'))
+    for name, benchmark in benchmarks:
+        requests_before, bytes_before = get_totals(stats_url)
+        reset_peak_rss()
+        latencies = []
+        started = time.time()
+        for i in range(repeat):
+            call_started = time.time()
+            with client.get_metrics().span(name):
+                benchmark(i)
+            latencies.append(time.time() - call_started)
+        elapsed = time.time() - started
+        requests_after, bytes_after = get_totals(stats_url)
+        requests = requests_after - requests_before
+        print('%-22s %6d %8d %8.1f %10.1f %9.1f %9.1f %9.1f' % (name, repeat,
+                requests, requests / elapsed,
+                (bytes_after - bytes_before) / 1024 / elapsed,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, peak_rss_mib()))
+
+    print()
+    print('%-28s %8s %8s %8s %8s %8s %8s' % ('action/module', 'requests',
+            'conn ms', 'ttfb ms', 'total ms', 'json ms', 'KiB/req'))
+    for item in client.get_metrics().get_snapshot()['requests']:
+        histograms = item['histograms']
+        def mean_ms(name):
+            return histograms[name]['sum'] / max(1, histograms[name]['count']) * 1000
+        print('%-28s %8d %8.2f %8.2f %8.2f %8.2f %8.1f' % (
+                '/'.join(filter(None, (item['action'], item['module'])))[:28],
+                item['requests'], mean_ms('connect_seconds'),
+                mean_ms('starttransfer_seconds'), mean_ms('total_seconds'),
+                mean_ms('decode_seconds'),
+                item['response_bytes'] / max(1, item['requests']) / 1024))
+    if options['metrics']:
+        with open(options['metrics'], 'w') as f:
+            f.write(client.get_metrics().to_prometheus().encode('utf-8'))
+    client.logout()
+except(KeyboardInterrupt) as err:
+    print()
+    print("Interrupted.")
+finally:
+    upload_file.close()
+    if process is not None:
+        process.terminate()
@@ -12,8 +12,11 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../pym')
 
 from plagwiki.config import Config
 from plagwiki.loaders.emergencyerror import EmergencyError
+from plagwiki.loaders.titleindex import natsort_key
+from plagwiki.loaders.wikierror import WikiError
 import pprint
 import re
+import time
 
 def ask_user(prompt, default=None):
     while True:
@@ -63,21 +66,29 @@ try:
                 continue
 
             # Ask the user for permission to go ahead
-            pages_in_category = client.get_category_members(title)
+            # (the members' wikitext is fetched in the same query; the
+            # edits below are refused if a page is changed after this)
+            starttimestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            pages_in_category = sorted(
+                    client.iter_category_pages(title, prop=('revisions',)),
+                    key=lambda page: natsort_key(page['title']))
             print()
             print('*** Found offending category: ' + title + ' ***')
             print('Members of this category:')
             for page in pages_in_category:
-                print('  '+page)
+                print('  '+page['title'])
             if not ask_user('Do you want to remove these pages from the category? [Y/n] ', True):
                 print('Skipping ' + title)
                 continue
 
             # Go do it already
             summary = 'PlagWiki-Bot - entferne überflüssige Plagiatsseitenkategorie (' + title + ')'
-            for page in pages_in_category:
-                oldtext = client.get_page_text(page)
-                if oldtext is None:
+            for pageinfo in pages_in_category:
+                page = pageinfo['title']
+                try:
+                    oldtext = pageinfo['revisions'][0]['*']
+                    basetimestamp = pageinfo['revisions'][0]['timestamp']
+                except(LookupError):
                     print('Page does not exist: ' + page)
                     continue
                 newtext = remove_category_plb(oldtext, fulltitle)
@@ -87,7 +98,14 @@ try:
                     pprint.pprint(newtext)
                     if ask_user("Really?"):
                         client.check_emergency()
-                        client.edit(page, newtext, summary)
+                        try:
+                            client.edit(page, newtext, summary,
+                                    basetimestamp=basetimestamp,
+                                    starttimestamp=starttimestamp)
+                        except(WikiError) as err:
+                            # e.g. somebody edited the page in the meantime
+                            print(err)
+                            print('Not edited, please check: ' + page)
                 else:
                     print('Page seems unchanged: ' + page)
 
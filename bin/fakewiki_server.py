@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This script runs a local stand-in MediaWiki API server with a synthetic
+# page corpus, for testing bots and benchmarking without a real wiki.
+#
+# Usage: fakewiki_server.py [--port=N] [--pages=N] [--page-size=BYTES]
+#                           [--latency=SECONDS] [--pagecache=FILE --api=URL]
+#
+# With --pagecache and --api, the corpus is imported from the pages of the
+# wiki at URL that are stored in the given page cache instead.
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../pym')
+
+from plagwiki.fakewiki.corpus import Corpus
+from plagwiki.fakewiki.server import FakeWikiServer
+from plagwiki.loaders.pagecache import PageCache
+
+options = {'port': '8080', 'pages': '1000', 'page-size': '4000',
+        'latency': '0', 'pagecache': None, 'api': None}
+for arg in sys.argv[1:]:
+    name, sep, value = arg.partition('=')
+    if name[0:2] != '--' or name[2:] not in options or not sep:
+        print('Unknown option: ' + arg, file=sys.stdout)
+        sys.exit(1)
+    options[name[2:]] = value
+
+if options['pagecache']:
+    if not options['api']:
+        print('--pagecache requires --api', file=sys.stdout)
+        sys.exit(1)
+    with PageCache(options['pagecache']) as page_cache:
+        corpus = Corpus.from_page_cache(page_cache, options['api'])
+else:
+    corpus = Corpus.synthetic(int(options['pages']), int(options['page-size']))
+
+server = FakeWikiServer(corpus, port=int(options['port']),
+        latency=float(options['latency']))
+print('Serving ' + unicode(len(corpus.get_titles())) + ' pages at ' +
+        server.get_api_url())
+print('Statistics at ' + server.get_stats_url())
+try:
+    server.serve_forever()
+except(KeyboardInterrupt) as err:
+    print()
+    print("Interrupted.")
@@ -1 +1 @@
-__all__ = ["bots", "config", "loaders", "reports", "statistics", "util", "visualizations"]
+__all__ = ["bots", "config", "fakewiki", "loaders", "reports", "statistics", "util", "visualizations"]
@@ -4,30 +4,48 @@
 # ease eventual Python 3 transition
 from __future__ import division, print_function, unicode_literals
 
-__all__ = ["config", "plaginfo", "plagwikiinfo", "plagwikiuser"]
+__all__ = ["clientpool", "config", "plaginfo", "plagwikiinfo", "plagwikiuser"]
 
 
 
 import os.path
+from plagwiki.config.clientpool import ClientPool
 from plagwiki.config.plaginfo import PlagInfo
 from plagwiki.config.plagwikiinfo import PlagWikiInfo
 from plagwiki.config.plagwikiuser import PlagWikiUser
+from plagwiki.loaders.asyncwikiclient import AsyncWikiClient
+from plagwiki.loaders.cassette import Cassette, RecordingCurlEngine, ReplayEngine
+from plagwiki.loaders.pagecache import PageCache
+from plagwiki.loaders.parsecache import ParseCache
+from plagwiki.loaders.ratelimiter import RequestScheduler
+from plagwiki.loaders.retrypolicy import CircuitBreaker, RetryPolicy
+from plagwiki.loaders.sessionstore import SessionStore
 from plagwiki.loaders.wikiclient import WikiClient
+from plagwiki.loaders.wikimirror import WikiMirror
 from plagwiki.util.plagerror import PlagError
 
 
 class Config(object):
     def __init__(self, directory=None):
+        self._directory = None
         self._plagwikis = {}
         self._plagwikis_canon = {}
         self._plags = {}
         self._plags_canon = {}
         self._users = {}
         self._users_canon = {}
+        self._page_caches = {}
+        self._parse_caches = {}
+        self._session_stores = {}
+        self._mirrors = {}
+        self._schedulers = {}
+        self._circuit_breakers = {}
+        self._client_pool = None
         if directory is not None:
             self.load(directory)
 
     def load(self, directory):
+        self._directory = directory
         self._plagwikis = PlagWikiInfo.all_from_file(os.path.join(directory, 'plagwiki.conf'))
         self._plags = PlagInfo.all_from_file(os.path.join(directory, 'plags.conf'))
         self._users = PlagWikiUser.all_from_file(os.path.join(directory, 'users.conf'))
@@ -75,30 +93,138 @@ class Config(object):
     def get_all_users(self):
         return self._users.keys()
 
-    def create_wiki_client(self, name, login=True):
+    def create_wiki_client(self, name, login=True, record=None, replay=None,
+            engine=None):
+        # record or replay may name a cassette file to record all API
+        # traffic to, or to serve it from instead of the network; engine
+        # may be a CurlEngine to use instead of a new one
         wikiinfo = self.get_plagwiki(name)
-        client = WikiClient(wikiinfo.api)
-        if wikiinfo.software == 'MediaWiki+SMW':
-            client.enable_semantic_mediawiki(wikiinfo.ask)
+        if [record, replay, engine].count(None) < 2:
+            raise PlagError('Only one of record, replay and engine may be given')
+        elif record is not None:
+            engine = RecordingCurlEngine(Cassette(record, 'record'))
+        elif replay is not None:
+            engine = ReplayEngine(Cassette(replay, 'replay'))
+        client = WikiClient(wikiinfo.api, engine)
+        self._setup_wiki_client(wikiinfo, client)
         if login:
             self.login_wiki_client(name, client)
         return client
 
+    def create_async_wiki_client(self, name, login=True):
+        wikiinfo = self.get_plagwiki(name)
+        async_client = AsyncWikiClient(wikiinfo.api)
+        self._setup_wiki_client(wikiinfo, async_client.get_client())
+        if login:
+            self.login_wiki_client(name, async_client.get_client())
+        return async_client
+
+    def get_client_pool(self):
+        # reused clients for scripts that need several, see ClientPool
+        if self._client_pool is None:
+            self._client_pool = ClientPool(self)
+        return self._client_pool
+
+    def get_page_cache(self, filename):
+        filename = self._get_path(filename)
+        if filename not in self._page_caches:
+            self._page_caches[filename] = PageCache(filename)
+        return self._page_caches[filename]
+
+    def get_parse_cache(self, filename):
+        filename = self._get_path(filename)
+        if filename not in self._parse_caches:
+            self._parse_caches[filename] = ParseCache(filename)
+        return self._parse_caches[filename]
+
+    def get_session_store(self, filename):
+        filename = self._get_path(filename)
+        if filename not in self._session_stores:
+            self._session_stores[filename] = SessionStore(filename)
+        return self._session_stores[filename]
+
+    def get_wiki_mirror(self, name, client=None):
+        # the mirror of a wiki (see the mirror option), or None; client is
+        # needed to fill it, reading works without one
+        wikiinfo = self.get_plagwiki(name)
+        if not wikiinfo.mirror:
+            return None
+        filename = self._get_path(wikiinfo.mirror)
+        key = (filename, wikiinfo.api)
+        if key not in self._mirrors:
+            self._mirrors[key] = WikiMirror(filename, wikiinfo.api)
+        if client is not None:
+            self._mirrors[key].set_client(client)
+        return self._mirrors[key]
+
+    def get_request_scheduler(self, name):
+        # all clients of a wiki share the same rate limits
+        wikiinfo = self.get_plagwiki(name)
+        if wikiinfo.name not in self._schedulers:
+            self._schedulers[wikiinfo.name] = RequestScheduler(
+                    wikiinfo.readrate, wikiinfo.writerate, wikiinfo.maxlag)
+        return self._schedulers[wikiinfo.name]
+
+    def get_circuit_breaker(self, name):
+        # all clients of a wiki stop together when it keeps failing
+        wikiinfo = self.get_plagwiki(name)
+        if wikiinfo.name not in self._circuit_breakers:
+            self._circuit_breakers[wikiinfo.name] = CircuitBreaker()
+        return self._circuit_breakers[wikiinfo.name]
+
+    def create_retry_policy(self, name):
+        wikiinfo = self.get_plagwiki(name)
+        kw = {}
+        for option, arg in (('maxattempts', 'max_attempts'),
+                ('connecttimeout', 'connect_timeout'), ('timeout', 'timeout'),
+                ('deadline', 'deadline')):
+            if getattr(wikiinfo, option) is not None:
+                kw[arg] = getattr(wikiinfo, option)
+        return RetryPolicy(**kw)
+
     def login_wiki_client(self, name, client):
         if self.has_user(name):
             userinfo = self.get_user(name)
             if userinfo.username and userinfo.password:
                 client.login(userinfo.username, userinfo.password)
-            client.set_emergency_page(userinfo.emergencypage, userinfo.emergencyvar)
-
-    def create_plag_client(self, name, login=True):
+            if userinfo.emergencymaxage is None:
+                client.set_emergency_page(userinfo.emergencypage, userinfo.emergencyvar)
+            else:
+                client.set_emergency_page(userinfo.emergencypage,
+                        userinfo.emergencyvar, userinfo.emergencymaxage)
+            monitor = client.get_emergency_monitor()
+            if monitor is not None and userinfo.emergencyinterval is not None:
+                monitor.start(userinfo.emergencyinterval)
+
+    def create_plag_client(self, name, login=True, record=None, replay=None):
         plaginfo = self.get_plag(name)
-        return self.create_wiki_client(plaginfo.wiki, login)
+        return self.create_wiki_client(plaginfo.wiki, login, record, replay)
 
     def login_plag_client(self, name):
         plaginfo = self.get_plag(name)
         self.login_wiki_client(plaginfo.wiki)
 
+    def _setup_wiki_client(self, wikiinfo, client):
+        if wikiinfo.software == 'MediaWiki+SMW':
+            client.enable_semantic_mediawiki(wikiinfo.ask)
+        if wikiinfo.parallelrequests is not None:
+            client.set_max_parallel_requests(wikiinfo.parallelrequests)
+        if wikiinfo.pagecache:
+            client.set_page_cache(self.get_page_cache(wikiinfo.pagecache))
+        if wikiinfo.parsecache:
+            client.set_parse_cache(self.get_parse_cache(wikiinfo.parsecache))
+        if wikiinfo.sessionstore:
+            client.set_session_store(self.get_session_store(wikiinfo.sessionstore))
+        client.set_request_scheduler(self.get_request_scheduler(wikiinfo.name))
+        client.set_retry_policy(self.create_retry_policy(wikiinfo.name))
+        client.set_circuit_breaker(self.get_circuit_breaker(wikiinfo.name))
+
+    def _get_path(self, filename):
+        # relative paths are relative to the configuration directory
+        if self._directory is not None:
+            filename = os.path.join(self._directory, filename)
+        return os.path.normpath(filename)
+
     def _canonicalize(self):
         self._plagwikis_canon = self._canonicalize_dict(self._plagwikis)
         self._plags_canon = self._canonicalize_dict(self._plags)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import sys
+import threading
+import time
+
+from plagwiki.loaders.curlengine import CurlEngine, create_share
+from plagwiki.loaders.wikierror import WikiError
+
+
+class ClientPool(object):
+    """Hands out reusable WikiClients for the wikis of a Config.
+
+    Scripts that work on several wikis, or create clients in a loop, get
+    a released client back instead of a new one, so its connections,
+    DNS lookups and TLS sessions are reused. All clients of a wiki share
+    a pycurl.CurlShare (see create_share()), which also means that they
+    share the login session: the pool logs in only once per wiki, and
+    further clients take over that session.
+
+    Use acquire() and release(), or the client() context manager:
+        with config.get_client_pool().client('VroniPlag') as client:
+            do something with client
+
+    Clients are never logged out when they are released. A client that
+    has been idle for more than check_interval seconds is checked before
+    it is handed out again: if the wiki cannot be reached, the client is
+    replaced, and if its session has timed out, it logs in again. Long
+    running daemons can therefore keep using the pool indefinitely.
+
+    close() logs out of (or saves the sessions of, see
+    WikiClient.set_session_store()) all wikis and closes all clients.
+    A ClientPool may be used by several threads.
+
+    """
+
+    def __init__(self, config, max_idle=4, check_interval=300):
+        """Constructor.
+
+        config is the Config the clients are created with. At most
+        max_idle released clients are kept per wiki; further ones are
+        closed.
+
+        """
+        self._config = config
+        self._max_idle = max_idle
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        # held while logging in, so that concurrent acquire() calls do not
+        # start competing sessions
+        self._login_lock = threading.Lock()
+        # per (wiki name, login): the share of the clients
+        self._shares = {}
+        # per (wiki name, login): list of (client, released at, generation)
+        self._idle = {}
+        # id(client) -> (key, client, generation)
+        self._in_use = {}
+        # per (wiki name, login): the client whose session the others share,
+        # and the generation of that session
+        self._leaders = {}
+        self._generations = {}
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    ### Handing out clients ###
+
+    def acquire(self, name, login=True):
+        """Return a WikiClient for the wiki name (see Config.get_plagwiki()).
+
+        If login is True, the client is logged in with the user configured
+        for the wiki (see Config.login_wiki_client()). Pass the client to
+        release() when it is not needed any more.
+
+        """
+        wikiinfo = self._config.get_plagwiki(name)
+        key = (wikiinfo.name, bool(login))
+        client = None
+        while client is None:
+            with self._lock:
+                if self._closed:
+                    raise WikiError('The ClientPool has been closed')
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                client, released, generation = idle.pop()
+            if time.time() - released > self._check_interval:
+                client = self._check(key, client)
+        if client is None:
+            client = self._create(key)
+        else:
+            self._join_session(key, client, generation)
+        with self._lock:
+            self._in_use[id(client)] = (key, client, self._generations.get(key, 0))
+        return client
+
+    def release(self, client):
+        """Give a client that was returned by acquire() back to the pool."""
+        with self._lock:
+            if id(client) not in self._in_use:
+                raise ValueError('client was not acquired from this pool')
+            key, client, generation = self._in_use.pop(id(client))
+            idle = self._idle.setdefault(key, [])
+            if not self._closed and len(idle) < self._max_idle:
+                idle.append((client, time.time(), generation))
+                return
+        self._close_client(client)
+
+    def client(self, name, login=True):
+        """Return a context manager that acquires a client for the wiki
+        name and releases it when the with statement is left."""
+        return _PooledClient(self, name, login)
+
+    def close(self):
+        """Log out of all wikis and close all clients.
+
+        Clients that are still in use are closed as well, so they must
+        not be used afterwards. If a session store is set for a wiki, its
+        session is saved instead of logged out.
+
+        """
+        with self._lock:
+            self._closed = True
+            clients = {}
+            for key, idle in self._idle.items():
+                clients.setdefault(key, []).extend(item[0] for item in idle)
+            for key, client, generation in self._in_use.values():
+                clients.setdefault(key, []).append(client)
+            self._idle = {}
+            self._in_use = {}
+            leaders = self._leaders
+            self._leaders = {}
+            shares = self._shares
+            self._shares = {}
+        for key, key_clients in clients.items():
+            leader = leaders.get(key)
+            if leader is not None and leader[0].is_logged_in():
+                # log out through any client, as they share the session
+                client = key_clients[0]
+                client.copy_session_from(leader[0])
+                try:
+                    client.__exit__(None, None, None)
+                except(WikiError) as err:
+                    print(unicode(err), file=sys.stderr)
+            for client in key_clients:
+                client.close()
+        for share in shares.values():
+            share.close()
+
+    ### Internal methods ###
+
+    def _create(self, key):
+        name, login = key
+        with self._lock:
+            share = self._shares.get(key)
+            if share is None:
+                share = self._shares[key] = create_share()
+        client = self._config.create_wiki_client(name, login=False,
+                engine=CurlEngine(share=share))
+        if login:
+            with self._login_lock:
+                if not self._join_session(key, client, None):
+                    self._config.login_wiki_client(name, client)
+                    self._set_leader(key, client)
+        return client
+
+    def _join_session(self, key, client, generation):
+        """Let client take over the current session of its wiki, unless
+        it already has. Returns False if there is no session yet."""
+        with self._lock:
+            leader = self._leaders.get(key)
+        if leader is None:
+            return False
+        if generation != leader[1]:
+            client.copy_session_from(leader[0])
+        return True
+
+    def _set_leader(self, key, client):
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            self._leaders[key] = (client, generation)
+
+    def _check(self, key, client):
+        """Check an idle client, log in again if its session has timed
+        out, and return it. Returns None (after closing the client) if
+        the wiki cannot be reached through it."""
+        name, login = key
+        try:
+            if not client.check_login() and login:
+                with self._login_lock:
+                    self._config.login_wiki_client(name, client)
+                    self._set_leader(key, client)
+        except(WikiError) as err:
+            print(unicode(err), file=sys.stderr)
+            print('Warning: replacing broken client of ' + name, file=sys.stderr)
+            self._close_client(client)
+            return None
+        return client
+
+    def _close_client(self, client):
+        # the session lives on in the other clients of the wiki
+        try:
+            client.close()
+        except(WikiError):
+            pass
+
+
+class _PooledClient(object):
+    def __init__(self, pool, name, login):
+        self._pool = pool
+        self._name = name
+        self._login = login
+        self._client = None
+
+    def __enter__(self):
+        self._client = self._pool.acquire(self._name, self._login)
+        return self._client
+
+    def __exit__(self, type, value, traceback):
+        self._pool.release(self._client)
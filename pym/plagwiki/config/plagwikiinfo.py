@@ -18,6 +18,18 @@ class PlagWikiInfo(object):
         self.api = None
         self.ask = None
         self.software = None
+        self.parallelrequests = None
+        self.pagecache = None
+        self.parsecache = None
+        self.sessionstore = None
+        self.mirror = None
+        self.readrate = None
+        self.writerate = None
+        self.maxlag = None
+        self.connecttimeout = None
+        self.timeout = None
+        self.deadline = None
+        self.maxattempts = None
 
     def verify_config(self):
         if not self.name:
@@ -40,6 +52,19 @@ class PlagWikiInfo(object):
                 raise PlagError('PlagWiki '+self.name+': No Ask URL defined!')
         else:
             raise PlagError('PlagWiki '+self.name+': Unknown wiki software: '+self.software+' (should be MediaWiki or MediaWiki+SMW)')
+        if self.parallelrequests is not None and self.parallelrequests < 1:
+            raise PlagError('PlagWiki '+self.name+': parallelrequests must be at least 1!')
+        if self.readrate is not None and self.readrate <= 0:
+            raise PlagError('PlagWiki '+self.name+': readrate must be positive!')
+        if self.writerate is not None and self.writerate <= 0:
+            raise PlagError('PlagWiki '+self.name+': writerate must be positive!')
+        if self.maxlag is not None and self.maxlag < 0:
+            raise PlagError('PlagWiki '+self.name+': maxlag must not be negative!')
+        for option in ('connecttimeout', 'timeout', 'deadline'):
+            if getattr(self, option) is not None and getattr(self, option) <= 0:
+                raise PlagError('PlagWiki '+self.name+': '+option+' must be positive!')
+        if self.maxattempts is not None and self.maxattempts < 1:
+            raise PlagError('PlagWiki '+self.name+': maxattempts must be at least 1!')
 
     def new_from_config(config_parser, name, verify=True):
         info = PlagWikiInfo(name)
@@ -56,6 +81,30 @@ class PlagWikiInfo(object):
             info.ask = config_parser.get(section, 'ask')
         if config_parser.has_option(section, 'software'):
             info.software = config_parser.get(section, 'software')
+        if config_parser.has_option(section, 'parallelrequests'):
+            info.parallelrequests = config_parser.getint(section, 'parallelrequests')
+        if config_parser.has_option(section, 'pagecache'):
+            info.pagecache = config_parser.get(section, 'pagecache')
+        if config_parser.has_option(section, 'parsecache'):
+            info.parsecache = config_parser.get(section, 'parsecache')
+        if config_parser.has_option(section, 'sessionstore'):
+            info.sessionstore = config_parser.get(section, 'sessionstore')
+        if config_parser.has_option(section, 'mirror'):
+            info.mirror = config_parser.get(section, 'mirror')
+        if config_parser.has_option(section, 'readrate'):
+            info.readrate = config_parser.getfloat(section, 'readrate')
+        if config_parser.has_option(section, 'writerate'):
+            info.writerate = config_parser.getfloat(section, 'writerate')
+        if config_parser.has_option(section, 'maxlag'):
+            info.maxlag = config_parser.getint(section, 'maxlag')
+        if config_parser.has_option(section, 'connecttimeout'):
+            info.connecttimeout = config_parser.getfloat(section, 'connecttimeout')
+        if config_parser.has_option(section, 'timeout'):
+            info.timeout = config_parser.getfloat(section, 'timeout')
+        if config_parser.has_option(section, 'deadline'):
+            info.deadline = config_parser.getfloat(section, 'deadline')
+        if config_parser.has_option(section, 'maxattempts'):
+            info.maxattempts = config_parser.getint(section, 'maxattempts')
         if verify:
             info.verify_config()
         return info
@@ -16,6 +16,8 @@ class PlagWikiUser(object):
         self.password = None
         self.emergencypage = None
         self.emergencyvar = None
+        self.emergencymaxage = None
+        self.emergencyinterval = None
 
     def verify_config(self):
         if not self.name:
@@ -24,6 +26,10 @@ class PlagWikiUser(object):
             raise PlagError('PlagWikiUser '+self.name+': emergencypage defined, but no emergencyvar!')
         if self.emergencyvar and not self.emergencypage:
             raise PlagError('PlagWikiUser '+self.name+': emergencyvar defined, but no emergencypage!')
+        if self.emergencymaxage is not None and self.emergencymaxage < 0:
+            raise PlagError('PlagWikiUser '+self.name+': emergencymaxage must not be negative!')
+        if self.emergencyinterval is not None and self.emergencyinterval <= 0:
+            raise PlagError('PlagWikiUser '+self.name+': emergencyinterval must be positive!')
 
     def new_from_config(config_parser, name, verify=True):
         user = PlagWikiUser(name)
@@ -36,6 +42,10 @@ class PlagWikiUser(object):
             user.emergencypage = config_parser.get(section, 'emergencypage')
         if config_parser.has_option(section, 'emergencyvar'):
             user.emergencyvar = config_parser.get(section, 'emergencyvar')
+        if config_parser.has_option(section, 'emergencymaxage'):
+            user.emergencymaxage = config_parser.getfloat(section, 'emergencymaxage')
+        if config_parser.has_option(section, 'emergencyinterval'):
+            user.emergencyinterval = config_parser.getfloat(section, 'emergencyinterval')
         if verify:
             user.verify_config()
         return user
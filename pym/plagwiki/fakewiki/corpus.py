@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import random
+import re
+import threading
+import time
+
+
+# Namespaces of a German wiki: (id, local name, canonical name)
+NAMESPACES = (
+    (-2, 'Medium', 'Media'),
+    (-1, 'Spezial', 'Special'),
+    (0, '', None),
+    (1, 'Diskussion', 'Talk'),
+    (2, 'Benutzer', 'User'),
+    (3, 'Benutzer Diskussion', 'User talk'),
+    (4, 'FakeWiki', 'Project'),
+    (6, 'Datei', 'File'),
+    (8, 'MediaWiki', 'MediaWiki'),
+    (10, 'Vorlage', 'Template'),
+    (12, 'Hilfe', 'Help'),
+    (14, 'Kategorie', 'Category'),
+)
+
+NAMESPACE_ALIASES = (
+    (6, 'Bild'),
+)
+
+MAINPAGE = 'Hauptseite'
+
+_WORDS = ('der', 'die', 'das', 'und', 'in', 'zu', 'den', 'von', 'mit',
+    'sich', 'des', 'auf', 'für', 'ist', 'im', 'dem', 'nicht', 'ein',
+    'eine', 'als', 'auch', 'es', 'an', 'werden', 'aus', 'er', 'hat',
+    'dass', 'sie', 'nach', 'wird', 'bei', 'einer', 'Arbeit', 'Quelle',
+    'Verfasser', 'Seite', 'Zeile', 'Fußnote', 'Literatur', 'Dissertation',
+    'Übernahme', 'wörtlich', 'Text', 'Analyse', 'Ergebnis', 'Frage')
+
+class Corpus(object):
+    """The pages of a FakeWikiServer.
+
+    A corpus holds pages (with their wikitext, categories and revision
+    metadata) and uploaded files, and knows the namespaces of the wiki.
+    Pages can be added directly with add_page(), generated with
+    synthetic() or imported from a PageCache with from_page_cache().
+    Each page only has its latest revision, but every change is
+    recorded in a log of recent changes (see get_changes()).
+
+    All methods are thread-safe.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pages = {}
+        self._pages_by_id = {}
+        self._files = {}
+        self._next_pageid = 1
+        self._next_revid = 1
+        self._changes = []
+        self._ns_names = {}
+        self._ns_numbers = {}
+        for ns_id, name, canonical in NAMESPACES:
+            self._ns_names[ns_id] = name
+            self._ns_numbers[name.lower()] = ns_id
+            if canonical is not None:
+                self._ns_numbers[canonical.lower()] = ns_id
+        for ns_id, alias in NAMESPACE_ALIASES:
+            self._ns_numbers[alias.lower()] = ns_id
+
+    ### Creating corpora ###
+
+    def synthetic(num_pages=1000, page_size=4000, num_categories=20,
+            prefix='Fakeplag', seed=0):
+        """Return a corpus of generated pages.
+
+        The corpus contains num_pages fragment pages named
+        '<prefix>/Fragment <page> <line>', each with about page_size bytes
+        of wikitext, an overview page '<prefix>', the main page, a
+        template used by all fragments and the emergency page
+        'Benutzer:FakeBot/Notaus' (with 'Notaus=0'). Each fragment is in
+        the category 'Kategorie:<prefix>' and in one of num_categories
+        source categories; every second one is also in 'Kategorie:Gesichtet'.
+        seed makes the generated texts reproducible.
+
+        """
+        corpus = Corpus()
+        rng = random.Random(seed)
+        corpus.add_page(MAINPAGE, 'Willkommen im FakeWiki.')
+        corpus.add_page('Benutzer:FakeBot/Notaus', 'Notaus=0')
+        corpus.add_page('Vorlage:Fragment',
+                '<div class="fragment">Fragment einer Plagiatsdokumentation</div>')
+        corpus.add_page(prefix, "'''" + prefix + "''' ist eine Dokumentation.\n"
+                '[[Kategorie:' + prefix + ']]')
+        for cat in range(num_categories):
+            corpus.add_page('Kategorie:Quelle %d' % (cat + 1),
+                    'Fragmente zu Quelle %d.' % (cat + 1))
+        for num in range(num_pages):
+            categories = ['Kategorie:' + prefix,
+                    'Kategorie:Quelle %d' % (rng.randrange(num_categories) + 1)]
+            if num % 2 == 0:
+                categories.append('Kategorie:Gesichtet')
+            words = []
+            length = 0
+            while length < page_size:
+                word = rng.choice(_WORDS)
+                words.append(word)
+                length += len(word.encode('utf-8')) + 1
+            text = ('{{Fragment\n|Seite=%d\n|Zeilen=%d\n}}\n' %
+                    (num // 10 + 1, num % 10 + 1) + ' '.join(words) + '\n' +
+                    ''.join('[[' + cat + ']]' for cat in categories))
+            corpus.add_page('%s/Fragment %03d %02d' %
+                    (prefix, num // 10 + 1, num % 10 + 1), text, categories)
+        return corpus
+    synthetic = staticmethod(synthetic)
+
+    def from_page_cache(page_cache, api):
+        """Return a corpus of all pages of the wiki api that are stored
+        in a PageCache.
+
+        The pages keep their page IDs, revision IDs, texts and categories.
+
+        """
+        corpus = Corpus()
+        for page in page_cache.iter_pages(api):
+            try:
+                text = page['revisions'][0]['*']
+            except(LookupError,TypeError):
+                continue
+            categories = [cat['title'] for cat in page.get('categories', [])]
+            corpus.add_page(page['title'], text, categories,
+                    pageid=page.get('pageid'), revid=page.get('lastrevid'),
+                    redirect=('redirect' in page))
+        return corpus
+    from_page_cache = staticmethod(from_page_cache)
+
+    ### Namespaces ###
+
+    def get_namespaces(self):
+        """Return the namespaces as a list of (id, local name, canonical
+        name) tuples."""
+        return list(NAMESPACES)
+
+    def get_namespace_aliases(self):
+        """Return the namespace aliases as a list of (id, alias) tuples."""
+        return list(NAMESPACE_ALIASES)
+
+    def normalize_title(self, title):
+        """Return (ns, title) for a page title, where title is normalized
+        (namespace name localized, underscores replaced by spaces, first
+        letter capitalized). Returns (None, None) for invalid titles."""
+        title = re.sub('[_ ]+', ' ', unicode(title)).strip()
+        if not title or re.search('[#<>\\[\\]|{}]', title):
+            return (None, None)
+        ns = 0
+        rest = title
+        if ':' in title:
+            name, after = title.split(':', 1)
+            name = name.strip().lower()
+            if name in self._ns_numbers:
+                ns = self._ns_numbers[name]
+                rest = after.strip()
+        if not rest:
+            return (None, None)
+        rest = rest[0].upper() + rest[1:]
+        if ns == 0:
+            return (ns, rest)
+        return (ns, self._ns_names[ns] + ':' + rest)
+
+    def split_title(self, title):
+        """Return (ns, title without namespace) for a normalized title."""
+        ns, title = self.normalize_title(title)
+        if ns:
+            return (ns, title.split(':', 1)[1])
+        return (ns, title)
+
+    ### Pages ###
+
+    def add_page(self, title, text, categories=None, pageid=None, revid=None,
+            redirect=False, timestamp=None):
+        """Create or replace a page and return its record.
+
+        categories is a list of category titles. If it is None, the
+        categories are taken from the [[Kategorie:...]] links in text.
+        pageid and revid default to the next free IDs; timestamp (an
+        ISO 8601 string) defaults to the current time.
+
+        """
+        ns, title = self.normalize_title(title)
+        if title is None:
+            raise ValueError('invalid title')
+        if categories is None:
+            categories = self._categories_from_text(text)
+        categories = [self.normalize_title(cat)[1] for cat in categories]
+        if timestamp is None:
+            timestamp = self._now()
+        with self._lock:
+            old = self._pages.get(title)
+            if pageid is None:
+                pageid = old['pageid'] if old is not None else self._next_pageid
+            if revid is None:
+                revid = self._next_revid
+            self._next_pageid = max(self._next_pageid, int(pageid) + 1)
+            self._next_revid = max(self._next_revid, int(revid) + 1)
+            page = {'pageid': int(pageid), 'ns': ns, 'title': title,
+                    'text': unicode(text), 'categories': categories,
+                    'revid': int(revid), 'timestamp': timestamp,
+                    'touched': timestamp, 'redirect': bool(redirect),
+                    'new': old is None}
+            if old is not None and old['pageid'] != page['pageid']:
+                del self._pages_by_id[old['pageid']]
+            self._pages[title] = page
+            self._pages_by_id[page['pageid']] = page
+            self._changes.append({'rcid': len(self._changes) + 1,
+                    'type': 'new' if old is None else 'edit',
+                    'ns': ns, 'title': title, 'pageid': page['pageid'],
+                    'revid': page['revid'],
+                    'old_revid': old['revid'] if old is not None else 0,
+                    'timestamp': timestamp})
+            return page
+
+    def edit_page(self, title, text):
+        """Save a new revision of a page (or create it), keeping its
+        categories in sync with the text. Returns (old record or None,
+        new record)."""
+        with self._lock:
+            old = self.get_page(title)
+            new = self.add_page(title, text)
+            return (old, new)
+
+    def get_page(self, title):
+        """Return the record of a page, or None if it does not exist."""
+        title = self.normalize_title(title)[1]
+        with self._lock:
+            return self._pages.get(title)
+
+    def get_page_by_id(self, pageid):
+        """Return the record of a page given its ID, or None."""
+        with self._lock:
+            return self._pages_by_id.get(int(pageid))
+
+    def get_titles(self, ns=None):
+        """Return the sorted list of titles of all pages (in namespace ns,
+        if it is not None)."""
+        with self._lock:
+            return sorted(title for title, page in self._pages.items()
+                    if ns is None or page['ns'] == ns)
+
+    def get_category_members(self, category):
+        """Return the sorted list of titles of the pages in a category."""
+        category = self.normalize_title(category)[1]
+        with self._lock:
+            return sorted(title for title, page in self._pages.items()
+                    if category in page['categories'])
+
+    def get_categories(self):
+        """Return a dict that maps the titles of all used categories to
+        their numbers of members."""
+        counts = {}
+        with self._lock:
+            for page in self._pages.values():
+                for category in page['categories']:
+                    counts[category] = counts.get(category, 0) + 1
+        return counts
+
+    def delete_page(self, title):
+        """Delete a page (and its file, if any). Returns the record of the
+        deleted page, or None if it does not exist."""
+        with self._lock:
+            page = self.get_page(title)
+            if page is None:
+                return None
+            del self._pages[page['title']]
+            del self._pages_by_id[page['pageid']]
+            self._files.pop(page['title'], None)
+            self._log('delete', 'delete', page['ns'], page['title'])
+            return page
+
+    def move_page(self, title, new_title, redirect=True):
+        """Rename a page, keeping its page ID. If redirect is True, a
+        redirect to the new title is left behind. Returns the record of
+        the moved page, or None if it does not exist."""
+        new_ns, new_title = self.normalize_title(new_title)
+        if new_title is None:
+            raise ValueError('invalid title')
+        with self._lock:
+            page = self.get_page(title)
+            if page is None:
+                return None
+            old_title = page['title']
+            del self._pages[old_title]
+            page['ns'] = new_ns
+            page['title'] = new_title
+            page['touched'] = self._now()
+            self._pages[new_title] = page
+            self._log('move', 'move', self.normalize_title(old_title)[0],
+                    old_title, {'new_ns': new_ns, 'new_title': new_title})
+            if redirect:
+                self.add_page(old_title, '#WEITERLEITUNG [[' + new_title + ']]',
+                        [], redirect=True)
+            return page
+
+    def get_changes(self):
+        """Return the log of recent changes as a list of dicts, oldest
+        first. Each change has the keys 'rcid', 'type' ('new', 'edit' or
+        'log'), 'ns', 'title', 'pageid', 'revid', 'old_revid' and
+        'timestamp'. Log entries also have 'logtype', 'logaction' and, for
+        moves, 'move' (with 'new_ns' and 'new_title')."""
+        with self._lock:
+            return [dict(change) for change in self._changes]
+
+    def touch(self, title):
+        """Update the touched timestamp of a page (as a purge would).
+        Returns False if the page does not exist."""
+        with self._lock:
+            page = self.get_page(title)
+            if page is None:
+                return False
+            page['touched'] = self._now()
+            return True
+
+    ### Files ###
+
+    def add_file(self, filename, data, text=''):
+        """Store an uploaded file and create or update its description
+        page. Returns the normalized file name."""
+        ns, title = self.normalize_title('Datei:' + filename)
+        if title is None or ns != 6:
+            raise ValueError('invalid file name')
+        with self._lock:
+            self._files[title] = data
+            if title not in self._pages:
+                self.add_page(title, text or '')
+        return title.split(':', 1)[1]
+
+    def get_file(self, filename):
+        """Return the contents of an uploaded file, or None."""
+        title = self.normalize_title('Datei:' + filename)[1]
+        with self._lock:
+            return self._files.get(title)
+
+    ### Internal methods ###
+
+    def _log(self, logtype, logaction, ns, title, move=None):
+        change = {'rcid': len(self._changes) + 1, 'type': 'log',
+                'logtype': logtype, 'logaction': logaction, 'ns': ns,
+                'title': title, 'pageid': 0, 'revid': 0, 'old_revid': 0,
+                'timestamp': self._now()}
+        if move is not None:
+            change['move'] = move
+        self._changes.append(change)
+
+    def _categories_from_text(self, text):
+        categories = []
+        for match in re.finditer('\\[\\[\\s*([^\\]|:]+)\\s*:\\s*([^\\]|]+)', text):
+            ns = self._ns_numbers.get(match.group(1).strip().lower())
+            if ns == 14:
+                categories.append('Kategorie:' + match.group(2).strip())
+        return categories
+
+    def _now(self):
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
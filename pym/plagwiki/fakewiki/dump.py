@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+from xml.sax.saxutils import escape, quoteattr
+
+from plagwiki.fakewiki.corpus import MAINPAGE, NAMESPACES
+
+
+EXPORT_NAMESPACE = 'http://www.mediawiki.org/xml/export-0.10/'
+
+class DumpWriter(object):
+    """Writes pages in the XML format of MediaWiki dumps and
+    Special:Export, e.g. to test DumpReader.
+
+    f is a file object opened in binary mode (or e.g. a gzip.GzipFile).
+    The header with the site information is written by the constructor,
+    the pages by write_page() or write_corpus(), and the footer by
+    close(), which does not close f.
+
+    """
+
+    def __init__(self, f, sitename='FakeWiki', base='http://localhost/wiki/'):
+        self._file = f
+        self._bytes = 0
+        lines = ['<mediawiki xmlns=' + quoteattr(EXPORT_NAMESPACE) +
+                ' version="0.10" xml:lang="de">',
+                '  <siteinfo>',
+                '    <sitename>' + escape(sitename) + '</sitename>',
+                '    <base>' + escape(base + MAINPAGE) + '</base>',
+                '    <generator>MediaWiki 1.19.24</generator>',
+                '    <case>first-letter</case>',
+                '    <namespaces>']
+        for ns_id, name, canonical in NAMESPACES:
+            lines.append('      <namespace key="%d" case="first-letter">%s</namespace>' %
+                    (ns_id, escape(name)))
+        lines.extend(['    </namespaces>', '  </siteinfo>'])
+        self._write('\n'.join(lines) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def get_bytes_written(self):
+        """Return the number of (uncompressed) bytes written so far."""
+        return self._bytes
+
+    def write_page(self, page):
+        """Write a page record of a Corpus (see Corpus.add_page())."""
+        lines = ['  <page>',
+                '    <title>' + escape(page['title']) + '</title>',
+                '    <ns>%d</ns>' % page['ns'],
+                '    <id>%d</id>' % page['pageid']]
+        if page.get('redirect'):
+            target = page['text'].split('[[', 1)[-1].split(']]', 1)[0]
+            lines.append('    <redirect title=' + quoteattr(target) + ' />')
+        text = page['text']
+        lines.extend(['    <revision>',
+                '      <id>%d</id>' % page['revid'],
+                '      <timestamp>' + page['timestamp'] + '</timestamp>',
+                '      <contributor><username>FakeBot</username><id>1</id></contributor>',
+                '      <text xml:space="preserve" bytes="%d">' %
+                len(text.encode('utf-8')) + escape(text) + '</text>',
+                '    </revision>',
+                '  </page>'])
+        self._write('\n'.join(lines) + '\n')
+
+    def write_corpus(self, corpus):
+        """Write all pages of a Corpus, in the order of their titles."""
+        for title in corpus.get_titles():
+            page = corpus.get_page(title)
+            if page is not None:
+                self.write_page(page)
+
+    def close(self):
+        """Write the footer."""
+        if self._file is not None:
+            self._write('</mediawiki>\n')
+            self._file = None
+
+    ### Internal methods ###
+
+    def _write(self, text):
+        data = text.encode('utf-8')
+        self._bytes += len(data)
+        self._file.write(data)
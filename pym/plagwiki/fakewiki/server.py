@@ -0,0 +1,1143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import BaseHTTPServer
+import binascii
+import cgi
+import Cookie
+import hashlib
+import json
+import re
+import SocketServer
+import threading
+import time
+import uuid
+
+from plagwiki.fakewiki.corpus import MAINPAGE
+
+
+SESSION_COOKIE = 'fakewiki_session'
+ANONYMOUS_TOKEN = '+\\'
+
+class FakeApiError(Exception):
+    """An error reported by FakeApi in the format of the MediaWiki API."""
+
+    def __init__(self, code, info, data=None):
+        Exception.__init__(self, code + ': ' + info)
+        self.code = code
+        self.info = info
+        # additional members of the error, e.g. {'offset': ...}
+        self.data = data or {}
+
+
+class FakeApi(object):
+    """Answers MediaWiki API requests from a Corpus.
+
+    This implements the subset of api.php that WikiClient uses, in the
+    format of MediaWiki 1.16 to 1.20 (including 'query-continue'):
+      action=login, action=logout
+      action=query with meta=siteinfo|userinfo, list=allpages,
+        list=categorymembers, list=allcategories, list=prefixsearch,
+        the same modules as generators, list=recentchanges,
+        titles=... and pageids=...,
+        prop=info|revisions|categories|categoryinfo|templates|imageinfo
+        and intoken=edit
+      action=parse, action=expandtemplates (simplified)
+      action=ask of Semantic MediaWiki (simplified, see _action_ask())
+      action=purge, action=edit, action=upload (including chunked
+        uploads to the stash)
+
+    handle() takes the request parameters and the session state and
+    returns the result. Requests with a maxlag parameter are refused
+    while the simulated replication lag (see set_lag()) is larger.
+
+    """
+
+    def __init__(self, corpus, max_limit=500, users=None,
+            max_result_size=None):
+        """Constructor.
+
+        corpus is the Corpus to serve. max_limit is the value of 'max'
+        for list limits. users is a dict that maps user names to
+        passwords; if it is None, any user name and password is accepted.
+
+        max_result_size limits the size of the revision contents in a
+        query result in bytes, like $wgAPIMaxResultSize: revisions that
+        do not fit are left out (in the order of their IDs) and continued
+        with rvcontinue. The first revision is always returned. None
+        means no limit.
+
+        """
+        self._corpus = corpus
+        self._max_limit = max_limit
+        self._max_result_size = max_result_size
+        self._users = users
+        self._lag = 0
+        self._lock = threading.Lock()
+        # filekey -> {'filename': ..., 'filesize': ..., 'data': ...}
+        self._stash = {}
+
+    def set_lag(self, lag):
+        """Set the simulated database replication lag in seconds."""
+        self._lag = lag
+
+    def handle(self, params, files, session):
+        """Answer an API request.
+
+        params is a dict of (unicode) request parameters, files a dict
+        that maps parameter names to the contents of uploaded files,
+        and session a dict that holds the state of the client's session
+        (it is modified by login and logout).
+
+        Returns (result, headers), where result is the API result (to be
+        encoded as JSON) and headers is a dict of extra HTTP headers.
+
+        """
+        if params.get('maxlag') is not None and self._lag > 0:
+            try:
+                maxlag = int(params['maxlag'])
+            except(ValueError):
+                maxlag = 0
+            if self._lag > maxlag:
+                return ({'error': {'code': 'maxlag', 'info':
+                        'Waiting for fakedb: %d seconds lagged' % self._lag}},
+                        {'Retry-After': '5',
+                         'X-Database-Lag': unicode(self._lag)})
+        action = params.get('action')
+        handler = getattr(self, '_action_' + unicode(action), None)
+        try:
+            if handler is None:
+                raise FakeApiError('unknown_action',
+                        'Unrecognized value for parameter \'action\': ' +
+                        unicode(action))
+            return (handler(params, files, session), {})
+        except(FakeApiError) as err:
+            error = dict(err.data)
+            error.update({'code': err.code, 'info': err.info})
+            return ({'error': error}, {})
+
+    ### Login and logout ###
+
+    def _action_login(self, p, files, session):
+        # user names are canonicalized like page titles
+        name = ' '.join(self._require(p, 'lgname').replace('_', ' ').split())
+        name = name[:1].upper() + name[1:]
+        password = p.get('lgpassword', '')
+        if self._users is not None:
+            if name not in self._users:
+                return {'login': {'result': 'NotExists'}}
+            if self._users[name] != password:
+                return {'login': {'result': 'WrongPass'}}
+        if p.get('lgtoken') is None:
+            session['logintoken'] = uuid.uuid4().hex
+            return {'login': {'result': 'NeedToken',
+                    'token': session['logintoken'],
+                    'cookieprefix': 'fakewiki', 'sessionid': session['id']}}
+        if p['lgtoken'] != session.get('logintoken'):
+            return {'login': {'result': 'WrongToken'}}
+        session['user'] = name
+        session['edittoken'] = uuid.uuid4().hex + ANONYMOUS_TOKEN
+        return {'login': {'result': 'Success', 'lguserid': 1,
+                'lgusername': name, 'lgtoken': uuid.uuid4().hex,
+                'cookieprefix': 'fakewiki', 'sessionid': session['id']}}
+
+    def _action_logout(self, p, files, session):
+        session.pop('user', None)
+        session.pop('edittoken', None)
+        return {}
+
+    ### Queries ###
+
+    def _action_query(self, p, files, session):
+        query = {}
+        query_continue = {}
+        meta = self._split(p.get('meta'))
+        if 'siteinfo' in meta:
+            query.update(self._siteinfo())
+        if 'userinfo' in meta:
+            if session.get('user'):
+                query['userinfo'] = {'id': 1, 'name': session['user']}
+            else:
+                query['userinfo'] = {'id': 0, 'name': '127.0.0.1',
+                        'anon': ''}
+            if 'rights' in self._split(p.get('uiprop')):
+                query['userinfo']['rights'] = self._rights(session)
+        if p.get('list'):
+            module = p['list']
+            entries, cont = self._list(module, p, '', False)
+            query[module] = entries
+            if cont:
+                query_continue[module] = cont
+        titles = None
+        if p.get('generator'):
+            module = p['generator']
+            entries, cont = self._list(module, p, 'g',
+                    'revisions' in self._split(p.get('prop')))
+            if cont:
+                query_continue[module] = cont
+            if not entries:
+                return self._with_continue({}, query, query_continue)
+            titles = [entry['title'] for entry in entries]
+        elif p.get('titles') is not None:
+            titles = self._split(p['titles'])
+        if titles is not None:
+            query.update(self._pages(p, session, titles=titles,
+                    query_continue=query_continue))
+        elif p.get('pageids') is not None:
+            query.update(self._pages(p, session,
+                    pageids=self._split(p['pageids']),
+                    query_continue=query_continue))
+        return self._with_continue({}, query, query_continue)
+
+    def _with_continue(self, result, query, query_continue):
+        if query:
+            result['query'] = query
+        if query_continue:
+            result['query-continue'] = query_continue
+        return result
+
+    def _siteinfo(self):
+        namespaces = {}
+        for ns_id, name, canonical in self._corpus.get_namespaces():
+            ns = {'id': ns_id, '*': name}
+            if canonical is not None:
+                ns['canonical'] = canonical
+            namespaces[unicode(ns_id)] = ns
+        aliases = [{'id': ns_id, '*': alias}
+                for ns_id, alias in self._corpus.get_namespace_aliases()]
+        general = {'mainpage': MAINPAGE, 'base': 'http://localhost/wiki/' + MAINPAGE,
+                'sitename': 'FakeWiki', 'generator': 'MediaWiki 1.16.5 (FakeWiki)',
+                'case': 'first-letter', 'lang': 'de', 'server': 'http://localhost',
+                'articlepath': '/wiki/$1', 'scriptpath': '', 'script': '/index.php'}
+        return {'general': general, 'namespaces': namespaces,
+                'namespacealiases': aliases}
+
+    def _list(self, module, p, g, revisions):
+        """Run a list module (or, if g is 'g', a generator) and return
+        (entries, continuation parameters or None)."""
+        if module == 'allpages':
+            return self._list_allpages(p, g + 'ap', revisions)
+        if module == 'categorymembers':
+            return self._list_categorymembers(p, g + 'cm', revisions)
+        if module == 'allcategories':
+            return self._list_allcategories(p, g + 'ac', revisions, g == 'g')
+        if module == 'prefixsearch':
+            return self._list_prefixsearch(p, g + 'ps', revisions)
+        if module == 'recentchanges' and not g:
+            return self._list_recentchanges(p, 'rc', revisions)
+        raise FakeApiError('unknown_' + ('generator' if g else 'list'),
+                'Unrecognized value: ' + unicode(module))
+
+    def _list_allpages(self, p, prefix, revisions):
+        ns = self._int(p.get(prefix + 'namespace', 0))
+        start = p.get(prefix + 'prefix', '')
+        start_from = p.get(prefix + 'from')
+        filterredir = p.get(prefix + 'filterredir', 'all')
+        limit = self._limit(p.get(prefix + 'limit'), revisions)
+        matches = []
+        for title in self._corpus.get_titles(ns):
+            rest = self._corpus.split_title(title)[1]
+            if not rest.startswith(start):
+                continue
+            if start_from is not None and rest < start_from:
+                continue
+            page = self._corpus.get_page(title)
+            if filterredir == 'redirects' and not page['redirect']:
+                continue
+            if filterredir == 'nonredirects' and page['redirect']:
+                continue
+            matches.append(page)
+            if len(matches) > limit:
+                break
+        cont = None
+        if len(matches) > limit:
+            cont = {prefix + 'from': self._corpus.split_title(matches[limit]['title'])[1]}
+            matches = matches[:limit]
+        return ([self._entry(page) for page in matches], cont)
+
+    def _list_categorymembers(self, p, prefix, revisions):
+        ns, category = self._corpus.normalize_title(self._require(p, prefix + 'title'))
+        if ns != 14:
+            raise FakeApiError('invalidcategory', 'The category name you entered is not valid')
+        namespaces = None
+        if p.get(prefix + 'namespace') is not None:
+            namespaces = [self._int(x) for x in self._split(p[prefix + 'namespace'])]
+        props = self._split(p.get(prefix + 'prop', 'ids|title'))
+        limit = self._limit(p.get(prefix + 'limit'), revisions)
+        members = []
+        for title in self._corpus.get_category_members(category):
+            page = self._corpus.get_page(title)
+            if page is None or (namespaces is not None and page['ns'] not in namespaces):
+                continue
+            sortkey = self._corpus.split_title(title)[1].upper()
+            members.append((sortkey, page['pageid'], page))
+        members.sort()
+        start = p.get(prefix + 'continue')
+        if start is not None:
+            try:
+                kind, key, pageid = start.split('|')
+                key = (binascii.unhexlify(key).decode('utf-8'), int(pageid))
+            except(ValueError,TypeError):
+                raise FakeApiError('badcontinue', 'Invalid continue param')
+            members = [member for member in members if member[0:2] >= key]
+        cont = None
+        if len(members) > limit:
+            sortkey, pageid, page = members[limit]
+            cont = {prefix + 'continue': 'page|%s|%d' %
+                    (binascii.hexlify(sortkey.encode('utf-8')), pageid)}
+            members = members[:limit]
+        entries = []
+        for sortkey, pageid, page in members:
+            entry = {'ns': page['ns'], 'title': page['title']}
+            if 'ids' in props:
+                entry['pageid'] = page['pageid']
+            if 'sortkey' in props:
+                entry['sortkey'] = binascii.hexlify(sortkey.encode('utf-8'))
+            if 'timestamp' in props:
+                entry['timestamp'] = page['timestamp']
+            entries.append(entry)
+        return (entries, cont)
+
+    def _list_allcategories(self, p, prefix, revisions, generator):
+        start = p.get(prefix + 'prefix', '')
+        start_from = p.get(prefix + 'from')
+        props = self._split(p.get(prefix + 'prop'))
+        limit = self._limit(p.get(prefix + 'limit'), revisions)
+        counts = self._corpus.get_categories()
+        names = sorted(self._corpus.split_title(title)[1] for title in counts)
+        names = [name for name in names if name.startswith(start) and
+                (start_from is None or name >= start_from)]
+        cont = None
+        if len(names) > limit:
+            cont = {prefix + 'from': names[limit]}
+            names = names[:limit]
+        if generator:
+            return ([{'title': 'Kategorie:' + name} for name in names], cont)
+        entries = []
+        for name in names:
+            entry = {'*': name}
+            if 'size' in props:
+                entry['size'] = counts['Kategorie:' + name]
+            entries.append(entry)
+        return (entries, cont)
+
+    def _list_prefixsearch(self, p, prefix, revisions):
+        search = self._require(p, prefix + 'search').lower()
+        ns = self._int(p.get(prefix + 'namespace', 0))
+        offset = self._int(p.get(prefix + 'offset', 0))
+        limit = min(self._limit(p.get(prefix + 'limit'), revisions), 100)
+        matches = [title for title in self._corpus.get_titles(ns)
+                if self._corpus.split_title(title)[1].lower().startswith(search)]
+        cont = None
+        if len(matches) > offset + limit:
+            cont = {prefix + 'offset': offset + limit}
+        return ([self._entry(self._corpus.get_page(title))
+                for title in matches[offset : offset + limit]], cont)
+
+    def _list_recentchanges(self, p, prefix, revisions):
+        props = self._split(p.get(prefix + 'prop', 'title|timestamp|ids'))
+        limit = self._limit(p.get(prefix + 'limit'), revisions)
+        newer = p.get(prefix + 'dir', 'older') == 'newer'
+        start = p.get(prefix + 'start')
+        end = p.get(prefix + 'end')
+        namespaces = None
+        if p.get(prefix + 'namespace') is not None:
+            namespaces = [self._int(x) for x in self._split(p[prefix + 'namespace'])]
+        types = self._split(p.get(prefix + 'type')) or None
+        changes = self._corpus.get_changes()
+        if not newer:
+            changes.reverse()
+        matches = []
+        for change in changes:
+            timestamp = change['timestamp']
+            if newer:
+                if (start is not None and timestamp < start) or \
+                        (end is not None and timestamp > end):
+                    continue
+            elif (start is not None and timestamp > start) or \
+                    (end is not None and timestamp < end):
+                continue
+            if namespaces is not None and change['ns'] not in namespaces:
+                continue
+            if types is not None and change['type'] not in types:
+                continue
+            matches.append(change)
+            if len(matches) > limit:
+                break
+        cont = None
+        if len(matches) > limit:
+            cont = {prefix + 'start': matches[limit]['timestamp']}
+            matches = matches[:limit]
+        entries = []
+        for change in matches:
+            entry = {'type': change['type']}
+            if 'title' in props:
+                entry['ns'] = change['ns']
+                entry['title'] = change['title']
+            if 'ids' in props:
+                for key in ('rcid', 'pageid', 'revid', 'old_revid'):
+                    entry[key] = change[key]
+            if 'timestamp' in props:
+                entry['timestamp'] = change['timestamp']
+            if 'loginfo' in props and change['type'] == 'log':
+                entry['logtype'] = change['logtype']
+                entry['logaction'] = change['logaction']
+                if 'move' in change:
+                    entry['move'] = dict(change['move'])
+            entries.append(entry)
+        return (entries, cont)
+
+    def _pages(self, p, session, titles=None, pageids=None, query_continue=None):
+        """Return the 'pages' (and 'normalized') part of a query result."""
+        props = self._split(p.get('prop'))
+        result = {}
+        normalized = []
+        pages = {}
+        missing_key = -1
+        records = []
+        # (page, entry) of the pages whose revision is requested
+        revisions = []
+        if titles is not None:
+            for title in titles:
+                ns, norm = self._corpus.normalize_title(title)
+                if norm is None:
+                    records.append(('invalid', title))
+                    continue
+                if norm != title:
+                    normalized.append({'from': title, 'to': norm})
+                page = self._corpus.get_page(norm)
+                records.append((page, norm) if page is not None else ('missing', norm))
+        else:
+            for pageid in pageids:
+                page = self._corpus.get_page_by_id(self._int(pageid))
+                records.append((page, None) if page is not None else ('missing', pageid))
+        for page, name in records:
+            if page == 'invalid':
+                pages[unicode(missing_key)] = {'title': name, 'invalid': ''}
+                missing_key -= 1
+                continue
+            if page == 'missing':
+                if titles is None:
+                    pages[unicode(missing_key)] = {'pageid': self._int(name), 'missing': ''}
+                else:
+                    ns = self._corpus.normalize_title(name)[0]
+                    entry = {'ns': ns, 'title': name, 'missing': ''}
+                    if 'categoryinfo' in props and ns == 14:
+                        entry['categoryinfo'] = self._categoryinfo(name)
+                    if p.get('intoken') == 'edit':
+                        entry['edittoken'] = session.get('edittoken', ANONYMOUS_TOKEN)
+                        entry['starttimestamp'] = self._now()
+                    pages[unicode(missing_key)] = entry
+                missing_key -= 1
+                continue
+            entry = self._entry(page)
+            if 'info' in props:
+                entry['touched'] = page['touched']
+                entry['lastrevid'] = page['revid']
+                entry['counter'] = 0
+                entry['length'] = len(page['text'].encode('utf-8'))
+                if page['new']:
+                    entry['new'] = ''
+                if page['redirect']:
+                    entry['redirect'] = ''
+                if p.get('intoken') == 'edit':
+                    entry['edittoken'] = session.get('edittoken', ANONYMOUS_TOKEN)
+                    entry['starttimestamp'] = self._now()
+            if 'revisions' in props:
+                revisions.append((page, entry))
+            if 'categoryinfo' in props and page['ns'] == 14:
+                entry['categoryinfo'] = self._categoryinfo(page['title'])
+            if 'templates' in props:
+                templates = sorted(self._templates(page['text']))
+                if templates:
+                    entry['templates'] = [{'ns': 10, 'title': template}
+                            for template in templates]
+            if 'imageinfo' in props and page['ns'] == 6:
+                data = self._corpus.get_file(page['title'].split(':', 1)[1])
+                if data is not None:
+                    entry['imageinfo'] = [self._imageinfo(page['title'], data)]
+            pages[unicode(page['pageid'])] = entry
+        if revisions:
+            self._page_revisions(p, revisions, query_continue)
+        if 'categories' in props:
+            self._page_categories(p, pages, query_continue)
+        if normalized:
+            result['normalized'] = normalized
+        result['pages'] = pages
+        return result
+
+    def _page_revisions(self, p, revisions, query_continue):
+        """Add the latest revisions to the page entries, observing
+        rvcontinue and the maximum result size (like MediaWiki does)."""
+        rvprop = self._split(p.get('rvprop', 'ids|timestamp|flags|comment|user'))
+        start = self._int(p.get('rvcontinue', 0))
+        size = 0
+        returned = False
+        for page, entry in sorted(revisions, key=lambda x: x[0]['revid']):
+            if page['revid'] < start:
+                continue
+            revision = self._revision(page, rvprop)
+            size += len(revision.get('*', '').encode('utf-8'))
+            if (returned and self._max_result_size is not None and
+                    size > self._max_result_size):
+                if query_continue is not None:
+                    query_continue['revisions'] = {'rvcontinue': page['revid']}
+                break
+            entry['revisions'] = [revision]
+            returned = True
+
+    def _page_categories(self, p, pages, query_continue):
+        """Add the categories to the page entries, observing cllimit and
+        clcontinue across all pages (like MediaWiki does)."""
+        limit = self._limit(p.get('cllimit'), False)
+        links = []
+        for entry in pages.values():
+            if 'pageid' not in entry or 'missing' in entry:
+                continue
+            page = self._corpus.get_page_by_id(entry['pageid'])
+            for category in sorted(page['categories']):
+                links.append((page['pageid'], self._corpus.split_title(category)[1]))
+        links.sort()
+        if p.get('clcontinue') is not None:
+            try:
+                pageid, name = p['clcontinue'].split('|', 1)
+                start = (int(pageid), name)
+            except(ValueError):
+                raise FakeApiError('badcontinue', 'Invalid continue param')
+            links = [link for link in links if link >= start]
+        if len(links) > limit:
+            query_continue['categories'] = {'clcontinue': '%d|%s' % links[limit]}
+            links = links[:limit]
+        for pageid, name in links:
+            pages[unicode(pageid)].setdefault('categories', []).append(
+                    {'ns': 14, 'title': 'Kategorie:' + name})
+
+    def _categoryinfo(self, category):
+        members = [self._corpus.get_page(title)
+                for title in self._corpus.get_category_members(category)]
+        files = sum(1 for page in members if page['ns'] == 6)
+        subcats = sum(1 for page in members if page['ns'] == 14)
+        return {'size': len(members), 'pages': len(members) - files - subcats,
+                'files': files, 'subcats': subcats}
+
+    def _revision(self, page, rvprop):
+        revision = {}
+        if 'ids' in rvprop:
+            revision['revid'] = page['revid']
+            revision['parentid'] = 0
+        if 'timestamp' in rvprop:
+            revision['timestamp'] = page['timestamp']
+        if 'user' in rvprop:
+            revision['user'] = 'FakeBot'
+        if 'comment' in rvprop:
+            revision['comment'] = ''
+        if 'size' in rvprop:
+            revision['size'] = len(page['text'].encode('utf-8'))
+        if 'content' in rvprop:
+            revision['*'] = page['text']
+        return revision
+
+    ### Parsing ###
+
+    def _action_expandtemplates(self, p, files, session):
+        text = self._require(p, 'text')
+        return {'expandtemplates': {'*': self._expand(text, 0)}}
+
+    def _action_parse(self, p, files, session):
+        revid = 0
+        if p.get('page') is not None:
+            page = self._corpus.get_page(p['page'])
+            if page is None:
+                raise FakeApiError('missingtitle', 'The page you specified doesn\'t exist')
+            title = page['title']
+            text = page['text']
+            revid = page['revid']
+        else:
+            title = p.get('title') or 'API'
+            text = p.get('text', '')
+        expanded = self._expand(text, 0)
+        links = re.findall('\\[\\[([^\\]|]+)(?:\\|[^\\]]*)?\\]\\]', expanded)
+        categories = []
+        pagelinks = []
+        for link in links:
+            ns, norm = self._corpus.normalize_title(link)
+            if norm is None:
+                continue
+            if ns == 14:
+                categories.append({'sortkey': '', '*':
+                        self._corpus.split_title(norm)[1].replace(' ', '_')})
+            else:
+                entry = {'ns': ns, '*': norm}
+                if self._corpus.get_page(norm) is not None:
+                    entry['exists'] = ''
+                pagelinks.append(entry)
+        templates = []
+        for norm in sorted(self._templates(text)):
+            entry = {'ns': 10, '*': norm}
+            if self._corpus.get_page(norm) is not None:
+                entry['exists'] = ''
+            templates.append(entry)
+        sections = []
+        for number, match in enumerate(re.finditer('^(=+)\\s*(.*?)\\s*\\1\\s*$',
+                expanded, re.M)):
+            sections.append({'toclevel': len(match.group(1)) - 1,
+                    'level': unicode(len(match.group(1))), 'line': match.group(2),
+                    'number': unicode(number + 1), 'index': unicode(number + 1),
+                    'fromtitle': title, 'byteoffset': match.start(),
+                    'anchor': match.group(2).replace(' ', '_')})
+        parsed = {'title': title, 'revid': revid,
+                'text': {'*': self._render(expanded)},
+                'langlinks': [], 'categories': categories, 'links': pagelinks,
+                'templates': templates, 'images': [],
+                'externallinks': re.findall('\\[(https?://[^\\s\\]]+)', expanded),
+                'sections': sections, 'displaytitle': title}
+        if p.get('prop') is not None:
+            props = self._split(p['prop'])
+            parsed = dict((key, value) for key, value in parsed.items()
+                    if key in props or key == 'title')
+        return {'parse': parsed}
+
+    def _expand(self, text, depth):
+        text = re.sub('(?s)<!--.*?-->', '', text)
+        if depth > 5:
+            return text
+
+        def replace(match):
+            name = match.group(1).split('|', 1)[0].strip()
+            page = self._corpus.get_page('Vorlage:' + name)
+            if page is None:
+                return '[[Vorlage:' + name + ']]'
+            return self._expand(page['text'], depth + 1)
+        return re.sub('(?s)\\{\\{(.*?)\\}\\}', replace, text)
+
+    def _templates(self, text, depth=0):
+        """Return the set of titles of the templates used by text, including
+        the templates used by these templates (like MediaWiki's
+        templatelinks table)."""
+        templates = set()
+        if depth > 5:
+            return templates
+        text = re.sub('(?s)<!--.*?-->', '', text)
+        for name in re.findall('\\{\\{\\s*([^|}]+?)\\s*[|}]', text):
+            norm = self._corpus.normalize_title('Vorlage:' + name)[1]
+            if norm is None or norm in templates:
+                continue
+            templates.add(norm)
+            page = self._corpus.get_page(norm)
+            if page is not None:
+                templates.update(self._templates(page['text'], depth + 1))
+        return templates
+
+    def _render(self, text):
+        text = re.sub('\\[\\[\\s*(Kategorie|Category)\\s*:[^\\]]*\\]\\]', '', text)
+        text = re.sub('\\[\\[([^\\]|]+)\\|([^\\]]*)\\]\\]',
+                '<a href="/wiki/\\1">\\2</a>', text)
+        text = re.sub('\\[\\[([^\\]|]+)\\]\\]', '<a href="/wiki/\\1">\\1</a>', text)
+        text = re.sub("'''(.*?)'''", '<b>\\1</b>', text)
+        text = re.sub("''(.*?)''", '<i>\\1</i>', text)
+        html = []
+        paragraph = []
+        for line in text.split('\n') + ['']:
+            match = re.match('^(=+)\\s*(.*?)\\s*\\1\\s*$', line)
+            if (match or not line.strip()) and paragraph:
+                html.append('<p>' + '\n'.join(paragraph) + '</p>')
+                paragraph = []
+            if match:
+                level = len(match.group(1))
+                html.append('<h%d>%s</h%d>' % (level, match.group(2), level))
+            elif line.strip():
+                paragraph.append(line.strip())
+        return '\n'.join(html)
+
+    ### Semantic MediaWiki ###
+
+    def _action_ask(self, p, files, session):
+        """Answer an SMW ask query.
+
+        Supported are conditions on categories ([[Kategorie:X]]), pages
+        ([[Title]]) and property values ([[Property::Value]]), printouts
+        (?Property or ?Property=Label) and the limit and offset options.
+        The property values of a page are the parameters of the templates
+        it calls and its [[Property::Value]] annotations (whose values
+        are pages). Results are sorted by title. With api_version=3,
+        results are a list (as in SMW 3), otherwise a dict.
+
+        """
+        parts = re.findall('(?:\[\[.*?\]\]|[^|\[])+', self._require(p, 'query'))
+        conditions = re.findall('\[\[(.*?)\]\]', parts[0] if parts else '')
+        printouts = []
+        options = {}
+        for part in parts[1:]:
+            part = part.strip()
+            if part.startswith('?'):
+                name, sep, label = part[1:].partition('=')
+                printouts.append((name.strip(), label.strip() or name.strip()))
+            elif '=' in part:
+                name, value = part.split('=', 1)
+                options[name.strip()] = value.strip()
+        limit = max(0, min(self._int(options.get('limit', 50)), 500))
+        offset = max(0, self._int(options.get('offset', 0)))
+        matches = []
+        for title in self._corpus.get_titles():
+            page = self._corpus.get_page(title)
+            properties = self._properties(page['text'])
+            if all(self._ask_matches(page, properties, condition)
+                    for condition in conditions):
+                matches.append((page, properties))
+        count = len(matches[offset : offset + limit])
+        typeids = {}
+        for name, label in printouts:
+            values = [value for page, properties in matches
+                    for value in properties.get(name, [])]
+            if any(typeid == '_wpg' for value, typeid in values):
+                typeids[name] = '_wpg'
+            elif values and all(re.match('^-?[0-9]+(\\.[0-9]+)?$', value)
+                    for value, typeid in values):
+                typeids[name] = '_num'
+            else:
+                typeids[name] = '_txt'
+        results = []
+        for page, properties in matches[offset : offset + limit]:
+            entry = self._ask_page(page['title'])
+            entry['printouts'] = {}
+            for name, label in printouts:
+                entry['printouts'][label] = [self._ask_value(value, typeids[name])
+                        for value, typeid in properties.get(name, [])]
+            results.append((page['title'], entry))
+        if p.get('api_version') == '3':
+            results = [{title: entry} for title, entry in results]
+        else:
+            results = dict(results) or []
+        printrequests = [{'label': '', 'typeid': '_wpg', 'mode': 2}]
+        printrequests += [{'label': label, 'typeid': typeids[name], 'mode': 1}
+                for name, label in printouts]
+        result = {'query': {'printrequests': printrequests, 'results': results,
+                'meta': {'hash': hashlib.md5(p['query'].encode('utf-8')).hexdigest(),
+                         'count': count, 'offset': offset}}}
+        if offset + limit < len(matches):
+            result['query-continue-offset'] = offset + limit
+        return result
+
+    def _properties(self, text):
+        """Return a dict that maps property names to lists of (value,
+        typeid) pairs."""
+        properties = {}
+        for call in re.findall('\{\{([^{}]*)\}\}', text):
+            for name, value in re.findall('\|\s*([^=|]+?)\s*=\s*([^|]*)', call):
+                properties.setdefault(name, []).append((value.strip(), '_txt'))
+        for name, value in re.findall('\[\[([^\]|:]+)::([^\]|]+)', text):
+            value = self._corpus.normalize_title(value)[1] or value.strip()
+            properties.setdefault(name.strip(), []).append((value, '_wpg'))
+        return properties
+
+    def _ask_matches(self, page, properties, condition):
+        if '::' in condition:
+            name, value = [x.strip() for x in condition.split('::', 1)]
+            norm = self._corpus.normalize_title(value)[1]
+            return any(actual == value or actual == norm
+                    for actual, typeid in properties.get(name, []))
+        ns, title = self._corpus.normalize_title(condition)
+        if ns == 14:
+            return title in page['categories']
+        return title == page['title']
+
+    def _ask_page(self, title):
+        page = self._corpus.get_page(title)
+        return {'fulltext': title, 'fullurl': 'http://localhost/wiki/' +
+                title.replace(' ', '_'), 'namespace': self._corpus.normalize_title(title)[0],
+                'exists': '1' if page is not None else ''}
+
+    def _ask_value(self, value, typeid):
+        if typeid == '_wpg':
+            return self._ask_page(value)
+        if typeid == '_num':
+            return float(value) if '.' in value else int(value)
+        return value
+
+    ### Changing pages ###
+
+    def _action_purge(self, p, files, session):
+        titles = self._split(self._require(p, 'titles'))
+        response = {}
+        limit = 500 if 'apihighlimits' in self._rights(session) else 50
+        if len(titles) > limit:
+            # like MediaWiki, ignore the excess titles with a warning
+            titles = titles[:limit]
+            response['warnings'] = {'purge': {'*': 'Too many values supplied'
+                    ' for parameter \'titles\': the limit is %d' % limit}}
+        result = []
+        normalized = []
+        for title in titles:
+            ns, norm = self._corpus.normalize_title(title)
+            if norm is None:
+                result.append({'title': title, 'invalid': ''})
+                continue
+            if norm != title:
+                normalized.append({'from': title, 'to': norm})
+            if self._corpus.touch(norm):
+                entry = {'ns': ns, 'title': norm, 'purged': ''}
+                if 'forcelinkupdate' in p:
+                    entry['linkupdate'] = ''
+                result.append(entry)
+            else:
+                result.append({'ns': ns, 'title': norm, 'missing': ''})
+        if normalized:
+            response['normalized'] = normalized
+        response['purge'] = result
+        return response
+
+    def _action_edit(self, p, files, session):
+        title = self._require(p, 'title')
+        self._check_token(p, session)
+        text = self._require(p, 'text')
+        if p.get('md5') is not None and \
+                hashlib.md5(text.encode('utf-8')).hexdigest() != p['md5']:
+            raise FakeApiError('badmd5', 'The supplied MD5 hash was incorrect')
+        ns, norm = self._corpus.normalize_title(title)
+        if norm is None:
+            raise FakeApiError('invalidtitle', 'Bad title "' + title + '"')
+        with self._lock:
+            page = self._corpus.get_page(norm)
+            if page is None:
+                if p.get('nocreate') is not None:
+                    raise FakeApiError('missingtitle', 'The page you specified doesn\'t exist')
+                if p.get('basetimestamp') is not None and \
+                        p.get('createonly') is None:
+                    raise FakeApiError('pagedeleted',
+                            'The page has been deleted since you fetched its timestamp')
+            else:
+                if p.get('createonly') is not None:
+                    raise FakeApiError('articleexists',
+                            'The article you tried to create has been created already')
+                if p.get('basetimestamp') is not None and \
+                        p['basetimestamp'] != page['timestamp']:
+                    raise FakeApiError('editconflict', 'Edit conflict detected')
+                if page['text'] == text:
+                    return {'edit': {'result': 'Success', 'pageid': page['pageid'],
+                            'title': page['title'], 'nochange': ''}}
+            old, new = self._corpus.edit_page(norm, text)
+        result = {'result': 'Success', 'pageid': new['pageid'],
+                'title': new['title'], 'newrevid': new['revid'],
+                'newtimestamp': new['timestamp']}
+        if old is None:
+            result['new'] = ''
+        else:
+            result['oldrevid'] = old['revid']
+        return {'edit': result}
+
+    def _action_upload(self, p, files, session):
+        filename = self._require(p, 'filename')
+        self._check_token(p, session)
+        if 'chunk' in files:
+            return self._upload_chunk(p, files['chunk'])
+        if p.get('filekey') is not None:
+            with self._lock:
+                stashed = self._stash.get(p['filekey'])
+                if stashed is None or len(stashed['data']) != stashed['filesize']:
+                    raise FakeApiError('missingresult',
+                            'No result in status data')
+                del self._stash[p['filekey']]
+            data = stashed['data']
+        elif 'file' in files:
+            data = files['file']
+        else:
+            raise FakeApiError('missingparam', 'One of the parameters file, url is required')
+        name = self._corpus.add_file(filename, data, p.get('text', ''))
+        return {'upload': {'result': 'Success', 'filename': name,
+                'imageinfo': self._imageinfo(name, data)}}
+
+    def _upload_chunk(self, p, chunk):
+        """Add a chunk to a file in the upload stash."""
+        filesize = self._int(self._require(p, 'filesize'))
+        offset = self._int(self._require(p, 'offset'))
+        with self._lock:
+            filekey = p.get('filekey')
+            if filekey is None:
+                if offset != 0:
+                    raise FakeApiError('stashfailed', 'Invalid chunk offset',
+                            {'offset': 0})
+                filekey = uuid.uuid4().hex[:12] + '.stash'
+                self._stash[filekey] = {'filename': p['filename'],
+                        'filesize': filesize, 'data': b''}
+            stashed = self._stash.get(filekey)
+            if stashed is None:
+                raise FakeApiError('stashfailed', 'Unknown filekey: ' + filekey)
+            if offset != len(stashed['data']):
+                raise FakeApiError('stashfailed',
+                        'Invalid chunk offset', {'offset': len(stashed['data'])})
+            if offset + len(chunk) > stashed['filesize']:
+                raise FakeApiError('stashfailed', 'File exceeds the given filesize')
+            stashed['data'] += chunk
+            if len(stashed['data']) < stashed['filesize']:
+                return {'upload': {'result': 'Continue', 'filekey': filekey,
+                        'offset': len(stashed['data'])}}
+            return {'upload': {'result': 'Success', 'filekey': filekey}}
+
+    ### Utilities ###
+
+    def _check_token(self, p, session):
+        token = p.get('token')
+        if token is None:
+            raise FakeApiError('notoken', 'The token parameter must be set')
+        if token != session.get('edittoken', ANONYMOUS_TOKEN):
+            raise FakeApiError('badtoken', 'Invalid token')
+
+    def _require(self, p, name):
+        if p.get(name) is None:
+            raise FakeApiError('no' + name, 'The ' + name + ' parameter must be set')
+        return p[name]
+
+    def _limit(self, value, revisions):
+        maximum = 50 if revisions else self._max_limit
+        if value is None:
+            return min(10, maximum)
+        if value == 'max':
+            return maximum
+        return max(1, min(self._int(value), maximum))
+
+    def _int(self, value):
+        try:
+            return int(value)
+        except(ValueError,TypeError):
+            raise FakeApiError('badinteger', 'Invalid integer: ' + unicode(value))
+
+    def _imageinfo(self, name, data):
+        return {'timestamp': self._now(), 'size': len(data),
+                'sha1': hashlib.sha1(data).hexdigest(),
+                'url': 'http://localhost/images/' + name.split(':')[-1]}
+
+    def _rights(self, session):
+        rights = ['read', 'edit', 'purge', 'upload', 'writeapi']
+        if session.get('user'):
+            # logged in users are bots
+            rights += ['apihighlimits', 'bot']
+        return rights
+
+    def _split(self, value):
+        if not value:
+            return []
+        return value.split('|')
+
+    def _entry(self, page):
+        return {'pageid': page['pageid'], 'ns': page['ns'], 'title': page['title']}
+
+    def _now(self):
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+class FakeWikiServer(object):
+    """A local HTTP server that emulates a MediaWiki API.
+
+    The API (see FakeApi) is served at get_api_url(); each request is
+    answered after a configurable latency, and requests are handled
+    concurrently. Statistics about the requests (number, bytes and
+    time spent per action) are available from get_stats() and, as JSON,
+    at the URL get_stats_url(). Transient failures can be simulated
+    with fail_next().
+
+    Example:
+        server = FakeWikiServer(Corpus.synthetic(), latency=0.05)
+        server.start()
+        client = WikiClient(server.get_api_url())
+        ...
+        server.stop()
+
+    """
+
+    def __init__(self, corpus, host='127.0.0.1', port=0, latency=0,
+            max_limit=500, users=None, max_result_size=None):
+        """Constructor.
+
+        corpus is the Corpus to serve. The server listens on host and
+        port (by default, on a free port of the loopback interface).
+        latency is the time in seconds each request takes in addition to
+        the actual processing time. max_limit, users and max_result_size
+        are passed to FakeApi.
+
+        """
+        self._api = FakeApi(corpus, max_limit, users, max_result_size)
+        self._latency = latency
+        self._sessions = {}
+        self._stats = {}
+        self._failures = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._httpd = _ThreadingHTTPServer((host, port), _ApiRequestHandler)
+        self._httpd.fakewiki = self
+
+    def get_api(self):
+        """Return the FakeApi object that answers the requests."""
+        return self._api
+
+    def get_api_url(self):
+        """Return the URL of the emulated api.php."""
+        host, port = self._httpd.server_address[0:2]
+        return 'http://%s:%d/api.php' % (host, port)
+
+    def get_stats_url(self):
+        """Return the URL at which get_stats() is served as JSON."""
+        host, port = self._httpd.server_address[0:2]
+        return 'http://%s:%d/stats' % (host, port)
+
+    def get_latency(self):
+        """Return the simulated latency in seconds."""
+        return self._latency
+
+    def set_latency(self, latency):
+        """Change the simulated latency in seconds."""
+        self._latency = latency
+
+    def fail_next(self, count, code=503):
+        """Let the next count API requests fail without processing them.
+
+        code is the HTTP response code to answer with, or None to close
+        the connection without an answer.
+
+        """
+        with self._lock:
+            self._failures.extend([code] * count)
+
+    def get_stats(self):
+        """Return a dict that maps each API action to a dict with the
+        number of 'requests', the 'bytes_in' and 'bytes_out' and the
+        'seconds' spent (including latency)."""
+        with self._lock:
+            return dict((action, dict(stats))
+                    for action, stats in self._stats.items())
+
+    def reset_stats(self):
+        """Reset the statistics."""
+        with self._lock:
+            self._stats = {}
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever,
+                name='FakeWikiServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        """Serve requests until stop() is called."""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """Stop serving requests and close the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    ### Internal methods ###
+
+    def _get_session(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                session_id = uuid.uuid4().hex
+                self._sessions[session_id] = {'id': session_id}
+            return self._sessions[session_id]
+
+    def _next_failure(self):
+        """Return (True, code) if the current request must fail."""
+        with self._lock:
+            if not self._failures:
+                return (False, None)
+            return (True, self._failures.pop(0))
+
+    def _record(self, action, bytes_in, bytes_out, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(unicode(action), {'requests': 0,
+                    'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+            stats['requests'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['seconds'] += seconds
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _ApiRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one piece, or delayed ACKs stall keep-alive
+    # connections by up to 40 ms per request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/stats':
+            self._send(200, json.dumps(self.server.fakewiki.get_stats()), {})
+        else:
+            self._handle_api()
+
+    def do_POST(self):
+        self._handle_api()
+
+    def _handle_api(self):
+        started = time.time()
+        fakewiki = self.server.fakewiki
+        if self.path.split('?', 1)[0] != '/api.php':
+            self._send(404, json.dumps({'error': {'code': 'notfound',
+                    'info': 'Not found: ' + self.path}}), {})
+            return
+        bytes_in = int(self.headers.get('Content-Length') or 0)
+        fail, code = fakewiki._next_failure()
+        if fail:
+            self.rfile.read(bytes_in)
+            if code is None:
+                self.close_connection = 1
+            else:
+                self._send(code, json.dumps({'error': {'code': 'http',
+                        'info': 'Simulated failure'}}), {})
+            fakewiki._record('failure', bytes_in, 0, time.time() - started)
+            return
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                environ={'REQUEST_METHOD': self.command,
+                         'QUERY_STRING': self.path.split('?', 1)[1]
+                                if '?' in self.path else ''},
+                keep_blank_values=True)
+        params = {}
+        files = {}
+        for name in form.keys():
+            field = form[name]
+            if isinstance(field, list):
+                field = field[0]
+            if field.filename is not None:
+                files[name] = field.value
+            else:
+                params[name] = field.value.decode('utf-8')
+        cookies = Cookie.SimpleCookie(self.headers.get('Cookie', b''))
+        session_id = None
+        if SESSION_COOKIE in cookies:
+            session_id = cookies[SESSION_COOKIE].value
+        session = fakewiki._get_session(session_id)
+        result, headers = fakewiki._api.handle(params, files, session)
+        if session['id'] != session_id:
+            headers['Set-Cookie'] = SESSION_COOKIE + '=' + session['id'] + '; path=/'
+        if fakewiki._latency:
+            time.sleep(fakewiki._latency)
+        body = json.dumps(result)
+        self._send(200, body, headers)
+        fakewiki._record(params.get('action'), bytes_in, len(body),
+                time.time() - started)
+
+    def _send(self, code, body, headers):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', unicode(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
@@ -1 +1 @@
-__all__ = ["emergencyerror", "wikiclient", "wikierror"]
+__all__ = ["askresult", "asyncwikiclient", "cassette", "chunkedupload", "curlengine", "dumpreader", "editqueue", "emergencyerror", "emergencymonitor", "jsonstream", "metrics", "pagecache", "parsecache", "purgereport", "ratelimiter", "retrypolicy", "sessionstore", "sqlitestore", "titleindex", "titlenormalizer", "tracing", "wikiclient", "wikierror", "wikimirror", "wikisync"]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import datetime
+
+
+# Semantic MediaWiki types whose values are strings.
+STRING_TYPES = frozenset(('_txt', '_str', '_cod', '_uri', '_anu', '_ema',
+    '_tel', '_keyw'))
+
+def convert_ask_value(typeid, value):
+    """Convert a printout value of an SMW ask result to a Python value.
+
+    typeid is the SMW type of the printout. Pages ('_wpg') become their
+    full titles, numbers ('_num') ints or floats, quantities ('_qty')
+    their numeric value, booleans ('_boo') bools, dates ('_dat')
+    datetime.datetime objects (in UTC) and strings (see STRING_TYPES)
+    unicode strings. Values of other types are returned unchanged.
+
+    """
+    if typeid == '_wpg':
+        if isinstance(value, dict):
+            return value.get('fulltext')
+        return unicode(value)
+    if typeid in ('_num', '_qty'):
+        if isinstance(value, dict):
+            value = value.get('value')
+        number = float(value)
+        if number.is_integer() and 'e' not in unicode(value).lower():
+            return int(number)
+        return number
+    if typeid == '_boo':
+        return value in (True, 1, '1', 't', 'true')
+    if typeid == '_dat':
+        if isinstance(value, dict):
+            value = value.get('timestamp')
+        return datetime.datetime(1970, 1, 1) + \
+                datetime.timedelta(seconds=int(value))
+    if typeid in STRING_TYPES:
+        return unicode(value)
+    return value
+
+
+class AskRow(object):
+    """One result row of a Semantic MediaWiki query (see WikiClient.ask()).
+
+    title is the full title of the page, namespace its namespace number
+    and fullurl its URL. The printouts are accessed by their labels:
+    row[label] is the list of all values (SMW properties may have
+    several), row.get(label) the first value or a default. The values
+    are converted according to their SMW types, see convert_ask_value().
+
+    Example:
+        for row in client.ask('[[Kategorie:Fakeplag]]', ['Seite', 'Zeilen']):
+            print(row.title, row.get('Seite'), row.get('Zeilen'))
+
+    """
+
+    def __init__(self, title, result, typeids):
+        """Constructor.
+
+        title is the key of the row in the API result, result the row
+        itself (with 'printouts', 'fulltext', 'fullurl' and 'namespace')
+        and typeids a dict that maps printout labels to SMW types.
+
+        """
+        self.title = result.get('fulltext', title)
+        self.namespace = result.get('namespace')
+        self.fullurl = result.get('fullurl')
+        self._printouts = {}
+        printouts = result.get('printouts') or {}
+        for label, values in printouts.items():
+            typeid = typeids.get(label)
+            self._printouts[label] = [convert_ask_value(typeid, value)
+                    for value in values]
+
+    def __repr__(self):
+        return '<AskRow ' + repr(self.title) + '>'
+
+    def __getitem__(self, label):
+        """Return the list of values of a printout."""
+        return list(self._printouts[label])
+
+    def __contains__(self, label):
+        """Return True if the row has a printout with this label."""
+        return label in self._printouts
+
+    def get(self, label, default=None):
+        """Return the first value of a printout, or default if the
+        printout has no values."""
+        values = self._printouts.get(label)
+        if not values:
+            return default
+        return values[0]
+
+    def get_labels(self):
+        """Return the sorted list of printout labels."""
+        return sorted(self._printouts)
+
+    def to_dict(self):
+        """Return the row as a dict with the key 'title' and one key per
+        printout label, mapped to the list of values."""
+        row = dict((label, list(values))
+                for label, values in self._printouts.items())
+        row['title'] = self.title
+        return row
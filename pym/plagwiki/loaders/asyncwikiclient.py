@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import collections
+import Queue
+import threading
+
+from plagwiki.loaders.curlengine import ThreadedCurlEngine
+from plagwiki.loaders.wikiclient import WikiClient
+from plagwiki.loaders.wikierror import WikiError
+
+
+DEFAULT_MAX_WORKERS = 8
+
+class WikiFuture(object):
+    """The result of an asynchronous AsyncWikiClient call.
+
+    The interface follows concurrent.futures.Future: result() blocks
+    until the call is done and returns its result (or raises its
+    exception), done() tells whether it is done, and callbacks added
+    with add_done_callback() are called with the future as soon as it
+    is done.
+
+    Callbacks run in a background thread. To hand a result over to an
+    event loop, use the loop's thread-safe scheduling function in the
+    callback (for example, loop.call_soon_threadsafe() in asyncio).
+
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """Return True if the call has finished."""
+        with self._condition:
+            return self._done
+
+    def result(self, timeout=None):
+        """Wait until the call has finished and return its result.
+
+        If the call raised an exception, it is raised here. If timeout
+        (in seconds) is not None and the call does not finish in time,
+        a WikiError is raised.
+
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait until the call has finished and return the exception
+        it raised, or None. See result() for timeout."""
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """Call callback(future) as soon as the call has finished (or
+        right now if it has finished already)."""
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        """Mark the call as finished with the given result."""
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        """Mark the call as finished with the given exception."""
+        self._finish(None, exception)
+
+    ### Internal methods ###
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise WikiError('Timeout while waiting for a wiki request')
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+
+class WikiIterator(object):
+    """The results of an asynchronous continued query.
+
+    The query runs in a background thread and keeps requesting further
+    results while earlier ones are consumed, until max_buffered results
+    are waiting. The results can be consumed either blocking, by
+    iterating over the WikiIterator as usual, or asynchronously with
+    next_future(), which returns a WikiFuture for the next result.
+
+    """
+
+    def __init__(self, generator, max_buffered=500):
+        self._condition = threading.Condition()
+        self._items = collections.deque()
+        self._waiters = collections.deque()
+        self._max_buffered = max_buffered
+        self._finished = False
+        self._exception = None
+        self._closed = False
+        thread = threading.Thread(target=self._produce, args=(generator,),
+                name='WikiIterator')
+        thread.daemon = True
+        thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return the next result, waiting for it if necessary."""
+        return self.next_future().result()
+
+    __next__ = next
+
+    def next_future(self):
+        """Return a WikiFuture for the next result.
+
+        At the end of the query, the future raises StopIteration. If the
+        query failed, the future raises the query's exception.
+
+        """
+        future = WikiFuture()
+        with self._condition:
+            if self._items:
+                future.set_result(self._items.popleft())
+                self._condition.notify_all()
+            elif self._finished:
+                future.set_exception(self._exception or StopIteration())
+            else:
+                self._waiters.append(future)
+        return future
+
+    def close(self):
+        """Stop the query. Results that have not been consumed yet are
+        discarded."""
+        with self._condition:
+            self._closed = True
+            self._items.clear()
+            self._condition.notify_all()
+
+    ### Internal methods ###
+
+    def _produce(self, generator):
+        exception = None
+        try:
+            for item in generator:
+                with self._condition:
+                    while len(self._items) >= self._max_buffered \
+                            and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        break
+                    if self._waiters:
+                        waiter = self._waiters.popleft()
+                    else:
+                        waiter = None
+                        self._items.append(item)
+                if waiter is not None:
+                    waiter.set_result(item)
+        except(Exception) as err:
+            exception = err
+        finally:
+            generator.close()
+        with self._condition:
+            self._finished = True
+            self._exception = exception
+            waiters = list(self._waiters)
+            self._waiters.clear()
+        for waiter in waiters:
+            waiter.set_exception(exception or StopIteration())
+
+
+class AsyncWikiClient(object):
+    """Manages a session with a wiki server without blocking the caller.
+
+    AsyncWikiClient offers the same operations as WikiClient. Instead
+    of blocking until the server has answered, the methods that access
+    the API return a WikiFuture immediately, and the iter_...() methods
+    return a WikiIterator. Many calls may be in flight at the same time:
+    the HTTP requests of all of them are multiplexed on one connection
+    pool (up to get_max_parallel_requests() requests at once), which is
+    driven by a single background thread.
+
+    All protocol logic is that of the underlying WikiClient (see
+    get_client()), which is used concurrently by up to max_workers
+    worker threads. Methods that do not access the API, such as
+    normalize_name() or get_article_url(), may be called on it
+    directly once the site information has been requested.
+
+    Example:
+        client = AsyncWikiClient('http://de.guttenplag.wikia.com/api.php')
+        futures = [client.get_page_text(title) for title in titles]
+        texts = [future.result() for future in futures]
+        for page in client.iter_category_pages('Kategorie:Plagiat'):
+            print(page['title'])
+        client.close()
+
+    """
+
+    # WikiClient methods that are wrapped as returning WikiFutures.
+    FUTURE_METHODS = (
+        'login', 'logout', 'check_emergency', 'request_siteinfo',
+        'request_userrights', 'request_edittoken', 'get_page_info', 'get_page_info_by_id',
+        'get_page_text', 'get_page_text_by_id', 'get_multi_page_info',
+        'get_multi_page_info_by_id', 'complete_pages', 'get_prefix_list',
+        'get_prefix_list_ids', 'get_prefix_index', 'get_category_members',
+        'get_category_members_ids', 'get_category_index', 'get_all_categories',
+        'get_all_categories_info', 'expandtemplates', 'expandtemplates_page',
+        'parse', 'parse_page', 'ask', 'get_last_change', 'purge',
+        'purge_multi', 'edit', 'upload')
+
+    # WikiClient methods that are wrapped as returning WikiIterators.
+    ITERATOR_METHODS = (
+        'iter_pages', 'iter_pages_by_id', 'iter_prefix_list',
+        'iter_category_members', 'iter_all_categories',
+        'iter_category_pages', 'iter_prefix_pages', 'iter_search_pages',
+        'iter_ask', 'iter_recent_changes')
+
+    def __init__(self, api, max_workers=DEFAULT_MAX_WORKERS):
+        """Constructor.
+
+        api is the URL to the MediaWiki API, see WikiClient. max_workers
+        is the maximum number of calls that are processed at the same
+        time; further calls wait until a worker is free.
+
+        """
+        self._engine = ThreadedCurlEngine()
+        self._client = WikiClient(api, self._engine)
+        self._max_workers = max_workers
+        self._tasks = Queue.Queue()
+        self._workers = []
+        self._idle_workers = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        """Called when entering a with statement. Returns self."""
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """Called when exiting a with statement. This logs out (or saves
+        the session, see WikiClient.__exit__()) and calls the close()
+        method."""
+        try:
+            self._client.__exit__(type, value, traceback)
+        finally:
+            self.close()
+
+    def close(self):
+        """Finish all pending calls and stop the background threads. The
+        client must not be used afterwards."""
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+        for worker in workers:
+            self._tasks.put(None)
+        for worker in workers:
+            worker.join()
+        self._engine.close()
+
+    ### Configuration ###
+
+    def get_client(self):
+        """Return the underlying WikiClient.
+
+        Use it for configuration (e.g. set_request_scheduler()) and for
+        methods that do not access the API. Calling its API methods
+        blocks the calling thread, but is otherwise safe.
+
+        """
+        return self._client
+
+    def get_max_parallel_requests(self):
+        """Return the maximum number of API requests in flight."""
+        return self._client.get_max_parallel_requests()
+
+    def set_max_parallel_requests(self, max_parallel_requests):
+        """Change the maximum number of API requests in flight."""
+        self._client.set_max_parallel_requests(max_parallel_requests)
+
+    def is_logged_in(self):
+        """Return true if the client is logged in."""
+        return self._client.is_logged_in()
+
+    ### Internal methods ###
+
+    def _submit(self, func, args, kw):
+        """Run func(*args, **kw) on a worker thread and return a WikiFuture
+        for its result."""
+        future = WikiFuture()
+        with self._lock:
+            if self._idle_workers == 0 and \
+                    len(self._workers) < self._max_workers:
+                worker = threading.Thread(target=self._work,
+                        name='AsyncWikiClient')
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+                self._idle_workers += 1
+            self._idle_workers -= 1
+        self._tasks.put((future, func, args, kw))
+        return future
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, func, args, kw = task
+            try:
+                future.set_result(func(*args, **kw))
+            except(Exception) as err:
+                future.set_exception(err)
+            with self._lock:
+                self._idle_workers += 1
+
+
+def _make_future_method(name):
+    method = getattr(WikiClient, name)
+    def future_method(self, *args, **kw):
+        return self._submit(getattr(self._client, name), args, kw)
+    future_method.__name__ = method.__name__
+    future_method.__doc__ = ('Asynchronous version of WikiClient.' + name +
+            '(); returns a WikiFuture for its result.\n\n' +
+            (method.__doc__ or ''))
+    return future_method
+
+def _make_iterator_method(name):
+    method = getattr(WikiClient, name)
+    def iterator_method(self, *args, **kw):
+        return WikiIterator(getattr(self._client, name)(*args, **kw))
+    iterator_method.__name__ = method.__name__
+    iterator_method.__doc__ = ('Asynchronous version of WikiClient.' + name +
+            '(); returns a WikiIterator over its results.\n\n' +
+            (method.__doc__ or ''))
+    return iterator_method
+
+for _name in AsyncWikiClient.FUTURE_METHODS:
+    setattr(AsyncWikiClient, _name, _make_future_method(_name))
+for _name in AsyncWikiClient.ITERATOR_METHODS:
+    setattr(AsyncWikiClient, _name, _make_iterator_method(_name))
+del _name
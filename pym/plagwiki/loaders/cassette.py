@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import hashlib
+import json
+import mmap
+import os
+import pycurl
+import struct
+import threading
+import time
+import urllib
+
+from plagwiki.loaders.curlengine import CurlEngine, DEFAULT_MAX_CONNECTIONS
+from plagwiki.loaders.wikierror import WikiError
+
+
+# Request parameters that differ between sessions without changing the
+# response, and are therefore left out of the request keys.
+VOLATILE_PARAMS = frozenset(('lgpassword', 'lgtoken', 'maxlag', 'token'))
+
+_FILE_MAGIC = b'PLAGCAS1'
+_RECORD_MAGIC = b'REC1'
+_RECORD_HEADER = struct.Struct(b'>4sHIII')
+
+def request_key(request):
+    """Return the key under which the exchange of a CurlRequest is
+    stored in a cassette.
+
+    The key consists of the URL and the sorted form parameters of the
+    request, except for VOLATILE_PARAMS. For file uploads, the name of
+    the uploaded file is used in place of its contents, and for uploads
+    from a buffer (e.g. chunks), the SHA-1 of the data.
+
+    """
+    params = []
+    for name, formfield in request.form:
+        if name.decode('utf-8') in VOLATILE_PARAMS:
+            continue
+        kind, value = formfield[0], formfield[1]
+        if kind == pycurl.FORM_FILE:
+            value = b'file:' + value
+        elif kind == pycurl.FORM_BUFFER:
+            value = b'buffer:' + hashlib.sha1(formfield[3]).hexdigest().encode('ascii')
+        params.append((name, value))
+    params.sort()
+    return request.url.encode('utf-8') + b'?' + urllib.urlencode(params)
+
+
+class Cassette(object):
+    """A file of recorded HTTP exchanges with a wiki API.
+
+    Each record holds the key of a request (see request_key()) and the
+    response code, headers and raw body of the response. Records are
+    appended one by one as they are recorded, so a cassette stays
+    usable even if the recording process dies.
+
+    For replaying, the file is memory-mapped and indexed by request key
+    once, when it is opened; bodies are not read before they are served.
+    If the same request was recorded several times (for instance, a page
+    before and after an edit), the responses are served in the recorded
+    order, and the last one is repeated once they are used up.
+
+    """
+
+    def __init__(self, filename, mode='replay'):
+        """Constructor.
+
+        filename is the path to the cassette file. mode is 'record' to
+        append new exchanges to the file (which is created if necessary)
+        or 'replay' to serve recorded exchanges.
+
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError('cassette mode must be record or replay: ' +
+                    unicode(mode))
+        self._filename = filename
+        self._mode = mode
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._index = {}
+        self._replayed = {}
+        if mode == 'record':
+            self._file = open(filename, 'ab')
+            if self._file.tell() == 0:
+                self._file.write(_FILE_MAGIC)
+                self._file.flush()
+        else:
+            self._open_replay()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the cassette file."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_filename(self):
+        """Return the path to the cassette file."""
+        return self._filename
+
+    def get_mode(self):
+        """Return 'record' or 'replay'."""
+        return self._mode
+
+    def __len__(self):
+        """Return the number of distinct requests in a replay cassette."""
+        return len(self._index)
+
+    def record(self, request, body=None):
+        """Append the exchange of a completed CurlRequest to the file.
+        body is the raw response, request.body by default."""
+        key = request_key(request)
+        headers = json.dumps(request.headers, sort_keys=True).encode('utf-8')
+        if body is None:
+            body = request.body
+        with self._lock:
+            self._file.write(_RECORD_HEADER.pack(_RECORD_MAGIC,
+                    request.response_code, len(key), len(headers), len(body)))
+            self._file.write(key)
+            self._file.write(headers)
+            self._file.write(body)
+            self._file.flush()
+
+    def replay(self, request):
+        """Fill in the response of a CurlRequest from the recording. If
+        the request has a sink, the body is written to it at once.
+
+        Raises a WikiError if the request has not been recorded.
+
+        """
+        key = request_key(request)
+        with self._lock:
+            entries = self._index.get(key)
+            if entries is None:
+                raise WikiError('Error while accessing ' + request.url +
+                        ': request not found in cassette ' +
+                        self._filename + ': ' + key.decode('utf-8'))
+            count = self._replayed.get(key, 0)
+            self._replayed[key] = count + 1
+            response_code, headers, body_pos, body_len = \
+                    entries[min(count, len(entries) - 1)]
+            request.started = time.time()
+            request.response_code = response_code
+            request.headers = dict(headers)
+            body = self._map[body_pos : body_pos + body_len]
+            request.response_bytes = body_len
+        if request.sink is not None:
+            request.body = None
+            request.sink.write(body)
+            request.sink.close()
+        else:
+            request.body = body
+        return request
+
+    ### Internal methods ###
+
+    def _open_replay(self):
+        with open(self._filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= len(_FILE_MAGIC):
+                raise WikiError('Empty cassette file: ' + self._filename)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[0 : len(_FILE_MAGIC)] != _FILE_MAGIC:
+            raise WikiError('Not a cassette file: ' + self._filename)
+        pos = len(_FILE_MAGIC)
+        size = len(self._map)
+        while pos + _RECORD_HEADER.size <= size:
+            magic, response_code, key_len, headers_len, body_len = \
+                    _RECORD_HEADER.unpack_from(self._map, pos)
+            pos += _RECORD_HEADER.size
+            end = pos + key_len + headers_len + body_len
+            if magic != _RECORD_MAGIC or end > size:
+                # a record that was cut off while recording
+                break
+            key = self._map[pos : pos + key_len]
+            pos += key_len
+            headers = json.loads(self._map[pos : pos + headers_len].decode('utf-8'))
+            pos += headers_len
+            self._index.setdefault(key, []).append(
+                    (response_code, headers, pos, body_len))
+            pos = end
+
+
+class RecordingCurlEngine(CurlEngine):
+    """A CurlEngine that records every exchange on a Cassette."""
+
+    def __init__(self, cassette, max_connections=DEFAULT_MAX_CONNECTIONS):
+        """Constructor.
+
+        cassette is a Cassette in 'record' mode. It is closed together
+        with the engine.
+
+        """
+        CurlEngine.__init__(self, max_connections)
+        self._cassette = cassette
+
+    def close(self):
+        """Close all handles and the cassette."""
+        CurlEngine.close(self)
+        self._cassette.close()
+
+    def get_cassette(self):
+        """Return the Cassette the exchanges are recorded on."""
+        return self._cassette
+
+    ### Internal methods ###
+
+    def _prepare_handle(self, curl, request):
+        buffers = CurlEngine._prepare_handle(self, curl, request)
+        if request.sink is not None:
+            # the cassette needs the body as well
+            buffer, sink = buffers[0], request.sink
+            def write(data):
+                buffer.write(data)
+                sink.write(data)
+            curl.setopt(pycurl.WRITEFUNCTION, write)
+        return buffers
+
+    def _finish_request(self, curl, request, buffers):
+        CurlEngine._finish_request(self, curl, request, buffers)
+        self._cassette.record(request, buffers[0].getvalue())
+
+
+class ReplayEngine(object):
+    """Serves requests from a Cassette instead of the network.
+
+    This provides the interface of CurlEngine, so that it can be passed
+    to WikiClient, but it neither opens connections nor waits for the
+    request throttle: every response is available immediately. This is
+    useful for tests and for benchmarking code on top of WikiClient
+    without network latency.
+
+    """
+
+    def __init__(self, cassette, max_connections=DEFAULT_MAX_CONNECTIONS):
+        """Constructor.
+
+        cassette is a Cassette in 'replay' mode. It is closed together
+        with the engine. max_connections is only stored, see
+        get_max_connections().
+
+        """
+        self._cassette = cassette
+        self._max_connections = 1
+        self.set_max_connections(max_connections)
+
+    def close(self):
+        """Close the cassette."""
+        self._cassette.close()
+
+    def get_cassette(self):
+        """Return the Cassette the responses are served from."""
+        return self._cassette
+
+    ### Configuration ###
+
+    def get_max_connections(self):
+        """Return the maximum number of concurrent requests."""
+        return self._max_connections
+
+    def set_max_connections(self, max_connections):
+        """Change the maximum number of concurrent requests. This has
+        no effect on replaying."""
+        max_connections = int(max_connections)
+        if max_connections < 1:
+            raise ValueError('max_connections must be at least 1')
+        self._max_connections = max_connections
+
+    def set_throttle(self, throttle):
+        """Ignored, replayed requests are never throttled."""
+        pass
+
+    def setopt(self, option, value):
+        """Ignored, there are no pycurl handles."""
+        pass
+
+    ### Cookies ###
+
+    def get_cookies(self):
+        """Return an empty list, replayed responses set no cookies."""
+        return []
+
+    def set_cookies(self, cookies):
+        """Ignored, replayed requests send no cookies."""
+        pass
+
+    def clear_cookies(self):
+        """Ignored, replayed requests send no cookies."""
+        pass
+
+    ### Performing requests ###
+
+    def perform(self, request):
+        """Serve a single request. See CurlEngine.perform()."""
+        return self._cassette.replay(request)
+
+    def perform_iter(self, request):
+        """Serve a single request. See CurlEngine.perform_iter()."""
+        self._cassette.replay(request)
+        yield None
+
+    def perform_multi(self, requests, callback):
+        """Serve several requests, in the same order in which a
+        CurlEngine with a single connection would perform them. See
+        CurlEngine.perform_multi()."""
+        queue = list(reversed(requests))
+        while queue:
+            next_requests = callback(self._cassette.replay(queue.pop()))
+            if next_requests:
+                queue.extend(reversed(next_requests))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import hashlib
+import os
+import pprint
+import time
+
+from plagwiki.loaders.wikierror import WikiError
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+def file_sha1(filename):
+    """Return the SHA-1 of a local file as a hex string, as it is
+    reported by the API (see WikiClient.get_file_info())."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(DEFAULT_CHUNK_SIZE)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+class ChunkedUpload(object):
+    """Uploads a large file in chunks, using the upload stash of the
+    MediaWiki API (MediaWiki 1.20 or later).
+
+    The file is sent in chunks of chunk_size bytes. The server confirms
+    the offset up to which it has received the file after each chunk.
+    If a chunk fails (e.g. because the connection broke), it is sent
+    again from the last confirmed offset, up to max_attempts times in a
+    row. If run() still fails, it raises a WikiError, and calling run()
+    again continues where the upload stopped. To continue in another
+    process, pass get_filekey() and get_offset() to the constructor.
+    Once the whole file is in the stash, it is published under its
+    remote name.
+
+    progress, if given, is called after each confirmed chunk as
+    progress(remote_filename, offset, filesize), so one function can
+    report the progress of several uploads that run in parallel. It is
+    called in the thread that runs the upload. Other threads may call
+    get_offset() at any time.
+
+    WikiClient.upload() uses this class for files larger than one chunk
+    if it is given a chunk_size.
+
+    """
+
+    def __init__(self, client, local_filename, remote_filename=None,
+            text=None, summary=None, chunk_size=DEFAULT_CHUNK_SIZE,
+            progress=None, filekey=None, offset=0):
+        """Constructor.
+
+        client is the WikiClient used for the upload. local_filename,
+        remote_filename, text and summary are as in WikiClient.upload().
+        filekey and offset continue an upload that has been interrupted.
+
+        """
+        if remote_filename is None:
+            remote_filename = os.path.basename(local_filename)
+        self._client = client
+        self._local_filename = local_filename
+        self._remote_filename = remote_filename
+        self._text = text
+        self._summary = summary
+        self._chunk_size = max(1, int(chunk_size))
+        self._progress = progress
+        self._filekey = filekey
+        self._offset = offset
+        self._filesize = os.path.getsize(local_filename)
+        self._result = None
+
+    def get_remote_filename(self):
+        """Return the name of the file on the wiki."""
+        return self._remote_filename
+
+    def get_filesize(self):
+        """Return the size of the local file in bytes."""
+        return self._filesize
+
+    def get_filekey(self):
+        """Return the key of the file in the upload stash, or None if no
+        chunk has been confirmed yet."""
+        return self._filekey
+
+    def get_offset(self):
+        """Return the number of bytes confirmed by the server."""
+        return self._offset
+
+    def is_complete(self):
+        """Return True if the file has been published on the wiki."""
+        return self._result is not None
+
+    def run(self, max_attempts=5, retry_delay=1.0):
+        """Upload the remaining chunks and publish the file.
+
+        A failed chunk is sent again after retry_delay seconds, and the
+        delay doubles with every further failure of the same chunk.
+
+        Returns the 'upload' part of the final API result (see
+        WikiClient.upload()).
+
+        """
+        if self._result is not None:
+            return self._result
+        self._client.request_edittoken()
+        with open(self._local_filename, 'rb') as f:
+            attempt = 1
+            while self._offset < self._filesize or self._filekey is None:
+                f.seek(self._offset)
+                chunk = f.read(self._chunk_size)
+                try:
+                    self._send_chunk(chunk)
+                    attempt = 1
+                except(WikiError):
+                    if attempt >= max_attempts:
+                        raise
+                    time.sleep(retry_delay * 2 ** (attempt - 1))
+                    attempt += 1
+        r_upload = self._client.query_api({'action':'upload',
+                'filename':self._remote_filename, 'filekey':self._filekey,
+                'ignorewarnings':'', 'token':self._client.get_edittoken(),
+                'text':self._text, 'comment':self._summary})
+        try:
+            if r_upload['upload']['result'] != 'Success':
+                raise LookupError()
+        except(LookupError,TypeError):
+            raise WikiError('MediaWiki upload request failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_upload))
+        self._result = r_upload['upload']
+        return self._result
+
+    ### Internal methods ###
+
+    def _send_chunk(self, chunk):
+        """Send the chunk at the current offset and record the offset
+        confirmed by the server."""
+        kw = {'action':'upload', 'stash':'', 'filename':self._remote_filename,
+                'filesize':self._filesize, 'offset':self._offset,
+                'filekey':self._filekey, 'ignorewarnings':'',
+                'token':self._client.get_edittoken(),
+                'chunk':(chunk, 'buffer', 'application/octet-stream')}
+        r_chunk = self._client.query_api(kw, False)
+        if 'error' in r_chunk:
+            error = r_chunk['error']
+            if 'offset' in error and self._filekey is not None:
+                # the server got the chunk, but its response was lost
+                self._set_offset(int(error['offset']))
+            raise WikiError('Error while uploading ' + self._remote_filename +
+                    ' at offset ' + unicode(self._offset) + ': ' +
+                    unicode(error.get('info')))
+        try:
+            upload = r_chunk['upload']
+            self._filekey = upload['filekey']
+            if upload['result'] == 'Success':
+                offset = self._filesize
+            elif upload['result'] == 'Continue':
+                offset = int(upload['offset'])
+            else:
+                raise LookupError()
+        except(LookupError,TypeError,ValueError):
+            raise WikiError('MediaWiki chunked upload request failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_chunk))
+        self._set_offset(offset)
+
+    def _set_offset(self, offset):
+        self._offset = offset
+        if self._progress is not None:
+            self._progress(self._remote_filename, offset, self._filesize)
@@ -0,0 +1,748 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import fcntl
+import io
+import os
+import pycurl
+import select
+import threading
+import time
+
+from plagwiki.loaders.wikierror import WikiError
+
+
+DEFAULT_MAX_CONNECTIONS = 4
+
+class CurlRequest(object):
+    """A single HTTP POST request performed by a CurlEngine.
+
+    url is the URL to post to (a unicode string), form is the form
+    contents in the format expected by pycurl.HTTPPOST. tag may be
+    anything; it is not used by the engine and is meant to let the
+    caller associate the request with its own bookkeeping.
+
+    kind is passed to the engine's throttle (see CurlEngine.set_throttle()).
+    The request is not sent before the time not_before (in seconds since
+    the epoch). label is a short description of the request, such as
+    'query/allpages', for metrics and error messages. trace_id is the
+    ID of the trace the request belongs to, if it is traced (see
+    plagwiki.loaders.tracing), or None. The transfer is aborted after
+    timeout seconds, unless timeout is None.
+
+    sink, if given, is an object with the methods write() and close()
+    (such as a plagwiki.loaders.jsonstream.JsonStream). The response is
+    then passed to sink.write() piece by piece as it arrives, instead of
+    being collected, and sink.close() is called once the transfer is
+    complete.
+
+    After the request has been performed, started is the time (in
+    seconds since the epoch) at which it was handed to libcurl, after
+    it has waited for the throttle. response_code contains the HTTP
+    response code, headers the response headers (a dict with
+    lowercase header names) and body the raw (undecoded) response, or
+    None if the request has a sink. timings is a dict with the times (in
+    seconds since the transfer started) at which the name lookup
+    ('namelookup'), the connection ('connect'), the protocol and TLS
+    setup ('pretransfer') and the first byte of the response
+    ('starttransfer') were done, and the total time ('total').
+    request_bytes and response_bytes are the sizes sent and received,
+    including headers. If the transfer failed (e.g. because the
+    connection broke or timed out), error describes the problem, errno
+    is the libcurl error code and response_code is None.
+
+    """
+
+    def __init__(self, url, form, tag=None, kind='read', not_before=0,
+            label=None, trace_id=None, timeout=None, sink=None):
+        self.url = url
+        self.form = form
+        self.tag = tag
+        self.kind = kind
+        self.not_before = not_before
+        self.label = label
+        self.trace_id = trace_id
+        self.timeout = timeout
+        self.sink = sink
+        self.started = None
+        self.response_code = None
+        self.headers = {}
+        self.body = None
+        self.timings = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.error = None
+        self.errno = None
+
+
+def create_share():
+    """Return a new pycurl.CurlShare that shares cookies, DNS lookups,
+    TLS sessions and (if pycurl supports it) connections between all
+    handles that use it, e.g. between the engines of several clients of
+    the same wiki (see CurlEngine.__init__())."""
+    share = pycurl.CurlShare()
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_COOKIE)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+        # only in newer versions of pycurl
+        share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+    return share
+
+
+class CurlEngine(object):
+    """Performs HTTP requests using a pool of pycurl handles.
+
+    Single requests are performed synchronously on one handle. Batches
+    of requests (see perform_multi()) are driven by a pycurl.CurlMulti,
+    so that up to get_max_connections() of them are in flight at the
+    same time. All handles share their cookies, which means that a
+    login session established through one handle is valid for all of
+    them.
+
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, share=None):
+        """Constructor.
+
+        max_connections is the maximum number of requests that
+        perform_multi() keeps in flight at once.
+
+        share is a pycurl.CurlShare (see create_share()) for the handles
+        of the engine, which may be shared with other engines. It must
+        share cookies at least. By default, the engine creates its own,
+        which only shares cookies. A share passed here is not closed by
+        close().
+
+        """
+        self._owns_share = share is None
+        if share is None:
+            share = pycurl.CurlShare()
+            share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_COOKIE)
+        self._share = share
+        self._multi = pycurl.CurlMulti()
+        self._options = {}
+        self._handles = []
+        self._idle_handles = []
+        self._max_connections = 1
+        self._throttle = None
+        self.set_max_connections(max_connections)
+
+    def close(self):
+        """Close all handles. The engine must not be used afterwards."""
+        for curl in self._handles:
+            curl.close()
+        self._handles = []
+        self._idle_handles = []
+        self._multi.close()
+        if self._owns_share:
+            self._share.close()
+
+    ### Configuration ###
+
+    def get_max_connections(self):
+        """Return the maximum number of concurrent requests."""
+        return self._max_connections
+
+    def set_max_connections(self, max_connections):
+        """Change the maximum number of concurrent requests."""
+        max_connections = int(max_connections)
+        if max_connections < 1:
+            raise ValueError('max_connections must be at least 1')
+        self._max_connections = max_connections
+
+    def set_throttle(self, throttle):
+        """Set the function that decides when requests may be sent.
+
+        throttle is called as throttle(kind) right before a request is
+        sent, where kind is the request's kind attribute. It must return
+        0 if the request may be sent now, or else the number of seconds
+        to wait before asking again. Set throttle to None to send all
+        requests immediately.
+
+        """
+        self._throttle = throttle
+
+    def setopt(self, option, value):
+        """Set a pycurl option on all current and future handles."""
+        self._options[option] = value
+        for curl in self._handles:
+            curl.setopt(option, value)
+
+    ### Cookies ###
+
+    def get_cookies(self):
+        """Return all cookies of the engine as a list of lines in the
+        Netscape cookie file format."""
+        curl = self._cookie_handle()
+        try:
+            return [line.decode('utf-8') if isinstance(line, bytes) else line
+                    for line in curl.getinfo(pycurl.INFO_COOKIELIST)]
+        finally:
+            curl.close()
+
+    def set_cookies(self, cookies):
+        """Add cookies (lines in the Netscape cookie file format, as
+        returned by get_cookies()) to the engine."""
+        curl = self._cookie_handle()
+        try:
+            for line in cookies:
+                curl.setopt(pycurl.COOKIELIST, line.encode('utf-8'))
+        finally:
+            curl.close()
+
+    def clear_cookies(self):
+        """Remove all cookies from the engine."""
+        curl = self._cookie_handle()
+        try:
+            curl.setopt(pycurl.COOKIELIST, b'ALL')
+        finally:
+            curl.close()
+
+    ### Performing requests ###
+
+    def perform(self, request):
+        """Perform a single request synchronously.
+
+        Failed transfers are not raised but reported in request.error
+        (see CurlRequest). HTTP error codes are not treated as failures
+        either; check request.response_code.
+
+        """
+        while True:
+            delay = self._delay(request, time.time())
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        curl = self._acquire_handle()
+        try:
+            buffers = self._prepare_handle(curl, request)
+            try:
+                curl.perform()
+            except(pycurl.error) as err:
+                self._fail_request(request, err.args[0], curl.errstr())
+            else:
+                self._finish_request(curl, request, buffers)
+        finally:
+            self._release_handle(curl)
+        return request
+
+    def perform_iter(self, request):
+        """Perform a single request, pausing while it is in progress.
+
+        This is a generator version of perform() for requests with a
+        sink (see CurlRequest). It yields None whenever libcurl has made
+        progress, so that the caller can process the part of the response
+        that the sink has received so far. The request is done when the
+        generator is exhausted; if the generator is closed before, the
+        transfer is aborted.
+
+        The transfer runs on a CurlMulti of its own, so the engine may be
+        used for other requests while the generator is paused.
+
+        """
+        while True:
+            delay = self._delay(request, time.time())
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        curl = self._acquire_handle()
+        multi = pycurl.CurlMulti()
+        added = False
+        try:
+            buffers = self._prepare_handle(curl, request)
+            multi.add_handle(curl)
+            added = True
+            while True:
+                while True:
+                    ret, num_handles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                num_queued, ok_list, err_list = multi.info_read()
+                if ok_list or err_list:
+                    multi.remove_handle(curl)
+                    added = False
+                    if err_list:
+                        handle, errno, errmsg = err_list[0]
+                        self._fail_request(request, errno, errmsg)
+                    else:
+                        self._finish_request(curl, request, buffers)
+                    return
+                yield None
+                timeout = 1.0
+                # wake up in time for libcurl's timeouts
+                curl_timeout = multi.timeout()
+                if curl_timeout >= 0 and curl_timeout / 1000 < timeout:
+                    timeout = curl_timeout / 1000
+                multi.select(timeout)
+        finally:
+            if added:
+                multi.remove_handle(curl)
+            multi.close()
+            self._release_handle(curl)
+
+    def perform_multi(self, requests, callback):
+        """Perform several requests concurrently.
+
+        requests is a sequence of CurlRequest objects. At most
+        get_max_connections() of them are in flight at any time; the
+        rest are queued and started (in order) as soon as a handle
+        becomes free and the throttle (see set_throttle()) allows it.
+
+        callback is called with each CurlRequest as soon as it has
+        completed. It may return a sequence of further CurlRequests (for
+        instance, to continue a query or to retry a failed transfer),
+        which are then queued before all remaining requests, or None.
+
+        Failed transfers are passed to callback like all others, see
+        perform(). If callback raises an exception, all other transfers
+        are aborted and the exception propagates.
+
+        """
+        queue = list(reversed(requests))
+        active = {}
+        try:
+            while queue or active:
+                # Start queued requests, skipping those that have to wait.
+                wait = None
+                pos = len(queue) - 1
+                while pos >= 0 and len(active) < self._max_connections:
+                    request = queue[pos]
+                    delay = self._delay(request, time.time())
+                    if delay > 0:
+                        if wait is None or delay < wait:
+                            wait = delay
+                        pos -= 1
+                        continue
+                    del queue[pos]
+                    pos -= 1
+                    curl = self._acquire_handle()
+                    active[curl] = (request, self._prepare_handle(curl, request))
+                    self._multi.add_handle(curl)
+                if not active:
+                    if wait is not None:
+                        time.sleep(wait)
+                    continue
+                while True:
+                    ret, num_handles = self._multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    num_queued, ok_list, err_list = self._multi.info_read()
+                    for curl, errno, errmsg in err_list:
+                        request, buffers = active.pop(curl)
+                        self._multi.remove_handle(curl)
+                        self._release_handle(curl)
+                        self._fail_request(request, errno, errmsg)
+                        next_requests = callback(request)
+                        if next_requests:
+                            queue.extend(reversed(next_requests))
+                    for curl in ok_list:
+                        request, buffers = active.pop(curl)
+                        self._multi.remove_handle(curl)
+                        self._finish_request(curl, request, buffers)
+                        self._release_handle(curl)
+                        next_requests = callback(request)
+                        if next_requests:
+                            queue.extend(reversed(next_requests))
+                    if num_queued == 0:
+                        break
+                if active:
+                    timeout = 1.0
+                    if wait is not None and wait < timeout:
+                        timeout = wait
+                    # wake up in time for libcurl's timeouts
+                    curl_timeout = self._multi.timeout()
+                    if curl_timeout >= 0 and curl_timeout / 1000 < timeout:
+                        timeout = curl_timeout / 1000
+                    self._multi.select(timeout)
+        finally:
+            for curl in active:
+                self._multi.remove_handle(curl)
+                self._release_handle(curl)
+
+    ### Internal methods ###
+
+    def _acquire_handle(self):
+        if self._idle_handles:
+            return self._idle_handles.pop()
+        curl = pycurl.Curl()
+        curl.setopt(pycurl.SHARE, self._share)
+        curl.setopt(pycurl.COOKIEFILE, b'')
+        for option, value in self._options.items():
+            curl.setopt(option, value)
+        self._handles.append(curl)
+        return curl
+
+    def _release_handle(self, curl):
+        self._idle_handles.append(curl)
+
+    def _cookie_handle(self):
+        # a temporary handle outside the pool, so that the cookies can be
+        # accessed from any thread (the share does its own locking)
+        curl = pycurl.Curl()
+        curl.setopt(pycurl.SHARE, self._share)
+        curl.setopt(pycurl.COOKIEFILE, b'')
+        return curl
+
+    def _delay(self, request, now):
+        """Return how long request has to wait before it may be sent.
+        Returns 0 (and accounts for the request) if it may be sent now."""
+        if request.not_before > now:
+            return request.not_before - now
+        if self._throttle is None:
+            return 0
+        return self._throttle(request.kind)
+
+    def _prepare_handle(self, curl, request):
+        buffer = io.BytesIO()
+        header_lines = []
+        curl.setopt(pycurl.URL, request.url.encode('utf-8'))
+        curl.setopt(pycurl.HTTPPOST, request.form)
+        # handles are reused, so the timeout is always set (0 = none)
+        timeout_ms = 0
+        if request.timeout is not None:
+            timeout_ms = max(1, int(request.timeout * 1000))
+        curl.setopt(pycurl.TIMEOUT_MS, timeout_ms)
+        request.started = time.time()
+        request.error = None
+        request.errno = None
+        if request.sink is not None:
+            curl.setopt(pycurl.WRITEFUNCTION, request.sink.write)
+        else:
+            curl.setopt(pycurl.WRITEFUNCTION, buffer.write)
+        curl.setopt(pycurl.HEADERFUNCTION, header_lines.append)
+        return (buffer, header_lines)
+
+    def _fail_request(self, request, errno, errmsg):
+        request.response_code = None
+        request.headers = {}
+        request.body = None
+        request.errno = errno
+        request.error = ('Error while accessing ' + request.url + ': ' +
+                unicode(errmsg))
+
+    def _finish_request(self, curl, request, buffers):
+        buffer, header_lines = buffers
+        request.response_code = curl.getinfo(pycurl.RESPONSE_CODE)
+        request.headers = {}
+        for line in header_lines:
+            line = line.decode('iso-8859-1')
+            if line.startswith('HTTP/'):
+                # a new response begins (e.g. after a redirect)
+                request.headers = {}
+            elif ':' in line:
+                name, value = line.split(':', 1)
+                request.headers[name.strip().lower()] = value.strip()
+        if request.sink is not None:
+            request.body = None
+            request.sink.close()
+        else:
+            request.body = buffer.getvalue()
+        request.timings = {
+            'namelookup': curl.getinfo(pycurl.NAMELOOKUP_TIME),
+            'connect': curl.getinfo(pycurl.CONNECT_TIME),
+            'pretransfer': curl.getinfo(pycurl.PRETRANSFER_TIME),
+            'starttransfer': curl.getinfo(pycurl.STARTTRANSFER_TIME),
+            'total': curl.getinfo(pycurl.TOTAL_TIME)}
+        request.request_bytes = int(curl.getinfo(pycurl.REQUEST_SIZE) +
+                curl.getinfo(pycurl.SIZE_UPLOAD))
+        request.response_bytes = int(curl.getinfo(pycurl.HEADER_SIZE) +
+                curl.getinfo(pycurl.SIZE_DOWNLOAD))
+
+
+class ThreadedCurlEngine(CurlEngine):
+    """A CurlEngine whose transfers are all driven by one background thread.
+
+    perform() and perform_multi() may be called from any number of
+    threads at the same time. The calling thread blocks until its own
+    requests are done, while the background thread multiplexes the
+    requests of all callers on a single pycurl.CurlMulti, so that up to
+    get_max_connections() requests are in flight in total. All pycurl
+    handles are only ever touched by the background thread.
+
+    Callbacks passed to perform_multi() run in the background thread.
+    They may call perform() and perform_multi() themselves; such nested
+    requests are queued like all others, and the background thread keeps
+    driving all transfers until they are done. If a request cannot be
+    prepared or finished, the exception is raised to the caller who
+    submitted it, and the other callers are not affected.
+
+    The background thread is started on first use and stopped by close().
+
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, share=None):
+        """Constructor. See CurlEngine.__init__()."""
+        CurlEngine.__init__(self, max_connections, share)
+        self._lock = threading.Lock()
+        self._incoming = []
+        # requests and transfers of the background thread
+        self._queue = []
+        self._active = {}
+        self._closing = False
+        self._thread = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def close(self):
+        """Wait for the background thread to finish all requests, stop it
+        and close all handles. The engine must not be used afterwards."""
+        with self._lock:
+            self._closing = True
+            thread = self._thread
+        self._wakeup()
+        if thread is not None:
+            thread.join()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+        CurlEngine.close(self)
+
+    ### Configuration ###
+
+    def setopt(self, option, value):
+        """Set a pycurl option on all future transfers."""
+        with self._lock:
+            # applied to the handles by the background thread
+            self._options[option] = value
+
+    ### Performing requests ###
+
+    def perform(self, request):
+        """Perform a single request, blocking the calling thread until it
+        is done. See CurlEngine.perform()."""
+        self.perform_multi([request], None)
+        return request
+
+    def perform_iter(self, request):
+        """Perform a single request, see CurlEngine.perform_iter().
+
+        The background thread passes the response to the sink as it
+        arrives, but the generator only yields once the request is done.
+
+        """
+        self.perform(request)
+        yield None
+
+    def perform_multi(self, requests, callback):
+        """Perform several requests concurrently, blocking the calling
+        thread until all of them (and all requests returned by callback)
+        are done. See CurlEngine.perform_multi()."""
+        if self._in_loop_thread():
+            # called by a callback: drive the loop until the requests are
+            # done, instead of blocking all other transfers
+            batch = _CurlBatch(callback)
+            batch.pending = len(requests)
+            self._queue[0:0] = [(request, batch) for request in requests]
+            while requests and not batch.done.is_set():
+                self._step()
+            if batch.error is not None:
+                raise batch.error
+            return
+        self._run_batch(requests, callback)
+
+    ### Internal methods ###
+
+    def _in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    def _run_batch(self, requests, callback):
+        batch = _CurlBatch(callback)
+        with self._lock:
+            if self._closing:
+                raise WikiError('The CurlEngine has been closed')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,
+                        name='CurlEngine')
+                self._thread.daemon = True
+                self._thread.start()
+            batch.pending = len(requests)
+            self._incoming.extend((request, batch) for request in requests)
+        self._wakeup()
+        if requests:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_write, b'x')
+        except(OSError):
+            # the pipe is full, so the thread wakes up anyway
+            pass
+
+    def _acquire_handle(self):
+        curl = CurlEngine._acquire_handle(self)
+        # pick up options set by other threads since the handle was created
+        with self._lock:
+            options = self._options.items()
+        for option, value in options:
+            curl.setopt(option, value)
+        return curl
+
+    def _loop(self):
+        error = None
+        try:
+            while True:
+                with self._lock:
+                    if (self._closing and not self._incoming and
+                            not self._queue and not self._active):
+                        return
+                self._step()
+        except(Exception) as err:
+            error = err
+        finally:
+            # never leave a caller waiting for requests that are not
+            # performed any more
+            self._fail_pending(error)
+
+    def _step(self):
+        """Start the queued requests that may be sent, process the
+        completed transfers and wait until there is something to do."""
+        queue = self._queue
+        active = self._active
+        with self._lock:
+            queue.extend(self._incoming)
+            self._incoming = []
+        # Start queued requests, skipping those that have to wait.
+        wait = None
+        pos = 0
+        while pos < len(queue) and len(active) < self._max_connections:
+            request, batch = queue[pos]
+            if batch.error is not None:
+                del queue[pos]
+                continue
+            try:
+                delay = self._delay(request, time.time())
+            except(Exception) as err:
+                del queue[pos]
+                batch.fail(err)
+                continue
+            if delay > 0:
+                if wait is None or delay < wait:
+                    wait = delay
+                pos += 1
+                continue
+            del queue[pos]
+            curl = None
+            try:
+                curl = self._acquire_handle()
+                buffers = self._prepare_handle(curl, request)
+                self._multi.add_handle(curl)
+            except(Exception) as err:
+                if curl is not None:
+                    self._release_handle(curl)
+                batch.fail(err)
+                continue
+            active[curl] = (request, batch, buffers)
+        if active:
+            while True:
+                ret, num_handles = self._multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                num_queued, ok_list, err_list = self._multi.info_read()
+                for curl, errno, errmsg in err_list:
+                    request, batch, buffers = active.pop(curl)
+                    self._multi.remove_handle(curl)
+                    self._release_handle(curl)
+                    try:
+                        self._fail_request(request, errno, errmsg)
+                    except(Exception) as err:
+                        batch.fail(err)
+                        continue
+                    queue[0:0] = [(next_request, batch) for next_request
+                            in batch.complete(request)]
+                for curl in ok_list:
+                    request, batch, buffers = active.pop(curl)
+                    self._multi.remove_handle(curl)
+                    try:
+                        self._finish_request(curl, request, buffers)
+                    except(Exception) as err:
+                        batch.fail(err)
+                        continue
+                    finally:
+                        self._release_handle(curl)
+                    queue[0:0] = [(next_request, batch) for next_request
+                            in batch.complete(request)]
+                if num_queued == 0:
+                    break
+        # Sleep until a transfer or the throttle needs attention, or
+        # until another thread submits requests.
+        timeout = 1.0
+        if wait is not None and wait < timeout:
+            timeout = wait
+        read_fds, write_fds, except_fds = [], [], []
+        if active:
+            read_fds, write_fds, except_fds = self._multi.fdset()
+            curl_timeout = self._multi.timeout()
+            if curl_timeout >= 0 and curl_timeout / 1000 < timeout:
+                timeout = curl_timeout / 1000
+        readable = select.select(read_fds + [self._wakeup_read],
+                write_fds, except_fds, timeout)[0]
+        if self._wakeup_read in readable:
+            try:
+                os.read(self._wakeup_read, 4096)
+            except(OSError):
+                pass
+
+    def _fail_pending(self, error):
+        """Fail the batches of all requests that have not completed, when
+        the background thread exits. error is the exception that stopped
+        it, or None if the engine has been closed."""
+        if error is None:
+            error = WikiError('The CurlEngine has been closed')
+        for curl, (request, batch, buffers) in self._active.items():
+            try:
+                self._multi.remove_handle(curl)
+            except(pycurl.error):
+                pass
+            self._release_handle(curl)
+            batch.fail(error)
+        self._active = {}
+        with self._lock:
+            pending = self._queue + self._incoming
+            self._queue = []
+            self._incoming = []
+            # a later request starts a new thread (unless closing), which
+            # must not find the multi handle still in use
+            self._thread = None
+        for request, batch in pending:
+            batch.fail(error)
+
+class _CurlBatch(object):
+    """The requests submitted by one call of ThreadedCurlEngine.perform()
+    or perform_multi()."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.pending = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def complete(self, request):
+        """Run the callback for a completed request and return the
+        requests it asks for."""
+        next_requests = []
+        if self.error is None and self.callback is not None:
+            try:
+                next_requests = list(self.callback(request) or [])
+            except(Exception) as err:
+                self.fail(err)
+                return []
+        self.pending += len(next_requests) - 1
+        if self.pending == 0:
+            self.done.set()
+        return next_requests
+
+    def fail(self, error):
+        """Record the exception that makes the batch fail and wake up
+        the caller, who raises it."""
+        if self.error is None:
+            self.error = error
+        self.done.set()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import bz2
+import re
+import zlib
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from plagwiki.loaders.titlenormalizer import TitleNormalizer
+from plagwiki.loaders.wikierror import WikiError
+
+
+# Canonical (English) names of the built-in namespaces of MediaWiki.
+# Dumps only contain the localized names.
+CANONICAL_NAMESPACES = {-2: 'Media', -1: 'Special', 1: 'Talk', 2: 'User',
+    3: 'User talk', 4: 'Project', 5: 'Project talk', 6: 'File',
+    7: 'File talk', 8: 'MediaWiki', 9: 'MediaWiki talk', 10: 'Template',
+    11: 'Template talk', 12: 'Help', 13: 'Help talk', 14: 'Category',
+    15: 'Category talk'}
+
+READ_SIZE = 256 * 1024
+
+# [[Namespace:Name]] or [[Namespace:Name|sort key]], but not
+# [[:Namespace:Name]], which only links to a category
+_LINK = re.compile(r'\[\[\s*([^\[\]|:]+?)\s*:\s*([^\[\]|]+?)\s*(?:\|[^\[\]]*)?\]\]')
+_COMMENT = re.compile(r'(?s)<!--.*?-->')
+
+class DumpReader(object):
+    """Reads the pages of a MediaWiki XML dump.
+
+    The dump may be the output of Special:Export or a database dump
+    like pages-meta-current.xml, uncompressed or compressed with gzip
+    or bzip2 (including multistream dumps); the compression is detected
+    from the first bytes. The XML is parsed as it is read, and each page
+    is discarded as soon as it has been yielded, so the memory needed
+    does not depend on the size of the dump.
+
+    iter_pages() yields page records in the format of
+    WikiClient.get_page_info(), with the latest revision of each page
+    in the dump. As dumps contain neither page_touched nor the results
+    of templates, 'touched' is the timestamp of the revision and the
+    categories are those linked directly in the wikitext. WikiClient
+    therefore re-queries the categories (but not the text) of imported
+    pages once, see import_pages().
+
+    Pages can be filtered by namespace, title prefix and category: a
+    page is yielded if it is in one of namespaces (if given) and, if
+    prefixes or categories are given, its title starts with one of
+    prefixes or it is in one of categories.
+
+    Example:
+        with DumpReader('pages-current.xml.bz2', namespaces=[0],
+                prefixes=['Fakeplag/']) as reader:
+            reader.import_pages(client.get_page_cache(), client.get_api_url())
+
+    """
+
+    def __init__(self, source, namespaces=None, prefixes=None, categories=None):
+        """Constructor.
+
+        source is the file name of the dump or a file object opened in
+        binary mode. prefixes are full titles (including the namespace
+        name); categories may be given with or without namespace prefix.
+
+        """
+        if hasattr(source, 'read'):
+            self._file = source
+            self._close_file = False
+        else:
+            self._file = open(source, 'rb')
+            self._close_file = True
+        self._input = _CountingFile(self._file)
+        self._namespaces = None
+        if namespaces is not None:
+            self._namespaces = frozenset(int(ns) for ns in namespaces)
+        self._prefixes = [unicode(prefix) for prefix in prefixes or ()]
+        self._categories = [unicode(category) for category in categories or ()]
+        self._full_prefixes = ()
+        self._full_categories = frozenset()
+        self._siteinfo = None
+        self._title_normalizer = None
+        self._category_names = frozenset()
+        self._page_tag = None
+        self._xml = None
+        self._pages_read = 0
+        self._pages_matched = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the dump file (unless a file object was passed)."""
+        if self._close_file and self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def get_siteinfo(self):
+        """Return the site information from the header of the dump, in
+        the format of WikiClient.get_siteinfo(), or None if the header
+        has not been read yet (see iter_pages())."""
+        return self._siteinfo
+
+    def get_title_normalizer(self):
+        """Return the TitleNormalizer of the wiki, or None if the header
+        has not been read yet."""
+        return self._title_normalizer
+
+    def get_bytes_read(self):
+        """Return the number of bytes read from the dump file so far."""
+        return self._input.get_count()
+
+    def get_xml_bytes_read(self):
+        """Return the number of uncompressed bytes parsed so far."""
+        if self._xml is None:
+            return 0
+        return self._xml.get_count()
+
+    def get_pages_read(self):
+        """Return the number of pages parsed so far."""
+        return self._pages_read
+
+    def get_pages_matched(self):
+        """Return the number of pages yielded so far."""
+        return self._pages_matched
+
+    def iter_pages(self):
+        """Iterate over the records of the pages in the dump that pass
+        the filters, in the order of the dump.
+
+        This is a generator. The dump can only be read once.
+
+        """
+        if self._xml is not None:
+            raise WikiError('The dump has already been read')
+        self._xml = _CountingFile(self._open_decompressed())
+        root = None
+        # cElementTree of Python 2 only accepts byte strings as events
+        events = (str('start'), str('end'))
+        for event, elem in ElementTree.iterparse(self._xml, events=events):
+            if root is None:
+                root = elem
+                # the tags include the XML namespace of the export format
+                self._page_tag = root.tag[:-len('mediawiki')] + 'page'
+                continue
+            if event != 'end':
+                continue
+            if self._tag(elem) == 'siteinfo':
+                self._set_siteinfo(self._parse_siteinfo(elem))
+                root.clear()
+            if elem.tag == self._page_tag:
+                page = self._parse_page(elem)
+                # drop the page, and the reference to it from the root
+                elem.clear()
+                root.clear()
+                self._pages_read += 1
+                if page is not None and self._matches(page):
+                    self._pages_matched += 1
+                    yield page
+
+    def import_pages(self, page_cache, api, batch_size=500):
+        """Store the pages that pass the filters in a PageCache, as the
+        pages of the wiki api. Returns the number of pages stored.
+
+        WikiClient takes the text of these pages from the cache as long
+        as their revision is current; their categories are queried once,
+        as they may differ from those in the wikitext.
+
+        """
+        count = 0
+        batch = []
+        for page in self.iter_pages():
+            batch.append(page)
+            if len(batch) >= batch_size:
+                page_cache.store(api, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            page_cache.store(api, batch)
+            count += len(batch)
+        return count
+
+    ### Internal methods ###
+
+    def _open_decompressed(self):
+        magic = self._input.peek(3)
+        if magic[:2] == b'\x1f\x8b':
+            return _DecompressingFile(self._input,
+                    lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+        if magic == b'BZh':
+            return _DecompressingFile(self._input, bz2.BZ2Decompressor)
+        return self._input
+
+    def _tag(self, elem):
+        # strip the XML namespace of the export format
+        return elem.tag.rsplit('}', 1)[-1]
+
+    def _children(self, elem):
+        """Return a dict that maps the tags of the children of elem to
+        the children (the last one, if several have the same tag)."""
+        return dict((self._tag(child), child) for child in elem)
+
+    def _text(self, elem):
+        if elem is None or elem.text is None:
+            return None
+        return unicode(elem.text)
+
+    def _parse_siteinfo(self, elem):
+        general = {}
+        namespaces = {}
+        for child in elem:
+            tag = self._tag(child)
+            if tag == 'namespaces':
+                for ns in child:
+                    ns_id = int(ns.get('key'))
+                    entry = {'id': ns_id, '*': unicode(ns.text or ''),
+                            'case': ns.get('case', 'first-letter')}
+                    if ns_id in CANONICAL_NAMESPACES:
+                        entry['canonical'] = CANONICAL_NAMESPACES[ns_id]
+                    namespaces[unicode(ns_id)] = entry
+            else:
+                general[tag] = unicode(child.text or '')
+        return {'general': general, 'namespaces': namespaces,
+                'namespacealiases': [{'id': 6, '*': 'Image'}]}
+
+    def _set_siteinfo(self, siteinfo):
+        self._siteinfo = siteinfo
+        normalizer = TitleNormalizer(siteinfo)
+        self._title_normalizer = normalizer
+        names = set()
+        for ns in siteinfo['namespaces'].values():
+            if ns['id'] == 14:
+                names.add(ns['*'].lower())
+                names.add(ns.get('canonical', ns['*']).lower())
+        for ns in siteinfo['namespacealiases']:
+            if ns['id'] == 14:
+                names.add(ns['*'].lower())
+        self._category_names = frozenset(names)
+        prefixes = []
+        for prefix in self._prefixes:
+            ns, rest = normalizer.split_name(prefix)
+            rest = rest.replace('_', ' ').lstrip()
+            rest = rest[:1].upper() + rest[1:]
+            if ns != 0:
+                rest = normalizer.normalize_namespace(ns) + ':' + rest
+            prefixes.append(rest)
+        self._full_prefixes = tuple(prefixes)
+        categories = set()
+        for category in self._categories:
+            ns, rest = normalizer.split_name(category)
+            if ns == 0:
+                ns = 14
+            categories.add(normalizer.combine_name(ns, rest))
+        self._full_categories = frozenset(categories)
+
+    def _parse_page(self, elem):
+        """Return the record of a <page> element, or None if it has no
+        revision."""
+        children = self._children(elem)
+        title = self._text(children.get('title'))
+        revision = children.get('revision')
+        if title is None or revision is None:
+            return None
+        if self._title_normalizer is None:
+            raise WikiError('The dump has no siteinfo header')
+        ns = self._text(children.get('ns'))
+        if ns is None:
+            ns = self._title_normalizer.split_name(title)[0]
+        revision = self._children(revision)
+        text = self._text(revision.get('text')) or ''
+        page = {'pageid': int(self._text(children.get('id'))), 'ns': int(ns),
+                'title': title,
+                'lastrevid': int(self._text(revision.get('id'))),
+                'touched': self._text(revision.get('timestamp')),
+                'length': len(text.encode('utf-8')),
+                'revisions': [{'*': text}]}
+        if 'redirect' in children:
+            page['redirect'] = ''
+        categories = self._text_categories(text)
+        if categories:
+            page['categories'] = [{'ns': 14, 'title': category}
+                    for category in categories]
+        return page
+
+    def _text_categories(self, text):
+        """Return the sorted list of categories linked in wikitext."""
+        if '[[' not in text:
+            return []
+        if '<!--' in text:
+            text = _COMMENT.sub('', text)
+        category_names = self._category_names
+        return sorted(set(self._title_normalizer.combine_name(14, name)
+                for ns, name in _LINK.findall(text)
+                if ns.lower().replace('_', ' ') in category_names))
+
+    def _matches(self, page):
+        if self._namespaces is not None and page['ns'] not in self._namespaces:
+            return False
+        if not self._full_prefixes and not self._full_categories:
+            return True
+        title = page['title']
+        if any(title.startswith(prefix) for prefix in self._full_prefixes):
+            return True
+        return any(category['title'] in self._full_categories
+                for category in page.get('categories', ()))
+
+
+class _CountingFile(object):
+    """A read-only file wrapper that counts the bytes read and can peek."""
+
+    def __init__(self, f):
+        self._file = f
+        self._count = 0
+        self._pending = b''
+
+    def get_count(self):
+        return self._count
+
+    def peek(self, size):
+        if len(self._pending) < size:
+            self._pending += self._file.read(size - len(self._pending))
+        return self._pending[:size]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._pending + self._file.read()
+            self._pending = b''
+        elif self._pending:
+            data = self._pending[:size]
+            self._pending = self._pending[size:]
+            if len(data) < size:
+                data += self._file.read(size - len(data))
+        else:
+            data = self._file.read(size)
+        self._count += len(data)
+        return data
+
+
+class _DecompressingFile(object):
+    """Decompresses a gzip or bzip2 file while it is read.
+
+    make_decompressor creates a zlib or bz2 decompressor object. Files
+    of several concatenated streams (like the multistream dumps of
+    Wikimedia) are supported, unlike with gzip.GzipFile and
+    bz2.BZ2File in Python 2, and the file need not be seekable.
+
+    """
+
+    def __init__(self, f, make_decompressor):
+        self._file = f
+        self._make_decompressor = make_decompressor
+        self._decompressor = make_decompressor()
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or
+                len(self._buffer) < size):
+            data = self._file.read(READ_SIZE)
+            if not data:
+                self._eof = True
+                break
+            while data:
+                try:
+                    self._buffer += self._decompressor.decompress(data)
+                except(EOFError):
+                    # bz2: the last stream has ended, start the next one
+                    self._decompressor = self._make_decompressor()
+                    continue
+                data = self._decompressor.unused_data
+                if data:
+                    # the stream has ended, the rest belongs to the next one
+                    self._decompressor = self._make_decompressor()
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import pprint
+
+from plagwiki.loaders.emergencyerror import EmergencyError
+
+
+# API error codes that mean somebody else changed the page in the meantime.
+CONFLICT_ERRORS = frozenset(('editconflict', 'pagedeleted', 'articleexists'))
+
+class EditResult(object):
+    """The outcome of editing one page with an EditQueue.
+
+    title is the page title as first passed to EditQueue.add(). status
+    is one of the following:
+      'saved':     the edit was saved, newrevid is the new revision ID
+      'unchanged': the transformed text equals the current text, so
+                   nothing was saved
+      'skipped':   a transform returned None, so nothing was saved
+      'conflict':  somebody else edited, deleted or created the page
+                   after its text was fetched, so the edit was refused
+      'failed':    the edit failed for another reason, e.g. because a
+                   request failed or the emergency halt is active
+    message describes the problem if status is 'conflict' or 'failed'.
+
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.status = None
+        self.message = None
+        self.newrevid = None
+
+    def __repr__(self):
+        return '<EditResult ' + repr(self.title) + ': ' + unicode(self.status) + '>'
+
+
+class EditQueue(object):
+    """Applies text transformations to many wiki pages.
+
+    Jobs are added with add(); each job consists of a page title and a
+    transform function. run() then fetches the current texts of all
+    pages (50 at a time), applies the transforms locally and saves the
+    changed pages. Saving starts as soon as the first batch of texts has
+    arrived, so edits and further fetches overlap. All requests pass the
+    client's request scheduler, so the write rate limit applies.
+
+    Each edit is submitted with the timestamp of the revision it is
+    based on and the time the text was fetched. If somebody else edits
+    the page in the meantime, the server refuses the edit and the
+    conflict is reported in the page's EditResult; no concurrent change
+    is ever overwritten. Failed requests are reported there as well, so
+    one broken page or batch does not stop the others.
+
+    Example:
+        queue = EditQueue(client, 'PlagWiki-Bot - fix typo')
+        for title in titles:
+            queue.add(title, lambda text: text.replace('Plagait', 'Plagiat'))
+        for result in queue.run():
+            if result.status == 'conflict':
+                print('Please check ' + result.title)
+
+    """
+
+    def __init__(self, client, summary=None, minor=True, bot=True,
+            check_emergency=False):
+        """Constructor.
+
+        client is the WikiClient used for all requests. summary, minor
+        and bot are used for all edits, see WikiClient.edit().
+
+        If check_emergency is True, client.check_emergency() is called
+        before the edits of each batch are submitted. Once it raises an
+        EmergencyError, no further edits are submitted.
+
+        """
+        self._client = client
+        self._summary = summary
+        self._minor = minor
+        self._bot = bot
+        self._check_emergency = check_emergency
+        self._titles = []
+        self._keys = {}
+        self._transforms = {}
+        self._summaries = {}
+
+    def __len__(self):
+        """Return the number of pages in the queue."""
+        return len(self._titles)
+
+    def add(self, title, transform, summary=None):
+        """Add a job to the queue.
+
+        title is the title of the page to edit.
+
+        transform is called with the current wikitext of the page (or
+        None if the page does not exist) and must return the new text,
+        or None to leave the page alone. If several jobs are added for
+        the same page (even under titles that differ, like 'Foo bar' and
+        'foo_bar'), their transforms are applied in order.
+
+        summary overrides the queue's edit summary for this page.
+
+        """
+        key = self._client.normalize_name(title)
+        if key not in self._transforms:
+            self._titles.append(key)
+            self._keys[key] = title
+            self._transforms[key] = []
+        self._transforms[key].append(transform)
+        if summary is not None:
+            self._summaries[key] = summary
+
+    def run(self):
+        """Process all jobs and empty the queue.
+
+        Returns a list of EditResult objects, one per page, in the order
+        in which the pages were first added. All problems, including
+        failed requests, are reported there.
+
+        """
+        titles = self._titles
+        transforms = self._transforms
+        summaries = self._summaries
+        results = dict((key, EditResult(title))
+                for key, title in self._keys.items())
+        self._titles = []
+        self._keys = {}
+        self._transforms = {}
+        self._summaries = {}
+        halted = []
+
+        def on_result(tag, kw, result):
+            if tag[0] == 'fetch':
+                return self._handle_fetch(tag[1], result, results,
+                        transforms, summaries, halted)
+            else:
+                self._handle_edit(results[tag[1]], result)
+                return None
+
+        def on_error(tag, kw, error):
+            if tag[0] == 'fetch':
+                chunk = tag[1]
+            else:
+                chunk = [tag[1]]
+            self._fail(chunk, results, unicode(error))
+            return None
+
+        chunk_size = 50
+        jobs = []
+        for chunk_pos in range(0, len(titles), chunk_size):
+            jobs.append(self._fetch_job(titles[chunk_pos : chunk_pos + chunk_size]))
+        self._client.query_pipeline(jobs, on_result, False, on_error)
+        return [results[title] for title in titles]
+
+    ### Internal methods ###
+
+    def _fetch_job(self, chunk, query_continue=None):
+        """Return the job that fetches the texts of the pages in chunk,
+        continuing a truncated result if query_continue is given."""
+        kw = {'action':'query', 'prop':'info|revisions',
+                'rvprop':'content|timestamp', 'intoken':'edit',
+                'titles':'|'.join(chunk)}
+        if query_continue:
+            kw.update(query_continue)
+        return (('fetch', chunk), kw)
+
+    def _handle_fetch(self, chunk, r_query, results, transforms, summaries,
+            halted):
+        """Apply the transforms to a fetched batch of pages and return
+        the edit jobs. halted is a list that holds the EmergencyError
+        once the emergency halt has been activated.
+
+        If the texts do not fit into one result, MediaWiki leaves out the
+        revisions of some pages and returns an rvcontinue parameter; the
+        job that fetches them is returned as well.
+
+        """
+        if 'error' in r_query:
+            self._fail(chunk, results, self._client.get_response_error(r_query))
+            return None
+        try:
+            # map titles normalized by the API back to our keys
+            original = dict((title, title) for title in chunk)
+            for entry in r_query['query'].get('normalized', []):
+                original[entry['to']] = entry['from']
+            pages = r_query['query']['pages'].values()
+            query_continue = r_query.get('query-continue', {}).get('revisions')
+        except(LookupError,TypeError,AttributeError):
+            self._fail(chunk, results, 'MediaWiki pages query failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_query))
+            return None
+        if self._check_emergency and not halted:
+            try:
+                self._client.check_emergency()
+            except(EmergencyError) as err:
+                halted.append(err)
+        if halted:
+            self._fail(chunk, results, unicode(halted[0]))
+            return None
+        jobs = []
+        deferred = []
+        for page in pages:
+            title = original.get(page.get('title'))
+            if title not in results:
+                continue
+            result = results[title]
+            if 'invalid' in page:
+                result.status = 'failed'
+                result.message = 'Invalid title'
+                continue
+            if 'missing' not in page and 'revisions' not in page:
+                if query_continue:
+                    # the text comes with the continuation
+                    deferred.append(title)
+                else:
+                    result.status = 'failed'
+                    result.message = 'MediaWiki returned no revision of the page'
+                continue
+            try:
+                token = page['edittoken']
+                if 'missing' in page:
+                    oldtext = None
+                    basetimestamp = None
+                else:
+                    revision = page['revisions'][0]
+                    oldtext = revision['*']
+                    basetimestamp = revision['timestamp']
+            except(LookupError,TypeError):
+                result.status = 'failed'
+                result.message = 'Unexpected page record: ' + \
+                        pprint.pformat(page)
+                continue
+            text = oldtext
+            for transform in transforms[title]:
+                text = transform(text)
+                if text is None:
+                    break
+            if text is None:
+                result.status = 'skipped'
+                continue
+            if text == oldtext:
+                result.status = 'unchanged'
+                continue
+            kw = self._client.get_edit_arguments(title, text, token,
+                    summaries.get(title, self._summary), self._minor,
+                    self._bot, basetimestamp, page.get('starttimestamp'),
+                    createonly=(oldtext is None))
+            jobs.append((('edit', title), kw))
+        # e.g. if the API ignored titles beyond its limit
+        message = self._client.get_response_error(r_query) or \
+                'Page missing from the API result'
+        edited = set(tag[1] for tag, kw in jobs)
+        edited.update(deferred)
+        self._fail([title for title in chunk if title not in edited],
+                results, message)
+        if deferred:
+            jobs.append(self._fetch_job(deferred, query_continue))
+        return jobs
+
+    def _handle_edit(self, result, r_edit):
+        """Record the outcome of an edit in result."""
+        if 'error' in r_edit:
+            if r_edit['error'].get('code') in CONFLICT_ERRORS:
+                result.status = 'conflict'
+            else:
+                result.status = 'failed'
+            result.message = r_edit['error'].get('info')
+            return
+        try:
+            if r_edit['edit']['result'] != 'Success':
+                raise LookupError()
+            if 'nochange' in r_edit['edit']:
+                result.status = 'unchanged'
+            else:
+                result.status = 'saved'
+                result.newrevid = r_edit['edit'].get('newrevid')
+        except(LookupError,TypeError):
+            result.status = 'failed'
+            result.message = 'Unexpected response: ' + pprint.pformat(r_edit)
+
+    def _fail(self, titles, results, message):
+        """Mark the pages that have no result yet as failed."""
+        for title in titles:
+            result = results[title]
+            if result.status is None:
+                result.status = 'failed'
+                result.message = message
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import pprint
+import re
+import sys
+import threading
+import time
+
+from plagwiki.loaders.emergencyerror import EmergencyError
+from plagwiki.loaders.wikierror import WikiError
+
+
+# By default, check() revalidates the state on every call.
+DEFAULT_MAX_AGE = 0
+
+_COMMENT = re.compile('<!--.*?-->')
+
+class EmergencyMonitor(object):
+    """Keeps track of the emergency halt state of a bot.
+
+    The state is read from the emergency variable on the emergency page
+    (see WikiClient.set_emergency_page()). It is cached together with
+    the revision ID of the page, so check() is just a flag check as long
+    as the state is at most max_age seconds old. After that, check()
+    revalidates it with a cheap request for the current revision ID of
+    the page, and downloads and scans the text only if the page has been
+    edited. With the default max_age of 0, every check() revalidates the
+    state; a larger max_age saves these requests, but a halt is then only
+    noticed up to max_age seconds late.
+
+    For bots that must not wait for the revalidation, start() runs a
+    watcher thread that revalidates the state every interval seconds.
+    With an interval below max_age, check() never sends a request. If the
+    watcher fails, e.g. because the wiki is not reachable, check() still
+    revalidates the state itself once it is older than max_age, so the
+    state used by check() is never older than that.
+
+    WikiClient creates an EmergencyMonitor in set_emergency_page() and
+    uses it in check_emergency(), see also get_emergency_monitor().
+
+    """
+
+    def __init__(self, client, page, var, max_age=DEFAULT_MAX_AGE):
+        """Constructor.
+
+        client is the WikiClient used to read the emergency page. page is
+        the emergency page name, var the name of the emergency variable.
+        max_age is the maximum age of the state used by check(), in
+        seconds.
+
+        """
+        self._client = client
+        self._page = page
+        self._var = var
+        self._var_regex = re.compile(re.escape(var) + r'\s*=\s*([0-9]+)')
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # the time the state was read, the revision ID of the page and the
+        # error message if the bot must halt (None otherwise)
+        self._checked = None
+        self._lastrevid = None
+        self._message = None
+        self._watcher = None
+        self._stop_event = None
+
+    ### Configuration ###
+
+    def get_page(self):
+        """Return the emergency page name."""
+        return self._page
+
+    def get_var(self):
+        """Return the name of the emergency variable."""
+        return self._var
+
+    def get_max_age(self):
+        """Return the maximum age of the state used by check(), in seconds."""
+        return self._max_age
+
+    def set_max_age(self, max_age):
+        """Change the maximum age of the state used by check(). With 0,
+        check() revalidates the state on every call."""
+        self._max_age = max_age
+
+    ### Checking ###
+
+    def check(self):
+        """Raise an EmergencyError if the bot must halt.
+
+        This is the case if the emergency variable is set to anything but
+        zero, or if the emergency page or variable does not exist. The
+        state is revalidated first if it is older than max_age seconds.
+
+        """
+        checked = self._checked
+        if checked is None or time.time() - checked > self._max_age:
+            self.refresh()
+        message = self._message
+        if message is not None:
+            raise EmergencyError(message)
+
+    def refresh(self):
+        """Revalidate the state now, regardless of its age."""
+        self._refresh(self._client)
+
+    def get_status(self):
+        """Return a dict with the current state: 'checked' is the time it
+        was read (in seconds since the epoch, None if it never was),
+        'lastrevid' the revision ID of the emergency page, 'halt' whether
+        the bot must halt and 'message' the reason (or None)."""
+        with self._lock:
+            return {'checked': self._checked, 'lastrevid': self._lastrevid,
+                    'halt': self._message is not None,
+                    'message': self._message}
+
+    ### Watcher thread ###
+
+    def start(self, interval):
+        """Start the watcher thread, which revalidates the state every
+        interval seconds.
+
+        The watcher uses a WikiClient of its own, because a WikiClient
+        may only be used by several threads at once if it runs on a
+        ThreadedCurlEngine (as in AsyncWikiClient), and because the
+        watcher should not wait behind the requests of the bot. It
+        shares the request scheduler, the retry policy, the circuit
+        breaker and the metrics of the monitor's client, but not its
+        login session, so the emergency page must be readable without
+        logging in.
+
+        """
+        self.stop()
+        client = type(self._client)(self._client.get_api_url())
+        client.set_user_agent(self._client.get_user_agent())
+        client.set_request_scheduler(self._client.get_request_scheduler())
+        client.set_retry_policy(self._client.get_retry_policy())
+        client.set_circuit_breaker(self._client.get_circuit_breaker())
+        client.set_metrics(self._client.get_metrics())
+        client.set_tracer(self._client.get_tracer())
+        stop_event = threading.Event()
+        watcher = threading.Thread(target=self._watch,
+                args=(client, interval, stop_event), name='EmergencyMonitor')
+        watcher.daemon = True
+        self._stop_event = stop_event
+        self._watcher = watcher
+        watcher.start()
+
+    def stop(self):
+        """Stop the watcher thread, if it is running."""
+        watcher = self._watcher
+        if watcher is None:
+            return
+        self._stop_event.set()
+        if watcher is not threading.current_thread():
+            watcher.join()
+        self._watcher = None
+        self._stop_event = None
+
+    def is_running(self):
+        """Return true if the watcher thread is running."""
+        return self._watcher is not None and self._watcher.is_alive()
+
+    ### Internal methods ###
+
+    def _watch(self, client, interval, stop_event):
+        try:
+            while not stop_event.is_set():
+                try:
+                    self._refresh(client)
+                except(WikiError) as err:
+                    # check() revalidates the state itself when it gets stale
+                    print(unicode(err), file=sys.stderr)
+                    print('Warning: emergency page could not be checked',
+                            file=sys.stderr)
+                stop_event.wait(interval)
+        finally:
+            client.close()
+
+    def _refresh(self, client):
+        started = time.time()
+        lastrevid = self._lastrevid
+        if lastrevid is not None:
+            page = self._query_page(client, 'info')
+            if page.get('lastrevid') == lastrevid:
+                self._set_state(started, lastrevid, self._message)
+                return
+        page = self._query_page(client, 'info|revisions')
+        if 'missing' in page:
+            self._set_state(started, None,
+                    'Emergency page ' + self._page + ' does not exist!')
+            return
+        try:
+            text = page['revisions'][0]['*']
+            lastrevid = page['revisions'][0]['revid']
+        except(LookupError,TypeError):
+            raise WikiError('MediaWiki emergency page request failed,' +
+                ' here is the full page: ' + "\n" + pprint.pformat(page))
+        self._set_state(started, lastrevid, self._parse(text))
+
+    def _query_page(self, client, prop):
+        kw = {'action':'query', 'titles':self._page, 'prop':prop}
+        if 'revisions' in prop:
+            kw['rvprop'] = 'ids|content'
+        r = client.query_api(kw)
+        try:
+            return r['query']['pages'].values()[0]
+        except(LookupError,TypeError,AttributeError):
+            raise WikiError('MediaWiki emergency page request failed,' +
+                ' here is the full response: ' + "\n" + pprint.pformat(r))
+
+    def _parse(self, text):
+        """Return the error message for the emergency page text, or None
+        if the bot may go on."""
+        text = _COMMENT.sub('', text)
+        match = self._var_regex.search(text)
+        if not match:
+            return ('Emergency variable ' + self._var +
+                    ' is not defined in emergency page ' + self._page + '!')
+        if int(match.group(1)) != 0:
+            return 'Emergency halt!'
+        return None
+
+    def _set_state(self, checked, lastrevid, message):
+        with self._lock:
+            # do not overwrite the result of a refresh that started later
+            if self._checked is not None and self._checked > checked:
+                return
+            self._checked = checked
+            self._lastrevid = lastrevid
+            self._message = message
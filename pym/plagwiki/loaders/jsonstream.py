@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import codecs
+import json
+import re
+import time
+
+
+HEAD_SIZE = 1000
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_START = '-0123456789'
+_NUMBER_CHARS = '+-.0123456789Ee'
+
+# what the parser expects next in the innermost open container
+_KEY_OR_END = 0
+_KEY = 1
+_COLON = 2
+_VALUE_OR_END = 3
+_VALUE = 4
+_COMMA_OR_END = 5
+
+class JsonStream(object):
+    """Decodes a JSON document incrementally, while it arrives piece by
+    piece, for instance as the sink of a CurlRequest (see
+    CurlEngine.perform_iter()).
+
+    The data is passed to write() as it arrives and close() is called
+    at its end. The document is never held as a whole, neither as bytes
+    nor as text: only the part that has not been parsed yet is buffered.
+    Objects and arrays nested less than depth levels deep are parsed
+    entry by entry, deeper values (like the records of the pages in a
+    MediaWiki API response) are each parsed in one go.
+
+    path is the sequence of object keys that leads from the top-level
+    value to the container (object or array) that holds the bulk of the
+    data, for example ('query', 'allpages') for a list query. Its entries
+    can be taken out of the document with pop_entries() as soon as they
+    are parsed, which keeps them from piling up. If path is None, there
+    is no such container. depth is the length of path by default.
+
+    write() never raises an exception: if the data is not valid JSON (or
+    not UTF-8), parsing stops and get_document() raises a ValueError, as
+    json.loads() would. So does a document whose top-level value is not
+    an object or an array, which never happens with the API. get_head()
+    returns the beginning of the data for error messages.
+
+    """
+
+    def __init__(self, path=None, depth=None):
+        if path is not None:
+            path = tuple(path)
+        if depth is None:
+            depth = len(path or ())
+        self._path = path
+        self._depth = depth
+        self._decoder = json.JSONDecoder()
+        self.reset()
+
+    def reset(self):
+        """Forget all data written so far, so that the stream can decode
+        another document (e.g. the response to a repeated request)."""
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._pos = 0
+        self._pieces = []
+        self._pieces_length = 0
+        self._offset = 0
+        self._wanted = 0
+        self._stack = []
+        self._document = None
+        self._entries = None
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._head = b''
+        self._bytes = 0
+        self._seconds = 0
+
+    def write(self, data):
+        """Decode the next piece of the document (a byte string)."""
+        started = time.time()
+        if len(self._head) < HEAD_SIZE:
+            self._head += data[:HEAD_SIZE - len(self._head)]
+        self._bytes += len(data)
+        if self._error is None:
+            try:
+                self._feed(self._text_decoder.decode(data), False)
+            except(ValueError) as err:
+                self._error = unicode(err)
+        self._seconds += time.time() - started
+
+    def close(self):
+        """Finish decoding: all data has been written."""
+        if self._closed:
+            return
+        started = time.time()
+        self._closed = True
+        if self._error is None:
+            try:
+                self._feed(self._text_decoder.decode(b'', True), True)
+            except(ValueError) as err:
+                self._error = unicode(err)
+        if self._error is None and not self._done:
+            self._error = self._message('Unexpected end of data', self._pos)
+        self._text = ''
+        self._pos = 0
+        self._pieces = []
+        self._seconds += time.time() - started
+
+    def pop_entries(self):
+        """Remove the entries of the container at path that have been
+        parsed so far from the document and return them as a list. (The
+        keys of an object are dropped.)"""
+        entries = self._entries
+        if not entries:
+            return []
+        if isinstance(entries, dict):
+            result = list(entries.values())
+            entries.clear()
+        else:
+            result = list(entries)
+            del entries[:]
+        return result
+
+    def get_document(self):
+        """Return the decoded document, without the entries taken by
+        pop_entries(). Raises a ValueError if the data is not valid JSON
+        or if the document is not complete yet."""
+        if self._error is not None:
+            raise ValueError(self._error)
+        if not self._done:
+            raise ValueError(self._message('Incomplete document', self._pos))
+        return self._document
+
+    def get_head(self):
+        """Return the first HEAD_SIZE bytes of the data as text."""
+        return self._head.decode('utf-8', 'replace')
+
+    def get_bytes_written(self):
+        """Return the number of bytes written so far."""
+        return self._bytes
+
+    def get_decode_seconds(self):
+        """Return the time spent decoding so far, in seconds."""
+        return self._seconds
+
+    ### Internal methods ###
+
+    def _feed(self, text, final):
+        if text:
+            self._pieces.append(text)
+            self._pieces_length += len(text)
+        if not final and (len(self._text) - self._pos +
+                self._pieces_length < self._wanted):
+            return
+        # join the new text to the unparsed rest of the old text
+        self._pieces.insert(0, self._text[self._pos:])
+        self._offset += self._pos
+        self._text = ''.join(self._pieces)
+        self._pos = 0
+        self._pieces = []
+        self._pieces_length = 0
+        self._parse(final)
+
+    def _parse(self, final):
+        text = self._text
+        end = len(text)
+        pos = self._pos
+        stack = self._stack
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos >= end:
+                break
+            char = text[pos]
+            if not stack:
+                if self._done:
+                    raise ValueError(self._message('Extra data', pos))
+                if char == '{':
+                    container = {}
+                    state = _KEY_OR_END
+                elif char == '[':
+                    container = []
+                    state = _VALUE_OR_END
+                else:
+                    raise ValueError(self._message('Expecting object or array', pos))
+                self._document = container
+                on_path = self._path is not None
+                if on_path and not self._path:
+                    self._entries = container
+                stack.append([container, 0, state, None, on_path])
+                pos += 1
+                continue
+            frame = stack[-1]
+            container, level, state, key, on_path = frame
+            is_object = isinstance(container, dict)
+            if state == _COMMA_OR_END or state == _KEY_OR_END or state == _VALUE_OR_END:
+                if char == ('}' if is_object else ']'):
+                    stack.pop()
+                    if not stack:
+                        self._done = True
+                    pos += 1
+                    continue
+            if state == _COMMA_OR_END:
+                if char != ',':
+                    raise ValueError(self._message("Expecting ',' delimiter", pos))
+                frame[2] = _KEY if is_object else _VALUE
+                pos += 1
+            elif state == _COLON:
+                if char != ':':
+                    raise ValueError(self._message("Expecting ':' delimiter", pos))
+                frame[2] = _VALUE
+                pos += 1
+            elif state == _KEY_OR_END or state == _KEY:
+                if char != '"':
+                    raise ValueError(self._message('Expecting property name', pos))
+                decoded = self._decode(text, pos, final)
+                if decoded is None:
+                    break
+                frame[3], pos = decoded
+                frame[2] = _COLON
+            elif level < self._depth and (char == '{' or char == '['):
+                # descend into the container
+                child = {} if char == '{' else []
+                if is_object:
+                    container[key] = child
+                else:
+                    container.append(child)
+                frame[2] = _COMMA_OR_END
+                child_on_path = (on_path and is_object and
+                        level < len(self._path) and key == self._path[level])
+                if child_on_path and level + 1 == len(self._path):
+                    self._entries = child
+                stack.append([child, level + 1,
+                        _KEY_OR_END if char == '{' else _VALUE_OR_END,
+                        None, child_on_path])
+                pos += 1
+            else:
+                decoded = self._decode(text, pos, final)
+                if decoded is None:
+                    break
+                value, pos = decoded
+                if is_object:
+                    container[key] = value
+                else:
+                    container.append(value)
+                frame[2] = _COMMA_OR_END
+        self._pos = pos
+
+    def _decode(self, text, pos, final):
+        """Parse the value that starts at pos with the json module.
+        Returns the value and the position after it, or None if the
+        value may not be complete yet."""
+        try:
+            value, end = self._decoder.raw_decode(text, pos)
+        except(ValueError):
+            if final:
+                raise ValueError(self._message('Invalid value', pos))
+            # Wait until the unparsed text has doubled, so that a long
+            # value is not parsed again and again.
+            self._wanted = 2 * (len(text) - pos)
+            return None
+        if not final and (end >= len(text) or (text[pos] in _NUMBER_START
+                and text[end] in _NUMBER_CHARS)):
+            # a number might go on
+            self._wanted = len(text) - pos + 1
+            return None
+        self._wanted = 0
+        return (value, end)
+
+    def _message(self, message, pos):
+        return message + ' at character ' + unicode(self._offset + pos)
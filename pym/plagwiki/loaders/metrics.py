@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import json
+import threading
+import time
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Timings of a request: (metric name, key in CurlRequest.timings)
+TIMINGS = (
+    ('namelookup_seconds', 'namelookup'),
+    ('connect_seconds', 'connect'),
+    ('pretransfer_seconds', 'pretransfer'),
+    ('starttransfer_seconds', 'starttransfer'),
+    ('total_seconds', 'total'),
+)
+
+class Histogram(object):
+    """A histogram with fixed bucket bounds, in the style of Prometheus.
+
+    Each bucket counts the observations that are less than or equal to
+    its upper bound; an implicit last bucket counts all observations.
+    Not thread-safe on its own (ClientMetrics does the locking).
+
+    """
+
+    def __init__(self, bounds):
+        """Constructor. bounds is the ascending sequence of upper bounds."""
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Add an observation."""
+        pos = 0
+        while pos < len(self.bounds) and value > self.bounds[pos]:
+            pos += 1
+        self.counts[pos] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        """Return the histogram as a dict with the keys 'buckets' (a list
+        of [upper bound, cumulative count] pairs, the last bound being
+        None for infinity), 'sum' and 'count'."""
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (None,), self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+class Span(object):
+    """A timed section of a bot's own work, see ClientMetrics.span().
+
+    name is the name of the span and labels a dict of further labels.
+    After the span has ended, duration holds its length in seconds and
+    error the exception that ended it (or None).
+
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._metrics = metrics
+
+    def __enter__(self):
+        self.start = time.time()
+        self._metrics._push_span(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.duration = time.time() - self.start
+        self.error = value
+        self._metrics._pop_span(self)
+
+
+class ClientMetrics(object):
+    """Aggregated measurements of the API requests of a WikiClient.
+
+    For every API response, WikiClient calls record_request(). The
+    measurements are aggregated per action and query module (e.g.
+    'query' and 'allpages'):
+      - counters of requests, API errors, retries (because of maxlag or
+        Retry-After) and responses that asked for a continuation
+      - counters of request and response bytes
+      - histograms of the pycurl timings (name lookup, connect,
+        pretransfer, start of transfer, total), of the JSON decoding
+        time and of the response size
+
+    Bots can time their own work with span(); the durations are
+    aggregated per span name. Hooks (see add_hook()) receive every
+    request and every span as it happens, e.g. for logging or tracing.
+
+    The aggregates can be exported with to_json() or to_prometheus().
+    All methods are thread-safe.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = {}
+        self._spans = {}
+        self._hooks = []
+        self._started = time.time()
+
+    ### Hooks and spans ###
+
+    def add_hook(self, hook):
+        """Register a hook.
+
+        hook is called as hook(kind, data). For API requests, kind is
+        'request' and data is a dict with the keys 'action', 'module',
+        'timings' (the pycurl timings in seconds), 'request_bytes',
+        'response_bytes', 'decode_seconds', 'continued', 'error',
+        'retry' and 'span' (the Span that is active in the thread that
+        handles the response, or None). For spans, kind is 'span' and
+        data is the Span object, after it has ended.
+
+        Hooks are called in the thread that handles the response, and
+        must not raise exceptions.
+
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Unregister a hook."""
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def span(self, name, **labels):
+        """Return a context manager that times a section of code.
+
+        For example:
+            with client.get_metrics().span('load fragments', plag='Xyz'):
+                fragments = client.get_multi_page_info(titles)
+
+        The duration is aggregated under name. API requests handled in
+        the same thread while the span is active are passed to hooks
+        together with the span.
+
+        """
+        return Span(self, name, labels)
+
+    def get_current_span(self):
+        """Return the innermost active Span of the calling thread, or None."""
+        stack = getattr(self._local, 'spans', None)
+        if stack:
+            return stack[-1]
+        return None
+
+    ### Recording ###
+
+    def record_request(self, action, module, timings, request_bytes,
+            response_bytes, decode_seconds, continued=False, error=None):
+        """Record a completed API request.
+
+        action and module identify the request (module may be ''),
+        timings is a dict with the pycurl timings in seconds (see
+        CurlRequest.timings; missing timings are not recorded).
+        request_bytes and response_bytes are the transferred sizes,
+        decode_seconds the time spent decoding the JSON response.
+        continued tells whether the response asked for a continuation,
+        and error is the API error code, if any.
+
+        """
+        with self._lock:
+            entry = self._request_entry(action, module)
+            entry['requests'] += 1
+            if error is not None:
+                entry['errors'] += 1
+            if continued:
+                entry['continuations'] += 1
+            entry['request_bytes'] += request_bytes
+            entry['response_bytes'] += response_bytes
+            histograms = entry['histograms']
+            for name, key in TIMINGS:
+                if key in timings:
+                    histograms[name].observe(timings[key])
+            histograms['decode_seconds'].observe(decode_seconds)
+            histograms['response_bytes'].observe(response_bytes)
+            hooks = list(self._hooks)
+        if hooks:
+            data = {'action': action, 'module': module, 'timings': timings,
+                    'request_bytes': request_bytes,
+                    'response_bytes': response_bytes,
+                    'decode_seconds': decode_seconds, 'continued': continued,
+                    'error': error, 'retry': False,
+                    'span': self.get_current_span()}
+            for hook in hooks:
+                hook('request', data)
+
+    def record_retry(self, action, module, timings):
+        """Record a request that is going to be retried."""
+        with self._lock:
+            self._request_entry(action, module)['retries'] += 1
+            hooks = list(self._hooks)
+        if hooks:
+            data = {'action': action, 'module': module, 'timings': timings,
+                    'request_bytes': 0, 'response_bytes': 0,
+                    'decode_seconds': 0, 'continued': False, 'error': None,
+                    'retry': True, 'span': self.get_current_span()}
+            for hook in hooks:
+                hook('request', data)
+
+    def reset(self):
+        """Discard all aggregated measurements."""
+        with self._lock:
+            self._requests = {}
+            self._spans = {}
+            self._started = time.time()
+
+    ### Export ###
+
+    def get_snapshot(self):
+        """Return the aggregated measurements as a dict.
+
+        The dict has the keys 'since' (the time of the last reset, in
+        seconds since the epoch), 'requests' (a list of dicts, one per
+        action and module, with the counters and a dict 'histograms'; see
+        Histogram.to_dict()) and 'spans' (a list of dicts with 'name',
+        'count', 'errors' and the 'histogram' of the durations).
+
+        """
+        with self._lock:
+            requests = []
+            for (action, module), entry in sorted(self._requests.items()):
+                item = dict(entry)
+                item['action'] = action
+                item['module'] = module
+                item['histograms'] = dict((name, histogram.to_dict())
+                        for name, histogram in entry['histograms'].items())
+                requests.append(item)
+            spans = []
+            for name, entry in sorted(self._spans.items()):
+                spans.append({'name': name, 'count': entry['histogram'].count,
+                        'errors': entry['errors'],
+                        'histogram': entry['histogram'].to_dict()})
+            return {'since': self._started, 'requests': requests,
+                    'spans': spans}
+
+    def to_json(self):
+        """Return get_snapshot() encoded as JSON."""
+        return json.dumps(self.get_snapshot(), sort_keys=True)
+
+    def to_prometheus(self, prefix='plagwiki'):
+        """Return the aggregated measurements in the Prometheus text
+        exposition format. All metric names start with prefix."""
+        snapshot = self.get_snapshot()
+        lines = []
+        counters = (('requests', 'API requests'),
+                ('errors', 'API requests that returned an error'),
+                ('retries', 'API requests that were retried'),
+                ('continuations', 'API responses that asked for a continuation'),
+                ('request_bytes', 'bytes sent to the API'),
+                ('response_bytes', 'bytes received from the API'))
+        for key, description in counters:
+            name = prefix + '_api_' + key + '_total'
+            lines.append('# HELP ' + name + ' Number of ' + description + '.')
+            lines.append('# TYPE ' + name + ' counter')
+            for item in snapshot['requests']:
+                lines.append(name + self._labels(action=item['action'],
+                        module=item['module']) + ' ' + unicode(item[key]))
+        histograms = [name for name, key in TIMINGS] + ['decode_seconds', 'response_bytes']
+        for key in histograms:
+            name = prefix + '_api_' + key
+            if key == 'response_bytes':
+                name += '_per_request'
+            lines.append('# HELP ' + name + ' Distribution of ' +
+                    key.replace('_', ' ') + ' per API request.')
+            lines.append('# TYPE ' + name + ' histogram')
+            for item in snapshot['requests']:
+                self._histogram_lines(lines, name, item['histograms'][key],
+                        action=item['action'], module=item['module'])
+        name = prefix + '_span_seconds'
+        lines.append('# HELP ' + name + ' Duration of spans.')
+        lines.append('# TYPE ' + name + ' histogram')
+        for item in snapshot['spans']:
+            self._histogram_lines(lines, name, item['histogram'], span=item['name'])
+        return '\n'.join(lines) + '\n'
+
+    ### Internal methods ###
+
+    def _request_entry(self, action, module):
+        key = (action or '', module or '')
+        entry = self._requests.get(key)
+        if entry is None:
+            histograms = dict((name, Histogram(SECONDS_BUCKETS))
+                    for name, timing in TIMINGS)
+            histograms['decode_seconds'] = Histogram(SECONDS_BUCKETS)
+            histograms['response_bytes'] = Histogram(BYTES_BUCKETS)
+            entry = {'requests': 0, 'errors': 0, 'retries': 0,
+                    'continuations': 0, 'request_bytes': 0,
+                    'response_bytes': 0, 'histograms': histograms}
+            self._requests[key] = entry
+        return entry
+
+    def _push_span(self, span):
+        stack = getattr(self._local, 'spans', None)
+        if stack is None:
+            stack = self._local.spans = []
+        stack.append(span)
+
+    def _pop_span(self, span):
+        stack = self._local.spans
+        if span in stack:
+            stack.remove(span)
+        with self._lock:
+            entry = self._spans.get(span.name)
+            if entry is None:
+                entry = self._spans[span.name] = {'errors': 0,
+                        'histogram': Histogram(SECONDS_BUCKETS)}
+            entry['histogram'].observe(span.duration)
+            if span.error is not None:
+                entry['errors'] += 1
+            hooks = list(self._hooks)
+        for hook in hooks:
+            hook('span', span)
+
+    def _histogram_lines(self, lines, name, histogram, **labels):
+        for bound, count in histogram['buckets']:
+            le = '+Inf' if bound is None else repr(float(bound))
+            lines.append(name + '_bucket' + self._labels(le=le, **labels) +
+                    ' ' + unicode(count))
+        lines.append(name + '_sum' + self._labels(**labels) + ' ' +
+                repr(float(histogram['sum'])))
+        lines.append(name + '_count' + self._labels(**labels) + ' ' +
+                unicode(histogram['count']))
+
+    def _labels(self, **labels):
+        if not labels:
+            return ''
+        parts = []
+        for key in sorted(labels):
+            value = unicode(labels[key]).replace('\\', '\\\\')
+            value = value.replace('"', '\\"').replace('\n', '\\n')
+            parts.append(key + '="' + value + '"')
+        return '{' + ','.join(parts) + '}'
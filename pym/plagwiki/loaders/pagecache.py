@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+from plagwiki.loaders.sqlitestore import SqliteStore
+
+
+class PageCache(SqliteStore):
+    """Persistent on-disk cache of wiki pages, keyed by revision.
+
+    The cache stores page records as returned by the MediaWiki API
+    (see WikiClient.get_page_info() for the format), including the
+    wikitext of the latest revision. Records are keyed by the URL of
+    the wiki API and the page ID, and remember the 'lastrevid' and
+    'touched' properties of the page they were downloaded at.
+
+    WikiClient uses the cache like this: it first asks the API for
+    the cheap info properties of all requested pages, then looks up
+    each page here. Only pages whose cached revision is out of date
+    (or which are not cached at all) are downloaded in full.
+
+    Page records are stored as zlib compressed JSON in an SQLite
+    database, see SqliteStore.
+
+    """
+
+    def __init__(self, filename):
+        """Constructor.
+
+        filename is the path to the SQLite database. It is created if
+        it does not exist yet.
+
+        """
+        SqliteStore.__init__(self, filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                ' api TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' title TEXT NOT NULL,'
+                ' lastrevid INTEGER NOT NULL,'
+                ' touched TEXT,'
+                ' data BLOB NOT NULL,'
+                ' PRIMARY KEY (api, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_title'
+                ' ON pages (api, title)')
+        self._db.commit()
+
+    def lookup(self, api, pageid, lastrevid, touched=None):
+        """Return the cached record of a page, or None.
+
+        api is the URL to api.php of the wiki, pageid is the page ID.
+        The record is only returned if it was downloaded at revision
+        lastrevid. If touched is not None, the record's page_touched
+        timestamp must match as well (use this if the record's
+        categories are needed, as these may change through templates
+        without a new revision of the page itself).
+
+        """
+        with self._lock:
+            row = self._db.execute('SELECT lastrevid, touched, data FROM pages'
+                    ' WHERE api = ? AND pageid = ?', (api, int(pageid))).fetchone()
+        if row is None or row[0] != int(lastrevid):
+            return None
+        if touched is not None and row[1] != touched:
+            return None
+        return self._decode(row[2])
+
+    def lookup_title(self, api, title):
+        """Return the cached record of a page given its title, or None.
+
+        This does not check whether the record is up to date.
+
+        """
+        with self._lock:
+            row = self._db.execute('SELECT data FROM pages'
+                    ' WHERE api = ? AND title = ?', (api, title)).fetchone()
+        if row is None:
+            return None
+        return self._decode(row[0])
+
+    def iter_pages(self, api):
+        """Iterate over the records of all cached pages of the wiki api,
+        in the order of their page IDs."""
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM pages WHERE api = ?'
+                    ' ORDER BY pageid', (api,)).fetchall()
+        for row in rows:
+            yield self._decode(row[0])
+
+    def store(self, api, pages):
+        """Store page records in the cache.
+
+        pages is a sequence of page records as returned by the API.
+        Records of missing pages and records without 'lastrevid' are
+        silently ignored.
+
+        """
+        rows = []
+        for page in pages:
+            if 'missing' in page or 'lastrevid' not in page:
+                continue
+            rows.append((api, int(page['pageid']), page['title'],
+                    int(page['lastrevid']), page.get('touched'),
+                    self._encode(page)))
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO pages'
+                    ' (api, pageid, title, lastrevid, touched, data)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+    def invalidate(self, api, pageids=None):
+        """Remove pages from the cache.
+
+        If pageids is None, all pages of the wiki api are removed.
+
+        """
+        with self._lock:
+            if pageids is None:
+                self._db.execute('DELETE FROM pages WHERE api = ?', (api,))
+            else:
+                self._db.executemany('DELETE FROM pages WHERE api = ? AND pageid = ?',
+                        [(api, int(pageid)) for pageid in pageids])
+            self._db.commit()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import hashlib
+import json
+import time
+
+from plagwiki.loaders.sqlitestore import SqliteStore
+
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+class ParseCache(SqliteStore):
+    """Persistent on-disk cache of parse and expandtemplates results.
+
+    Results are keyed by the URL of the wiki API and a key that
+    identifies the input (see make_key()): for pages, the revision ID
+    of the page, and for wikitext, the SHA-1 of the text. Together with
+    each result, the cache stores the revision IDs of all templates the
+    result depends on. WikiClient checks these against the current
+    revision IDs before it uses a cached result, and removes all results
+    that depend on a changed template with invalidate_templates(). See
+    WikiClient.set_parse_cache().
+
+    The total size of the (zlib compressed) results is bounded by
+    max_size bytes; when it is exceeded, the least recently used results
+    are removed.
+
+    The results are stored in an SQLite database, see SqliteStore.
+
+    """
+
+    def __init__(self, filename, max_size=DEFAULT_MAX_SIZE):
+        """Constructor.
+
+        filename is the path to the SQLite database. It is created if
+        it does not exist yet. max_size is the maximum total size of the
+        cached results in bytes.
+
+        """
+        SqliteStore.__init__(self, filename)
+        self._max_size = max_size
+        self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                ' api TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' used REAL NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' templates TEXT NOT NULL,'
+                ' data BLOB NOT NULL,'
+                ' PRIMARY KEY (api, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_used'
+                ' ON results (used)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS dependencies ('
+                ' api TEXT NOT NULL,'
+                ' template TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' PRIMARY KEY (api, template, key))')
+        self._db.commit()
+
+    def get_max_size(self):
+        """Return the maximum total size of the cached results in bytes."""
+        return self._max_size
+
+    def set_max_size(self, max_size):
+        """Change the maximum total size of the cached results in bytes.
+        Results are removed when the next result is stored."""
+        self._max_size = max_size
+
+    def get_size(self):
+        """Return the total size of the cached results in bytes."""
+        with self._lock:
+            row = self._db.execute('SELECT SUM(size) FROM results').fetchone()
+        return row[0] or 0
+
+    def make_key(*parts):
+        """Return a cache key for a result, computed from the parts that
+        identify it, e.g. the kind of result, the page title, its
+        revision ID (or its text) and the requested properties. The parts
+        must be JSON serializable."""
+        data = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+    make_key = staticmethod(make_key)
+
+    def lookup(self, api, key):
+        """Return (result, templates) for a cached result, or None.
+
+        api is the URL to api.php of the wiki, key the key of the result
+        (see make_key()). templates is a dict that maps the title of each
+        template the result depends on to the revision ID it had when the
+        result was stored (0 if the template did not exist).
+
+        """
+        with self._lock:
+            row = self._db.execute('SELECT templates, data FROM results'
+                    ' WHERE api = ? AND key = ?', (api, key)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE results SET used = ?'
+                    ' WHERE api = ? AND key = ?', (time.time(), api, key))
+            self._db.commit()
+        return (self._decode(row[1]), json.loads(row[0]))
+
+    def store(self, api, key, result, templates):
+        """Store a result in the cache, replacing an earlier result with
+        the same key. See lookup() for the arguments."""
+        data = self._encode(result)
+        with self._lock:
+            self._delete(api, [key])
+            self._db.execute('INSERT INTO results'
+                    ' (api, key, used, size, templates, data)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', (api, key, time.time(),
+                    len(data), json.dumps(templates), data))
+            self._db.executemany('INSERT INTO dependencies'
+                    ' (api, template, key) VALUES (?, ?, ?)',
+                    [(api, template, key) for template in templates])
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, api, keys=None):
+        """Remove results from the cache.
+
+        If keys is None, all results of the wiki api are removed.
+
+        """
+        with self._lock:
+            if keys is None:
+                self._db.execute('DELETE FROM results WHERE api = ?', (api,))
+                self._db.execute('DELETE FROM dependencies WHERE api = ?', (api,))
+            else:
+                self._delete(api, keys)
+            self._db.commit()
+
+    def invalidate_templates(self, api, templates):
+        """Remove all results that depend on any of the given templates
+        (e.g. because they have been edited). Returns the number of
+        removed results."""
+        with self._lock:
+            keys = set()
+            for template in templates:
+                keys.update(row[0] for row in self._db.execute(
+                        'SELECT key FROM dependencies'
+                        ' WHERE api = ? AND template = ?', (api, template)))
+            self._delete(api, keys)
+            self._db.commit()
+        return len(keys)
+
+    ### Internal methods ###
+
+    def _delete(self, api, keys):
+        rows = [(api, key) for key in keys]
+        self._db.executemany('DELETE FROM results WHERE api = ? AND key = ?', rows)
+        self._db.executemany('DELETE FROM dependencies WHERE api = ? AND key = ?',
+                rows)
+
+    def _evict(self):
+        """Remove the least recently used results until the total size
+        is below the maximum."""
+        size = self._db.execute('SELECT SUM(size) FROM results').fetchone()[0] or 0
+        if size <= self._max_size:
+            return
+        # make some room, so that not every store() has to evict
+        excess = size - self._max_size * 0.9
+        victims = {}
+        for api, key, result_size in self._db.execute('SELECT api, key, size'
+                ' FROM results ORDER BY used'):
+            if excess <= 0:
+                break
+            victims.setdefault(api, []).append(key)
+            excess -= result_size
+        for api, keys in victims.items():
+            self._delete(api, keys)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+
+# Possible statuses of a title in a PurgeReport.
+PURGE_STATUSES = ('purged', 'missing', 'invalid', 'failed')
+
+class PurgeReport(object):
+    """The outcome of purging pages with WikiClient.purge_multi().
+
+    For each requested title (as passed to purge_multi()), the report
+    holds one of the following statuses:
+      'purged':  the page has been purged
+      'missing': the page does not exist
+      'invalid': the title is not a valid page title
+      'failed':  the request for the title failed, or the API did not
+                 report a result for it
+    get_message() describes the problem for 'invalid' and 'failed'
+    titles.
+
+    Example:
+        report = client.purge_multi(titles, forcelinkupdate=True)
+        for title in report.get_titles('failed'):
+            print(title + ': ' + report.get_message(title))
+
+    """
+
+    def __init__(self):
+        # requested title -> (status, normalized title, message)
+        self._results = {}
+        self._titles = []
+        self._linkupdates = set()
+
+    def __len__(self):
+        """Return the number of titles in the report."""
+        return len(self._titles)
+
+    def __repr__(self):
+        counts = ', '.join('%d %s' % (len(self.get_titles(status)), status)
+                for status in PURGE_STATUSES)
+        return '<PurgeReport: ' + counts + '>'
+
+    def is_success(self):
+        """Return True if all titles have been purged."""
+        return all(result[0] == 'purged' for result in self._results.values())
+
+    def get_titles(self, status=None):
+        """Return the requested titles with the given status (or all of
+        them if status is None), in the order they were requested."""
+        if status is None:
+            return list(self._titles)
+        return [title for title in self._titles
+                if self._results[title][0] == status]
+
+    def get_status(self, title):
+        """Return the status of a requested title, or None if the title
+        is not in the report."""
+        result = self._results.get(title)
+        if result is None:
+            return None
+        return result[0]
+
+    def get_normalized_title(self, title):
+        """Return the normalized form of a requested title, as reported by
+        the API, or None if it is not known."""
+        result = self._results.get(title)
+        if result is None:
+            return None
+        return result[1]
+
+    def get_message(self, title):
+        """Return a description of the problem with a requested title, or
+        None if there is none."""
+        result = self._results.get(title)
+        if result is None:
+            return None
+        return result[2]
+
+    def has_linkupdate(self, title):
+        """Return True if the links of the page have been updated as well
+        (see the forcelinkupdate argument of purge_multi())."""
+        return title in self._linkupdates
+
+    def add(self, title, status, normalized=None, message=None,
+            linkupdate=False):
+        """Record the result for a requested title, replacing an earlier
+        result for the same title."""
+        if status not in PURGE_STATUSES:
+            raise ValueError('invalid purge status: ' + unicode(status))
+        if title not in self._results:
+            self._titles.append(title)
+        self._results[title] = (status, normalized, message)
+        if linkupdate:
+            self._linkupdates.add(title)
+        else:
+            self._linkupdates.discard(title)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import re
+import threading
+import time
+
+
+# API actions that modify the wiki and are limited by the write bucket.
+WRITE_ACTIONS = frozenset((
+    'block', 'delete', 'edit', 'emailuser', 'filerevert', 'import',
+    'move', 'patrol', 'protect', 'purge', 'rollback', 'unblock',
+    'undelete', 'upload', 'userrights', 'watch'))
+
+class TokenBucket(object):
+    """A token bucket that limits the rate of some operation.
+
+    The bucket holds up to burst tokens and is refilled with rate
+    tokens per second. Each operation takes one token.
+
+    """
+
+    def __init__(self, rate, burst=None):
+        """Constructor.
+
+        rate is the number of tokens added per second (a positive
+        number). burst is the capacity of the bucket; if it is None,
+        the capacity is rate (but at least 1). The bucket starts full.
+
+        """
+        if rate <= 0:
+            raise ValueError('token bucket rate must be positive')
+        if burst is None:
+            burst = max(rate, 1)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+
+    def reserve(self, now=None):
+        """Take a token if one is available.
+
+        Returns 0 if a token was taken. Otherwise no token is taken and
+        the number of seconds until the next token becomes available is
+        returned.
+
+        """
+        if now is None:
+            now = time.time()
+        self._tokens = min(self.burst,
+                self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def release(self):
+        """Give back a token taken by reserve() for an operation that
+        did not take place after all."""
+        self._tokens = min(self.burst, self._tokens + 1)
+
+
+class RequestScheduler(object):
+    """Decides when API requests may be sent.
+
+    Read and write requests (see WRITE_ACTIONS) are limited by
+    separate token buckets. Both buckets are optional; without them,
+    requests are sent as fast as possible.
+
+    If maxlag is set, the maxlag parameter is added to every request, so
+    that the server refuses requests while its database replication lag
+    exceeds maxlag seconds. The client then calls backoff() and retries
+    the request, up to max_retries times. Responses with a Retry-After
+    header (e.g. HTTP 503) are handled the same way.
+
+    All methods are thread-safe, so one scheduler may be shared by
+    several clients of the same wiki.
+
+    """
+
+    def __init__(self, read_rate=None, write_rate=None, maxlag=None,
+            max_retries=10):
+        """Constructor.
+
+        read_rate and write_rate are the maximum numbers of read and
+        write requests per second, or None for no limit. maxlag is the
+        maxlag parameter in seconds, or None to disable it. max_retries
+        is the maximum number of times a request is retried because of
+        maxlag or Retry-After.
+
+        """
+        self._read_bucket = None
+        self._write_bucket = None
+        if read_rate:
+            self._read_bucket = TokenBucket(read_rate)
+        if write_rate:
+            self._write_bucket = TokenBucket(write_rate)
+        self._maxlag = maxlag
+        self._max_retries = max_retries
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def get_maxlag(self):
+        """Return the maxlag parameter, or None if it is disabled."""
+        return self._maxlag
+
+    def get_max_retries(self):
+        """Return the maximum number of retries per request."""
+        return self._max_retries
+
+    def request_kind(self, kw):
+        """Return 'write' if the API arguments kw describe a write
+        request, 'read' otherwise."""
+        if kw.get('action') in WRITE_ACTIONS:
+            return 'write'
+        return 'read'
+
+    def prepare(self, kw):
+        """Add the maxlag parameter to the API arguments kw (unless it
+        is disabled or kw already has one)."""
+        if self._maxlag is not None and kw.get('maxlag') is None:
+            kw['maxlag'] = self._maxlag
+
+    def reserve(self, kind, now=None):
+        """Ask whether a request of the given kind may be sent now.
+
+        kind is 'read' or 'write'. Returns 0 if the request may be sent
+        (and accounts for it). Otherwise returns the number of seconds
+        to wait before asking again.
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if kind == 'write':
+                bucket = self._write_bucket
+            else:
+                bucket = self._read_bucket
+            if bucket is None:
+                return 0
+            return bucket.reserve(now)
+
+    def release(self, kind):
+        """Give back what reserve() accounted for a request of the given
+        kind, because the request is not sent after all (e.g. because the
+        circuit breaker holds it back)."""
+        with self._lock:
+            if kind == 'write':
+                bucket = self._write_bucket
+            else:
+                bucket = self._read_bucket
+            if bucket is not None:
+                bucket.release()
+
+    def wait(self, kind):
+        """Block until a request of the given kind may be sent."""
+        while True:
+            delay = self.reserve(kind)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def backoff(self, seconds):
+        """Hold back all requests for the given number of seconds."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                    time.time() + seconds)
+
+    def retry_delay(self, response_code, headers, error, attempt):
+        """Decide whether a response asks for the request to be retried.
+
+        response_code is the HTTP response code, headers the dict of
+        response headers (with lowercase names), error the 'error' part
+        of the parsed API response (or None), and attempt the number of
+        times the request has been sent so far.
+
+        Returns the number of seconds to back off before retrying, or
+        None if the request should not be retried.
+
+        A maxlag error is retried as soon as the reported lag should
+        have dropped below maxlag, but never later than Retry-After
+        says. Other responses with a Retry-After header are retried
+        after the given delay.
+
+        """
+        if attempt > self._max_retries:
+            return None
+        retry_after = self._parse_seconds(headers.get('retry-after'))
+        if error is not None and error.get('code') == 'maxlag':
+            delay = retry_after
+            lag = self._parse_seconds(headers.get('x-database-lag'))
+            if lag is None:
+                match = re.search(r'([0-9.]+) seconds lagged', error.get('info', ''))
+                if match:
+                    lag = self._parse_seconds(match.group(1))
+            if lag is not None and self._maxlag is not None:
+                needed = lag - self._maxlag + 1
+                if delay is None or needed < delay:
+                    delay = needed
+            if delay is None:
+                delay = 5
+            return max(delay, 1)
+        if retry_after is not None and response_code in (429, 503):
+            return max(retry_after, 1)
+        return None
+
+    ### Internal methods ###
+
+    def _parse_seconds(self, value):
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except(ValueError):
+            return None
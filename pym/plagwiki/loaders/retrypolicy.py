@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import random
+import threading
+import time
+
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_CONNECT_TIMEOUT = 20
+DEFAULT_TIMEOUT = 120
+DEFAULT_DEADLINE = 600
+
+# The slowest upload speed (in bytes per second) that the timeout of an
+# upload allows for, see RetryPolicy.request_timeout().
+MIN_UPLOAD_RATE = 16 * 1024
+
+# HTTP response codes of transient server problems.
+TRANSIENT_RESPONSE_CODES = frozenset((429, 500, 502, 503, 504))
+
+# libcurl errors that occur before the request has been sent (could not
+# resolve the proxy or host, could not connect), so that retrying is
+# safe even for requests that are not idempotent.
+CONNECT_ERRORS = frozenset((5, 6, 7))
+
+# API actions that may be repeated without changing the outcome.
+IDEMPOTENT_ACTIONS = frozenset(('purge',))
+
+class RetryPolicy(object):
+    """Decides whether and when a failed API request is sent again.
+
+    A request fails transiently if the transfer fails (e.g. because the
+    connection broke or timed out) or the server answers with one of
+    TRANSIENT_RESPONSE_CODES. Such requests are retried up to
+    max_attempts times in total, after a random delay between 0 and
+    base_delay * 2 ** (attempt - 1) seconds (capped at max_delay), so
+    that clients that failed together do not retry together.
+
+    Only idempotent requests (see is_idempotent()) are retried after a
+    failure that may have happened after the server received them.
+    Requests that could not be sent at all (see CONNECT_ERRORS) are
+    always retried.
+
+    Each transfer is aborted after timeout seconds (plus the time its
+    uploaded files take at MIN_UPLOAD_RATE), and connecting after
+    connect_timeout seconds. deadline is the time in seconds that
+    one API call may take in total, including all retries and delays,
+    counted from when its first request is sent (time spent waiting for
+    the RequestScheduler before that does not count); a request is not
+    retried if it would have to be sent after the deadline. Any of these
+    may be None for no limit.
+
+    Replication lag and Retry-After responses are handled by the
+    RequestScheduler, see WikiClient.set_request_scheduler().
+
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=1.0,
+            max_delay=60.0, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+            timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._connect_timeout = connect_timeout
+        self._timeout = timeout
+        self._deadline = deadline
+
+    def get_max_attempts(self):
+        """Return the maximum number of times a request is sent."""
+        return self._max_attempts
+
+    def get_connect_timeout(self):
+        """Return the connect timeout in seconds, or None."""
+        return self._connect_timeout
+
+    def get_timeout(self):
+        """Return the timeout of a single transfer in seconds, or None."""
+        return self._timeout
+
+    def get_deadline(self):
+        """Return the time one API call may take in seconds, or None."""
+        return self._deadline
+
+    def is_idempotent(self, kw, kind):
+        """Return True if the request with the API arguments kw may be
+        sent again after it possibly reached the server.
+
+        kind is the kind of the request ('read' or 'write', see
+        RequestScheduler.request_kind()). Reads are idempotent, as are
+        IDEMPOTENT_ACTIONS and uploads of chunks (the server checks the
+        offset). Edits are idempotent if they carry the MD5 of the text
+        and the timestamp of the revision they are based on (or may
+        only create the page): if the first attempt has been saved, the
+        retry saves nothing.
+
+        """
+        action = kw.get('action')
+        if kind == 'read' or action in IDEMPOTENT_ACTIONS:
+            return True
+        if action == 'edit':
+            return bool(kw.get('md5')) and (kw.get('basetimestamp') is not None
+                    or bool(kw.get('createonly')))
+        if action == 'upload':
+            return kw.get('offset') is not None
+        return False
+
+    def is_transient(self, request):
+        """Return True if a completed CurlRequest failed transiently."""
+        return (request.error is not None or
+                request.response_code in TRANSIENT_RESPONSE_CODES)
+
+    def retry_delay(self, request, kw, attempt, deadline):
+        """Decide whether a failed request is sent again.
+
+        request is the completed CurlRequest, kw its API arguments,
+        attempt the number of times it has been sent and deadline the
+        time (in seconds since the epoch) of the call's deadline, or
+        None.
+
+        Returns the number of seconds to wait before the next attempt,
+        or None if the request must not be retried.
+
+        """
+        if not self.is_transient(request) or attempt >= self._max_attempts:
+            return None
+        if (request.errno not in CONNECT_ERRORS and
+                not self.is_idempotent(kw, request.kind)):
+            return None
+        delay = random.uniform(0, min(self._max_delay,
+                self._base_delay * 2 ** (attempt - 1)))
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        return delay
+
+    def make_deadline(self, now=None):
+        """Return the deadline (in seconds since the epoch) of an API
+        call that starts now, or None."""
+        if self._deadline is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now + self._deadline
+
+    def request_timeout(self, deadline, now=None, upload_size=0):
+        """Return the timeout for the next transfer of a call with the
+        given deadline, or None for no limit.
+
+        upload_size is the number of bytes of the files (or chunks) that
+        the transfer uploads. The time they take at MIN_UPLOAD_RATE is
+        added to the timeout, even beyond the deadline, so that large
+        uploads are not cut off.
+
+        """
+        timeout = self._timeout
+        if deadline is not None:
+            if now is None:
+                now = time.time()
+            remaining = max(deadline - now, 0.001)
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        if timeout is not None and upload_size:
+            timeout += upload_size / MIN_UPLOAD_RATE
+        return timeout
+
+
+class CircuitBreaker(object):
+    """Stops sending requests to a wiki that keeps failing.
+
+    After failure_threshold transient failures in a row (see
+    RetryPolicy.is_transient()), the circuit opens: requests are held
+    back for reset_timeout seconds. Then a single probe request is let
+    through. If it succeeds, the circuit closes again; if it fails, the
+    circuit stays open for another reset_timeout seconds.
+
+    WikiClient fails requests immediately if the circuit would hold
+    them back beyond their deadline. All methods are thread-safe, so
+    one breaker may be shared by all clients of a wiki.
+
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must be at least 1')
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._open_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def get_state(self):
+        """Return 'closed', 'open' or 'half-open'."""
+        with self._lock:
+            if self._open_until is None:
+                return 'closed'
+            if time.time() < self._open_until or self._probing:
+                return 'open'
+            return 'half-open'
+
+    def get_wait(self, now=None):
+        """Return the number of seconds until the circuit lets a probe
+        request through, or 0 if it is not open."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._open_until is None:
+                return 0
+            return max(self._open_until - now, 0)
+
+    def reserve(self, now=None):
+        """Ask whether a request may be sent now.
+
+        Returns 0 if it may be sent (in a half-open circuit, it is the
+        probe). Otherwise returns the number of seconds to wait before
+        asking again.
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._open_until is None:
+                return 0
+            if now < self._open_until:
+                return self._open_until - now
+            if self._probing:
+                # wait for the outcome of the probe
+                return min(1.0, self._reset_timeout)
+            self._probing = True
+            return 0
+
+    def record_success(self):
+        """Record a request that reached a healthy server."""
+        with self._lock:
+            self._failures = 0
+            self._open_until = None
+            self._probing = False
+
+    def record_failure(self, now=None):
+        """Record a transient failure."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self._failure_threshold:
+                self._open_until = now + self._reset_timeout
+                self._probing = False
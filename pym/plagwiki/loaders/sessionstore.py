@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import json
+import os
+import stat
+import time
+
+from plagwiki.loaders.sqlitestore import SqliteStore
+
+
+class SessionStore(SqliteStore):
+    """Persistent store of login sessions, so that short-lived bots do
+    not have to log in and bootstrap a new session on every run.
+
+    For each wiki API URL and user name, the store keeps the site
+    information (see WikiClient.get_siteinfo()), the edit token and the
+    session cookies of the last session. WikiClient.login() resumes a
+    stored session after checking with a single API request that it is
+    still valid, and falls back to a full login otherwise (see
+    WikiClient.set_session_store()).
+
+    The store is an SQLite database (see SqliteStore) that must only be
+    accessible by its owner, since the cookies give access to the wiki
+    account.
+
+    """
+
+    def __init__(self, filename):
+        """Constructor.
+
+        filename is the path to the SQLite database. It is created with
+        mode 0600 if it does not exist yet. If it exists and is accessible
+        by others, its mode is changed to 0600; an OSError is raised if
+        that fails (e.g. because the file belongs to another user).
+
+        """
+        if not os.path.exists(filename):
+            # create the file with restrictive permissions before sqlite does
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        elif stat.S_IMODE(os.stat(filename).st_mode) & 0o077:
+            os.chmod(filename, 0o600)
+        SqliteStore.__init__(self, filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                ' api TEXT NOT NULL,'
+                ' username TEXT NOT NULL,'
+                ' saved REAL NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' PRIMARY KEY (api, username))')
+        self._db.commit()
+
+    def load(self, api, username):
+        """Return the stored session of username on the wiki api, or None.
+
+        The session is a dict with the keys 'siteinfo', 'edittoken',
+        'cookies' (a list of cookies in the Netscape cookie file format)
+        and 'saved' (the time it was saved, in seconds since the epoch).
+
+        """
+        with self._lock:
+            row = self._db.execute('SELECT saved, data FROM sessions'
+                    ' WHERE api = ? AND username = ?', (api, username)).fetchone()
+        if row is None:
+            return None
+        session = json.loads(row[1])
+        session['saved'] = row[0]
+        return session
+
+    def save(self, api, username, siteinfo, edittoken, cookies):
+        """Store the session of username on the wiki api, replacing the
+        previously stored one. See load() for the arguments."""
+        data = json.dumps({'siteinfo': siteinfo, 'edittoken': edittoken,
+                'cookies': list(cookies)})
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sessions'
+                    ' (api, username, saved, data) VALUES (?, ?, ?, ?)',
+                    (api, username, time.time(), data))
+            self._db.commit()
+
+    def delete(self, api, username):
+        """Forget the session of username on the wiki api."""
+        with self._lock:
+            self._db.execute('DELETE FROM sessions WHERE api = ? AND username = ?',
+                    (api, username))
+            self._db.commit()
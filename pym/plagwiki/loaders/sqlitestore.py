@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import json
+import sqlite3
+import threading
+import zlib
+
+
+class SqliteStore(object):
+    """Base class of the caches and stores that keep their data in an
+    SQLite database (PageCache, ParseCache, SessionStore, WikiMirror and
+    WikiSync).
+
+    Several processes may share the same database file, as SQLite does
+    the locking. Within a process, an object may be used by several
+    threads: they share one connection, so subclasses must hold
+    self._lock whenever they access self._db.
+
+    Subclasses call the constructor first and then create their tables
+    with self._db.
+
+    """
+
+    def __init__(self, filename):
+        """Constructor.
+
+        filename is the path to the SQLite database. It is created if
+        it does not exist yet.
+
+        """
+        self._filename = filename
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_filename(self):
+        """Return the path to the SQLite database."""
+        return self._filename
+
+    ### Internal methods ###
+
+    def _encode(self, value):
+        """Return value as zlib compressed JSON, for a BLOB column."""
+        return sqlite3.Binary(zlib.compress(json.dumps(value).encode('utf-8')))
+
+    def _decode(self, data):
+        """Return the value stored by _encode()."""
+        return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import bisect
+import re
+
+
+_NATSORT_CHUNKS = re.compile(r'(\d+|\D+)')
+_DIGITS = frozenset('0123456789')
+_TRAILING_DIGITS = re.compile(r'\d+$')
+
+def natsort_key(title):
+    """Return the key for natural sorting of title, a tuple of its digit
+    and non-digit parts in which the digit parts are integers. For
+    example, 'Seite 9' sorts before 'Seite 10'."""
+    return tuple([int(chunk) if chunk[0] in _DIGITS else chunk
+            for chunk in _NATSORT_CHUNKS.findall(title)])
+
+
+class TitleIndex(object):
+    """A collection of pages (or plain titles), kept in natural sort order
+    of their titles (see natsort_key()).
+
+    Items are either dicts with a 'title' and optionally a 'pageid' key,
+    as returned by the API, or (with title_key=None) title strings.
+    Titles are unique: adding an item with the title of an existing one
+    replaces it. The sort key of every title is computed once, when the
+    item is added.
+
+    Besides iteration and indexing in sorted order, the index supports
+    lookups by title and page ID, and prefix lookups by binary search.
+    New batches of items, e.g. the next chunk of a continued query, are
+    merged in linear time.
+
+    WikiClient's listing methods build an index once and return it (see
+    e.g. WikiClient.get_category_index()) or lists taken from it.
+
+    """
+
+    def __init__(self, items=(), title_key='title'):
+        """Constructor.
+
+        items is an iterable of initial items. title_key is the key of
+        the title in the item dicts, or None if the items are titles.
+
+        """
+        self._title_key = title_key
+        # sorted list of (sort key, title, item)
+        self._entries = []
+        self._by_title = {}
+        self._by_id = {}
+        self.merge(items)
+
+    ### Adding items ###
+
+    def add(self, item):
+        """Insert a single item at its sorted position."""
+        entry = self._entry(item)
+        if entry[1] in self._by_title:
+            self._remove(entry[1])
+        bisect.insort(self._entries, entry)
+        self._register(entry)
+
+    def merge(self, items):
+        """Insert an iterable of items at their sorted positions.
+
+        The items are sorted once, then merged with the existing items
+        in linear time, so this is much faster than calling add() for
+        each item.
+
+        """
+        batch = {}
+        for item in items:
+            entry = self._entry(item)
+            batch[entry[1]] = entry
+        if not batch:
+            return
+        for title in batch:
+            if title in self._by_title:
+                self._remove(title)
+        new_entries = sorted(batch.values())
+        if not self._entries:
+            self._entries = new_entries
+        else:
+            # two sorted runs, which sort() merges in linear time
+            self._entries.extend(new_entries)
+            self._entries.sort()
+        for entry in new_entries:
+            self._register(entry)
+
+    ### Lookups ###
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        """Iterate over the items in sorted order."""
+        for entry in self._entries:
+            yield entry[2]
+
+    def __getitem__(self, index):
+        """Return the item at index (or a list of items for a slice)."""
+        if isinstance(index, slice):
+            return [entry[2] for entry in self._entries[index]]
+        return self._entries[index][2]
+
+    def __contains__(self, title):
+        return title in self._by_title
+
+    def get_items(self):
+        """Return a list of all items in sorted order."""
+        return [entry[2] for entry in self._entries]
+
+    def get_titles(self):
+        """Return a list of all titles in sorted order."""
+        return [entry[1] for entry in self._entries]
+
+    def get_by_title(self, title):
+        """Return the item with the given title, or None."""
+        entry = self._by_title.get(title)
+        if entry is None:
+            return None
+        return entry[2]
+
+    def get_by_id(self, pageid):
+        """Return the item with the given page ID, or None."""
+        return self._by_id.get(int(pageid))
+
+    def get_prefix(self, prefix):
+        """Return a list of the items whose titles start with prefix, in
+        sorted order."""
+        entries = self._entries
+        digits = _TRAILING_DIGITS.search(prefix)
+        if digits is None:
+            start, end = self._prefix_range(prefix)
+            ranges = [(start, end)]
+        else:
+            # Titles that start with a prefix that ends in digits do not
+            # form a contiguous range: 'Seite 1' matches 'Seite 1' and
+            # 'Seite 10', but not 'Seite 2' between them. They are in the
+            # range of the prefix without the digits, in the subranges of
+            # the numbers 1, 10-19, 100-199 and so on.
+            base = prefix[:digits.start()]
+            start, end = self._prefix_range(base)
+            number = digits.group()
+            if number[0] == '0':
+                # leading zeros, just search the whole range
+                ranges = [(start, end)]
+            else:
+                ranges = self._number_ranges(natsort_key(base), int(number),
+                        start, end)
+        # the ranges may contain some titles with leading zeros in their
+        # numbers that do not match
+        return [entry[2] for start, end in ranges
+                for entry in entries[start:end] if entry[1].startswith(prefix)]
+
+    ### Internal methods ###
+
+    def _entry(self, item):
+        if self._title_key is None:
+            title = item
+        else:
+            title = item[self._title_key]
+        return (natsort_key(title), title, item)
+
+    def _register(self, entry):
+        self._by_title[entry[1]] = entry
+        item = entry[2]
+        if self._title_key is not None and 'pageid' in item:
+            self._by_id[int(item['pageid'])] = item
+
+    def _remove(self, title):
+        entry = self._by_title.pop(title)
+        pos = bisect.bisect_left(self._entries, entry)
+        del self._entries[pos]
+        item = entry[2]
+        if self._title_key is not None and 'pageid' in item:
+            self._by_id.pop(int(item['pageid']), None)
+
+    def _prefix_range(self, prefix):
+        """Return the (start, end) positions of the range of entries that
+        contains all titles starting with prefix, which must not end in a
+        digit. The range may also contain other titles whose digit parts
+        have leading zeros."""
+        if not prefix:
+            return (0, len(self._entries))
+        key = natsort_key(prefix)
+        # all titles that start with prefix have a key that starts with
+        # key[:-1], followed by a string that starts with key[-1]
+        last = key[-1]
+        upper = key[:-1] + (last[:-1] + unichr(ord(last[-1]) + 1),)
+        start = bisect.bisect_left(self._entries, (key,))
+        end = bisect.bisect_left(self._entries, (upper,), start)
+        return (start, end)
+
+    def _number_ranges(self, key, number, start, end):
+        """Return a list of (start, end) ranges of the entries between
+        start and end whose keys continue key with a number whose digits
+        start with those of number."""
+        entries = self._entries
+        # numbers sort before strings, so this skips entries that continue
+        # key with a string
+        end = bisect.bisect_left(entries, (key + ('',),), start, end)
+        ranges = []
+        low, high = number, number + 1
+        while start < end:
+            start = bisect.bisect_left(entries, (key + (low,),), start, end)
+            stop = bisect.bisect_left(entries, (key + (high,),), start, end)
+            if start < stop:
+                ranges.append((start, stop))
+            start = stop
+            low *= 10
+            high *= 10
+        return ranges
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+from plagwiki.loaders.wikierror import WikiError
+
+
+DEFAULT_CACHE_SIZE = 10000
+
+class TitleNormalizer(object):
+    """Normalizes page titles and namespaces of a wiki.
+
+    A TitleNormalizer is built once from the site information of a wiki
+    (see WikiClient.get_siteinfo()) and needs no further API requests.
+    WikiClient creates one whenever it gets the site information, see
+    WikiClient.get_title_normalizer().
+
+    Normalized titles are kept in a bounded cache of at most cache_size
+    titles, which forgets the least recently used ones. To keep lookups
+    as cheap as a dict access, the cache has two generations of
+    cache_size/2 titles each: new titles go into the young generation,
+    and when that is full, the old generation is dropped and the young
+    one takes its place. Titles found in the old generation move back
+    into the young one. For the long title lists that bots process,
+    normalize_many() normalizes each distinct title only once.
+
+    A TitleNormalizer may be used by several threads, and it can be
+    pickled (without its cache), e.g. to pass it to worker processes.
+
+    """
+
+    def __init__(self, siteinfo, cache_size=DEFAULT_CACHE_SIZE):
+        """Constructor.
+
+        siteinfo is the 'query' part of an API response to
+        meta=siteinfo with siprop=general|namespaces|namespacealiases.
+        Raises a LookupError if it lacks namespace information.
+
+        """
+        ns_numbers = {}
+        ns_names = {}
+        for ns in siteinfo['namespaces'].values():
+            ns_id = int(ns['id'])
+            ns_numbers[ns_id] = ns_id
+            ns_numbers[ns['*'].lower()] = ns_id
+            if 'canonical' in ns:
+                ns_numbers[ns['canonical'].lower()] = ns_id
+            ns_names[ns_id] = ns['*']
+        for ns in siteinfo['namespacealiases']:
+            ns_id = int(ns['id'])
+            ns_numbers[ns['*'].lower()] = ns_id
+            if not ns_id in ns_names:
+                # should not happen
+                ns_names[ns_id] = ns['*']
+        self._init(ns_numbers, ns_names, cache_size)
+
+    def __getstate__(self):
+        return {'ns_numbers': self._ns_numbers, 'ns_names': self._ns_names,
+                'cache_size': self._cache_size}
+
+    def __setstate__(self, state):
+        self._init(state['ns_numbers'], state['ns_names'], state['cache_size'])
+
+    ### Namespaces ###
+
+    def get_namespaces(self):
+        """Return a dict that maps each namespace number to its localized
+        canonical name."""
+        return dict(self._ns_names)
+
+    def namespace_to_number(self, ns, raise_on_error=True):
+        """Convert the namespace name or number ns to a namespace number.
+
+        See WikiClient.namespace_to_number().
+
+        """
+        try:
+            # also handles numeric ns arguments
+            return self._ns_numbers[ns]
+        except(KeyError,TypeError):
+            pass
+        # assume ns is a string and normalize it
+        nsnumber = self._ns_numbers.get(unicode(ns).lower().replace('_', ' '))
+        if nsnumber is None and raise_on_error:
+            raise WikiError('No such namespace: ' + unicode(ns))
+        return nsnumber
+
+    def normalize_namespace(self, ns):
+        """Return the localized canonical name of the namespace name or
+        number ns. See WikiClient.normalize_namespace()."""
+        nsnumber = self.namespace_to_number(ns)
+        try:
+            return self._ns_names[nsnumber]
+        except(LookupError):
+            raise WikiError('No such namespace: ' + unicode(ns))
+
+    ### Titles ###
+
+    def split_name(self, name):
+        """Split a page name into namespace number and rest of page name.
+        See WikiClient.split_name()."""
+        prefix, sep, rest = name.partition(':')
+        if sep:
+            nsnumber = self.namespace_to_number(prefix, False)
+            if nsnumber is not None:
+                return (nsnumber, rest)
+        return (0, name)  # article namespace
+
+    def combine_name(self, ns, rest):
+        """Concatenate a namespace name (or number) and rest of page name.
+        See WikiClient.combine_name()."""
+        # TODO: normalize special page names?
+        nsname = self.normalize_namespace(ns)
+        rest = rest.replace('_', ' ')
+        rest = rest[0:1].upper() + rest[1:]  # capitalize only first
+        if nsname:
+            return nsname + ':' + rest
+        else:
+            return rest
+
+    def normalize_name(self, name):
+        """Normalize a wiki page name."""
+        # the individual dict operations are atomic, so no lock is needed
+        normalized = self._young.get(name)
+        if normalized is None:
+            normalized = self._old.get(name)
+            if normalized is None:
+                normalized = self._normalize(name)
+            self._remember(name, normalized)
+        return normalized
+
+    def normalize_many(self, names):
+        """Normalize a sequence of page names. Returns a list of the
+        normalized names, in the same order."""
+        normalized = {}
+        normalize_name = self.normalize_name
+        for name in names:
+            if name not in normalized:
+                normalized[name] = normalize_name(name)
+        return [normalized[name] for name in names]
+
+    def get_cache_size(self):
+        """Return the maximum number of cached titles."""
+        return self._cache_size
+
+    def clear_cache(self):
+        """Discard all cached titles."""
+        self._young = {}
+        self._old = {}
+
+    ### Internal methods ###
+
+    def _init(self, ns_numbers, ns_names, cache_size):
+        self._ns_numbers = ns_numbers
+        self._ns_names = ns_names
+        self._cache_size = max(2, int(cache_size))
+        self._generation_size = self._cache_size // 2
+        self.clear_cache()
+
+    def _normalize(self, name):
+        # split_name() and combine_name() in one go
+        ns_numbers = self._ns_numbers
+        prefix, sep, rest = name.partition(':')
+        nsnumber = None
+        if sep:
+            nsnumber = ns_numbers.get(prefix)
+            if nsnumber is None:
+                nsnumber = ns_numbers.get(prefix.lower().replace('_', ' '))
+        if nsnumber is None:
+            nsnumber = 0
+            rest = name
+        nsname = self._ns_names.get(nsnumber)
+        if nsname is None:
+            raise WikiError('No such namespace: ' + unicode(nsnumber))
+        rest = rest.replace('_', ' ')
+        rest = rest[0:1].upper() + rest[1:]  # capitalize only first
+        if nsname:
+            return nsname + ':' + rest
+        else:
+            return rest
+
+    def _remember(self, name, normalized):
+        young = self._young
+        if len(young) >= self._generation_size:
+            self._old = young
+            young = self._young = {}
+        young[name] = normalized
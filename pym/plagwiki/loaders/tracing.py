@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import collections
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {TRACE: 'TRACE', DEBUG: 'DEBUG', INFO: 'INFO',
+        WARNING: 'WARNING', ERROR: 'ERROR', OFF: 'OFF'}
+
+def level_from_name(name):
+    """Return the level with the given name (case-insensitive), or the
+    level itself if name is a number. Raises a ValueError otherwise."""
+    if isinstance(name, int):
+        return name
+    name = unicode(name).strip().upper()
+    for level, level_name in LEVEL_NAMES.items():
+        if level_name == name:
+            return level
+    try:
+        return int(name)
+    except(ValueError):
+        raise ValueError('unknown trace level: ' + name)
+
+def truncate_payload(payload, max_string=200, max_items=20, max_depth=6):
+    """Return a reduced copy of payload that is cheap to serialize.
+
+    payload may consist of dicts, lists, tuples, strings and numbers.
+    Strings longer than max_string characters, lists and dicts with more
+    than max_items entries and structures nested deeper than max_depth
+    are cut off, with a note of how much was left out. Only the parts
+    that are kept are visited, so this is cheap even for huge payloads
+    such as page texts.
+
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8', 'replace')
+    if isinstance(payload, unicode):
+        if len(payload) > max_string:
+            return (payload[:max_string] + '... [' +
+                    unicode(len(payload) - max_string) + ' more characters]')
+        return payload
+    if payload is None or isinstance(payload, (bool, int, long, float)):
+        return payload
+    if max_depth <= 0:
+        return '[' + type(payload).__name__ + ']'
+    if isinstance(payload, dict):
+        result = {}
+        for key in sorted(payload)[:max_items]:
+            result[unicode(key)] = truncate_payload(payload[key], max_string,
+                    max_items, max_depth - 1)
+        if len(payload) > max_items:
+            result['...'] = unicode(len(payload) - max_items) + ' more entries'
+        return result
+    if isinstance(payload, (list, tuple)):
+        result = [truncate_payload(item, max_string, max_items, max_depth - 1)
+                for item in payload[:max_items]]
+        if len(payload) > max_items:
+            result.append('... [' + unicode(len(payload) - max_items) +
+                    ' more entries]')
+        return result
+    return truncate_payload(unicode(payload), max_string, max_items, max_depth)
+
+
+class TraceEvent(object):
+    """A single traced occurrence, e.g. an API request or response.
+
+    level is the trace level, name a short dotted name such as
+    'wikiclient.request', trace_id an identifier shared by related events
+    (e.g. a request and its response; may be None), message a short text
+    and thread the name of the thread that emitted the event.
+
+    The payload is neither copied nor serialized when the event is
+    created. Sinks call get_payload() or format(), which truncate and
+    serialize it once, on first use.
+
+    """
+
+    def __init__(self, tracer, level, name, message, payload, trace_id):
+        self.level = level
+        self.name = name
+        self.message = message
+        self.trace_id = trace_id
+        self.time = time.time()
+        self.thread = threading.current_thread().name
+        self._tracer = tracer
+        self._payload = payload
+        self._truncated = None
+        self._text = None
+
+    def get_level_name(self):
+        """Return the name of the trace level."""
+        return LEVEL_NAMES.get(self.level, unicode(self.level))
+
+    def get_payload(self):
+        """Return the payload, truncated according to the tracer."""
+        if self._truncated is None and self._payload is not None:
+            self._truncated = self._tracer.truncate(self._payload)
+            self._payload = None
+        return self._truncated
+
+    def detach(self):
+        """Truncate the payload now and drop the reference to the
+        original, so that the event can be kept without keeping the
+        (possibly large and mutable) original payload alive."""
+        self.get_payload()
+
+    def format(self):
+        """Return the event as a line of text."""
+        if self._text is None:
+            text = (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.time)) +
+                    '.%03d' % int(self.time % 1 * 1000) + ' ' +
+                    self.get_level_name() + ' ' + self.name)
+            if self.trace_id is not None:
+                text += ' [' + unicode(self.trace_id) + ']'
+            if self.message:
+                text += ' ' + self.message
+            payload = self.get_payload()
+            if payload is not None:
+                text += ' ' + json.dumps(payload, ensure_ascii=False, sort_keys=True)
+            self._text = text
+        return self._text
+
+    def to_dict(self):
+        """Return the event as a dict that can be encoded as JSON."""
+        return {'time': self.time, 'level': self.get_level_name(),
+                'name': self.name, 'trace_id': self.trace_id,
+                'thread': self.thread, 'message': self.message,
+                'payload': self.get_payload()}
+
+
+### Sinks ###
+
+class StreamSink(object):
+    """Writes events as lines of text to a stream (by default, stderr)."""
+
+    def __init__(self, stream=None):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        stream = self._stream
+        if stream is None:
+            stream = sys.stderr
+        line = event.format() + '\n'
+        with self._lock:
+            if isinstance(stream, io.TextIOBase):
+                stream.write(line)
+            else:
+                stream.write(line.encode('utf-8'))
+            stream.flush()
+
+    def close(self):
+        pass
+
+
+class RotatingFileSink(object):
+    """Writes events as lines of text to a file, which is rotated when it
+    grows beyond max_bytes.
+
+    On rotation, filename is renamed to filename.1, filename.1 to
+    filename.2 and so on; at most backup_count old files are kept.
+
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self._filename = filename
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._lock = threading.Lock()
+        self._file = None
+
+    def get_filename(self):
+        """Return the name of the current file."""
+        return self._filename
+
+    def emit(self, event):
+        line = (event.format() + '\n').encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._filename, 'ab')
+            if (self._max_bytes > 0 and self._file.tell() > 0 and
+                    self._file.tell() + len(line) > self._max_bytes):
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self._backup_count - 1, 0, -1):
+            source = self._filename + '.' + unicode(i)
+            if os.path.exists(source):
+                os.rename(source, self._filename + '.' + unicode(i + 1))
+        if self._backup_count > 0:
+            os.rename(self._filename, self._filename + '.1')
+        else:
+            os.remove(self._filename)
+        self._file = open(self._filename, 'ab')
+
+
+class RingBufferSink(object):
+    """Keeps the last capacity events in memory, for instance to dump
+    them when a bot fails.
+
+    Events are kept with their payloads already truncated (see
+    TraceEvent.detach()), but they are only formatted as text when they
+    are read.
+
+    """
+
+    def __init__(self, capacity=1000):
+        self._events = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        event.detach()
+        with self._lock:
+            self._events.append(event)
+
+    def get_events(self):
+        """Return the kept events, oldest first."""
+        with self._lock:
+            return list(self._events)
+
+    def clear(self):
+        """Discard all kept events."""
+        with self._lock:
+            self._events.clear()
+
+    def dump(self, stream=None):
+        """Write the kept events as lines of text to stream (by default,
+        stderr)."""
+        sink = StreamSink(stream)
+        for event in self.get_events():
+            sink.emit(event)
+
+    def close(self):
+        pass
+
+
+class Tracer(object):
+    """Dispatches trace events to sinks.
+
+    Each sink is added with a minimum level; a sink only receives events
+    at or above its level. As long as no sink wants events of a level,
+    is_enabled() returns False for it and tracing at that level costs a
+    single comparison: payloads are neither formatted nor copied.
+
+    Related events (such as an API request and its response) can share a
+    trace ID from new_trace_id(). With a sample rate below 1, only that
+    fraction of trace IDs is handed out; callers skip tracing when they
+    get None, so that sampled requests are traced completely.
+
+    Payloads are truncated before they are serialized, see
+    truncate_payload() and set_truncation().
+
+    """
+
+    def __init__(self, sample_rate=1.0):
+        self._lock = threading.Lock()
+        self._sinks = []
+        self._min_level = OFF
+        self._sample_rate = 1.0
+        self._next_id = 1
+        self._truncation = (200, 20, 6)
+        self.set_sample_rate(sample_rate)
+
+    ### Configuration ###
+
+    def add_sink(self, sink, level=DEBUG):
+        """Add a sink that receives all events at or above level.
+
+        A sink is an object with the methods emit(event) and close(); see
+        StreamSink, RotatingFileSink and RingBufferSink. Returns sink.
+
+        """
+        with self._lock:
+            # replaced, not modified, so that emit() needs no lock
+            self._sinks = self._sinks + [(level_from_name(level), sink)]
+            self._update_min_level()
+        return sink
+
+    def remove_sink(self, sink):
+        """Remove a sink (without closing it)."""
+        with self._lock:
+            self._sinks = [(level, s) for level, s in self._sinks if s is not sink]
+            self._update_min_level()
+
+    def get_sinks(self):
+        """Return a list of (level, sink) pairs."""
+        with self._lock:
+            return list(self._sinks)
+
+    def close(self):
+        """Remove and close all sinks."""
+        with self._lock:
+            sinks = self._sinks
+            self._sinks = []
+            self._update_min_level()
+        for level, sink in sinks:
+            sink.close()
+
+    def get_sample_rate(self):
+        """Return the fraction of traces that are recorded."""
+        return self._sample_rate
+
+    def set_sample_rate(self, sample_rate):
+        """Change the fraction (between 0 and 1) of traces that are
+        recorded, see new_trace_id()."""
+        sample_rate = float(sample_rate)
+        if sample_rate < 0 or sample_rate > 1:
+            raise ValueError('sample_rate must be between 0 and 1')
+        self._sample_rate = sample_rate
+
+    def set_truncation(self, max_string=200, max_items=20, max_depth=6):
+        """Change how payloads are truncated, see truncate_payload()."""
+        self._truncation = (max_string, max_items, max_depth)
+
+    def truncate(self, payload):
+        """Truncate payload according to set_truncation()."""
+        max_string, max_items, max_depth = self._truncation
+        return truncate_payload(payload, max_string, max_items, max_depth)
+
+    ### Tracing ###
+
+    def is_enabled(self, level):
+        """Return whether any sink receives events at level."""
+        return level >= self._min_level
+
+    def new_trace_id(self, level=DEBUG):
+        """Return a new trace ID for events at level, or None if nothing
+        is traced at that level or the trace is not sampled."""
+        if level < self._min_level:
+            return None
+        if self._sample_rate < 1 and random.random() >= self._sample_rate:
+            return None
+        with self._lock:
+            trace_id = self._next_id
+            self._next_id += 1
+        return trace_id
+
+    def emit(self, level, name, message=None, payload=None, trace_id=None):
+        """Pass an event to all sinks that want events at level.
+
+        payload is serialized lazily, see TraceEvent. Exceptions raised
+        by sinks are reported on stderr and otherwise ignored, so that
+        tracing never breaks the traced code.
+
+        """
+        if level < self._min_level:
+            return
+        event = TraceEvent(self, level, name, message, payload, trace_id)
+        for sink_level, sink in self._sinks:
+            if level >= sink_level:
+                try:
+                    sink.emit(event)
+                except(Exception) as err:
+                    print('Tracing failed: ' + unicode(err), file=sys.stderr)
+
+    def trace(self, name, message=None, payload=None, trace_id=None):
+        self.emit(TRACE, name, message, payload, trace_id)
+
+    def debug(self, name, message=None, payload=None, trace_id=None):
+        self.emit(DEBUG, name, message, payload, trace_id)
+
+    def info(self, name, message=None, payload=None, trace_id=None):
+        self.emit(INFO, name, message, payload, trace_id)
+
+    def warning(self, name, message=None, payload=None, trace_id=None):
+        self.emit(WARNING, name, message, payload, trace_id)
+
+    def error(self, name, message=None, payload=None, trace_id=None):
+        self.emit(ERROR, name, message, payload, trace_id)
+
+    ### Internal methods ###
+
+    def _update_min_level(self):
+        self._min_level = min([level for level, sink in self._sinks] + [OFF])
+
+
+_default_tracer = None
+_default_tracer_lock = threading.Lock()
+
+def get_tracer():
+    """Return the default Tracer, which WikiClient uses unless told
+    otherwise.
+
+    The default tracer has no sinks, unless the environment variable
+    PLAGWIKI_TRACE is set to a level name (e.g. 'debug'): then events at
+    that level and above are written to stderr, or to the rotating file
+    named by PLAGWIKI_TRACE_FILE. PLAGWIKI_TRACE_SAMPLE sets the sample
+    rate.
+
+    """
+    global _default_tracer
+    with _default_tracer_lock:
+        if _default_tracer is None:
+            _default_tracer = Tracer()
+            _configure_from_environment(_default_tracer)
+        return _default_tracer
+
+def _configure_from_environment(tracer):
+    level = os.environ.get('PLAGWIKI_TRACE')
+    if not level:
+        return
+    if os.environ.get('PLAGWIKI_TRACE_SAMPLE'):
+        tracer.set_sample_rate(os.environ['PLAGWIKI_TRACE_SAMPLE'])
+    filename = os.environ.get('PLAGWIKI_TRACE_FILE')
+    if filename:
+        tracer.add_sink(RotatingFileSink(filename), level)
+    else:
+        tracer.add_sink(StreamSink(), level)
@@ -5,20 +5,48 @@
 from __future__ import division, print_function, unicode_literals
 
 import hashlib
-import io
 import json
 import os
 import pprint
 import pycurl
 import re
 import sys
-
-from plagwiki.loaders.emergencyerror import EmergencyError
+import threading
+import time
+
+from plagwiki.loaders.askresult import AskRow
+from plagwiki.loaders.chunkedupload import ChunkedUpload, file_sha1
+from plagwiki.loaders.curlengine import CurlEngine, CurlRequest
+from plagwiki.loaders.emergencymonitor import DEFAULT_MAX_AGE, EmergencyMonitor
+from plagwiki.loaders.jsonstream import JsonStream
+from plagwiki.loaders.metrics import ClientMetrics
+from plagwiki.loaders.parsecache import ParseCache
+from plagwiki.loaders.purgereport import PurgeReport
+from plagwiki.loaders.ratelimiter import RequestScheduler
+from plagwiki.loaders.retrypolicy import CircuitBreaker, RetryPolicy
+from plagwiki.loaders.titleindex import TitleIndex
+from plagwiki.loaders.titlenormalizer import TitleNormalizer
+from plagwiki.loaders.tracing import DEBUG, get_tracer
 from plagwiki.loaders.wikierror import WikiError
 
 
 DEFAULT_USERAGENT = 'plagwiki/0.1a'
 
+# Request parameters whose values are not traced.
+SECRET_PARAMS = frozenset(('lgpassword', 'lgtoken', 'token'))
+
+# Number of rows requested at once by SMW queries, see iter_ask().
+ASK_BATCH_SIZE = 500
+
+# Seconds for which iter_ask() reuses the latest recent change of the wiki
+# (see get_last_change()) when it looks up the parse cache.
+LAST_CHANGE_MAX_AGE = 10
+
+# Template calls ({{Name}} or {{Name|...}}, but not {{{parameter}}}) and
+# comments in wikitext, see _text_templates().
+_TEMPLATE_CALL = re.compile(r'(?<!\{)\{\{(?!\{)([^{}|\[\]<>\n]+)(?=\||\}\})')
+_COMMENT = re.compile(r'(?s)<!--.*?-->')
+
 class WikiClient(object):
     """Manages a session with a wiki server.
 
@@ -27,24 +55,32 @@ class WikiClient(object):
     of a category, editing a page, uploading files, logging in and out,
     and more.
 
-    Currently, this class supports MediaWiki servers using the API.
-    Support for the Semantic MediaWiki extension (including arbitrary
-    SMW queries) is planned for the future.
+    Currently, this class supports MediaWiki servers using the API,
+    including queries of the Semantic MediaWiki extension (see ask()).
 
     Almost all methods (except the most simplest getters) may raise
     exceptions, in particular those that access the API. In case of
     problems with the API or the wiki itself, a WikiError is raised.
 
+    A WikiClient whose engine is a ThreadedCurlEngine may be used by
+    several threads at once (see AsyncWikiClient). The site information,
+    user rights and edit token are then requested only once, and logging
+    in or out waits until no other thread is requesting them.
+
     """
 
     ### Constructor and support for 'with' statements ###
 
-    def __init__(self, api):
+    def __init__(self, api, engine=None):
         """Constructor.
 
         api must be a fully qualified URL to the MediaWiki API.
         For example, api = 'http://de.guttenplag.wikia.com/api.php'.
 
+        engine is the CurlEngine that performs the HTTP requests. By
+        default, the client creates its own. (AsyncWikiClient passes a
+        ThreadedCurlEngine, for instance.)
+
         The constructor does not communicate with the API, neither
         for logging in (see login() for that), for querying site information
         (see request_siteinfo() for that), nor for requesting tokens (see
@@ -55,18 +91,38 @@ class WikiClient(object):
         """
         self._api = api
         self._ask = None
-        self._curl = pycurl.Curl()
-        self._curl.setopt(pycurl.VERBOSE, 0)
-        self._curl.setopt(pycurl.HEADER, 0)
-        self._curl.setopt(pycurl.NOPROGRESS, 1)
-        self._curl.setopt(pycurl.FOLLOWLOCATION, 1)
-        self._curl.setopt(pycurl.MAXREDIRS, 5)
-        self._curl.setopt(pycurl.USERAGENT, self._to_utf8(DEFAULT_USERAGENT))
-        self._curl.setopt(pycurl.COOKIEFILE, self._to_utf8(''))
+        if engine is None:
+            engine = CurlEngine()
+        self._engine = engine
+        self._engine.setopt(pycurl.VERBOSE, 0)
+        self._engine.setopt(pycurl.HEADER, 0)
+        self._engine.setopt(pycurl.NOPROGRESS, 1)
+        self._engine.setopt(pycurl.FOLLOWLOCATION, 1)
+        self._engine.setopt(pycurl.MAXREDIRS, 5)
+        self._engine.setopt(pycurl.USERAGENT, self._to_utf8(DEFAULT_USERAGENT))
+        # accept all compressions that libcurl supports
+        self._engine.setopt(pycurl.ENCODING, b'')
+        # keep idle connections of long-lived clients open
+        self._engine.setopt(pycurl.TCP_KEEPALIVE, 1)
+        self._engine.setopt(pycurl.TCP_KEEPIDLE, 60)
+        self._engine.setopt(pycurl.TCP_KEEPINTVL, 30)
+        self._scheduler = None
+        self._retry_policy = None
+        self._circuit_breaker = CircuitBreaker()
+        self.set_request_scheduler(RequestScheduler())
+        self.set_retry_policy(RetryPolicy())
         self._useragent = DEFAULT_USERAGENT
         self._logged_in = False
-        self._emergencypage = None
-        self._emergencyvar = None
+        self._emergency_monitor = None
+        self._incremental_decoding = False
+        self._page_cache = None
+        self._parse_cache = None
+        self._session_store = None
+        self._session_user = None
+        self._metrics = ClientMetrics()
+        self._tracer = get_tracer()
+        # guards the login state and the information requested on demand
+        self._info_lock = threading.RLock()
         self.clear_cached_info()
 
     def __enter__(self):
@@ -79,8 +135,20 @@ class WikiClient(object):
         return self
 
     def __exit__(self, type, value, traceback):
-        """Called when exiting a with statement. This calls the logout() method."""
-        self.logout()
+        """Called when exiting a with statement. This calls the logout() method,
+        unless a session store is set: then the session is saved instead, so
+        that the next run can resume it (see set_session_store())."""
+        if self._session_store is not None and self._logged_in:
+            self._save_session()
+        else:
+            self.logout()
+
+    def close(self):
+        """Close the connections of the client. This does not log out,
+        and the client must not be used afterwards."""
+        if self._emergency_monitor is not None:
+            self._emergency_monitor.stop()
+        self._engine.close()
 
     ### Configuration ###
 
@@ -91,8 +159,9 @@ class WikiClient(object):
     def enable_semantic_mediawiki(self, ask):
         """Enable Semantic MediaWiki queries.
         
-        SMW queries are disabled by default. (Enabling them has no real
-        effect at the moment, as SMW queries are not implemented.)
+        SMW queries are disabled by default. Once they are enabled, they
+        can be performed with ask() and iter_ask() (through the API of
+        the wiki, which needs SMW 1.8 or later).
 
         ask must be the full URL to Special:Ask (possibly localized).
         For example, set ask to
@@ -117,7 +186,191 @@ class WikiClient(object):
     def set_user_agent(self, user_agent):
         """Change the user agent string."""
         self._useragent = unicode(user_agent)
-        self._curl.setopt(pycurl.USERAGENT, self._to_utf8(self._useragent))
+        self._engine.setopt(pycurl.USERAGENT, self._to_utf8(self._useragent))
+
+    def get_max_parallel_requests(self):
+        """Return the maximum number of API requests that are kept in
+        flight at the same time by batch queries."""
+        return self._engine.get_max_connections()
+
+    def set_max_parallel_requests(self, max_parallel_requests):
+        """Change the maximum number of API requests that are kept in
+        flight at the same time by batch queries.
+
+        Batch queries (such as get_multi_page_info() or get_page_text()
+        with many pages) are split into chunks of 50 pages. Up to this
+        many chunks are requested concurrently. Set this to 1 to send
+        all requests one after another.
+
+        """
+        self._engine.set_max_connections(max_parallel_requests)
+
+    def get_incremental_decoding(self):
+        """Return whether API responses are decoded while they arrive
+        (see set_incremental_decoding())."""
+        return self._incremental_decoding
+
+    def set_incremental_decoding(self, incremental_decoding):
+        """Enable or disable incremental decoding of API responses.
+
+        Normally, a response is collected, converted to text and then
+        parsed, so it is held in memory about three times over before
+        any of it is processed. With incremental decoding, responses are
+        parsed as they arrive (see JsonStream), and only the parsed
+        result is kept. The list queries of iter_prefix_list(),
+        iter_category_members() and iter_all_categories() then even
+        yield each entry as soon as it has arrived. Page queries (like
+        those of iter_pages() or iter_category_pages()) still yield whole
+        batches, because their continuations have to be merged in.
+
+        Incremental decoding is disabled by default, since it costs some
+        CPU time. A list query request that fails after some of its
+        entries have been yielded is not retried (see set_retry_policy()),
+        as the entries cannot be taken back.
+
+        """
+        self._incremental_decoding = bool(incremental_decoding)
+
+    def get_request_scheduler(self):
+        """Return the RequestScheduler used by this client."""
+        return self._scheduler
+
+    def set_request_scheduler(self, scheduler):
+        """Change the RequestScheduler used by this client.
+
+        The scheduler limits the rate of read and write requests, adds
+        the maxlag parameter to requests and decides how long to back
+        off when the server is lagged or asks to retry later. The
+        default scheduler does not limit anything. A scheduler may be
+        shared by several clients of the same wiki.
+
+        """
+        self._scheduler = scheduler
+        self._engine.set_throttle(self._throttle)
+
+    def get_retry_policy(self):
+        """Return the RetryPolicy used by this client."""
+        return self._retry_policy
+
+    def set_retry_policy(self, retry_policy):
+        """Change the RetryPolicy used by this client.
+
+        The policy decides which requests are sent again after a
+        transient failure (a broken connection, a timeout or an HTTP
+        error such as 503) and how long to wait before, and sets the
+        timeouts and the deadline of each API call. The default policy
+        retries idempotent requests up to 5 times and gives up on a
+        call after 10 minutes.
+
+        """
+        self._retry_policy = retry_policy
+        connect_timeout = retry_policy.get_connect_timeout()
+        self._engine.setopt(pycurl.CONNECTTIMEOUT_MS,
+                0 if connect_timeout is None else int(connect_timeout * 1000))
+
+    def get_circuit_breaker(self):
+        """Return the CircuitBreaker used by this client."""
+        return self._circuit_breaker
+
+    def set_circuit_breaker(self, circuit_breaker):
+        """Change the CircuitBreaker used by this client.
+
+        While the circuit is open because the wiki keeps failing, no
+        requests are sent; API calls whose deadline would pass before
+        the circuit is tried again fail immediately with a WikiError.
+        By default, every client has its own breaker. A breaker should
+        be shared by all clients of the same wiki.
+
+        """
+        self._circuit_breaker = circuit_breaker
+
+    def get_page_cache(self):
+        """Return the PageCache used by this client, or None."""
+        return self._page_cache
+
+    def set_page_cache(self, page_cache):
+        """Enable or disable the persistent page cache.
+
+        page_cache is a PageCache object, or None to disable caching
+        (the default). While caching is enabled, queries for page text
+        first ask the API for the latest revision ID of each page and
+        only download pages that have changed since they were cached.
+
+        """
+        self._page_cache = page_cache
+
+    def get_parse_cache(self):
+        """Return the ParseCache, or None if parse caching is disabled."""
+        return self._parse_cache
+
+    def set_parse_cache(self, parse_cache):
+        """Enable or disable the persistent cache of parse and
+        expandtemplates results.
+
+        parse_cache is a ParseCache object, or None to disable caching
+        (the default). While caching is enabled, parse(), parse_page(),
+        expandtemplates() and expandtemplates_page() reuse results as
+        long as the page (or text) and all templates it uses are
+        unchanged. For pages, this is checked with a request for the
+        revision IDs of the page and its templates; for wikitext, with
+        a request for the revision IDs of its templates.
+
+        Only templates that are called by name are detected in the
+        wikitext passed to expandtemplates(), not those whose names are
+        computed by other templates or parser functions.
+
+        """
+        self._parse_cache = parse_cache
+
+    def get_session_store(self):
+        """Return the SessionStore used by this client, or None."""
+        return self._session_store
+
+    def set_session_store(self, session_store):
+        """Enable or disable persistent login sessions.
+
+        session_store is a SessionStore object, or None to disable
+        persistent sessions (the default). While a session store is set,
+        login() first tries to resume the stored session of the user: it
+        restores the session cookies and the site information and checks
+        with a single API request (which also fetches a fresh edit token)
+        that the session is still valid. Only if it is not, the full login
+        handshake is performed. After a login, the session is saved in
+        the store; leaving a with statement saves it again instead of
+        logging out, while logout() logs out and forgets it.
+
+        """
+        self._session_store = session_store
+
+    def get_metrics(self):
+        """Return the ClientMetrics of this client, or None."""
+        return self._metrics
+
+    def set_metrics(self, metrics):
+        """Change the ClientMetrics that the requests of this client
+        are recorded on.
+
+        metrics is a ClientMetrics object (which may be shared by several
+        clients), or None to disable recording. By default, every client
+        records on its own ClientMetrics.
+
+        """
+        self._metrics = metrics
+
+    def get_tracer(self):
+        """Return the Tracer used by this client."""
+        return self._tracer
+
+    def set_tracer(self, tracer):
+        """Change the Tracer used by this client.
+
+        By default, all clients use the default tracer (see
+        plagwiki.loaders.tracing.get_tracer()), which traces nothing
+        unless sinks are added to it. API requests and their parsed
+        responses are traced at level DEBUG, retries at level INFO.
+
+        """
+        self._tracer = tracer
 
     ### Login and logout ###
 
@@ -135,34 +388,41 @@ class WikiClient(object):
         increase or remove the API limits and thereby increase throughput.
 
         """
-        r_prelogin = self._query_api(action='login',
-                lgname=username, lgpassword=password)
-        try:
-            if r_prelogin['login']['result'] == 'WrongPass':
-                raise WikiError('Login failed, wrong password!')
-            if r_prelogin['login']['result'] != 'NeedToken':
-                raise LookupError()
-            prelogin_token = r_prelogin['login']['token']
-        except(LookupError,TypeError):
-            raise WikiError('wiki pre-login request failed (expected' +
-                    ' NeedToken), here is the full response: ' +
-                    "\n" + pprint.pformat(r_prelogin))
-        r_login = self._query_api(action='login',
-                lgname=username, lgpassword=password,
-                lgtoken=prelogin_token)
-        try:
-            if r_login['login']['result'] == 'WrongPass':
-                raise WikiError('Login failed, wrong password!')
-            if r_login['login']['result'] == 'WrongPluginPass':
-                raise WikiError('Login failed, wrong password!')
-            if r_login['login']['result'] != 'Success':
-                raise LookupError()
-        except(LookupError,TypeError):
-            raise WikiError('MediaWiki login request failed,' +
-                    ' here is the full response: ' +
-                    "\n" + pprint.pformat(r_login))
-        self._logged_in = True
-        self.clear_cached_info()
+        with self._info_lock:
+            if self._session_store is not None and self._resume_session(username):
+                return
+            r_prelogin = self._query_api(action='login',
+                    lgname=username, lgpassword=password)
+            try:
+                if r_prelogin['login']['result'] == 'WrongPass':
+                    raise WikiError('Login failed, wrong password!')
+                if r_prelogin['login']['result'] != 'NeedToken':
+                    raise LookupError()
+                prelogin_token = r_prelogin['login']['token']
+            except(LookupError,TypeError):
+                raise WikiError('wiki pre-login request failed (expected' +
+                        ' NeedToken), here is the full response: ' +
+                        "\n" + pprint.pformat(r_prelogin))
+            r_login = self._query_api(action='login',
+                    lgname=username, lgpassword=password,
+                    lgtoken=prelogin_token)
+            try:
+                if r_login['login']['result'] == 'WrongPass':
+                    raise WikiError('Login failed, wrong password!')
+                if r_login['login']['result'] == 'WrongPluginPass':
+                    raise WikiError('Login failed, wrong password!')
+                if r_login['login']['result'] != 'Success':
+                    raise LookupError()
+            except(LookupError,TypeError):
+                raise WikiError('MediaWiki login request failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_login))
+            self._logged_in = True
+            self._session_user = username
+            self.clear_cached_info()
+            if self._session_store is not None:
+                self.request_edittoken()
+                self._save_session()
 
     def logout(self, force=False):
         """Log out of the API. This does nothing if not logged in.
@@ -171,75 +431,135 @@ class WikiClient(object):
         thinks it is already logged out.
 
         """
-        if self._logged_in or force:
-            try:
-                self._query_api(action='logout')
-            except(WikiError) as err:
-                print(unicode(err), file=sys.stderr)
-                print('Warning: MediaWiki logout request failed!',
-                        file=sys.stderr)
-            else:
-                self._logged_in = False
-                self.clear_cached_info()
+        with self._info_lock:
+            if self._logged_in or force:
+                try:
+                    self._query_api(action='logout')
+                except(WikiError) as err:
+                    print(unicode(err), file=sys.stderr)
+                    print('Warning: MediaWiki logout request failed!',
+                            file=sys.stderr)
+                else:
+                    self._logged_in = False
+                    self.clear_cached_info()
+                    if self._session_store is not None and self._session_user is not None:
+                        self._session_store.delete(self._api, self._session_user)
+                    self._session_user = None
 
     def is_logged_in(self):
         """Return True if the client thinks it is logged in.
 
         This may erroneously return True in case the login session
-        has been idle for a while and timed out by the server.
-        TODO: write a method that asks meta=userinfo if we're still logged in.
+        has been idle for a while and timed out by the server. Use
+        check_login() to ask the server.
 
         """
         return self._logged_in
 
+    def check_login(self):
+        """Ask the API whether the client is still logged in.
+
+        Returns True if it is. If the session has timed out, the client
+        is marked as logged out and False is returned. Since this is a
+        cheap request, it can also be used to check that the wiki is
+        reachable: a WikiError is raised if it is not.
+
+        """
+        r_userinfo = self._query_api(action='query', meta='userinfo')
+        try:
+            userinfo = r_userinfo['query']['userinfo']
+        except(LookupError,TypeError):
+            raise WikiError('MediaWiki userinfo request failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_userinfo))
+        logged_in = 'anon' not in userinfo
+        if logged_in and self._session_user is not None:
+            logged_in = (userinfo.get('name') ==
+                    self._canonical_username(self._session_user))
+        with self._info_lock:
+            if self._logged_in and not logged_in:
+                self._logged_in = False
+                self.clear_cached_info()
+        return logged_in
+
+    def copy_session_from(self, client):
+        """Take over the login state, site information and edit token of
+        another client of the same wiki.
+
+        This is only useful if the engines of both clients share their
+        cookies (see CurlEngine.__init__()), so that this client sends
+        the session cookies of the other one. ClientPool uses this to log
+        in only once per wiki.
+
+        """
+        with self._info_lock:
+            self._logged_in = client._logged_in
+            self._session_user = client._session_user
+            self._siteinfo = client._siteinfo
+            self._title_normalizer = client._title_normalizer
+            self._userrights = client._userrights
+            self._edittoken = client._edittoken
+
     ### Emergency halt for bots ###
 
-    def set_emergency_page(self, page, var):
+    def set_emergency_page(self, page, var, max_age=DEFAULT_MAX_AGE):
         """Set the bot's emergency page for check_emergency().
 
         page is the emergency page name, usually a subpage of the user page.
         var is the name of the emergency variable.
 
-        See also check_emergency().
+        By default, check_emergency() revalidates the emergency state on
+        every call, so a halt takes effect before the next edit. A positive
+        max_age relaxes this: check_emergency() then acts on a state up to
+        max_age seconds old and sends a request at most that often, so the
+        bot may go on for up to max_age seconds after it has been halted.
+        A watcher thread (see EmergencyMonitor.start()) with an interval
+        below max_age keeps the state fresh without delaying the bot.
+
+        See also check_emergency() and get_emergency_monitor().
 
         """
-        self._emergencypage = page
-        self._emergencyvar = var
+        if self._emergency_monitor is not None:
+            self._emergency_monitor.stop()
+        if page is None or var is None:
+            self._emergency_monitor = None
+        else:
+            self._emergency_monitor = EmergencyMonitor(self, page, var, max_age)
+
+    def get_emergency_monitor(self):
+        """Return the EmergencyMonitor used by check_emergency(), or None
+        if no emergency page is set. Use it e.g. to start a watcher thread
+        that keeps the emergency state up to date."""
+        return self._emergency_monitor
 
     def check_emergency(self):
-        """Download the wikitext of the defined emergency page, and raise
-        an EmergencyError if the emergency variable has been activated.
+        """Raise an EmergencyError if the emergency variable on the defined
+        emergency page has been activated.
 
         Assume that PAGE, VAR are the parameters to the most recent call to
         set_emergency_page(). If either is None or set_emergency_page() has
         never been called, a warning message is printed to stderr and the
-        method returns. Otherwise the wikitext of PAGE is retrieved and
-        scanned for an occurrence of <VAR>=<VALUE>. If VALUE is anything
-        else than zero an EmergencyError is raised. Note that text inside
-        <!-- comments --> is stripped before looking for the variable.
+        method returns. Otherwise the wikitext of PAGE is scanned for an
+        occurrence of <VAR>=<VALUE>. If VALUE is anything else than zero,
+        or if PAGE or VAR does not exist, an EmergencyError is raised. Note
+        that text inside <!-- comments --> is stripped before looking for
+        the variable.
+
+        The result is cached together with the revision ID of PAGE, and
+        revalidated with a cheap request for the current revision ID when
+        it is older than the max_age given to set_emergency_page(). The
+        text is only downloaded again when PAGE has been edited. So this
+        can be called before every single edit. See EmergencyMonitor.
 
         Use this facilty in automated bots and protect the emergency page
         so that other administrators can halt your bot.
 
         """
-        page = self._emergencypage
-        var = self._emergencyvar
-        if page is None:
-            print("Warning: Emergency page is undefined!", file=sys.stderr)
-            return
-        if var is None:
-            print("Warning: Emergency variable is undefined!", file=sys.stderr)
+        monitor = self._emergency_monitor
+        if monitor is None:
+            print("Warning: Emergency page or variable is undefined!", file=sys.stderr)
             return
-        text = self.get_page_text(page)
-        if text is None:
-            raise EmergencyError('Emergency page ' + page + ' does not exist!')
-        text = re.sub('<!--.*?-->', '', text)
-        match = re.search(re.escape(var) + '\s*=\s*([0-9]+)', text)
-        if match:
-            if int(match.group(1)) != 0:
-                raise EmergencyError('Emergency halt!')
-        else:
-            raise EmergencyError('Emergency variable ' + var + ' is not defined in emergency page ' + page + '!')
+        monitor.check()
 
     ### Initialization ###
 
@@ -253,37 +573,16 @@ class WikiClient(object):
         Returns None, but see get_siteinfo().
 
         """
-        if not self.has_siteinfo():
-            r_siteinfo = self._query_api(action='query', meta='siteinfo',
-                    siprop='general|namespaces|namespacealiases')
-            try:
-                if not r_siteinfo['query']['general']:
-                    raise LookupError()
-                if not r_siteinfo['query']['namespaces']:
-                    raise LookupError()
-                if not r_siteinfo['query']['namespacealiases']:
-                    raise LookupError()
-                self._siteinfo = r_siteinfo['query']
-                # Get list of namespaces and namespace aliases
-                self._siteinfo_ns = {}
-                self._siteinfo_ns_normalized = {}
-                for ns in self._siteinfo['namespaces'].values():
-                    ns_id = int(ns['id'])
-                    self._siteinfo_ns[int(ns_id)] = int(ns_id)
-                    self._siteinfo_ns[ns['*'].lower()] = int(ns_id)
-                    if 'canonical' in ns:
-                        self._siteinfo_ns[ns['canonical'].lower()] = int(ns_id)
-                    self._siteinfo_ns_normalized[ns_id] = ns['*']
-                for ns in self._siteinfo['namespacealiases']:
-                    ns_id = int(ns['id'])
-                    self._siteinfo_ns[ns['*'].lower()] = ns_id
-                    if not ns_id in self._siteinfo_ns_normalized:
-                        # should not happen
-                        self._siteinfo_ns_normalized[ns_id] = ns['*']
-            except(LookupError,TypeError):
-                raise WikiError('MediaWiki siteinfo request failed,' +
-                    ' here is the full response: ' +
-                    "\n" + pprint.pformat(r_siteinfo))
+        with self._info_lock:
+            if not self.has_siteinfo():
+                r_siteinfo = self._query_api(action='query', meta='siteinfo',
+                        siprop='general|namespaces|namespacealiases')
+                try:
+                    self._set_siteinfo(r_siteinfo['query'])
+                except(LookupError,TypeError):
+                    raise WikiError('MediaWiki siteinfo request failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_siteinfo))
 
     def has_siteinfo(self):
         """Return True if request_siteinfo() has been successfully run."""
@@ -305,18 +604,19 @@ class WikiClient(object):
         Returns None, but see get_edittoken().
 
         """
-        if not self.has_edittoken():
-            self.request_siteinfo()
-            mainpage = self._siteinfo['general']['mainpage']
-            r_edittoken = self._query_api(action='query', prop='info',
-                    intoken='edit', titles=mainpage)
-            try:
-                self._edittoken = unicode(
-                        r_edittoken['query']['pages'].values()[0]['edittoken'])
-            except(LookupError,TypeError):
-                raise WikiError('MediaWiki edit token request failed,' +
-                    ' here is the full response: ' +
-                    "\n" + pprint.pformat(r_edittoken))
+        with self._info_lock:
+            if not self.has_edittoken():
+                self.request_siteinfo()
+                mainpage = self._siteinfo['general']['mainpage']
+                r_edittoken = self._query_api(action='query', prop='info',
+                        intoken='edit', titles=mainpage)
+                try:
+                    self._edittoken = unicode(
+                            r_edittoken['query']['pages'].values()[0]['edittoken'])
+                except(LookupError,TypeError):
+                    raise WikiError('MediaWiki edit token request failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_edittoken))
 
     def has_edittoken(self):
         """Return True if request_edittoken() has been successfully run."""
@@ -329,12 +629,48 @@ class WikiClient(object):
         """
         return self._edittoken
 
+    def request_userrights(self):
+        """Request the rights of the current user (e.g. 'apihighlimits').
+
+        Methods whose limits depend on the rights call this method when
+        required, so there is normally no need to call this method
+        explicitly.
+
+        Returns None, but see get_userrights().
+
+        """
+        with self._info_lock:
+            if not self.has_userrights():
+                r_userinfo = self._query_api(action='query', meta='userinfo',
+                        uiprop='rights')
+                try:
+                    self._userrights = frozenset(
+                            r_userinfo['query']['userinfo']['rights'])
+                except(LookupError,TypeError):
+                    raise WikiError('MediaWiki userinfo request failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_userinfo))
+
+    def has_userrights(self):
+        """Return True if request_userrights() has been successfully run."""
+        return self._userrights is not None
+
+    def get_userrights(self):
+        """Return the rights of the current user as a frozenset if
+        request_userrights() has been successfully run, or None otherwise.
+
+        """
+        return self._userrights
+
     def clear_cached_info(self):
-        """Clear the site information and the edit token."""
-        self._siteinfo = None
-        self._siteinfo_ns = None
-        self._siteinfo_ns_normalized = None
-        self._edittoken = None
+        """Clear the site information, the user rights and the edit token."""
+        with self._info_lock:
+            self._siteinfo = None
+            self._title_normalizer = None
+            self._userrights = None
+            self._edittoken = None
+            # (time requested, result) of get_last_change(), see iter_ask()
+            self._last_change = None
 
     ### Query methods ###
 
@@ -367,9 +703,9 @@ class WikiClient(object):
         This method queries info, revisions and categories.
 
         """
-        api_result = self._query_entries((title,), True, ('info', 'revisions', 'categories'))
+        pages = self._query_entries((title,), True, ('info', 'revisions', 'categories'))
         try:
-            return api_result['query']['pages'].values()[0]
+            return pages[0]
         except(LookupError):
             return None
 
@@ -380,9 +716,9 @@ class WikiClient(object):
         for get_page_info() for a description of the result format.
 
         """
-        api_result = self._query_entries((pageid,), False, ('info', 'revisions', 'categories'))
+        pages = self._query_entries((pageid,), False, ('info', 'revisions', 'categories'))
         try:
-            return api_result['query']['pages'].values()[0]
+            return pages[0]
         except(LookupError):
             return None
 
@@ -392,9 +728,9 @@ class WikiClient(object):
         title is the requested page name.
 
         """
-        api_result = self._query_entries((title,), True, ('revisions',))
+        pages = self._query_entries((title,), True, ('revisions',))
         try:
-            return api_result['query']['pages'].values()[0]['revisions'][0]['*']
+            return pages[0]['revisions'][0]['*']
         except(LookupError):
             return None
 
@@ -404,9 +740,9 @@ class WikiClient(object):
         pageid is the page ID of the requested page.
 
         """
-        api_result = self._query_entries((pageid,), False, ('revisions',))
+        pages = self._query_entries((pageid,), False, ('revisions',))
         try:
-            return api_result['query']['pages'].values()[0]['revisions'][0]['*']
+            return pages[0]['revisions'][0]['*']
         except(LookupError):
             return None
 
@@ -425,14 +761,7 @@ class WikiClient(object):
         sorted alphabetically by title.
 
         """
-        api_result = self._query_entries(titles, True, ('info', 'revisions', 'categories'))
-        result = api_result['query']['pages'].values()
-        if redirects is not None:
-            if redirects:
-                result = [x for x in result if 'redirects' in x]
-            else:
-                result = [x for x in result if 'redirects' not in x]
-        return self._natsorted_by_title(result)
+        return TitleIndex(self.iter_pages(titles, redirects)).get_items()
 
     def get_multi_page_info_by_id(self, pageids, redirects=None):
         """Same as get_page_info_by_id(), but supports multiple page IDs.
@@ -449,14 +778,64 @@ class WikiClient(object):
         sorted alphabetically by title.
 
         """
-        api_result = self._query_entries(pageids, False, ('info', 'revisions', 'categories'))
-        result = api_result['query']['pages'].values()
-        if redirects is not None:
-            if redirects:
-                result = [x for x in result if 'redirects' in x]
-            else:
-                result = [x for x in result if 'redirects' not in x]
-        return self._natsorted_by_title(result)
+        return TitleIndex(self.iter_pages_by_id(pageids, redirects)).get_items()
+
+    def iter_pages(self, titles, redirects=None, prop=None):
+        """Iterate over information about multiple wiki pages.
+
+        titles is the list of requested page names. redirects works as in
+        get_multi_page_info().
+
+        prop is the list of properties to get. If set to None, equivalent
+        to ('info', 'revisions', 'categories'), in which case each page
+        is in the same format as the return value of get_page_info().
+
+        This is a generator. Pages are requested in chunks of 50 (see
+        get_max_parallel_requests() for how many chunks are in flight at
+        once), and the pages of each chunk are yielded as soon as the
+        chunk is complete. Unlike get_multi_page_info(), the pages are
+        not sorted, so the whole result never has to be held in memory.
+
+        """
+        if prop is None:
+            prop = ('info', 'revisions', 'categories')
+        for batch in self._iter_entries(titles, True, prop):
+            for page in self._filter_redirects(batch, redirects):
+                yield page
+
+    def iter_pages_by_id(self, pageids, redirects=None, prop=None):
+        """Same as iter_pages(), but pageids is a list of page IDs."""
+        if prop is None:
+            prop = ('info', 'revisions', 'categories')
+        for batch in self._iter_entries(pageids, False, prop):
+            for page in self._filter_redirects(batch, redirects):
+                yield page
+
+    def complete_pages(self, pages, prop=None):
+        """Return the complete records of pages whose info properties are
+        known, e.g. from iter_pages() with prop ('info',).
+
+        prop is as in iter_pages(). If the page cache is enabled and prop
+        contains 'revisions', pages whose last revision (according to
+        their info) is in the cache are taken from there; all others are
+        downloaded. Missing and invalid pages are returned unchanged.
+        Returns a list of page records in the same order as pages.
+
+        """
+        if prop is None:
+            prop = ('info', 'revisions', 'categories')
+        pages = list(pages)
+        if self._page_cache is not None and 'revisions' in prop:
+            return self._refresh_cached_entries([pages], prop)[0]
+        pageids = [int(page['pageid']) for page in pages
+                if 'missing' not in page and 'invalid' not in page]
+        fresh = dict((int(page['pageid']), page) for page in
+                self._query_entries_uncached(pageids, False, prop)
+                if 'missing' not in page)
+        return [page if 'missing' in page or 'invalid' in page else
+                fresh.get(int(page['pageid']),
+                        {'pageid': int(page['pageid']), 'missing': ''})
+                for page in pages]
 
     def get_prefix_list(self, prefix, redirects=None, namespace=None):
         """Return a list of titles of pages with a given prefix.
@@ -479,10 +858,14 @@ class WikiClient(object):
         The returned list is sorted alphabetically.
 
         """
-        self.request_siteinfo()
-        api_result = self._query_prefix_list(prefix, redirects, namespace)
-        result = [page['title'] for page in api_result['query']['allpages']]
-        return self._natsorted(result)
+        return self.get_prefix_index(prefix, redirects, namespace).get_titles()
+
+    def get_prefix_index(self, prefix, redirects=None, namespace=None):
+        """Same as get_prefix_list(), but returns a TitleIndex of the
+        pages, as yielded by iter_prefix_list(). Use this instead of
+        several calls of get_prefix_list() and get_prefix_list_ids() to
+        look up pages by title, page ID or a longer prefix."""
+        return TitleIndex(self.iter_prefix_list(prefix, redirects, namespace))
 
     def get_prefix_list_ids(self, prefix, redirects=None, namespace=None):
         """Return a list of page IDs of pages with a given prefix.
@@ -505,9 +888,8 @@ class WikiClient(object):
         The returned list is sorted numerically.
 
         """
-        self.request_siteinfo()
-        api_result = self._query_prefix_list(prefix, redirects, namespace)
-        return sorted(int(page['pageid']) for page in api_result['query']['allpages'])
+        return sorted(int(page['pageid']) for page in
+                self.iter_prefix_list(prefix, redirects, namespace))
 
     def get_category_members(self, category, namespace=None):
         """Return a list of titles of pages in the given category.
@@ -524,10 +906,13 @@ class WikiClient(object):
         The returned list is sorted alphabetically.
 
         """
-        self.request_siteinfo()
-        api_result = self._query_category_members(category, namespace)
-        result = [page['title'] for page in api_result['query']['categorymembers']]
-        return self._natsorted(result)
+        return self.get_category_index(category, namespace).get_titles()
+
+    def get_category_index(self, category, namespace=None):
+        """Same as get_category_members(), but returns a TitleIndex of
+        the pages, as yielded by iter_category_members(). Use this to look
+        up category members by title, page ID or prefix."""
+        return TitleIndex(self.iter_category_members(category, namespace))
 
     def get_category_members_ids(self, category, namespace=None):
         """Return a list of page IDs of pages in the given category.
@@ -544,9 +929,8 @@ class WikiClient(object):
         The returned list is sorted numerically.
 
         """
-        self.request_siteinfo()
-        api_result = self._query_category_members(category, namespace)
-        return sorted(int(page['pageid']) for page in api_result['query']['categorymembers'])
+        return sorted(int(page['pageid']) for page in
+                self.iter_category_members(category, namespace))
 
     def get_all_categories(self, prefix=None):
         """Return a list of all categories.
@@ -566,10 +950,8 @@ class WikiClient(object):
         namespace prefix), sorted alphabetically.
 
         """
-        self.request_siteinfo()
-        api_result = self._query_all_categories(prefix)
-        result = [page['*'] for page in api_result['query']['allcategories']]
-        return self._natsorted(result)
+        result = (page['*'] for page in self.iter_all_categories(prefix))
+        return TitleIndex(result, title_key=None).get_titles()
 
     def get_all_categories_info(self, prefix=None):
         """Return a list of all categories, with additional info.
@@ -597,11 +979,233 @@ class WikiClient(object):
                           has been deleted). The 'pageid' field is missing if
                           this one is present.
 
+        """
+        result = self.iter_all_categories(prefix, with_info=True)
+        return TitleIndex(result).get_items()
+
+    def iter_prefix_list(self, prefix, redirects=None, namespace=None):
+        """Iterate over pages with a given prefix.
+
+        The parameters work identical to those of get_prefix_list().
+
+        This is a generator. It yields one dict per page, with the keys
+        'pageid', 'ns' and 'title', in the order returned by the server.
+        Each batch of pages is yielded as soon as it arrives, so the
+        first pages are available after the first request.
+
+        """
+        self.request_siteinfo()
+        if namespace is None:
+            nsnumber, prefix = self.split_name(prefix)
+        else:
+            nsnumber = self.namespace_to_number(namespace)
+        kw = {'action':'query', 'list':'allpages',
+                'aplimit':'max', 'apprefix':prefix, 'apnamespace':nsnumber}
+        if redirects is not None:
+            if redirects:
+                kw['apfilterredir'] = 'redirects'
+            else:
+                kw['apfilterredir'] = 'nonredirects'
+        for batch in self._query_continued(kw, 'allpages', 'allpages', 'prefix'):
+            for page in batch:
+                yield page
+
+    def iter_category_members(self, category, namespace=None,
+            with_sortkey=False, with_timestamp=False):
+        """Iterate over pages in the given category.
+
+        category and namespace work identical to the parameters of
+        get_category_members().
+
+        If with_sortkey is set to True, the results include the sort key
+        of each category member.
+
+        If with_timestamp is set to True, the time and date articles were
+        added to the category are included in the results.
+
+        This is a generator. It yields one dict per category member, with
+        the keys 'pageid', 'ns' and 'title' (and 'sortkey' and 'timestamp'
+        if requested), in the order returned by the server. Each batch
+        of members is yielded as soon as it arrives.
+
         """
         self.request_siteinfo()
-        api_result = self._query_all_categories_info(prefix)
-        result = api_result['query']['pages'].values()
-        return self._natsorted_by_title(result)
+        nsnumber, rest = self.split_name(category)
+        if nsnumber == self.namespace_to_number(''):
+            # namespace prefix was omitted, prepend Category:
+            nsnumber = self.namespace_to_number('Category')
+        category = self.combine_name(nsnumber, rest)
+        kw = {'action':'query', 'list':'categorymembers',
+                'cmlimit':'max', 'cmtitle':category, 'cmprop':'ids|title'}
+        if namespace is not None:
+            kw['cmnamespace'] = self.namespace_to_number(namespace)
+        if with_sortkey:
+            kw['cmprop'] += '|sortkey'
+        if with_timestamp:
+            kw['cmprop'] += '|timestamp'
+        for batch in self._query_continued(kw, 'categorymembers',
+                'categorymembers', 'categorymembers'):
+            for page in batch:
+                yield page
+
+    def iter_all_categories(self, prefix=None, with_info=False):
+        """Iterate over all categories.
+
+        The prefix parameter works identical to the prefix parameter
+        in get_all_categories().
+
+        If with_info is False (the default), this performs a list query
+        and yields one dict per category, where the '*' key is the
+        category name without the 'Category:' namespace prefix. If
+        with_info is True, this performs a generator query instead and
+        yields dicts in the format described at get_all_categories_info().
+
+        This is a generator. Each batch of categories is yielded as soon
+        as it arrives, in the order returned by the server.
+
+        """
+        self.request_siteinfo()
+        if with_info:
+            kw = {'action':'query', 'generator':'allcategories',
+                    'gaclimit':'max', 'prop':'categoryinfo'}
+            prefix_param = 'gacprefix'
+            result_key = 'pages'
+        else:
+            kw = {'action':'query', 'list':'allcategories', 'aclimit':'max'}
+            prefix_param = 'acprefix'
+            result_key = 'allcategories'
+        if prefix:
+            nsnumber, rest = self.split_name(prefix)
+            if nsnumber != self.namespace_to_number('') and nsnumber != self.namespace_to_number('Category'):
+                raise WikiError('AllCategories prefix is in incorrect namespace')
+            kw[prefix_param] = rest
+        for batch in self._query_continued(kw, 'allcategories', result_key,
+                'allcategories', with_info):
+            for page in batch:
+                yield page
+
+    def iter_category_pages(self, category, namespace=None, prop=None):
+        """Iterate over the pages in a category, including their content.
+
+        category and namespace work identical to the parameters of
+        get_category_members().
+
+        prop is the list of page properties to get, see iter_pages().
+
+        This performs a generator query, so the category members and
+        their properties (including the wikitext, if prop includes
+        'revisions') arrive in the same responses. This is a generator
+        that yields the page records of each batch as soon as the batch
+        is complete.
+
+        """
+        self.request_siteinfo()
+        nsnumber, rest = self.split_name(category)
+        if nsnumber == self.namespace_to_number(''):
+            # namespace prefix was omitted, prepend Category:
+            nsnumber = self.namespace_to_number('Category')
+        kw = {'generator':'categorymembers',
+                'gcmtitle':self.combine_name(nsnumber, rest)}
+        if namespace is not None:
+            kw['gcmnamespace'] = self.namespace_to_number(namespace)
+        for batch in self._query_generator(kw, 'categorymembers', 'gcmlimit',
+                prop, 'categorymembers'):
+            for page in batch:
+                yield page
+
+    def iter_prefix_pages(self, prefix, redirects=None, namespace=None, prop=None):
+        """Iterate over the pages with a given prefix, including their
+        content.
+
+        prefix, redirects and namespace work identical to the parameters
+        of get_prefix_list().
+
+        prop is the list of page properties to get, see iter_pages().
+
+        Like iter_category_pages(), this performs a generator query and
+        yields page records batch by batch.
+
+        """
+        self.request_siteinfo()
+        if namespace is None:
+            nsnumber, prefix = self.split_name(prefix)
+        else:
+            nsnumber = self.namespace_to_number(namespace)
+        kw = {'generator':'allpages', 'gapprefix':prefix,
+                'gapnamespace':nsnumber}
+        if redirects is not None:
+            if redirects:
+                kw['gapfilterredir'] = 'redirects'
+            else:
+                kw['gapfilterredir'] = 'nonredirects'
+        for batch in self._query_generator(kw, 'allpages', 'gaplimit',
+                prop, 'prefix'):
+            for page in batch:
+                yield page
+
+    def iter_search_pages(self, search, namespace=None, prop=None):
+        """Iterate over the pages found by a prefix search, including
+        their content.
+
+        search is the search string. Unlike get_prefix_list(), this uses
+        the wiki's search backend (list=prefixsearch), so the matching is
+        case-insensitive and the results are ordered by relevance.
+
+        namespace is the namespace (name or number) to search in. If it
+        is None (the default), the main namespace is searched.
+
+        prop is the list of page properties to get, see iter_pages().
+
+        Like iter_category_pages(), this performs a generator query and
+        yields page records batch by batch.
+
+        """
+        self.request_siteinfo()
+        kw = {'generator':'prefixsearch', 'gpssearch':search}
+        if namespace is not None:
+            kw['gpsnamespace'] = self.namespace_to_number(namespace)
+        for batch in self._query_generator(kw, 'prefixsearch', 'gpslimit',
+                prop, 'prefixsearch'):
+            for page in batch:
+                yield page
+
+    def get_last_change(self):
+        """Return the latest entry in the recent changes of the wiki, as a
+        dict with the keys 'rcid', 'revid' and 'timestamp', or None if
+        there are no recent changes."""
+        r_changes = self._query_api(action='query', list='recentchanges',
+                rclimit=1, rcprop='ids|timestamp')
+        try:
+            changes = r_changes['query']['recentchanges']
+            if not changes:
+                return None
+            return {'rcid': changes[0]['rcid'], 'revid': changes[0]['revid'],
+                    'timestamp': changes[0]['timestamp']}
+        except(LookupError,TypeError):
+            raise WikiError('MediaWiki recentchanges query failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_changes))
+
+    def iter_recent_changes(self, start=None):
+        """Iterate over the recent changes of the wiki, oldest first.
+
+        start is the timestamp of the first change to return (changes at
+        exactly that time are included), or None to start with the oldest
+        change the wiki keeps. Each change is a dict with (among others)
+        the keys 'type', 'title', 'rcid', 'revid' and 'timestamp', and for
+        log entries 'logtype' and the log parameters.
+
+        This is a generator, which requests further changes as needed.
+
+        """
+        kw = {'action':'query', 'list':'recentchanges', 'rcdir':'newer',
+                'rclimit':'max', 'rcprop':'title|ids|timestamp|loginfo'}
+        if start is not None:
+            kw['rcstart'] = start
+        for batch in self._query_continued(kw, 'recentchanges',
+                'recentchanges', 'recentchanges'):
+            for change in batch:
+                yield change
 
     ### Parsing wikitext ###
 
@@ -614,18 +1218,35 @@ class WikiClient(object):
         page links to itself, or when links to subpages are present.
         If set to None, defaults to 'API'.
 
+        If a parse cache is set, the result may come from the cache, see
+        set_parse_cache().
+
         See http://www.mediawiki.org/wiki/API:Parsing_wikitext.
         """
-        return self._query_expandtemplates(text=text, title=title)
+        if self._parse_cache is None:
+            return self._query_expandtemplates(text=text, title=title)
+        key = ParseCache.make_key('expandtemplates', title, text)
+        return self._cached_parse(key,
+                lambda: (self._query_expandtemplates(text=text, title=title), None),
+                self._text_templates(text))
 
     def expandtemplates_page(self, page):
         """Preprocesses wikitext. Expands templates, strips comments, etc.
 
         page is the title of the page to preprocess.
 
+        If a parse cache is set, the result may come from the cache, see
+        set_parse_cache().
+
         See http://www.mediawiki.org/wiki/API:Parsing_wikitext.
         """
-        return self._query_expandtemplates(page=page)
+        if self._parse_cache is None:
+            return self._query_expandtemplates(page=page)
+        title, lastrevid, templates = self._page_templates(page)
+        key = ParseCache.make_key('expandtemplates_page', title, lastrevid)
+        return self._cached_parse(key,
+                lambda: (self._query_expandtemplates(page=title), None),
+                templates)
 
     def parse(self, text, title=None, prop=None):
         """Parses wikitext.
@@ -640,11 +1261,18 @@ class WikiClient(object):
         to ('text', 'langlinks', 'categories', 'links', 'templates',
         'images', 'externallinks', 'sections', 'revid').
 
+        If a parse cache is set, the result may come from the cache, see
+        set_parse_cache().
+
         See http://www.mediawiki.org/wiki/API:Parsing_wikitext.
         """
         if prop is not None:
             prop = '|'.join(prop)
-        return self._query_parse(text=text, title=title, prop=prop)
+        if self._parse_cache is None:
+            return self._query_parse(text=text, title=title, prop=prop)
+        key = ParseCache.make_key('parse', title, text, prop)
+        return self._cached_parse(key,
+                lambda: self._query_parse_templates(prop, text=text, title=title))
 
     def parse_page(self, page, prop=None):
         """Parses wikitext.
@@ -655,30 +1283,158 @@ class WikiClient(object):
         to ('text', 'langlinks', 'categories', 'links', 'templates',
         'images', 'externallinks', 'sections', 'revid').
 
+        If a parse cache is set, the result may come from the cache, see
+        set_parse_cache().
+
         See http://www.mediawiki.org/wiki/API:Parsing_wikitext.
         """
         if prop is not None:
             prop = '|'.join(prop)
-        return self._query_parse(page=page, prop=prop)
+        if self._parse_cache is None:
+            return self._query_parse(page=page, prop=prop)
+        title, lastrevid, templates = self._page_templates(page)
+        key = ParseCache.make_key('parse_page', title, lastrevid, prop)
+        return self._cached_parse(key,
+                lambda: (self._query_parse(page=title, prop=prop), None),
+                templates)
+
+    ### Semantic MediaWiki queries ###
+
+    def ask(self, query, printouts=None, limit=None, use_cache=True):
+        """Perform a Semantic MediaWiki query.
+
+        query contains the conditions of the query in SMW syntax, e.g.
+        '[[Kategorie:Fakeplag]][[Quelle::Meier 2001]]', and may be
+        followed by printouts and options such as '|sort=Seite'. It must
+        not set limit or offset.
+
+        printouts is a sequence of names of the properties to return for
+        each page. Each name may be followed by '=' and a label, which
+        is then used instead of the name in the results.
+
+        limit is the maximum number of rows to return, or None to return
+        all of them. The rows are requested ASK_BATCH_SIZE at a time (or
+        fewer, if the wiki restricts this).
+
+        Returns a list of AskRow objects. Their values are converted
+        according to the types of the properties.
+
+        If use_cache is True and a parse cache is set (see
+        set_parse_cache()), the rows are cached, together with the ID of
+        the latest entry in the recent changes of the wiki (see
+        get_last_change()), and the cached rows are used as long as
+        nothing has been changed on the wiki. Note that SMW may update
+        its data some time after a change.
+
+        Looking up the cache takes a recentchanges request, which is
+        made at most every LAST_CHANGE_MAX_AGE seconds (and after every
+        write request of this client). So changes made by others may go
+        unnoticed for that long.
+
+        """
+        return list(self.iter_ask(query, printouts, limit, use_cache))
+
+    def iter_ask(self, query, printouts=None, limit=None, use_cache=True):
+        """Iterate over the rows of a Semantic MediaWiki query.
+
+        The parameters work identical to those of ask().
+
+        This is a generator. It yields one AskRow per page, in the order
+        returned by the server. Each batch of rows is yielded as soon as
+        it arrives. (Wikis with SMW versions before 3.0 return the rows
+        of a batch in no particular order; they are yielded sorted by
+        title then.)
+
+        """
+        if not self.has_semantic_mediawiki():
+            raise WikiError('Semantic MediaWiki queries are not enabled' +
+                    ' for ' + self._api)
+        query = unicode(query)
+        for printout in printouts or ():
+            printout = unicode(printout)
+            if not printout.startswith('?'):
+                printout = '?' + printout
+            query += '|' + printout
+        key = None
+        if use_cache and self._parse_cache is not None:
+            key = ParseCache.make_key('ask', query, limit,
+                    self._get_recent_last_change())
+            cached = self._parse_cache.lookup(self._api, key)
+            if cached is not None:
+                typeids = cached[0]['typeids']
+                for title, result in cached[0]['rows']:
+                    yield AskRow(title, result, typeids)
+                return
+        typeids = {}
+        rows = []
+        for batch_typeids, batch in self._query_ask(query, limit):
+            typeids.update(batch_typeids)
+            for title, result in batch:
+                if key is not None:
+                    rows.append((title, result))
+                yield AskRow(title, result, batch_typeids)
+        if key is not None:
+            self._parse_cache.store(self._api, key,
+                    {'typeids': typeids, 'rows': rows}, {})
 
     ### Purging wiki pages ###
 
-    def purge(self, title):
+    def purge(self, title, forcelinkupdate=False):
         """Requests that a page is deleted from the server-side article cache
-        and rebuilt."""
-        r_purge = self._query_api(action='purge', titles=title)
-        # TODO verify success
+        and rebuilt. Returns a PurgeReport, see purge_multi()."""
+        return self.purge_multi((title,), forcelinkupdate)
 
-    def purge_multi(self, titles):
+    def purge_multi(self, titles, forcelinkupdate=False):
         """Requests that multiple pages are deleted from the server-side
-        article cache and rebuilt."""
-        titles_joined = '|'.join(titles)
-        r_purge = self._query_api(action='purge', titles=titles_joined)
-        # TODO verify success
+        article cache and rebuilt.
+
+        The pages are purged in chunks of 50 titles, or 500 if the user
+        has the 'apihighlimits' right (see get_userrights()). Up to
+        get_max_parallel_requests() chunks are in flight at once; all of
+        them pass the request scheduler, so the write rate limit applies.
+
+        If forcelinkupdate is True, the link tables of the pages are
+        updated as well, e.g. to update the categories that the pages get
+        from a changed template.
+
+        Returns a PurgeReport with the result for each title. Pages that
+        do not exist or could not be purged do not cause a WikiError, so
+        check the report.
+
+        """
+        report = PurgeReport()
+        unique_titles = []
+        seen = set()
+        for title in titles:
+            if '|' in title:
+                # cannot be passed in the titles parameter
+                report.add(title, 'invalid', message='Invalid title')
+            elif title not in seen:
+                seen.add(title)
+                unique_titles.append(title)
+        titles = unique_titles
+        if 'apihighlimits' in self._require_userrights():
+            chunk_size = 500
+        else:
+            chunk_size = 50
+        jobs = []
+        for chunk_pos in range(0, len(titles), chunk_size):
+            chunk = titles[chunk_pos : chunk_pos + chunk_size]
+            kw = {'action':'purge', 'titles':'|'.join(chunk)}
+            if forcelinkupdate:
+                kw['forcelinkupdate'] = ''
+            jobs.append((chunk, kw))
+
+        def on_result(chunk, kw, r_purge):
+            self._add_purge_results(report, chunk, r_purge)
+
+        self._query_api_pipeline(jobs, on_result, False)
+        return report
 
     ### Editing and uploading ###
 
-    def edit(self, title, text, summary=None, minor=True, bot=True):
+    def edit(self, title, text, summary=None, minor=True, bot=True,
+            basetimestamp=None, starttimestamp=None):
         """Edits or creates a wiki page.
 
         title is the title of the page to be modified.
@@ -687,27 +1443,37 @@ class WikiClient(object):
         minor sets the minor flag; by default, it is enabled.
         bot sets the bot flag; by default, it is enabled.
 
+        basetimestamp is the timestamp of the revision the new text is
+        based on, and starttimestamp the time at which that revision was
+        downloaded. If they are given, the server refuses the edit (and
+        a WikiError is raised) if somebody else has edited or deleted the
+        page in the meantime. See EditQueue for a convenient way to use
+        them for many pages.
+
         You should always log in (preferably using a bot account) before
         editing wiki pages. Particularly if doing automated edits, state
         the name and purpose of the bot in the edit summary.
 
+        Returns the 'edit' part of the API result, which contains (among
+        others) the new revision ID in 'newrevid'.
+
         """
         self.request_edittoken()
-        text = unicode(text)
-        md5 = hashlib.md5(self._to_utf8(text)).hexdigest()
-        r_edit = self._query_api(action = 'edit',
-                title = title, text = text, md5 = md5, summary = summary,
-                token = self._edittoken, minor = bool(minor), bot = bool(bot),
-                watchlist = 'nochange')
+        r_edit = self._query_api(**self._edit_kw(title, text, summary,
+                minor, bot, self._require_edittoken(), basetimestamp,
+                starttimestamp))
         try:
             if r_edit['edit']['result'] != 'Success':
                 raise LookupError()
+            return r_edit['edit']
         except(LookupError,TypeError):
             raise WikiError('MediaWiki edit request failed,' +
                     ' here is the full response: ' +
                     "\n" + pprint.pformat(r_edit))
 
-    def upload(self, local_filename, remote_filename=None, text=None, summary=None):
+    def upload(self, local_filename, remote_filename=None, text=None,
+            summary=None, chunk_size=None, progress=None,
+            skip_identical=False):
         """Uploads a media file to the wiki.
 
         local_filename is the absolute or relative path to the local file.
@@ -721,6 +1487,19 @@ class WikiClient(object):
 
         summary is the upload summary.
 
+        By default, the whole file is uploaded in a single request. If
+        chunk_size is given (e.g. chunkedupload.DEFAULT_CHUNK_SIZE), files
+        larger than chunk_size bytes are uploaded in chunks of that size,
+        and chunks that fail are sent again (see ChunkedUpload, which
+        also describes the progress callback).
+
+        If skip_identical is True and the file on the wiki has the same
+        SHA-1 as the local file, nothing is uploaded and None is
+        returned.
+
+        Otherwise returns the 'upload' part of the API result, which
+        contains (among others) 'result' and 'filename'.
+
         You may have to log in before uploading files. Remember that the
         list of acceptable file types is limited and depends on the wiki
         configuration. Particularly if doing automated upload, state
@@ -730,8 +1509,17 @@ class WikiClient(object):
         self.request_edittoken()
         if remote_filename is None:
             remote_filename = os.path.basename(local_filename)
+        if skip_identical:
+            fileinfo = self.get_file_info(remote_filename)
+            if (fileinfo is not None and
+                    fileinfo.get('sha1') == file_sha1(local_filename)):
+                return None
+        if (chunk_size is not None and
+                os.path.getsize(local_filename) > chunk_size):
+            return ChunkedUpload(self, local_filename, remote_filename, text,
+                    summary, chunk_size, progress).run()
         r_upload = self._query_api(action='upload', filename=remote_filename,
-                ignorewarnings='', token=self._edittoken,
+                ignorewarnings='', token=self._require_edittoken(),
                 text=text, comment=summary,
                 file=(local_filename, 'file', 'application/octet-stream'))
         try:
@@ -741,13 +1529,126 @@ class WikiClient(object):
             raise WikiError('MediaWiki upload request failed,' +
                 ' here is the full response: ' +
                 "\n" + pprint.pformat(r_upload))
+        return r_upload['upload']
+
+    def get_file_info(self, remote_filename):
+        """Return information about the current version of a file on the
+        wiki, or None if there is no such file.
+
+        Returns a dict with the keys 'sha1' (the SHA-1 of the file as a
+        hex string), 'size', 'timestamp' and 'url'.
+
+        """
+        self.request_siteinfo()
+        r_fileinfo = self._query_api(action='query', prop='imageinfo',
+                titles=self.combine_name(6, remote_filename),
+                iiprop='sha1|size|timestamp|url')
+        try:
+            page = r_fileinfo['query']['pages'].values()[0]
+            if 'imageinfo' not in page:
+                return None
+            return page['imageinfo'][0]
+        except(LookupError,TypeError,AttributeError):
+            raise WikiError('MediaWiki imageinfo request failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_fileinfo))
+
+    def get_edit_arguments(self, title, text, token, summary=None, minor=True,
+            bot=True, basetimestamp=None, starttimestamp=None,
+            createonly=False):
+        """Return the API arguments of an edit, e.g. to send it with
+        query_pipeline().
+
+        token is the edit token (see request_edittoken()), the other
+        arguments are as in edit(). If createonly is True, the server
+        refuses the edit if the page exists.
+
+        """
+        return self._edit_kw(title, text, summary, minor, bot, token,
+                basetimestamp, starttimestamp, createonly)
+
+    ### Direct MediaWiki API access ###
+
+    def query_api(self, kw, raise_errors=True):
+        """Perform a raw MediaWiki API request and return the parsed
+        result.
+
+        kw is a dict of API arguments. Argument values may be tuples to
+        upload files, see _query_api(). The request passes the request
+        scheduler and is sent again as the retry policy allows (see
+        set_retry_policy()); if it still fails, a WikiError is raised.
+
+        If raise_errors is True (the default), a WikiError is raised as
+        well if the API reports an error or warnings. Otherwise they are
+        returned as part of the result (see get_response_error()).
+
+        """
+        if raise_errors:
+            return self._query_api(**kw)
+        results = []
+        self._query_api_pipeline([(None, kw)],
+                lambda tag, kw, result: results.append(result), False)
+        return results[0]
+
+    def query_pipeline(self, jobs, on_result, raise_errors=True,
+            on_error=None):
+        """Perform raw MediaWiki API requests concurrently, where each
+        result may cause further requests.
+
+        jobs is a sequence of (tag, kw) pairs, where kw contains the API
+        arguments of a request (e.g. from get_edit_arguments()) and tag
+        is anything the caller wants to associate with the request. Up
+        to get_max_parallel_requests() requests are in flight at once,
+        and all of them pass the request scheduler.
+
+        on_result is called as on_result(tag, kw, result) whenever a
+        request has completed, where result is the parsed API result.
+        It may return a sequence of further (tag, kw) pairs, which are
+        queued before all remaining requests, or None.
+
+        If raise_errors is True (the default), a WikiError is raised
+        as soon as the API reports an error or warning. Otherwise such
+        results are passed to on_result like all others (see
+        get_response_error()).
+
+        A request that still fails after all retries (see
+        set_retry_policy()) raises a WikiError, unless on_error is given:
+        then on_error(tag, kw, error) is called with the WikiError
+        instead, and may return further jobs like on_result.
+
+        """
+        self._query_api_pipeline(jobs, on_result, raise_errors, on_error)
+
+    def get_response_error(self, result):
+        """Return the error or the warnings reported in a parsed API
+        result as a message, or None if there are none."""
+        if 'error' in result:
+            return unicode(result['error'].get('info'))
+        if 'warnings' in result:
+            return "\n".join(x['*'] for x in result['warnings'].values())
+        return None
 
     ### Name and namespace helper methods ###
 
+    def get_title_normalizer(self):
+        """Return the TitleNormalizer of the wiki, which implements the
+        methods of this section without going through the client. It is
+        replaced whenever the site information changes."""
+        normalizer = self._title_normalizer
+        if normalizer is None:
+            with self._info_lock:
+                self.request_siteinfo()
+                normalizer = self._title_normalizer
+        return normalizer
+
     def normalize_name(self, name):
         """Normalize a wiki page name."""
-        nsnumber, rest = self.split_name(name)
-        return self.combine_name(nsnumber, rest)
+        return self.get_title_normalizer().normalize_name(name)
+
+    def normalize_many(self, names):
+        """Normalize a sequence of wiki page names. Returns a list of the
+        normalized names, in the same order."""
+        return self.get_title_normalizer().normalize_many(names)
 
     def combine_name(self, ns, rest):
         """Concatenate a namespace name (or number) and rest of page name.
@@ -759,14 +1660,7 @@ class WikiClient(object):
         The article namespace (ns=0) is properly supported.
 
         """
-        # TODO: normalize special page names?
-        nsname = self.normalize_namespace(ns)
-        rest = rest.replace('_', ' ')
-        rest = rest[0:1].upper() + rest[1:]  # capitalize only first
-        if nsname:
-            return nsname + ':' + rest
-        else:
-            return rest
+        return self.get_title_normalizer().combine_name(ns, rest)
 
     def split_name(self, name):
         """Split a page name into namespace and rest of page name.
@@ -779,14 +1673,7 @@ class WikiClient(object):
         to be 0, aka the main namespace.
 
         """
-        parts = name.split(':', 1)
-        assert len(parts) >= 1
-        assert len(parts) <= 2
-        if len(parts) == 2:
-            nsnumber = self.namespace_to_number(parts[0], False)
-            if nsnumber is not None:
-                return (nsnumber, parts[1])
-        return (0, name)  # article namespace
+        return self.get_title_normalizer().split_name(name)
 
     def normalize_namespace(self, ns):
         """Normalize the namespace name or number ns.
@@ -795,12 +1682,7 @@ class WikiClient(object):
         canonical name for the namespace.
 
         """
-        self.request_siteinfo()
-        nsnumber = self.namespace_to_number(ns)
-        try:
-            return self._siteinfo_ns_normalized[nsnumber]
-        except(LookupError):
-            raise WikiError('No such namespace: ' + unicode(ns))
+        return self.get_title_normalizer().normalize_namespace(ns)
 
     def namespace_to_number(self, ns, raise_on_error=True):
         """Convert the namespace name or number ns to a namespace number.
@@ -815,205 +1697,224 @@ class WikiClient(object):
         Otherwise, returns None.
 
         """
-        self.request_siteinfo()
-        if ns in self._siteinfo_ns:  # also handles numeric ns arguments
-            return self._siteinfo_ns[ns]
-        else:
-            # assume ns is a string and normalize it
-            ns_normalized = unicode(ns).lower().replace('_', ' ')
-            if ns_normalized in self._siteinfo_ns:
-                return self._siteinfo_ns[ns_normalized]
-            elif raise_on_error:
-                raise WikiError('No such namespace: ' + unicode(ns))
-            else:
-                return None
+        return self.get_title_normalizer().namespace_to_number(ns, raise_on_error)
 
     def get_article_path(self, title):
         """Returns the path to the given article page (URL without
         protocol scheme, server and port)."""
-        self.request_siteinfo()
         title = self.normalize_name(title)
-        return self._siteinfo['general']['articlepath'].replace('$1', title)
+        return self._require_siteinfo()['general']['articlepath'].replace(
+                '$1', title)
 
     def get_article_url(self, title):
         """Returns the URL to the given article page."""
-        self.request_siteinfo()
-        return self._siteinfo['general']['server'] + self.get_article_path(title)
-
-    ### Internal methods (low-level query methods) ###
-
-    def _query_prefix_list(self, prefix, redirects=None, namespace=None):
-        """Query a list of pages with a given prefix.
-
-        prefix is the prefix of the page names that are to be searched.
-        Depending on how the namespace parameter is set, it includes the
-        namespace prefix, or it doesn't (see below).
+        return (self._require_siteinfo()['general']['server'] +
+                self.get_article_path(title))
 
-        redirects may be None, False or True. If redirects is None, the
-        query returns both redirects and non-redirects. If redirects is
-        False, the query returns only non-redirects. If redirects is True,
-        only redirects are returned. The default is None.
-
-        namespace defines which namespace is searched. The default is None,
-        which means the namespace is inferred from the prefix parameter.
-        Otherwise, the prefix parameter should not include a namespace prefix
-        and namespace may a namespace number or a namespace name (custom and
-        localized names are allowed, as well as namespace aliases).
+    ### Internal methods (site information and sessions) ###
 
-        Returns the API result. This method automatically resumes the query
-        if the result limit is exceeded.
+    def _require_siteinfo(self):
+        """Return the site information, requesting it first if needed."""
+        with self._info_lock:
+            self.request_siteinfo()
+            return self._siteinfo
+
+    def _require_edittoken(self):
+        """Return the edit token, requesting it first if needed."""
+        with self._info_lock:
+            self.request_edittoken()
+            return self._edittoken
+
+    def _require_userrights(self):
+        """Return the user rights, requesting them first if needed."""
+        with self._info_lock:
+            self.request_userrights()
+            return self._userrights
+
+    def _set_siteinfo(self, siteinfo):
+        """Set the site information from the 'query' part of a siteinfo
+        response, and build the TitleNormalizer from it."""
+        if not siteinfo['general']:
+            raise LookupError()
+        if not siteinfo['namespaces']:
+            raise LookupError()
+        if not siteinfo['namespacealiases']:
+            raise LookupError()
+        title_normalizer = TitleNormalizer(siteinfo)
+        self._siteinfo = siteinfo
+        self._title_normalizer = title_normalizer
+
+    def _resume_session(self, username):
+        """Try to resume the session of username from the session store.
+
+        Restores the stored cookies and site information, and checks with
+        a single request whether the session is still logged in. This
+        request also returns a fresh edit token, and some general site
+        information to check that the stored site information is still
+        current. Returns True if the session has been resumed.
 
         """
-        if namespace is None:
-            nsnumber, prefix = self.split_name(prefix)
-        else:
-            nsnumber = self.namespace_to_number(namespace)
-        kw = {'action':'query', 'list':'allpages',
-                'aplimit':'max', 'apprefix':prefix, 'apnamespace':nsnumber}
-        if redirects is not None:
-            if redirects:
-                kw['apfilterredir'] = 'redirects'
-            else:
-                kw['apfilterredir'] = 'nonredirects'
-        r_query = self._query_api(**kw)
+        stored = self._session_store.load(self._api, username)
+        if stored is None:
+            return False
+        self._engine.set_cookies(stored['cookies'])
         try:
-            # Continue query if result is incomplete.
-            while 'query-continue' in r_query:
-                kw['apfrom'] = r_query['query-continue']['allpages']['apfrom']
-                r_query2 = self._query_api(**kw)
-                r_query = self._merge_recursive(r_query, r_query2)
-            if r_query['query']['allpages'] is None:
-                raise LookupError()
-            return r_query
+            self._set_siteinfo(stored['siteinfo'])
+            mainpage = self._siteinfo['general']['mainpage']
         except(LookupError,TypeError):
-            raise WikiError('MediaWiki prefix query failed,' +
-                ' here is the full response: ' +
-                "\n" + pprint.pformat(r_query))
-
-    def _query_category_members(self, category, namespace=None, with_sortkey=False, with_timestamp=False):
-        """Query a list of pages in the given category.
-
-        category is the name of the category, with or without the
-        'Category:' namespace prefix.
-
-        namespace defines which namespaces are searched. The default is None,
-        which means that the results are not limited by namespace. Otherwise,
-        namespace may a namespace number or a namespace name (custom and
-        localized names are allowed, as well as namespace aliases), and
-        specifies which namespace the results should be limited to.
-
-        If with_sortkey is set to True, the results include the sort key
-        of each category member.
-
-        If with_timestamp is set to True, the time and date articles were
-        added to the category are included in the results.
-
-        Returns the API result. This method automatically resumes the query
-        if the result limit is exceeded.
-
-        Precondition: request_siteinfo() must have been called before.
-
-        """
-        nsnumber, rest = self.split_name(category)
-        if nsnumber == self.namespace_to_number(''):
-            # namespace prefix was omitted, prepend Category:
-            nsnumber = self.namespace_to_number('Category')
-        category = self.combine_name(nsnumber, rest)
-        kw = {'action':'query', 'list':'categorymembers',
-                'cmlimit':'max', 'cmtitle':category, 'cmprop':'ids|title'}
-        if namespace is not None:
-            kw['cmnamespace'] = self.namespace_to_number(namespace)
-        if with_sortkey:
-            kw['cmprop'] += '|sortkey'
-        if with_timestamp:
-            kw['cmprop'] += '|timestamp'
-
-        r_query = self._query_api(**kw)
+            self.clear_cached_info()
+            mainpage = 'Main Page'
+        r_session = self._query_api(action='query', meta='siteinfo|userinfo',
+                siprop='general', uiprop='rights', prop='info', intoken='edit',
+                titles=mainpage)
         try:
-            while 'query-continue' in r_query:
-                kw['cmcontinue'] = r_query['query-continue']['categorymembers']['cmcontinue']
-                r_query2 = self._query_api(**kw)
-                r_query = self._merge_recursive(r_query, r_query2)
-            if r_query['query']['categorymembers'] is None:
-                raise LookupError()
-            return r_query
+            userinfo = r_session['query']['userinfo']
+            general = r_session['query']['general']
+            userrights = frozenset(userinfo.get('rights', ()))
+            edittoken = unicode(
+                    r_session['query']['pages'].values()[0]['edittoken'])
         except(LookupError,TypeError):
-            raise WikiError('MediaWiki categorymembers query failed,' +
+            raise WikiError('MediaWiki session check failed,' +
                 ' here is the full response: ' +
-                "\n" + pprint.pformat(r_query))
+                "\n" + pprint.pformat(r_session))
+        if ('anon' in userinfo or
+                userinfo.get('name') != self._canonical_username(username)):
+            # the session has expired
+            self._engine.clear_cookies()
+            self._session_store.delete(self._api, username)
+            self.clear_cached_info()
+            return False
+        if self._siteinfo is not None:
+            stored_general = self._siteinfo['general']
+            for key in ('generator', 'sitename', 'mainpage', 'base', 'lang'):
+                if stored_general.get(key) != general.get(key):
+                    # the wiki has changed, request_siteinfo() will refresh it
+                    self.clear_cached_info()
+                    break
+        self._userrights = userrights
+        self._edittoken = edittoken
+        self._logged_in = True
+        self._session_user = username
+        return True
 
-    def _query_all_categories(self, prefix=None):
-        """Query all categories.
+    def _save_session(self):
+        """Save the current session in the session store."""
+        if self._session_store is None or self._session_user is None:
+            return
+        self._session_store.save(self._api, self._session_user,
+                self._siteinfo, self._edittoken, self._engine.get_cookies())
 
-        prefix is an optional title prefix, with or without the
-        'Category:' namespace prefix.
+    def _canonical_username(self, username):
+        name = ' '.join(username.replace('_', ' ').split())
+        return name[:1].upper() + name[1:]
 
-        The exact criteria for a category to be included in the result
-        are documented at get_all_categories().
+    ### Internal methods (low-level query methods) ###
 
-        Returns the API result. This method automatically resumes the query
-        if the result limit is exceeded. This method performs a list
-        query (as opposed to a generator query).
+    def _query_continued(self, kw, module, result_key, what, generator=False):
+        """Perform a query and automatically resume it until it is complete.
 
-        Precondition: request_siteinfo() must have been called before.
+        kw contains the arguments of the first request (see _query_api()).
+        module is the name of the query module whose entry in
+        'query-continue' holds the continuation parameters, and
+        result_key is the key in the 'query' part of the result that
+        holds the entries. what names the query in error messages.
 
-        """
-        kw = {'action':'query', 'list':'allcategories', 'aclimit':'max'}
-        if prefix:
-            nsnumber, rest = self.split_name(prefix)
-            if nsnumber != self.namespace_to_number('') and nsnumber != self.namespace_to_number('Category'):
-                raise WikiError('AllCategories prefix is in incorrect namespace')
-            kw['acprefix'] = rest
-        r_query = self._query_api(**kw)
-        try:
-            while 'query-continue' in r_query:
-                kw['acfrom'] = r_query['query-continue']['allcategories']['acfrom']
-                r_query2 = self._query_api(**kw)
-                r_query = self._merge_recursive(r_query, r_query2)
-            if r_query['query']['allcategories'] is None:
-                raise LookupError()
-            return r_query
-        except(LookupError,TypeError):
-            raise WikiError('MediaWiki allcategories query failed,' +
-                ' here is the full response: ' +
-                "\n" + pprint.pformat(r_query))
+        Set generator to True for generator queries; these return no
+        'query' part at all if there are no results.
 
-    def _query_all_categories_info(self, prefix=None):
-        """Query all categories with info.
+        This is a generator. It yields a list of entries for each
+        response, as soon as the response arrives. (If the entries are
+        returned as a dict, as with generator queries, the list of its
+        values is yielded.) With incremental decoding (see
+        set_incremental_decoding()), the entries of a response are
+        yielded in several lists, as they arrive.
 
-        prefix is an optional title prefix, with or without the
-        'Category:' namespace prefix.
+        """
+        kw = dict(kw)
+        while True:
+            stream = None
+            if self._incremental_decoding:
+                stream = JsonStream(('query', result_key))
+                for entries in self._query_api_stream(stream, kw):
+                    yield entries
+                r_query = stream.get_document()
+            else:
+                r_query = self._query_api(**kw)
+            try:
+                if generator and 'query' not in r_query:
+                    result = []
+                else:
+                    result = r_query['query'][result_key]
+                if result is None:
+                    raise LookupError()
+                if isinstance(result, dict):
+                    result = result.values()
+                if 'query-continue' in r_query:
+                    kw.update(r_query['query-continue'][module])
+            except(LookupError,TypeError):
+                raise WikiError('MediaWiki ' + what + ' query failed,' +
+                    ' here is the full response: ' +
+                    "\n" + pprint.pformat(r_query))
+            if stream is None:
+                yield result
+            if 'query-continue' not in r_query:
+                break
+
+    def _query_generator(self, kw, module, limit_param, prop, what):
+        """Perform a generator query with page properties.
 
-        The exact criteria for a category to be included in the result
-        are documented at get_all_categories().
+        kw contains the generator arguments (see _query_api()). module is
+        the name of the generator module and limit_param the name of its
+        limit parameter. prop is the list of page properties to get; if
+        it is None, ('info', 'revisions', 'categories') is used. what
+        names the query in error messages.
 
-        Returns the API result. This method automatically resumes the query
-        if the result limit is exceeded. This method performs a generator
-        query (as opposed to a list query).
+        Continuations of the page properties (for example, of long
+        category lists) are followed before the generator is advanced,
+        so each batch is complete when it is yielded.
 
-        Precondition: request_siteinfo() must have been called before.
+        This is a generator that yields the list of page records of each
+        batch. If the page cache is enabled and prop contains info,
+        revisions and categories, the pages are also stored in the cache.
 
         """
-        kw = {'action':'query', 'generator':'allcategories',
-                'gaclimit':'max', 'prop':'categoryinfo'}
-        if prefix:
-            nsnumber, rest = self.split_name(prefix)
-            if nsnumber != self.namespace_to_number('') and nsnumber != self.namespace_to_number('Category'):
-                raise WikiError('AllCategories prefix is in incorrect namespace')
-            kw['gacprefix'] = rest
-        r_query = self._query_api(**kw)
-        try:
-            while 'query-continue' in r_query:
-                kw['gacfrom'] = r_query['query-continue']['allcategories']['gacfrom']
-                r_query2 = self._query_api(**kw)
-                r_query = self._merge_recursive(r_query, r_query2)
-            if r_query['query']['pages'] is None:  # FIXME is this an error?
-                raise LookupError()
-            return r_query
-        except(LookupError,TypeError):
-            raise WikiError('MediaWiki allcategories query failed,' +
-                ' here is the full response: ' +
-                "\n" + pprint.pformat(r_query))
+        if prop is None:
+            prop = ('info', 'revisions', 'categories')
+        kw = dict(kw)
+        kw.update(self._page_prop_kw(prop))
+        kw['action'] = 'query'
+        # page content can only be requested for 50 pages at a time
+        kw[limit_param] = 50 if 'revisions' in prop else 'max'
+        store = (self._page_cache is not None and 'info' in prop and
+                'revisions' in prop and 'categories' in prop)
+        while True:
+            results = []
+            generator_continue = None
+            kw_batch = dict(kw)
+            while True:
+                r_query = self._query_api(**kw_batch)
+                try:
+                    query_continue = dict(r_query.get('query-continue', {}))
+                    if module in query_continue:
+                        generator_continue = query_continue.pop(module)
+                    if 'query' in r_query:
+                        results.append(r_query)
+                    kw_batch = dict(kw)
+                    for params in query_continue.values():
+                        kw_batch.update(params)
+                except(LookupError,TypeError,AttributeError):
+                    raise WikiError('MediaWiki ' + what + ' query failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_query))
+                if not query_continue:
+                    break
+            batch = self._merge_page_results(results)
+            if store:
+                self._page_cache.store(self._api, batch)
+            yield batch
+            if generator_continue is None:
+                break
+            kw.update(generator_continue)
 
     def _query_entries(self, ids_or_titles, using_titles, prop):
         """Retrieve page data given a list of page IDs or page titles.
@@ -1029,60 +1930,258 @@ class WikiClient(object):
         prop is the list of properties to get (as a python list).
         The only property for which automatic continuation of the query
         is supported is "categories". If prop includes 'revisions',
-        rvprop=content is automatically set.
+        rvprop=content|timestamp is automatically set, and the page cache (see
+        set_page_cache()) is used if it is enabled. Pages taken from the
+        cache may contain more properties than requested.
+
+        Returns the list of page records (in no particular order). See
+        _iter_entries() for a version of this method that does not
+        collect all pages in memory.
+
+        """
+        result = []
+        for batch in self._iter_entries(ids_or_titles, using_titles, prop):
+            result.extend(batch)
+        return result
+
+    def _iter_entries(self, ids_or_titles, using_titles, prop):
+        """Like _query_entries(), but yield the page records chunk by chunk.
+
+        The pages are requested in chunks of 50. Up to
+        get_max_parallel_requests() chunks (including their continuation
+        queries) are in flight at the same time. This is a generator that
+        yields a list of page records for each chunk, in order.
+
+        """
+        if self._page_cache is not None and 'revisions' in prop:
+            return self._iter_entries_cached(ids_or_titles, using_titles, prop)
+        return self._iter_entries_uncached(ids_or_titles, using_titles, prop)
+
+    def _iter_entries_cached(self, ids_or_titles, using_titles, prop):
+        """Like _iter_entries(), but use the page cache.
+
+        First the info properties of the pages are queried. Pages whose
+        last revision is in the cache are taken from there (with the
+        fresh info properties merged in), all others are downloaded with
+        properties info, revisions and categories and stored in the
+        cache.
 
-        Returns the API result.
+        Precondition: the page cache is enabled.
 
         """
+        window = []
+        for batch in self._iter_entries_uncached(ids_or_titles, using_titles, ('info',)):
+            window.append(batch)
+            if len(window) >= self.get_max_parallel_requests():
+                for batch in self._refresh_cached_entries(window, prop):
+                    yield batch
+                window = []
+        if window:
+            for batch in self._refresh_cached_entries(window, prop):
+                yield batch
+
+    def _refresh_cached_entries(self, info_batches, prop):
+        """Look up batches of page info records in the page cache,
+        download all pages that are not cached, and return the list of
+        complete batches.
+
+        Cached pages whose revision is current, but whose 'touched'
+        timestamp is not, only get their info and categories queried
+        again, not their text.
+
+        """
+        batches = []
+        stale_ids = []
+        # pages whose text is current, but whose categories may not be
+        retouched = {}
+        for info_batch in info_batches:
+            batch = []
+            for page in info_batch:
+                if 'missing' in page or 'invalid' in page:
+                    batch.append(page)
+                    continue
+                cached = self._page_cache.lookup(self._api, page['pageid'],
+                        page['lastrevid'])
+                if cached is None:
+                    stale_ids.append(int(page['pageid']))
+                    batch.append(int(page['pageid']))
+                elif (('categories' in prop or 'info' in prop) and
+                        cached.get('touched') != page['touched']):
+                    retouched[int(page['pageid'])] = cached
+                    batch.append(int(page['pageid']))
+                else:
+                    cached.update(page)
+                    batch.append(cached)
+            batches.append(batch)
+        if stale_ids or retouched:
+            fresh = {}
+            # the categories may have changed through a template, or the
+            # page was imported from a dump (see DumpReader)
+            for page in self._query_entries_uncached(sorted(retouched), False,
+                    ('info', 'categories')):
+                cached = retouched.get(int(page.get('pageid', 0)))
+                if cached is None or 'missing' in page:
+                    continue
+                if int(page['lastrevid']) != int(cached['lastrevid']):
+                    # edited in the meantime
+                    stale_ids.append(int(page['pageid']))
+                    continue
+                cached.pop('categories', None)
+                cached.update(page)
+                fresh[int(page['pageid'])] = cached
+            for page in self._query_entries_uncached(stale_ids, False,
+                    ('info', 'revisions', 'categories')):
+                fresh[int(page['pageid'])] = page
+            self._page_cache.store(self._api, fresh.values())
+            batches = [[fresh.get(page, {'pageid': page, 'missing': ''})
+                        if isinstance(page, int) else page
+                        for page in batch] for batch in batches]
+        return batches
+
+    def _query_entries_uncached(self, ids_or_titles, using_titles, prop):
+        """Like _query_entries(), but never use the page cache."""
+        result = []
+        for batch in self._iter_entries_uncached(ids_or_titles, using_titles, prop):
+            result.extend(batch)
+        return result
+
+    def _iter_entries_uncached(self, ids_or_titles, using_titles, prop):
+        """Like _iter_entries(), but never use the page cache."""
         chunk_size = 50
-        r_total = {}
+        kw_list = []
         for chunk_pos in range(0, len(ids_or_titles), chunk_size):
             chunk = ids_or_titles[chunk_pos : chunk_pos + chunk_size]
             chunk_piped = '|'.join(unicode(x) for x in chunk)
-            kw = {'action':'query', 'prop':('|'.join(prop))}
-            if 'revisions' in prop:
-                kw['rvprop'] = 'content'
-            if 'categories' in prop:
-                kw['cllimit'] = 'max'
+            kw = self._page_prop_kw(prop)
+            kw['action'] = 'query'
             if using_titles:
                 kw['titles'] = chunk_piped
             else:
                 kw['pageids'] = chunk_piped
-            r_query = self._query_api(**kw)
+            kw_list.append(kw)
+
+        def continue_func(kw, r_query):
+            if 'query-continue' not in r_query:
+                return None
+            try:
+                kw = dict(kw)
+                kw.update(r_query['query-continue']['categories'])
+                return kw
+            except(LookupError,TypeError):
+                raise WikiError('MediaWiki pages query failed,' +
+                    ' here is the full response: ' +
+                    "\n" + pprint.pformat(r_query))
+
+        # Dispatch the chunks in windows, so that results can be yielded
+        # while later chunks have not been requested yet.
+        window_size = self.get_max_parallel_requests()
+        for window_pos in range(0, len(kw_list), window_size):
+            window = kw_list[window_pos : window_pos + window_size]
+            for chunk_results in self._query_api_multi(window, continue_func):
+                yield self._merge_page_results(chunk_results)
+
+    def _page_prop_kw(self, prop):
+        """Return the API arguments for querying the page properties prop."""
+        kw = {'prop':('|'.join(prop))}
+        if 'revisions' in prop:
+            kw['rvprop'] = 'content|timestamp'
+        if 'categories' in prop:
+            kw['cllimit'] = 'max'
+        return kw
+
+    def _merge_page_results(self, results):
+        """Merge the API results of a page query and its continuations.
+
+        Returns the list of page records. The categories of each page
+        are concatenated; all other properties are taken from the first
+        result that contains them.
+
+        """
+        pages = {}
+        for r_query in results:
             try:
-                while 'query-continue' in r_query:
-                    kw['clcontinue'] = r_query['query-continue']['categories']['clcontinue']
-                    r_query2 = self._query_api(**kw)
-                    r_query = self._merge_recursive(r_query, r_query2)
                 if r_query['query']['pages'] is None:
                     raise LookupError()
-                # Hacky fix for a minor problem.
-                # If we had to repeat the query to get all categories,
-                # _merge_recursive concatenated the revisions list for each
-                # page (so we get the same result repeated n times, where n
-                # is the number of queries we had to do). _merge_recursive's
-                # concatenating behavior is good, since it allows us to
-                # combine the category lists from multiple queries. But it
-                # causes the stated problem with the revisions field.
-                for page in r_query['query']['pages'].values():
-                    if 'missing' not in page:
-                        page['revisions'] = page['revisions'][0:1]
-                # Combine all query results into a total result.
-                r_total = self._merge_recursive(r_total, r_query)
+                for key, page in r_query['query']['pages'].items():
+                    if key not in pages:
+                        pages[key] = page
+                        continue
+                    for name, value in page.items():
+                        if name == 'categories':
+                            pages[key].setdefault('categories', []).extend(value)
+                        elif name not in pages[key]:
+                            pages[key][name] = value
             except(LookupError,TypeError):
                 raise WikiError('MediaWiki pages query failed,' +
                     ' here is the full response: ' +
                     "\n" + pprint.pformat(r_query))
-        return r_total
+        return pages.values()
+
+    def _edit_kw(self, title, text, summary, minor, bot, token,
+            basetimestamp=None, starttimestamp=None, createonly=False):
+        """Return the API arguments for an edit (see edit())."""
+        text = unicode(text)
+        md5 = hashlib.md5(self._to_utf8(text)).hexdigest()
+        kw = {'action':'edit', 'title':title, 'text':text, 'md5':md5,
+                'summary':summary, 'token':token, 'minor':bool(minor),
+                'bot':bool(bot), 'watchlist':'nochange',
+                'basetimestamp':basetimestamp,
+                'starttimestamp':starttimestamp}
+        if createonly:
+            kw['createonly'] = True
+        return kw
+
+    def _add_purge_results(self, report, titles, r_purge):
+        """Record the result of purging a chunk of titles in a PurgeReport."""
+        if 'error' in r_purge:
+            message = unicode(r_purge['error'].get('info'))
+            for title in titles:
+                report.add(title, 'failed', message=message)
+            return
+        # map the titles in the result to the requested ones; several of
+        # them may be normalized or redirected to the same page
+        requested = dict((title, [title]) for title in titles)
+        try:
+            for entry in (r_purge.get('normalized', []) +
+                    r_purge.get('redirects', [])):
+                requested.setdefault(entry['to'], []).extend(
+                        requested.pop(entry['from'], []))
+            for entry in r_purge['purge']:
+                for title in requested.get(entry['title'], [entry['title']]):
+                    self._add_purge_result(report, title, entry)
+        except(LookupError,TypeError):
+            raise WikiError('MediaWiki purge request failed,' +
+                ' here is the full response: ' +
+                "\n" + pprint.pformat(r_purge))
+        # e.g. if the API ignored titles beyond its limit
+        warnings = [x['*'] for x in r_purge.get('warnings', {}).values()]
+        message = '\n'.join(warnings) or 'No result from the API'
+        for title in titles:
+            if report.get_status(title) is None:
+                report.add(title, 'failed', message=message)
+
+    def _add_purge_result(self, report, title, entry):
+        """Record the result of purging a requested title in a PurgeReport.
+        entry is the entry of the page in the API result."""
+        if 'invalid' in entry:
+            report.add(title, 'invalid', message=unicode(
+                    entry.get('invalidreason', 'Invalid title')))
+        elif 'missing' in entry:
+            report.add(title, 'missing', entry['title'])
+        elif 'purged' in entry:
+            report.add(title, 'purged', entry['title'],
+                    linkupdate=('linkupdate' in entry))
+        else:
+            report.add(title, 'failed', entry['title'], 'Not purged')
 
     def _query_expandtemplates(self, **kw):
         kw['action'] = 'expandtemplates'
         if 'page' in kw and kw['page'] is not None:
             # the 'page' parameter is not supported by action=expandtemplates;
             # fake it
-            api_result = self._query_entries((kw['page'],), True, ('revisions',))
+            pages = self._query_entries((kw['page'],), True, ('revisions',))
             try:
-                kw['text'] = api_result['query']['pages'].values()[0]['revisions'][0]['*']
+                kw['text'] = pages[0]['revisions'][0]['*']
                 kw['title'] = kw['page']
                 del kw['page']
             except(LookupError):
@@ -1101,6 +2200,196 @@ class WikiClient(object):
         except(LookupError):
             raise WikiError('MediaWiki parse query returned no data.')
 
+    def _query_ask(self, query, limit):
+        """Perform an SMW ask query and follow its offset continuation.
+
+        This is a generator. For each response, it yields a dict that
+        maps the printout labels to their SMW types, and the list of
+        (title, result) pairs of the rows.
+
+        """
+        offset = 0
+        while limit is None or offset < limit:
+            batch_size = ASK_BATCH_SIZE
+            if limit is not None:
+                batch_size = min(batch_size, limit - offset)
+            kw = {'action':'ask', 'api_version':3, 'query':query +
+                    '|limit=' + unicode(batch_size) + '|offset=' + unicode(offset)}
+            r_ask = self.query_api(kw, False)
+            # SMW before 3.0 warns about the unknown api_version
+            r_ask.get('warnings', {}).pop('main', None)
+            if not r_ask.get('warnings'):
+                r_ask.pop('warnings', None)
+            self._check_response_errors(r_ask)
+            try:
+                typeids = dict((printrequest['label'], printrequest['typeid'])
+                        for printrequest in r_ask['query']['printrequests'])
+                results = r_ask['query']['results']
+                if isinstance(results, dict):
+                    batch = sorted(results.items())
+                else:
+                    # SMW 3 keeps the order in a list of single-row dicts
+                    batch = [row.items()[0] for row in results]
+                next_offset = r_ask.get('query-continue-offset')
+                if next_offset is not None:
+                    next_offset = int(next_offset)
+            except(LookupError,TypeError,AttributeError,ValueError):
+                raise WikiError('MediaWiki ask query failed,' +
+                    ' here is the full response: ' +
+                    "\n" + pprint.pformat(r_ask))
+            yield (typeids, batch)
+            if next_offset is None or next_offset <= offset:
+                break
+            offset = next_offset
+
+    ### Internal methods (parse cache) ###
+
+    def _get_recent_last_change(self):
+        """Return get_last_change(), reusing the result of an earlier
+        call for LAST_CHANGE_MAX_AGE seconds unless this client has sent
+        a write request since."""
+        now = time.time()
+        cached = self._last_change
+        if cached is not None and now - cached[0] < LAST_CHANGE_MAX_AGE:
+            return cached[1]
+        last_change = self.get_last_change()
+        self._last_change = (now, last_change)
+        return last_change
+
+    def _cached_parse(self, key, compute, templates=None):
+        """Return the result with the given key from the parse cache if it
+        is still valid, or compute and cache it.
+
+        compute() returns (result, templates), where templates is the list
+        of titles of the templates the result depends on, or None if they
+        are given as templates instead.
+
+        """
+        cached = self._parse_cache.lookup(self._api, key)
+        if cached is not None:
+            result, revids = cached
+            current = self._template_revids(revids)[0]
+            changed = [template for template, revid in revids.items()
+                    if current.get(template, 0) != revid]
+            if not changed:
+                return result
+            self._parse_cache.invalidate_templates(self._api, changed)
+        if templates is not None:
+            # get the revision IDs first, so that a template edited while
+            # computing the result makes the cached result invalid
+            revids = self._template_dependencies(templates)
+            result = compute()[0]
+        else:
+            result, templates = compute()
+            revids = self._template_dependencies(templates)
+        self._parse_cache.store(self._api, key, result, revids)
+        return result
+
+    def _query_parse_templates(self, prop, **kw):
+        """Same as _query_parse(), but also returns the titles of the
+        templates used, see _cached_parse()."""
+        props = None
+        if prop is not None:
+            props = prop.split('|')
+            if 'templates' not in props:
+                prop += '|templates'
+        result = self._query_parse(prop=prop, **kw)
+        templates = [template['*'] for template in result.get('templates', ())]
+        if props is not None and 'templates' not in props:
+            del result['templates']
+        return (result, templates)
+
+    def _page_templates(self, page):
+        """Return (title, lastrevid, templates) for a page, where templates
+        are the titles of all templates the page uses."""
+        kw = {'action':'query', 'titles':page, 'prop':'info|templates',
+                'tllimit':'max'}
+        templates = []
+        while True:
+            r_page = self._query_api(**kw)
+            try:
+                entry = r_page['query']['pages'].values()[0]
+            except(LookupError,TypeError,AttributeError):
+                raise WikiError('MediaWiki templates request failed,' +
+                    ' here is the full response: ' +
+                    "\n" + pprint.pformat(r_page))
+            if 'missing' in entry or 'invalid' in entry:
+                raise WikiError('The page you specified does not exist.')
+            templates.extend(template['title']
+                    for template in entry.get('templates', ()))
+            try:
+                kw.update(r_page['query-continue']['templates'])
+            except(LookupError,TypeError):
+                return (entry['title'], entry['lastrevid'], templates)
+
+    def _text_templates(self, text):
+        """Return the titles of the templates that are called by name in
+        wikitext."""
+        templates = set()
+        for name in _TEMPLATE_CALL.findall(_COMMENT.sub('', text)):
+            name = name.strip()
+            if not name or name.startswith('#'):
+                # parser function
+                continue
+            if name.startswith(':'):
+                templates.add(name[1:])
+            elif self.split_name(name)[0] != 0:
+                templates.add(name)
+            else:
+                templates.add(self.combine_name(10, name))
+        return sorted(templates)
+
+    def _template_dependencies(self, templates):
+        """Return a dict that maps the titles of the given templates and
+        of all templates they use to their revision IDs (0 for missing
+        templates)."""
+        revids = {}
+        queried = set()
+        pending = set(templates)
+        while pending:
+            found, used = self._template_revids(pending)
+            revids.update(found)
+            queried.update(pending)
+            # the keys of revids are the titles normalized by the API
+            pending = used.difference(revids, queried)
+        return revids
+
+    def _template_revids(self, templates):
+        """Return the revision IDs of the given templates (as a dict, 0 for
+        missing templates) and the set of titles of the templates they
+        use."""
+        templates = sorted(templates)
+        kw_list = []
+        for chunk_pos in range(0, len(templates), 50):
+            kw_list.append({'action':'query', 'prop':'info|templates',
+                    'tllimit':'max',
+                    'titles':'|'.join(templates[chunk_pos : chunk_pos + 50])})
+
+        def continue_func(kw, r_query):
+            try:
+                next_kw = dict(kw)
+                next_kw.update(r_query['query-continue']['templates'])
+                return next_kw
+            except(LookupError,TypeError):
+                return None
+
+        revids = {}
+        used = set()
+        for results in self._query_api_multi(kw_list, continue_func):
+            for r_query in results:
+                try:
+                    for entry in r_query['query']['pages'].values():
+                        if 'invalid' in entry:
+                            continue
+                        revids[entry['title']] = int(entry.get('lastrevid', 0))
+                        used.update(template['title'] for template in
+                                entry.get('templates', ()))
+                except(LookupError,TypeError,AttributeError):
+                    raise WikiError('MediaWiki templates request failed,' +
+                        ' here is the full response: ' +
+                        "\n" + pprint.pformat(r_query))
+        return (revids, used)
+
     ### Internal methods (direct MediaWiki API access) ###
 
     def _query_api(self, **kw):
@@ -1111,6 +2400,12 @@ class WikiClient(object):
         is ignored and always set to 'json'. Finally, the JSON returned
         by the server is parsed with simplejson and then returned.
 
+        The request is sent when the request scheduler allows it (see
+        set_request_scheduler()), and is automatically repeated if the
+        server reports replication lag (maxlag) or asks to retry later,
+        or if it fails transiently and the retry policy allows to send
+        it again (see set_retry_policy()).
+
         For example, to get the first 500 page titles:
             wc._query_api(action='query', list='allpages', aplimit=500)
 
@@ -1120,11 +2415,14 @@ class WikiClient(object):
         Argument values may be tuples (instead of strings or integers
         as in the above example). In that case, the tuple must contain
         three elements: (value, is_file, contenttype)
-        value:        The file name (if is_file is 'file') or value (if
-                      is_file is 'string'). Need not be a string if is_file
-                      is 'string', as it is passed through unicode() first.
+        value:        The file name (if is_file is 'file'), the file
+                      content as a byte string (if is_file is 'buffer')
+                      or value (if is_file is 'string'). Need not be a
+                      string if is_file is 'string', as it is passed
+                      through unicode() first.
         is_file:      Whether value is the name of a file to be uploaded
-                      ('file') or should be passed as-is ('string').
+                      ('file'), the content of a file to be uploaded
+                      ('buffer') or should be passed as-is ('string').
         contenttype:  The MIME type. This may be set to None if not needed.
         Non-tuple argument values are equivalent to (value, 'string', None).
 
@@ -1136,6 +2434,157 @@ class WikiClient(object):
 
         """
 
+        deadline = None
+        attempt = 1
+        delay = 0
+        while True:
+            request = self._make_request(kw, None, deadline, delay,
+                    self._make_sink())
+            self._engine.perform(request)
+            if attempt == 1:
+                deadline = self._call_deadline(request)
+            delay = self._retry_delay(request, kw, attempt, deadline)
+            if delay is None:
+                return self._handle_response(request)
+            attempt += 1
+
+    def _query_api_stream(self, stream, kw):
+        """Perform a raw MediaWiki API request and decode the response
+        incrementally.
+
+        kw are the arguments of the request (see _query_api()), stream
+        is the JsonStream that decodes the response. This is a generator
+        that yields the list of entries taken from the stream (see
+        JsonStream.pop_entries()) whenever part of the response has
+        arrived. Once it is exhausted, the rest of the response can be
+        obtained with stream.get_document(). Errors are handled as in
+        _query_api(), except that a request is not sent again after
+        entries have been yielded.
+
+        """
+        deadline = None
+        attempt = 1
+        delay = 0
+        yielded = False
+        while True:
+            stream.reset()
+            request = self._make_request(dict(kw), None, deadline, delay,
+                    stream)
+            for step in self._engine.perform_iter(request):
+                entries = stream.pop_entries()
+                if entries:
+                    yielded = True
+                    yield entries
+            if attempt == 1:
+                deadline = self._call_deadline(request)
+            delay = self._retry_delay(request, kw, attempt, deadline)
+            if delay is None:
+                break
+            if yielded:
+                raise WikiError('Error while accessing ' + self._api + ': ' +
+                        (request.error or 'HTTP ' +
+                        unicode(request.response_code)) + ', not sending ' +
+                        request.label + ' request again after part of ' +
+                        'its response has been processed')
+            attempt += 1
+        self._handle_response(request)
+        entries = stream.pop_entries()
+        if entries:
+            yield entries
+
+    def _query_api_multi(self, kw_list, continue_func=None):
+        """Perform several raw MediaWiki API requests concurrently.
+
+        kw_list is a sequence of dicts, each of which contains the
+        keyword arguments of one request (see _query_api()). Up to
+        get_max_parallel_requests() requests are in flight at once.
+
+        continue_func, if given, is called as continue_func(kw, result)
+        whenever a request has completed, where kw is the dict of
+        arguments of the completed request and result is the parsed API
+        result. It may return the arguments of a follow-up request (for
+        example, a copy of kw with updated continuation parameters), or
+        None if there is nothing to follow up.
+
+        Returns a list with one entry per element of kw_list, in the
+        same order. Each entry is the list of API results of that
+        request, followed by the results of its follow-up requests.
+
+        """
+        results = [[] for kw in kw_list]
+
+        def on_result(index, kw, result):
+            results[index].append(result)
+            if continue_func is not None:
+                next_kw = continue_func(kw, result)
+                if next_kw is not None:
+                    return [(index, next_kw)]
+            return None
+
+        self._query_api_pipeline(list(enumerate(kw_list)), on_result)
+        return results
+
+    def _query_api_pipeline(self, jobs, on_result, raise_errors=True,
+            on_error=None):
+        """Perform raw MediaWiki API requests concurrently, where each
+        result may cause further requests.
+
+        kw in jobs are the keyword arguments of _query_api(), the other
+        arguments are as in query_pipeline().
+
+        Each request (with its retries, but not its follow-ups) has its
+        own deadline, which starts when the request is first sent (see
+        _call_deadline()).
+
+        """
+        def make_requests(tag, kw, attempt, deadline, delay=0):
+            """Return the request of a job in a list, or the requests of
+            the jobs returned by on_error if it cannot be sent."""
+            try:
+                kw = dict(kw)
+                return [self._make_request(kw, (tag, kw, attempt, deadline),
+                        deadline, delay, self._make_sink())]
+            except(WikiError) as err:
+                if on_error is None:
+                    raise
+                return start_jobs(on_error(tag, kw, err))
+
+        def start_jobs(jobs):
+            requests = []
+            for tag, kw in jobs or ():
+                requests.extend(make_requests(tag, kw, 1, None))
+            return requests
+
+        def on_complete(request):
+            tag, kw, attempt, deadline = request.tag
+            if attempt == 1:
+                deadline = self._call_deadline(request)
+            delay = self._retry_delay(request, kw, attempt, deadline)
+            if delay is not None:
+                return make_requests(tag, kw, attempt + 1, deadline, delay)
+            try:
+                result = self._handle_response(request, raise_errors)
+            except(WikiError) as err:
+                if on_error is None:
+                    raise
+                return start_jobs(on_error(tag, kw, err))
+            return start_jobs(on_result(tag, kw, result))
+
+        self._engine.perform_multi(start_jobs(jobs), on_complete)
+
+    def _make_request(self, kw, tag=None, deadline=None, delay=0, sink=None):
+        """Convert API arguments (see _query_api()) to a CurlRequest.
+
+        deadline is the time (in seconds since the epoch) by which the
+        API call must be done (see _call_deadline()), or None if it has
+        no deadline or the request is the first of the call. The request
+        is not sent before delay seconds have passed. sink is the
+        JsonStream that decodes the response, or None. Raises a WikiError
+        if the circuit breaker would hold the request back beyond the
+        deadline, or if delay would already take it there.
+
+        """
+
         # pycurl expects form contents in the following format:
         # [(argname, (pycurl.FORM_xxx, value, pycurl.FORM_xxx, value, ...)),
         #  (argname, (pycurl.FORM_xxx, value, pycurl.FORM_xxx, value, ...)),
@@ -1143,11 +2592,32 @@ class WikiClient(object):
         # This method does not support pycurl.FORM_FILENAME.
         # Note that pycurl currently (May 2011) doesn't support unicode.
         kw['format'] = 'json'
-        if __debug__:
-            print("Request:")
-            pprint.pprint(kw)
-            print()
+        self._scheduler.prepare(kw)
+        if self._scheduler.request_kind(kw) == 'write':
+            # the wiki changes, see _get_recent_last_change()
+            self._last_change = None
+        label = self._request_label(kw)
+        now = time.time()
+        if deadline is None:
+            # the first request of a call: do not wait for the circuit
+            # breaker longer than the whole call may take
+            deadline = self._retry_policy.make_deadline(now)
+        if deadline is not None:
+            breaker_wait = self._circuit_breaker.get_wait(now)
+            if breaker_wait > 0 and now + breaker_wait >= deadline:
+                raise WikiError('Error while accessing ' + self._api + ': ' +
+                        'the wiki keeps failing, not sending ' + label +
+                        ' request (circuit breaker is open)')
+            if now + delay >= deadline:
+                raise WikiError('Error while accessing ' + self._api + ': ' +
+                        'not sending ' + label + ' request, the deadline of ' +
+                        'the API call has passed')
+        trace_id = self._tracer.new_trace_id(DEBUG)
+        if trace_id is not None:
+            self._tracer.debug('wikiclient.request', label,
+                    self._trace_params(kw), trace_id)
         form = []
+        upload_size = 0
         for argname in sorted(kw):
             argvalue = kw[argname]
             argname = unicode(argname)
@@ -1168,53 +2638,237 @@ class WikiClient(object):
             value, is_file, contenttype = argvalue
             if isinstance(value, bool):
                 value = unicode(value).lower()
-            if is_file != 'file' and is_file != 'string':
+            if is_file not in ('file', 'buffer', 'string'):
                 raise ValueError('second entry of keyword argument must be' +
-                                 '\'file\' or \'string\': ' + unicode(is_file))
+                                 '\'file\', \'buffer\' or \'string\': ' +
+                                 unicode(is_file))
             if is_file == 'file':
                 formfield = [pycurl.FORM_FILE, self._to_utf8(value)]
+                upload_size += os.path.getsize(value)
+            elif is_file == 'buffer':
+                formfield = [pycurl.FORM_BUFFER, self._to_utf8(argname),
+                        pycurl.FORM_BUFFERPTR, bytes(value)]
+                upload_size += len(value)
             else:
                 formfield = [pycurl.FORM_CONTENTS, self._to_utf8(value)]
             if contenttype is not None:
                 formfield += [pycurl.FORM_CONTENTTYPE, self._to_utf8(contenttype)]
             form.append((self._to_utf8(argname), tuple(formfield)))
 
-        buffer = io.BytesIO()
-        self._curl.setopt(pycurl.URL, self._to_utf8(self._api))
-        self._curl.setopt(pycurl.HTTPPOST, form)
-        self._curl.setopt(pycurl.WRITEFUNCTION, buffer.write)
+        return CurlRequest(self._api, form, tag,
+                self._scheduler.request_kind(kw), now + delay, label, trace_id,
+                self._retry_policy.request_timeout(deadline, now,
+                upload_size), sink)
+
+    def _make_sink(self):
+        """Return a JsonStream for decoding a response if incremental
+        decoding is enabled, or else None."""
+        if not self._incremental_decoding:
+            return None
+        # parse the entries of the query modules (e.g. pages) one by one
+        return JsonStream(depth=2)
+
+    def _request_label(self, kw):
+        """Return the label of a request (see CurlRequest), that is, the
+        action and the query module separated by a slash."""
+        action = unicode(kw.get('action', ''))
+        if action != 'query':
+            return action
+        for param in ('list', 'generator', 'prop', 'meta'):
+            if kw.get(param):
+                return action + '/' + unicode(kw[param])
+        return action
+
+    def _trace_params(self, kw):
+        """Return a copy of API arguments that is safe to trace."""
+        params = {}
+        for name, value in kw.items():
+            if value is None:
+                continue
+            if name in SECRET_PARAMS:
+                value = '***'
+            elif isinstance(value, (list, tuple)):
+                value = list(value)
+                if len(value) > 1 and value[1] == 'buffer':
+                    value[0] = '(' + unicode(len(value[0])) + ' bytes)'
+            params[name] = value
+        return params
+
+    def _throttle(self, kind):
+        """Decide when a request may be sent (see CurlEngine.set_throttle())."""
+        delay = self._circuit_breaker.get_wait()
+        if delay > 0:
+            return delay
+        delay = self._scheduler.reserve(kind)
+        if delay > 0:
+            return delay
+        delay = self._circuit_breaker.reserve()
+        if delay > 0:
+            # e.g. another request is probing the wiki
+            self._scheduler.release(kind)
+        return delay
+
+    def _call_deadline(self, request):
+        """Return the deadline (in seconds since the epoch) of an API call
+        whose first request is the completed CurlRequest request, or None.
+
+        The time of a call starts when its first request is handed to
+        libcurl, so that the time it waits for the request scheduler (for
+        example, behind many other edits) does not count.
+
+        """
+        started = request.started
+        if started is None:
+            started = time.time()
+        return self._retry_policy.make_deadline(started)
 
+    def _retry_delay(self, request, kw, attempt, deadline):
+        """Check whether a completed request must be sent again.
+
+        kw are the API arguments of the request, attempt is the number
+        of times it has been sent and deadline the deadline of the call.
+        Returns None if the request is done, or else the number of
+        seconds to wait before it is sent again.
+
+        """
+        if self._retry_policy.is_transient(request):
+            self._circuit_breaker.record_failure()
+        else:
+            self._circuit_breaker.record_success()
+        if self._should_retry(request, attempt, deadline):
+            # the scheduler holds back all requests
+            return 0
+        delay = self._retry_policy.retry_delay(request, kw, attempt, deadline)
+        if delay is None:
+            return None
+        if self._metrics is not None:
+            action, sep, module = (request.label or '').partition('/')
+            self._metrics.record_retry(action, module, request.timings)
+        if request.trace_id is not None:
+            self._tracer.info('wikiclient.retry', (request.error or 'HTTP ' +
+                    unicode(request.response_code)) + ', attempt ' +
+                    unicode(attempt) + ', retrying in ' +
+                    unicode(round(delay, 3)) + 's', None, request.trace_id)
+        return delay
+
+    def _should_retry(self, request, attempt, deadline=None):
+        """Check whether a completed request must be sent again because
+        the server is lagged or overloaded (see RequestScheduler).
+
+        attempt is the number of times the request has been sent. If the
+        request must be retried before the deadline, all requests are
+        held back as long as the scheduler says and True is returned.
+
+        """
+        if request.error is not None:
+            return False
+        headers = request.headers
+        if (request.response_code == 200 and 'retry-after' not in headers
+                and 'x-database-lag' not in headers):
+            return False
+        error = None
         try:
-            self._curl.perform()
-        except(pycurl.error) as err:
-            raise WikiError('Error while accessing ' + self._api + ': ' +
-                            self._curl.errstr())
+            error = self._parse_response(request)['error']
+        except(ValueError,LookupError,TypeError):
+            pass
+        delay = self._scheduler.retry_delay(request.response_code,
+                headers, error, attempt)
+        if delay is None:
+            return False
+        if deadline is not None and time.time() + delay >= deadline:
+            return False
+        if self._metrics is not None:
+            action, sep, module = (request.label or '').partition('/')
+            self._metrics.record_retry(action, module, request.timings)
+        if request.trace_id is not None:
+            self._tracer.info('wikiclient.retry', 'HTTP ' +
+                    unicode(request.response_code) + ', attempt ' +
+                    unicode(attempt) + ', retrying in ' + unicode(delay) + 's',
+                    error, request.trace_id)
+        self._scheduler.backoff(delay)
+        return True
+
+    def _handle_response(self, request, raise_errors=True):
+        """Check and parse the response to a completed CurlRequest.
+
+        If raise_errors is False, errors and warnings reported by the API
+        are not raised but returned as part of the result.
 
-        response_code = self._curl.getinfo(pycurl.RESPONSE_CODE)
+        """
+        if request.error is not None:
+            if request.trace_id is not None:
+                self._tracer.debug('wikiclient.response', request.error,
+                        None, request.trace_id)
+            raise WikiError(request.error)
+        response_code = request.response_code
         if not (response_code >= 200 and response_code <= 299):
+            if request.trace_id is not None:
+                body = request.body
+                if request.sink is not None:
+                    body = request.sink.get_head()
+                self._tracer.debug('wikiclient.response', 'HTTP ' +
+                        unicode(response_code), body, request.trace_id)
             raise WikiError('Error while accessing ' + self._api + ': ' +
                             "Response was HTTP " + unicode(response_code))
 
-        response_uni = buffer.getvalue().decode('utf-8')
+        decode_started = time.time()
         try:
-            response_parsed = json.loads(response_uni)
+            response_parsed = self._parse_response(request)
         except(ValueError) as err:
+            if request.sink is not None:
+                response_uni = request.sink.get_head()
+            else:
+                response_uni = request.body.decode('utf-8', 'replace')
             raise WikiError('Error while accessing ' + self._api + ': ' +
                              unicode(err) + "\n\n" +
                              "Response was:\n" +
                              self._truncate_text(response_uni, 500))
-        if __debug__:
-            print("Result:")
-            pprint.pprint(response_parsed)
-            print()
+        decode_seconds = time.time() - decode_started
+        if request.sink is not None:
+            decode_seconds += request.sink.get_decode_seconds()
+        if self._metrics is not None:
+            self._record_metrics(request, response_parsed, decode_seconds)
+        if request.trace_id is not None:
+            self._tracer.debug('wikiclient.response', 'HTTP ' +
+                    unicode(response_code) + ', ' +
+                    unicode(self._response_size(request)) + ' bytes',
+                    response_parsed, request.trace_id)
+        if raise_errors:
+            self._check_response_errors(response_parsed)
+        return response_parsed
+
+    def _parse_response(self, request):
+        """Return the parsed JSON response of a completed CurlRequest.
+        Raises a ValueError if the response is not valid JSON."""
+        if request.sink is not None:
+            return request.sink.get_document()
+        return json.loads(request.body.decode('utf-8'))
+
+    def _response_size(self, request):
+        """Return the size of the body of a completed CurlRequest."""
+        if request.sink is not None:
+            return request.sink.get_bytes_written()
+        return len(request.body)
+
+    def _record_metrics(self, request, response_parsed, decode_seconds):
+        """Record a parsed response on the ClientMetrics."""
+        action, sep, module = (request.label or '').partition('/')
+        continued = 'query-continue' in response_parsed
+        error = None
         if 'error' in response_parsed:
+            error = response_parsed['error'].get('code', 'unknown')
+        self._metrics.record_request(action, module, request.timings,
+                request.request_bytes,
+                request.response_bytes or self._response_size(request),
+                decode_seconds, continued, error)
+
+    def _check_response_errors(self, response_parsed):
+        """Raise a WikiError if a parsed API response reports an error
+        or warnings."""
+        message = self.get_response_error(response_parsed)
+        if message is not None:
             raise WikiError('Error while accessing ' + self._api + ': ' +
-                    response_parsed['error']['info'])
-        if 'warnings' in response_parsed:
-            all_api_warnings = [x['*'] for x in response_parsed['warnings'].values()]
-            raise WikiError('Error while accessing ' + self._api + ': ' +
-                    "\n".join(all_api_warnings))
-        return response_parsed
+                    message)
 
     ### Utilities ###
 
@@ -1229,44 +2883,16 @@ class WikiClient(object):
         else:
             return text[0:(limit-3)] + '...'
 
-    def _merge_recursive(self, r1, r2, toplevel=True):
-        if isinstance(r1, dict) and isinstance(r2, dict):
-            r = {}
-            for key in r1:
-                # special case query-continue in the topmost level:
-                # it is always dropped from r1
-                if not toplevel or key != 'query-continue':
-                    r[key] = r1[key]
-            for key in r2:
-                if key in r:
-                    r[key] = self._merge_recursive(r[key], r2[key], False)
-                else:
-                    r[key] = r2[key]
-            return r
-        elif isinstance(r1, tuple) and isinstance(r2, tuple):
-            return r1+r2
-        elif isinstance(r1, list) and isinstance(r2, list):
-            return r1+r2
-        else:
-            return r2
-
-    # The following two methods are snipped from the eighth comment in
-    #   http://code.activestate.com/recipes/285264-natural-string-sorting/
-    # By Seo Sanghyeon.  Some changes by Connelly Barnes & Spondon Saha
-
-    def _try_int(self, s):
-        """Convert to integer if possible."""
-        try:
-            return int(s)
-        except:
-            return s
+    def _filter_redirects(self, pages, redirects):
+        """Filter a list of page records by their 'redirect' property.
 
-    def _natsort_key(self, s):
-        """Computes a key for natural string sorting."""
-        return map(self._try_int, re.findall(r'(\d+|\D+)', s))
+        redirects may be None (keep all pages), False (keep only
+        non-redirects) or True (keep only redirects).
 
-    def _natsorted(self, l):
-        return sorted(l, key=self._natsort_key)
-
-    def _natsorted_by_title(self, l):
-        return sorted(l, key=lambda x: self._natsort_key(x['title']))
+        """
+        if redirects is None:
+            return pages
+        elif redirects:
+            return [x for x in pages if 'redirect' in x]
+        else:
+            return [x for x in pages if 'redirect' not in x]
@@ -0,0 +1,537 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import json
+import time
+
+from plagwiki.loaders.sqlitestore import SqliteStore
+from plagwiki.loaders.titleindex import TitleIndex
+from plagwiki.loaders.titlenormalizer import TitleNormalizer
+from plagwiki.loaders.wikierror import WikiError
+
+
+_PAGE_PROP = ('info', 'revisions', 'categories')
+
+class WikiMirror(SqliteStore):
+    """Local copy of parts of a wiki in an SQLite database.
+
+    The mirror holds complete page records (see WikiClient.get_page_info()
+    for the format, including the wikitext of the latest revision and
+    the categories) of the pages with some title prefixes and of the
+    members of some categories, together with the site information of
+    the wiki. Use mirror_plag() to copy the fragment and page pages and
+    the fragment and source categories of a plag (see PlagInfo), or
+    mirror_prefix() and mirror_category() for single listings. These
+    download the pages with generator queries, 50 pages per request,
+    through a WikiClient (its page cache is filled along the way).
+
+    The query methods have the same signatures and results as those of
+    WikiClient, but read the database only, so read-only scripts can
+    use a mirror instead of a client:
+        mirror = WikiMirror('mirror.sqlite', client.get_api_url(), client)
+        mirror.mirror_plag(config.get_plag('Fakeplag'))
+        for page in mirror.iter_prefix_pages('Fakeplag/Fragment'):
+            print(page['title'], page['revisions'][0]['*'])
+
+    Listing methods raise a WikiError if the requested prefix or
+    category has not been mirrored, as the result would be incomplete.
+    Pages that are not in the mirror are reported as missing. The
+    mirror is as current as the last mirror_*() call; see WikiSync for
+    keeping pages up to date.
+
+    The database may be shared by several wikis and processes, see
+    SqliteStore.
+
+    """
+
+    def __init__(self, filename, api, client=None):
+        """Constructor.
+
+        filename is the path to the SQLite database. It is created if it
+        does not exist yet. api is the URL to api.php of the wiki.
+        client is the WikiClient used to fill the mirror; it is not
+        needed for reading. The constructor does not communicate with
+        the API.
+
+        """
+        SqliteStore.__init__(self, filename)
+        self._api = api
+        self._client = client
+        self._title_normalizer = None
+        self._db.execute('CREATE TABLE IF NOT EXISTS siteinfo ('
+                ' api TEXT NOT NULL PRIMARY KEY,'
+                ' data TEXT NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                ' api TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' ns INTEGER NOT NULL,'
+                ' title TEXT NOT NULL,'
+                ' rest TEXT NOT NULL,'
+                ' redirect INTEGER NOT NULL,'
+                ' lastrevid INTEGER NOT NULL,'
+                ' touched TEXT,'
+                ' data BLOB NOT NULL,'
+                ' PRIMARY KEY (api, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_title'
+                ' ON pages (api, title)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_prefix'
+                ' ON pages (api, ns, rest)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS categories ('
+                ' api TEXT NOT NULL,'
+                ' category TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' PRIMARY KEY (api, category, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS categories_pageid'
+                ' ON categories (api, pageid)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS listings ('
+                ' api TEXT NOT NULL,'
+                ' kind TEXT NOT NULL,'
+                ' ns INTEGER NOT NULL,'
+                ' name TEXT NOT NULL,'
+                ' synced REAL NOT NULL,'
+                ' PRIMARY KEY (api, kind, ns, name))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS listed ('
+                ' api TEXT NOT NULL,'
+                ' kind TEXT NOT NULL,'
+                ' ns INTEGER NOT NULL,'
+                ' name TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' PRIMARY KEY (api, kind, ns, name, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS listed_pageid'
+                ' ON listed (api, pageid)')
+        self._db.commit()
+
+    def close(self):
+        """Close the database. The client is not closed."""
+        SqliteStore.close(self)
+
+    def get_api_url(self):
+        """Return the URL to api.php of the mirrored wiki."""
+        return self._api
+
+    def get_client(self):
+        """Return the WikiClient used to fill the mirror, or None."""
+        return self._client
+
+    def set_client(self, client):
+        """Set the WikiClient used to fill the mirror."""
+        self._client = client
+
+    ### Filling the mirror ###
+
+    def mirror_plag(self, plaginfo):
+        """Copy the pages of a plag into the mirror.
+
+        plaginfo is a PlagInfo. The pages with the prefixes fragmentprefix
+        and pagesprefix (if set) and the members of fragmentcategory and
+        sourcecategory are mirrored.
+
+        Returns a dict that maps each listing, as a tuple like
+        ('prefix', 'Fakeplag/Fragment'), to its number of pages.
+
+        """
+        counts = {}
+        for prefix in (plaginfo.fragmentprefix,
+                getattr(plaginfo, 'pagesprefix', None)):
+            if prefix:
+                counts[('prefix', prefix)] = self.mirror_prefix(prefix)
+        for category in (getattr(plaginfo, 'fragmentcategory', None),
+                plaginfo.sourcecategory):
+            if category:
+                counts[('category', category)] = self.mirror_category(category)
+        return counts
+
+    def mirror_prefix(self, prefix, namespace=None):
+        """Copy the pages with a given prefix into the mirror, replacing
+        an earlier copy of the listing.
+
+        prefix and namespace work as in WikiClient.get_prefix_list().
+        Returns the number of pages.
+
+        """
+        client = self._require_client()
+        self._store_siteinfo(client)
+        if namespace is None:
+            nsnumber, prefix = client.split_name(prefix)
+        else:
+            nsnumber = client.namespace_to_number(namespace)
+        pages = client.iter_prefix_pages(prefix, namespace=nsnumber,
+                prop=_PAGE_PROP)
+        return self._mirror_listing('prefix', nsnumber, prefix, pages)
+
+    def mirror_category(self, category):
+        """Copy the members of a category into the mirror, replacing an
+        earlier copy of the listing.
+
+        category is the name of the category, with or without the
+        'Category:' namespace prefix. Returns the number of pages.
+
+        """
+        client = self._require_client()
+        self._store_siteinfo(client)
+        category = self._full_category(category)
+        pages = client.iter_category_pages(category, prop=_PAGE_PROP)
+        return self._mirror_listing('category', 0, category, pages)
+
+    def get_listings(self):
+        """Return the mirrored listings as a list of dicts with the keys
+        'kind' ('prefix' or 'category'), 'ns' (the namespace of a prefix),
+        'name', 'synced' (the time of the last copy in seconds since the
+        epoch) and 'pages' (the number of pages)."""
+        with self._lock:
+            rows = self._db.execute('SELECT kind, ns, name, synced,'
+                    ' (SELECT COUNT(*) FROM listed WHERE listed.api = listings.api'
+                    ' AND listed.kind = listings.kind AND listed.ns = listings.ns'
+                    ' AND listed.name = listings.name)'
+                    ' FROM listings WHERE api = ? ORDER BY kind, ns, name',
+                    (self._api,)).fetchall()
+        return [{'kind': row[0], 'ns': row[1], 'name': row[2],
+                'synced': row[3], 'pages': row[4]} for row in rows]
+
+    ### Query methods (see WikiClient) ###
+
+    def get_page_info(self, title):
+        """Return the record of a single page, see
+        WikiClient.get_page_info()."""
+        pages = self._lookup_titles((title,))
+        return pages[0]
+
+    def get_page_info_by_id(self, pageid):
+        """Return the record of a single page given its page ID."""
+        pages = self._lookup_ids((pageid,))
+        return pages[0]
+
+    def get_page_text(self, title):
+        """Return the raw wikitext of a single page."""
+        try:
+            return self.get_page_info(title)['revisions'][0]['*']
+        except(LookupError):
+            return None
+
+    def get_page_text_by_id(self, pageid):
+        """Return the raw wikitext of a single page given its page ID."""
+        try:
+            return self.get_page_info_by_id(pageid)['revisions'][0]['*']
+        except(LookupError):
+            return None
+
+    def get_multi_page_info(self, titles, redirects=None):
+        """Same as get_page_info(), but supports multiple titles. See
+        WikiClient.get_multi_page_info()."""
+        return TitleIndex(self.iter_pages(titles, redirects)).get_items()
+
+    def get_multi_page_info_by_id(self, pageids, redirects=None):
+        """Same as get_page_info_by_id(), but supports multiple page IDs."""
+        return TitleIndex(self.iter_pages_by_id(pageids, redirects)).get_items()
+
+    def iter_pages(self, titles, redirects=None, prop=None):
+        """Iterate over the records of multiple pages, see
+        WikiClient.iter_pages(). prop is ignored: the records are always
+        complete."""
+        for pos in range(0, len(titles), 500):
+            for page in self._filter_redirects(
+                    self._lookup_titles(titles[pos : pos + 500]), redirects):
+                yield page
+
+    def iter_pages_by_id(self, pageids, redirects=None, prop=None):
+        """Same as iter_pages(), but pageids is a list of page IDs."""
+        for pos in range(0, len(pageids), 500):
+            for page in self._filter_redirects(
+                    self._lookup_ids(pageids[pos : pos + 500]), redirects):
+                yield page
+
+    def get_prefix_list(self, prefix, redirects=None, namespace=None):
+        """Return the sorted list of titles of pages with a given prefix,
+        see WikiClient.get_prefix_list()."""
+        return self.get_prefix_index(prefix, redirects, namespace).get_titles()
+
+    def get_prefix_index(self, prefix, redirects=None, namespace=None):
+        """Same as get_prefix_list(), but returns a TitleIndex of the
+        pages, as yielded by iter_prefix_list()."""
+        return TitleIndex(self.iter_prefix_list(prefix, redirects, namespace))
+
+    def get_prefix_list_ids(self, prefix, redirects=None, namespace=None):
+        """Return the sorted list of page IDs of pages with a given
+        prefix."""
+        return sorted(int(page['pageid']) for page in
+                self.iter_prefix_list(prefix, redirects, namespace))
+
+    def iter_prefix_list(self, prefix, redirects=None, namespace=None):
+        """Iterate over pages with a given prefix, see
+        WikiClient.iter_prefix_list(). Yields dicts with the keys
+        'pageid', 'ns' and 'title', ordered by title."""
+        rows = self._prefix_rows('pages.pageid, pages.ns, pages.title', prefix, redirects, namespace)
+        for row in rows:
+            yield {'pageid': row[0], 'ns': row[1], 'title': row[2]}
+
+    def iter_prefix_pages(self, prefix, redirects=None, namespace=None, prop=None):
+        """Iterate over the records of the pages with a given prefix, see
+        WikiClient.iter_prefix_pages(). prop is ignored."""
+        rows = self._prefix_rows('pages.data', prefix, redirects, namespace)
+        for row in rows:
+            yield self._decode(row[0])
+
+    def get_category_members(self, category, namespace=None):
+        """Return the sorted list of titles of pages in the given category,
+        see WikiClient.get_category_members()."""
+        return self.get_category_index(category, namespace).get_titles()
+
+    def get_category_index(self, category, namespace=None):
+        """Same as get_category_members(), but returns a TitleIndex of
+        the pages, as yielded by iter_category_members()."""
+        return TitleIndex(self.iter_category_members(category, namespace))
+
+    def get_category_members_ids(self, category, namespace=None):
+        """Return the sorted list of page IDs of pages in the given
+        category."""
+        return sorted(int(page['pageid']) for page in
+                self.iter_category_members(category, namespace))
+
+    def iter_category_members(self, category, namespace=None):
+        """Iterate over pages in the given category, see
+        WikiClient.iter_category_members(). Yields dicts with the keys
+        'pageid', 'ns' and 'title', ordered by title."""
+        rows = self._category_rows('pages.pageid, pages.ns, pages.title', category, namespace)
+        for row in rows:
+            yield {'pageid': row[0], 'ns': row[1], 'title': row[2]}
+
+    def iter_category_pages(self, category, namespace=None, prop=None):
+        """Iterate over the records of the pages in a category, see
+        WikiClient.iter_category_pages(). prop is ignored."""
+        rows = self._category_rows('pages.data', category, namespace)
+        for row in rows:
+            yield self._decode(row[0])
+
+    def get_all_categories(self, prefix=None):
+        """Return the sorted list of the categories of the mirrored pages
+        (without the 'Category:' namespace prefix), optionally limited to
+        those that start with prefix. Unlike
+        WikiClient.get_all_categories(), categories without mirrored
+        pages are not listed."""
+        with self._lock:
+            rows = self._db.execute('SELECT DISTINCT category FROM categories'
+                    ' WHERE api = ?', (self._api,)).fetchall()
+        names = [self.split_name(row[0])[1] for row in rows]
+        if prefix is not None:
+            prefix = self.split_name(self._full_category(prefix))[1]
+            names = [name for name in names if name.startswith(prefix)]
+        return TitleIndex(names, title_key=None).get_titles()
+
+    ### Name and namespace helper methods (see WikiClient) ###
+
+    def get_siteinfo(self):
+        """Return the site information of the wiki as stored by the last
+        mirror_*() call, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT data FROM siteinfo WHERE api = ?',
+                    (self._api,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_title_normalizer(self):
+        """Return the TitleNormalizer of the wiki, built from the stored
+        site information."""
+        normalizer = self._title_normalizer
+        if normalizer is None:
+            siteinfo = self.get_siteinfo()
+            if siteinfo is None:
+                raise WikiError('The mirror of ' + self._api +
+                        ' is empty, there is no site information')
+            normalizer = TitleNormalizer(siteinfo)
+            self._title_normalizer = normalizer
+        return normalizer
+
+    def normalize_name(self, name):
+        """Normalize a wiki page name."""
+        return self.get_title_normalizer().normalize_name(name)
+
+    def combine_name(self, ns, rest):
+        """Concatenate a namespace name (or number) and rest of page name."""
+        return self.get_title_normalizer().combine_name(ns, rest)
+
+    def split_name(self, name):
+        """Split a page name into namespace number and rest of page name."""
+        return self.get_title_normalizer().split_name(name)
+
+    def normalize_namespace(self, ns):
+        """Normalize the namespace name or number ns."""
+        return self.get_title_normalizer().normalize_namespace(ns)
+
+    def namespace_to_number(self, ns, raise_on_error=True):
+        """Convert the namespace name or number ns to a namespace number."""
+        return self.get_title_normalizer().namespace_to_number(ns, raise_on_error)
+
+    ### Internal methods ###
+
+    def _require_client(self):
+        if self._client is None:
+            raise WikiError('The mirror of ' + self._api + ' has no client,'
+                    ' see WikiMirror.set_client()')
+        return self._client
+
+    def _store_siteinfo(self, client):
+        client.request_siteinfo()
+        siteinfo = client.get_siteinfo()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO siteinfo (api, data)'
+                    ' VALUES (?, ?)', (self._api, json.dumps(siteinfo)))
+            self._db.commit()
+        self._title_normalizer = client.get_title_normalizer()
+
+    def _full_category(self, category):
+        """Return the full name of a category, with namespace prefix."""
+        nsnumber, rest = self.split_name(category)
+        if nsnumber == self.namespace_to_number(''):
+            # namespace prefix was omitted, prepend Category:
+            nsnumber = self.namespace_to_number('Category')
+        return self.combine_name(nsnumber, rest)
+
+    def _mirror_listing(self, kind, ns, name, pages):
+        """Store the pages of a listing batch by batch, then replace the
+        old listing and delete the pages no listing refers to anymore."""
+        pageids = set()
+        batch = []
+        for page in pages:
+            if 'missing' in page or 'lastrevid' not in page:
+                continue
+            batch.append(page)
+            pageids.add(int(page['pageid']))
+            if len(batch) >= 500:
+                self._store_pages(batch)
+                batch = []
+        self._store_pages(batch)
+        with self._lock:
+            self._db.execute('DELETE FROM listed WHERE api = ? AND kind = ?'
+                    ' AND ns = ? AND name = ?', (self._api, kind, ns, name))
+            self._db.executemany('INSERT INTO listed'
+                    ' (api, kind, ns, name, pageid) VALUES (?, ?, ?, ?, ?)',
+                    [(self._api, kind, ns, name, pageid) for pageid in pageids])
+            self._db.execute('INSERT OR REPLACE INTO listings'
+                    ' (api, kind, ns, name, synced) VALUES (?, ?, ?, ?, ?)',
+                    (self._api, kind, ns, name, time.time()))
+            for table in ('categories', 'pages'):
+                self._db.execute('DELETE FROM ' + table + ' WHERE api = ?'
+                        ' AND pageid NOT IN (SELECT pageid FROM listed'
+                        ' WHERE api = ?)', (self._api, self._api))
+            self._db.commit()
+        return len(pageids)
+
+    def _store_pages(self, pages):
+        if not pages:
+            return
+        page_rows = []
+        category_rows = []
+        for page in pages:
+            pageid = int(page['pageid'])
+            ns = int(page['ns'])
+            rest = page['title']
+            if ns != 0:
+                rest = rest.split(':', 1)[-1]
+            page_rows.append((self._api, pageid, ns, page['title'], rest,
+                    int('redirect' in page), int(page['lastrevid']),
+                    page.get('touched'), self._encode(page)))
+            for category in page.get('categories', []):
+                category_rows.append((self._api, category['title'], pageid))
+        with self._lock:
+            # a page may have been moved to the title of another one
+            self._db.executemany('DELETE FROM pages WHERE api = ?'
+                    ' AND title = ? AND pageid != ?',
+                    [(row[0], row[3], row[1]) for row in page_rows])
+            self._db.executemany('DELETE FROM categories WHERE api = ?'
+                    ' AND pageid = ?', [(row[0], row[1]) for row in page_rows])
+            self._db.executemany('INSERT OR REPLACE INTO pages'
+                    ' (api, pageid, ns, title, rest, redirect, lastrevid,'
+                    ' touched, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    page_rows)
+            self._db.executemany('INSERT OR REPLACE INTO categories'
+                    ' (api, category, pageid) VALUES (?, ?, ?)', category_rows)
+            self._db.commit()
+
+    def _lookup_titles(self, titles):
+        """Return the records of the pages with the given titles, in the
+        same order. Pages that are not mirrored are reported as missing."""
+        titles = [self.normalize_name(title) for title in titles]
+        found = {}
+        with self._lock:
+            for title in set(titles):
+                row = self._db.execute('SELECT data FROM pages'
+                        ' WHERE api = ? AND title = ?', (self._api, title)).fetchone()
+                if row is not None:
+                    found[title] = self._decode(row[0])
+        return [found.get(title) or {'ns': self.split_name(title)[0],
+                'title': title, 'missing': ''} for title in titles]
+
+    def _lookup_ids(self, pageids):
+        """Return the records of the pages with the given IDs, in the same
+        order. Pages that are not mirrored are reported as missing."""
+        found = {}
+        with self._lock:
+            for pageid in set(int(pageid) for pageid in pageids):
+                row = self._db.execute('SELECT data FROM pages'
+                        ' WHERE api = ? AND pageid = ?', (self._api, pageid)).fetchone()
+                if row is not None:
+                    found[pageid] = self._decode(row[0])
+        return [found.get(int(pageid)) or {'pageid': int(pageid), 'missing': ''}
+                for pageid in pageids]
+
+    def _prefix_rows(self, columns, prefix, redirects, namespace):
+        """Select columns of the mirrored pages with a given prefix,
+        ordered by title. Raises a WikiError if the prefix is not
+        covered by a mirrored listing."""
+        if namespace is None:
+            nsnumber, prefix = self.split_name(prefix)
+        else:
+            nsnumber = self.namespace_to_number(namespace)
+        with self._lock:
+            names = [row[0] for row in self._db.execute('SELECT name FROM listings'
+                    ' WHERE api = ? AND kind = ? AND ns = ?',
+                    (self._api, 'prefix', nsnumber)).fetchall()]
+            if not any(prefix.startswith(name) for name in names):
+                raise WikiError('Prefix ' + self.combine_name(nsnumber, prefix) +
+                        ' is not mirrored, see WikiMirror.mirror_prefix()')
+            sql = ('SELECT ' + columns + ' FROM pages'
+                    ' WHERE api = ? AND ns = ? AND rest >= ?')
+            args = [self._api, nsnumber, prefix]
+            if prefix:
+                # the titles with the prefix form a range in the index
+                sql += ' AND rest < ?'
+                args.append(prefix[:-1] + unichr(ord(prefix[-1]) + 1))
+            if redirects is not None:
+                sql += ' AND redirect = ?'
+                args.append(int(bool(redirects)))
+            return self._db.execute(sql + ' ORDER BY pages.title', args).fetchall()
+
+    def _category_rows(self, columns, category, namespace):
+        """Select columns of the mirrored members of a category, ordered
+        by title. Raises a WikiError if the category is not mirrored."""
+        category = self._full_category(category)
+        with self._lock:
+            row = self._db.execute('SELECT synced FROM listings'
+                    ' WHERE api = ? AND kind = ? AND ns = 0 AND name = ?',
+                    (self._api, 'category', category)).fetchone()
+            if row is None:
+                raise WikiError(category + ' is not mirrored,'
+                        ' see WikiMirror.mirror_category()')
+            sql = ('SELECT ' + columns + ' FROM pages'
+                    ' JOIN listed ON listed.api = pages.api'
+                    ' AND listed.pageid = pages.pageid'
+                    ' WHERE pages.api = ? AND listed.kind = ?'
+                    ' AND listed.ns = 0 AND listed.name = ?')
+            args = [self._api, 'category', category]
+            if namespace is not None:
+                sql += ' AND pages.ns = ?'
+                args.append(self.namespace_to_number(namespace))
+            return self._db.execute(sql + ' ORDER BY pages.title', args).fetchall()
+
+    def _filter_redirects(self, pages, redirects):
+        """Filter a list of page records by their 'redirect' property."""
+        if redirects is None:
+            return pages
+        elif redirects:
+            return [x for x in pages if 'redirect' in x]
+        else:
+            return [x for x in pages if 'redirect' not in x]
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import calendar
+import json
+import pprint
+import time
+
+from plagwiki.loaders.sqlitestore import SqliteStore
+from plagwiki.loaders.titleindex import TitleIndex
+from plagwiki.loaders.wikierror import WikiError
+
+
+# MediaWiki forgets recent changes after $wgRCMaxAge (90 days by default,
+# but many wikis keep them for a shorter time). A wiki that has not been
+# synced for longer than this is synced in full again.
+DEFAULT_RC_MAX_AGE = 30 * 24 * 3600
+
+# Log types whose entries change the pages of a wiki.
+SYNC_LOG_TYPES = frozenset(('delete', 'move', 'upload', 'import', 'merge'))
+
+_PAGE_PROP = ('info', 'revisions', 'categories')
+
+class WikiSync(SqliteStore):
+    """Keeps local copies of a part of a wiki up to date.
+
+    The part of the wiki (the scope) consists of all pages whose titles
+    start with one of prefixes and all pages in one of categories, e.g.
+    the fragment pages and the source pages of a plag. The pages
+    themselves are kept in the page cache of the client (see
+    WikiClient.set_page_cache()); this class keeps track of which pages
+    are in the scope, the categories of each page and the high-water
+    mark: the timestamp and ID of the last recent change it has seen.
+
+    The first sync() enumerates the scope and downloads all pages that
+    are not cached yet. Every later sync() only pages through the
+    recent changes since the high-water mark (edits, new pages, moves,
+    deletions and category changes) and queries the affected pages in
+    batches of 50, so that syncing a quiet wiki costs a single request.
+
+    The state is an SQLite database (see SqliteStore), which may be
+    shared by several scopes and wikis. Do not run sync() in several threads or processes
+    for the same scope at the same time.
+
+    Example:
+        sync = WikiSync(client, 'sync.sqlite', prefixes=['Fakeplag/'],
+                categories=['Kategorie:Fakeplag'])
+        sync.sync()
+        for title in sync.get_category_members('Kategorie:Fakeplag'):
+            print(title, len(sync.get_page(title)['revisions'][0]['*']))
+
+    """
+
+    def __init__(self, client, filename, prefixes=(), categories=(),
+            max_age=DEFAULT_RC_MAX_AGE):
+        """Constructor.
+
+        client is the WikiClient to use; it must have a page cache.
+        filename is the path to the SQLite database, which is created if
+        it does not exist yet. prefixes and categories define the scope.
+        If the high-water mark is older than max_age seconds, sync()
+        syncs the whole scope again. The constructor does not
+        communicate with the API.
+
+        """
+        if client.get_page_cache() is None:
+            raise ValueError('WikiSync needs a WikiClient with a page cache')
+        SqliteStore.__init__(self, filename)
+        self._client = client
+        self._api = client.get_api_url()
+        self._prefixes = tuple(unicode(prefix) for prefix in prefixes)
+        self._categories = tuple(unicode(category) for category in categories)
+        self._scope = json.dumps([sorted(self._prefixes), sorted(self._categories)])
+        self._max_age = max_age
+        self._full_prefixes = None
+        self._full_categories = None
+        self._db.execute('CREATE TABLE IF NOT EXISTS state ('
+                ' api TEXT NOT NULL,'
+                ' scope TEXT NOT NULL,'
+                ' rcstart TEXT,'
+                ' rcid INTEGER NOT NULL,'
+                ' synced REAL NOT NULL,'
+                ' PRIMARY KEY (api, scope))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                ' api TEXT NOT NULL,'
+                ' scope TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' title TEXT NOT NULL,'
+                ' PRIMARY KEY (api, scope, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_title'
+                ' ON pages (api, scope, title)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS members ('
+                ' api TEXT NOT NULL,'
+                ' scope TEXT NOT NULL,'
+                ' category TEXT NOT NULL,'
+                ' pageid INTEGER NOT NULL,'
+                ' PRIMARY KEY (api, scope, category, pageid))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS members_pageid'
+                ' ON members (api, scope, pageid)')
+        self._db.commit()
+
+    def close(self):
+        """Close the database. The client is not closed."""
+        SqliteStore.close(self)
+
+    def get_client(self):
+        """Return the WikiClient."""
+        return self._client
+
+    def get_prefixes(self):
+        """Return the title prefixes of the scope."""
+        return self._prefixes
+
+    def get_categories(self):
+        """Return the categories of the scope."""
+        return self._categories
+
+    def get_high_water_mark(self):
+        """Return the last recent change seen by sync() as a dict with
+        the keys 'timestamp' and 'rcid', or None if the scope has never
+        been synced. 'timestamp' is None if the wiki had no recent
+        changes."""
+        state = self._load_state()
+        if state is None:
+            return None
+        return {'timestamp': state[0], 'rcid': state[1]}
+
+    def reset(self):
+        """Forget the state of the scope, so that the next sync() is a
+        full sync. The page cache is not touched."""
+        with self._lock:
+            for table in ('state', 'pages', 'members'):
+                self._db.execute('DELETE FROM ' + table +
+                        ' WHERE api = ? AND scope = ?', (self._api, self._scope))
+            self._db.commit()
+
+    def sync(self):
+        """Bring the local copies of the pages in the scope up to date.
+
+        Returns a dict with the keys 'full' (True if the whole scope was
+        synced), 'changes' (the number of recent changes processed),
+        'updated' (the sorted titles of the pages that were checked and
+        are in the scope) and 'removed' (the sorted titles of the pages
+        that were deleted or left the scope).
+
+        """
+        state = self._load_state()
+        if state is None or self._is_expired(state[0]):
+            return self._full_sync()
+        return self._incremental_sync(state[0], state[1])
+
+    def get_titles(self):
+        """Return the titles of all pages in the scope, in natural sort
+        order."""
+        with self._lock:
+            rows = self._db.execute('SELECT title FROM pages'
+                    ' WHERE api = ? AND scope = ?', (self._api, self._scope)).fetchall()
+        return TitleIndex([row[0] for row in rows], None).get_titles()
+
+    def get_category_members(self, category):
+        """Return the titles of the pages in the scope that are in the
+        given category (a full title, like 'Kategorie:Fakeplag'), in
+        natural sort order."""
+        with self._lock:
+            rows = self._db.execute('SELECT pages.title FROM members'
+                    ' JOIN pages ON pages.api = members.api'
+                    ' AND pages.scope = members.scope AND pages.pageid = members.pageid'
+                    ' WHERE members.api = ? AND members.scope = ?'
+                    ' AND members.category = ?',
+                    (self._api, self._scope, category)).fetchall()
+        return TitleIndex([row[0] for row in rows], None).get_titles()
+
+    def get_page_categories(self, title):
+        """Return the sorted list of categories of a page in the scope, or
+        None if the page is not in the scope."""
+        with self._lock:
+            row = self._db.execute('SELECT pageid FROM pages'
+                    ' WHERE api = ? AND scope = ? AND title = ?',
+                    (self._api, self._scope, title)).fetchone()
+            if row is None:
+                return None
+            rows = self._db.execute('SELECT category FROM members'
+                    ' WHERE api = ? AND scope = ? AND pageid = ?',
+                    (self._api, self._scope, row[0])).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def get_page(self, title):
+        """Return the cached record of a page in the scope (see
+        WikiClient.get_page_info()), or None if the page is not in the
+        scope."""
+        with self._lock:
+            row = self._db.execute('SELECT pageid FROM pages'
+                    ' WHERE api = ? AND scope = ? AND title = ?',
+                    (self._api, self._scope, title)).fetchone()
+        if row is None:
+            return None
+        return self._client.get_page_cache().lookup_title(self._api, title)
+
+    ### Internal methods ###
+
+    def _full_sync(self):
+        # remember the last change first, so that changes made while the
+        # scope is enumerated are picked up by the next sync
+        last = self._client.get_last_change()
+        pageids = set()
+        for prefix in self._prefixes:
+            for page in self._client.iter_prefix_list(prefix):
+                pageids.add(int(page['pageid']))
+        for category in self._categories:
+            for page in self._client.iter_category_members(category):
+                pageids.add(int(page['pageid']))
+        old = self._tracked_pages()
+        pages = []
+        for page in self._client.iter_pages_by_id(sorted(pageids),
+                prop=_PAGE_PROP):
+            if 'missing' not in page:
+                pages.append(page)
+        present = set(int(page['pageid']) for page in pages)
+        removed = [(pageid, title) for pageid, title in old.items()
+                if pageid not in present]
+        self._update_tracked(pages, removed)
+        if last is None:
+            self._save_state(None, 0)
+        else:
+            self._save_state(last['timestamp'], last['rcid'])
+        return {'full': True, 'changes': 0,
+                'updated': sorted(page['title'] for page in pages),
+                'removed': sorted(title for pageid, title in removed)}
+
+    def _incremental_sync(self, rcstart, rcid):
+        titles = set()
+        categorized = set()
+        count = 0
+        mark = (rcstart, rcid)
+        for change in self._client.iter_recent_changes(rcstart):
+            key = (change['timestamp'], int(change.get('rcid', 0)))
+            if rcstart is not None and key <= (rcstart, rcid):
+                # rcstart is inclusive: skip the changes already seen
+                continue
+            count += 1
+            if mark[0] is None or key > mark:
+                mark = key
+            changetype = change.get('type')
+            if changetype == 'log' and change.get('logtype') not in SYNC_LOG_TYPES:
+                continue
+            titles.add(change['title'])
+            if changetype == 'categorize':
+                categorized.add(change['title'])
+            new_title = (change.get('move', {}).get('new_title') or
+                    change.get('logparams', {}).get('target_title'))
+            if new_title:
+                titles.add(new_title)
+        for category in self._get_full_categories():
+            if category in categorized:
+                # category changes through templates do not show up as
+                # edits of the member pages, so list the category again
+                titles.update(self.get_category_members(category))
+                titles.update(page['title'] for page in
+                        self._client.iter_category_members(category))
+        updated, removed = self._update_titles(titles)
+        self._save_state(mark[0], mark[1])
+        return {'full': False, 'changes': count, 'updated': updated,
+                'removed': removed}
+
+    def _update_titles(self, titles):
+        """Check the pages with the given titles, download those that are
+        in the scope and have changed, and update the tracked pages.
+        Returns the sorted lists of updated and removed titles."""
+        tracked = self._tracked_pages()
+        tracked_titles = set(tracked.values())
+        if not self._categories:
+            # without categories, no other page can enter the scope
+            titles = [title for title in titles
+                    if title in tracked_titles or self._has_prefix(title)]
+        if not titles:
+            return ([], [])
+        in_scope = []
+        missing_titles = set()
+        for page in self._client.iter_pages(sorted(titles),
+                prop=('info', 'categories')):
+            if 'invalid' in page:
+                continue
+            if 'missing' in page:
+                missing_titles.add(page['title'])
+            elif self._in_scope(page):
+                in_scope.append(page)
+        pages = []
+        if in_scope:
+            pages = [page for page in
+                    self._client.complete_pages(in_scope, _PAGE_PROP)
+                    if 'missing' not in page]
+        present = set(int(page['pageid']) for page in pages)
+        queried = set(titles) - missing_titles
+        removed = []
+        deleted = []
+        for pageid, title in tracked.items():
+            if pageid in present:
+                continue
+            if title in missing_titles:
+                deleted.append(pageid)
+                removed.append((pageid, title))
+            elif title in queried:
+                # the page left the scope
+                removed.append((pageid, title))
+        if deleted:
+            self._client.get_page_cache().invalidate(self._api, deleted)
+        self._update_tracked(pages, removed)
+        return (sorted(page['title'] for page in pages),
+                sorted(title for pageid, title in removed))
+
+    def _update_tracked(self, pages, removed):
+        """Store the pages and their categories, and forget the removed
+        (pageid, title) pairs."""
+        with self._lock:
+            for pageid, title in removed:
+                self._db.execute('DELETE FROM pages WHERE api = ? AND scope = ?'
+                        ' AND pageid = ?', (self._api, self._scope, pageid))
+                self._db.execute('DELETE FROM members WHERE api = ? AND scope = ?'
+                        ' AND pageid = ?', (self._api, self._scope, pageid))
+            for page in pages:
+                pageid = int(page['pageid'])
+                self._db.execute('DELETE FROM pages WHERE api = ? AND scope = ?'
+                        ' AND title = ? AND pageid != ?',
+                        (self._api, self._scope, page['title'], pageid))
+                self._db.execute('INSERT OR REPLACE INTO pages'
+                        ' (api, scope, pageid, title) VALUES (?, ?, ?, ?)',
+                        (self._api, self._scope, pageid, page['title']))
+                self._db.execute('DELETE FROM members WHERE api = ? AND scope = ?'
+                        ' AND pageid = ?', (self._api, self._scope, pageid))
+                self._db.executemany('INSERT OR REPLACE INTO members'
+                        ' (api, scope, category, pageid) VALUES (?, ?, ?, ?)',
+                        [(self._api, self._scope, category['title'], pageid)
+                        for category in page.get('categories', [])])
+            self._db.execute('DELETE FROM members WHERE api = ? AND scope = ?'
+                    ' AND pageid NOT IN (SELECT pageid FROM pages'
+                    ' WHERE api = ? AND scope = ?)',
+                    (self._api, self._scope, self._api, self._scope))
+            self._db.commit()
+
+    def _tracked_pages(self):
+        """Return a dict that maps the IDs of the tracked pages to their
+        titles."""
+        with self._lock:
+            rows = self._db.execute('SELECT pageid, title FROM pages'
+                    ' WHERE api = ? AND scope = ?', (self._api, self._scope)).fetchall()
+        return dict((int(row[0]), row[1]) for row in rows)
+
+    def _load_state(self):
+        with self._lock:
+            return self._db.execute('SELECT rcstart, rcid FROM state'
+                    ' WHERE api = ? AND scope = ?', (self._api, self._scope)).fetchone()
+
+    def _save_state(self, rcstart, rcid):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO state'
+                    ' (api, scope, rcstart, rcid, synced) VALUES (?, ?, ?, ?, ?)',
+                    (self._api, self._scope, rcstart, int(rcid), time.time()))
+            self._db.commit()
+
+    def _is_expired(self, rcstart):
+        if rcstart is None or self._max_age is None:
+            return False
+        try:
+            seen = calendar.timegm(time.strptime(rcstart, '%Y-%m-%dT%H:%M:%SZ'))
+        except(ValueError):
+            raise WikiError('Invalid high-water mark: ' + pprint.pformat(rcstart))
+        return time.time() - seen > self._max_age
+
+    def _in_scope(self, page):
+        if self._has_prefix(page['title']):
+            return True
+        categories = self._get_full_categories()
+        return any(category['title'] in categories
+                for category in page.get('categories', []))
+
+    def _has_prefix(self, title):
+        return any(title.startswith(prefix) for prefix in self._get_full_prefixes())
+
+    def _get_full_prefixes(self):
+        """Return the prefixes as prefixes of full page titles."""
+        if self._full_prefixes is None:
+            self._client.request_siteinfo()
+            prefixes = []
+            for prefix in self._prefixes:
+                ns, rest = self._client.split_name(prefix)
+                rest = rest.replace('_', ' ').lstrip()
+                rest = rest[:1].upper() + rest[1:]
+                if ns != 0:
+                    rest = self._client.normalize_namespace(ns) + ':' + rest
+                prefixes.append(rest)
+            self._full_prefixes = tuple(prefixes)
+        return self._full_prefixes
+
+    def _get_full_categories(self):
+        """Return the set of the normalized full titles of the categories."""
+        if self._full_categories is None:
+            self._client.request_siteinfo()
+            category_ns = self._client.namespace_to_number('Category')
+            categories = set()
+            for category in self._categories:
+                ns, rest = self._client.split_name(category)
+                if ns == 0:
+                    ns = category_ns
+                categories.add(self._client.combine_name(ns, rest))
+            self._full_categories = frozenset(categories)
+        return self._full_categories
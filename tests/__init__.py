@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Unit tests of the plagwiki package. Run them from the top directory with
+#   python -m unittest discover -s tests -t .
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import os
+import sys
+
+# the package is not installed, but used from the source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'pym'))
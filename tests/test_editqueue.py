@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+from plagwiki.fakewiki.corpus import Corpus
+from plagwiki.fakewiki.server import FakeWikiServer
+from plagwiki.loaders.editqueue import EditQueue
+from plagwiki.loaders.retrypolicy import RetryPolicy
+from plagwiki.loaders.wikiclient import WikiClient
+
+
+FRAGMENT = 'Fakeplag/Fragment 001 01'
+
+class EditQueueTest(unittest.TestCase):
+
+    def start(self, num_pages=5, page_size=200, max_result_size=None):
+        self.corpus = Corpus.synthetic(num_pages, page_size)
+        self.server = FakeWikiServer(self.corpus,
+                max_result_size=max_result_size)
+        self.server.start()
+        self.client = WikiClient(self.server.get_api_url())
+        self.client.set_retry_policy(RetryPolicy(max_attempts=1))
+        self.client.login('FakeBot', 'secret')
+        self.queue = EditQueue(self.client, 'test')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def text(self, title):
+        page = self.corpus.get_page(title)
+        return page['text'] if page is not None else None
+
+    def run_queue(self):
+        return dict((result.title, result) for result in self.queue.run())
+
+    def test_statuses(self):
+        self.start()
+        self.queue.add(FRAGMENT, lambda text: text + '\nneu')
+        self.queue.add('Fakeplag/Fragment 001 02', lambda text: text)
+        self.queue.add('Fakeplag/Fragment 001 03', lambda text: None)
+        results = self.run_queue()
+        self.assertEqual(results[FRAGMENT].status, 'saved')
+        self.assertEqual(results[FRAGMENT].newrevid,
+                self.corpus.get_page(FRAGMENT)['revid'])
+        self.assertTrue(self.text(FRAGMENT).endswith('\nneu'))
+        self.assertEqual(results['Fakeplag/Fragment 001 02'].status, 'unchanged')
+        self.assertEqual(results['Fakeplag/Fragment 001 03'].status, 'skipped')
+        self.assertEqual(len(self.queue), 0)
+
+    def test_transforms_of_same_page_in_order(self):
+        self.start()
+        self.queue.add(FRAGMENT, lambda text: text + '1')
+        self.queue.add(FRAGMENT.replace(' ', '_'), lambda text: text + '2')
+        results = self.queue.run()
+        self.assertEqual([result.title for result in results], [FRAGMENT])
+        self.assertTrue(self.text(FRAGMENT).endswith('12'))
+
+    def test_conflict_with_concurrent_edit(self):
+        self.start()
+        # timestamps have a resolution of one second, so the fetched
+        # revision must be older than the concurrent one
+        self.corpus.add_page(FRAGMENT, self.text(FRAGMENT),
+                timestamp='2011-01-01T00:00:00Z')
+        def transform(text):
+            # somebody else saves the page after it has been fetched
+            self.corpus.edit_page(FRAGMENT, 'other edit')
+            return text + '\nneu'
+        self.queue.add(FRAGMENT, transform)
+        results = self.run_queue()
+        self.assertEqual(results[FRAGMENT].status, 'conflict')
+        self.assertEqual(self.text(FRAGMENT), 'other edit')
+
+    def test_conflict_with_concurrent_delete(self):
+        self.start()
+        def transform(text):
+            self.corpus.delete_page(FRAGMENT)
+            return text + '\nneu'
+        self.queue.add(FRAGMENT, transform)
+        self.assertEqual(self.run_queue()[FRAGMENT].status, 'conflict')
+        self.assertIsNone(self.text(FRAGMENT))
+
+    def test_missing_page_created(self):
+        self.start()
+        texts = []
+        def transform(text):
+            texts.append(text)
+            return 'new page'
+        self.queue.add('Fakeplag/New page', transform)
+        self.assertEqual(self.run_queue()['Fakeplag/New page'].status, 'saved')
+        self.assertEqual(texts, [None])
+        self.assertEqual(self.text('Fakeplag/New page'), 'new page')
+
+    def test_conflict_with_concurrent_create(self):
+        self.start()
+        def transform(text):
+            self.corpus.edit_page('Fakeplag/New page', 'other page')
+            return 'new page'
+        self.queue.add('Fakeplag/New page', transform)
+        self.assertEqual(self.run_queue()['Fakeplag/New page'].status,
+                'conflict')
+        self.assertEqual(self.text('Fakeplag/New page'), 'other page')
+
+    def test_invalid_title(self):
+        self.start()
+        self.queue.add('Fakeplag/<invalid>', lambda text: 'x')
+        self.queue.add(FRAGMENT, lambda text: text + '\nneu')
+        results = self.run_queue()
+        self.assertEqual(results['Fakeplag/<invalid>'].status, 'failed')
+        self.assertEqual(results[FRAGMENT].status, 'saved')
+
+    def test_failed_fetch(self):
+        self.start()
+        self.queue.add(FRAGMENT, lambda text: text + '\nneu')
+        self.server.fail_next(1)
+        result = self.run_queue()[FRAGMENT]
+        self.assertEqual(result.status, 'failed')
+        self.assertTrue(result.message)
+
+    def test_truncated_fetch_continued(self):
+        self.start(num_pages=120, page_size=1000, max_result_size=20000)
+        titles = ['Fakeplag/Fragment %03d %02d' % (num // 10 + 1, num % 10 + 1)
+                for num in range(120)]
+        for title in titles:
+            self.queue.add(title, lambda text: text + '\nneu')
+        results = self.run_queue()
+        self.assertEqual(set(result.status for result in results.values()),
+                set(['saved']))
+        for title in titles:
+            self.assertTrue(self.text(title).endswith('\nneu'), title)
+
+
+if __name__ == '__main__':
+    unittest.main()
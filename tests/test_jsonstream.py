@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import json
+import random
+import unittest
+
+from plagwiki.loaders.jsonstream import JsonStream
+
+
+DOCUMENTS = [
+    '{}',
+    '[]',
+    '[12345]',
+    '{"n": -1.5e+10}',
+    '["a string with \\"escapes\\" and \\u00fc"]',
+    ' [true, null] ',
+    '{"query": {"allpages": [{"pageid": 1, "ns": 0, "title": "A"},'
+        ' {"pageid": 22, "ns": 0, "title": "Fragment 22 01"}]},'
+        ' "query-continue": {"allpages": {"apfrom": "B"}}}',
+    '{"query": {"pages": {"-1": {"title": "X", "missing": ""},'
+        ' "7": {"pageid": 7, "title": "Grüße ☃",'
+        ' "revisions": [{"*": "{{Fragment|Seite=1}} [[a]]\\n",'
+        ' "timestamp": "2011-01-01T00:00:00Z"}]}}}}',
+    '[1, 2.5, -3, true, false, null, "x", [[], {}], {"a": [1, {"b": 2}]}]',
+    '\n{ "a" :\t[ 1 ,2 ] , "b" : { } }\n',
+]
+
+MALFORMED = [
+    b'',
+    b'{',
+    b'{"a": 1',
+    b'{"a" 1}',
+    b'{"a": 1,}',
+    b'[1 2]',
+    b'[1,]',
+    b'{"a": tru}',
+    b'{"a": 1} x',
+    b'{"a": 1}{}',
+    b'"unterminated',
+    b'{"a": "\xff\xfe"}',
+    b'{"a": 01}',
+    # the top-level value must be a container
+    b'12345',
+]
+
+
+def split(data, sizes):
+    """Split data into pieces of the given sizes (repeated cyclically)."""
+    pieces = []
+    pos = 0
+    i = 0
+    while pos < len(data):
+        size = sizes[i % len(sizes)]
+        pieces.append(data[pos:pos + size])
+        pos += size
+        i += 1
+    return pieces
+
+
+def decode(pieces, path=None, depth=None, pop=False):
+    stream = JsonStream(path, depth)
+    entries = []
+    for piece in pieces:
+        stream.write(piece)
+        if pop:
+            entries.extend(stream.pop_entries())
+    stream.close()
+    document = stream.get_document()
+    if pop:
+        entries.extend(stream.pop_entries())
+    return document, entries
+
+
+class JsonStreamTest(unittest.TestCase):
+
+    def test_every_chunk_size(self):
+        for text in DOCUMENTS:
+            data = text.encode('utf-8')
+            expected = json.loads(text)
+            for size in range(1, len(data) + 1):
+                for depth in (0, 1, 2, 3):
+                    document = decode(split(data, [size]), depth=depth)[0]
+                    self.assertEqual(document, expected,
+                            '%r in pieces of %d, depth %d' % (text, size, depth))
+
+    def test_random_chunk_boundaries(self):
+        rng = random.Random(0)
+        for text in DOCUMENTS:
+            data = text.encode('utf-8')
+            expected = json.loads(text)
+            for i in range(20):
+                sizes = [rng.randint(1, 7) for j in range(5)]
+                self.assertEqual(decode(split(data, sizes), depth=2)[0],
+                        expected, '%r in pieces of %r' % (text, sizes))
+
+    def test_pop_entries(self):
+        text = DOCUMENTS[6]
+        expected = json.loads(text)
+        entries = expected['query']['allpages']
+        for size in (1, 3, 10, len(text)):
+            document, popped = decode(split(text.encode('utf-8'), [size]),
+                    ('query', 'allpages'), pop=True)
+            self.assertEqual(popped, entries)
+            self.assertEqual(document['query']['allpages'], [])
+            self.assertEqual(document['query-continue'],
+                    expected['query-continue'])
+
+    def test_pop_entries_of_object(self):
+        text = DOCUMENTS[7]
+        expected = json.loads(text)
+        document, popped = decode(split(text.encode('utf-8'), [5]),
+                ('query', 'pages'), pop=True)
+        self.assertEqual(sorted(popped, key=lambda page: page['title']),
+                sorted(expected['query']['pages'].values(),
+                key=lambda page: page['title']))
+        self.assertEqual(document, {'query': {'pages': {}}})
+
+    def test_malformed(self):
+        for data in MALFORMED:
+            for size in (1, 2, max(len(data), 1)):
+                stream = JsonStream(depth=2)
+                for piece in split(data, [size]):
+                    # never raises
+                    stream.write(piece)
+                stream.close()
+                self.assertRaises(ValueError, stream.get_document)
+
+    def test_incomplete_before_close(self):
+        stream = JsonStream()
+        stream.write(b'{"a": [1, 2]')
+        self.assertRaises(ValueError, stream.get_document)
+        stream.write(b'}')
+        stream.close()
+        self.assertEqual(stream.get_document(), {'a': [1, 2]})
+
+    def test_reset(self):
+        stream = JsonStream()
+        stream.write(b'{"broken"')
+        stream.close()
+        self.assertRaises(ValueError, stream.get_document)
+        stream.reset()
+        stream.write(b'[1]')
+        stream.close()
+        self.assertEqual(stream.get_document(), [1])
+
+    def test_head_and_bytes(self):
+        stream = JsonStream()
+        for piece in split(b'{"error": {"code": "x"}}', [4]):
+            stream.write(piece)
+        stream.close()
+        self.assertEqual(stream.get_head(), '{"error": {"code": "x"}}')
+        self.assertEqual(stream.get_bytes_written(), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import time
+import unittest
+
+from plagwiki.loaders.ratelimiter import RequestScheduler, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        # later than the creation of any bucket, which starts full
+        self.now = time.time() + 1000
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(2, burst=3)
+        for i in range(3):
+            self.assertEqual(bucket.reserve(self.now), 0)
+        self.assertAlmostEqual(bucket.reserve(self.now), 0.5)
+        self.assertAlmostEqual(bucket.reserve(self.now + 0.25), 0.25)
+        self.assertEqual(bucket.reserve(self.now + 0.5), 0)
+        self.assertAlmostEqual(bucket.reserve(self.now + 0.5), 0.5)
+
+    def test_refused_reserve_takes_no_token(self):
+        bucket = TokenBucket(1, burst=1)
+        self.assertEqual(bucket.reserve(self.now), 0)
+        for i in range(5):
+            self.assertTrue(bucket.reserve(self.now + 0.5) > 0)
+        self.assertEqual(bucket.reserve(self.now + 1), 0)
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(10, burst=2)
+        self.assertEqual(bucket.reserve(self.now), 0)
+        self.assertEqual(bucket.reserve(self.now + 100), 0)
+        self.assertEqual(bucket.reserve(self.now + 100), 0)
+        self.assertTrue(bucket.reserve(self.now + 100) > 0)
+
+    def test_release(self):
+        bucket = TokenBucket(1, burst=1)
+        self.assertEqual(bucket.reserve(self.now), 0)
+        bucket.release()
+        self.assertEqual(bucket.reserve(self.now), 0)
+        # never above the capacity
+        bucket.release()
+        bucket.release()
+        self.assertEqual(bucket.reserve(self.now), 0)
+        self.assertTrue(bucket.reserve(self.now) > 0)
+
+    def test_default_burst(self):
+        self.assertEqual(TokenBucket(0.5).burst, 1)
+        self.assertEqual(TokenBucket(5).burst, 5)
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = time.time() + 1000
+
+    def test_separate_buckets(self):
+        scheduler = RequestScheduler(read_rate=1, write_rate=1)
+        self.assertEqual(scheduler.reserve('read', self.now), 0)
+        self.assertEqual(scheduler.reserve('write', self.now), 0)
+        self.assertTrue(scheduler.reserve('read', self.now) > 0)
+        self.assertTrue(scheduler.reserve('write', self.now) > 0)
+
+    def test_unlimited(self):
+        scheduler = RequestScheduler()
+        for i in range(100):
+            self.assertEqual(scheduler.reserve('write', self.now), 0)
+
+    def test_release(self):
+        scheduler = RequestScheduler(write_rate=1)
+        self.assertEqual(scheduler.reserve('write', self.now), 0)
+        scheduler.release('write')
+        self.assertEqual(scheduler.reserve('write', self.now), 0)
+
+    def test_backoff_holds_back_all_requests(self):
+        scheduler = RequestScheduler()
+        scheduler.backoff(2000)
+        self.assertTrue(scheduler.reserve('read', self.now) > 0)
+        self.assertTrue(scheduler.reserve('write', self.now) > 0)
+
+    def test_request_kind(self):
+        scheduler = RequestScheduler()
+        self.assertEqual(scheduler.request_kind({'action': 'edit'}), 'write')
+        self.assertEqual(scheduler.request_kind({'action': 'query'}), 'read')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import time
+import unittest
+
+from plagwiki.fakewiki.corpus import Corpus
+from plagwiki.fakewiki.server import FakeWikiServer
+from plagwiki.loaders.curlengine import CurlRequest
+from plagwiki.loaders.retrypolicy import CircuitBreaker, RetryPolicy
+from plagwiki.loaders.wikiclient import WikiClient
+from plagwiki.loaders.wikierror import WikiError
+
+
+def make_request(kind='read', response_code=200, errno=None):
+    request = CurlRequest('http://localhost/api.php', [], kind=kind)
+    request.response_code = response_code
+    if errno is not None:
+        request.response_code = None
+        request.errno = errno
+        request.error = 'Error while accessing http://localhost/api.php: failed'
+    return request
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_reads_are_idempotent(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_idempotent({'action': 'query'}, 'read'))
+        self.assertTrue(policy.is_idempotent({'action': 'purge'}, 'write'))
+
+    def test_edit_idempotent_only_with_md5_and_base(self):
+        policy = RetryPolicy()
+        kw = {'action': 'edit', 'md5': 'abc'}
+        self.assertFalse(policy.is_idempotent(kw, 'write'))
+        self.assertTrue(policy.is_idempotent(dict(kw,
+                basetimestamp='2011-01-01T00:00:00Z'), 'write'))
+        self.assertTrue(policy.is_idempotent(dict(kw, createonly=True),
+                'write'))
+        self.assertFalse(policy.is_idempotent({'action': 'edit',
+                'basetimestamp': '2011-01-01T00:00:00Z'}, 'write'))
+
+    def test_upload_idempotent_only_for_chunks(self):
+        policy = RetryPolicy()
+        self.assertFalse(policy.is_idempotent({'action': 'upload'}, 'write'))
+        self.assertTrue(policy.is_idempotent({'action': 'upload',
+                'offset': 0}, 'write'))
+
+    def test_transient_failures(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_transient(make_request(response_code=503)))
+        self.assertTrue(policy.is_transient(make_request(errno=28)))
+        self.assertFalse(policy.is_transient(make_request(response_code=200)))
+        self.assertFalse(policy.is_transient(make_request(response_code=404)))
+
+    def test_retry_delay_attempts(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=60)
+        request = make_request(response_code=503)
+        kw = {'action': 'query'}
+        for attempt in (1, 2):
+            delay = policy.retry_delay(request, kw, attempt, None)
+            self.assertTrue(0 <= delay <= 0.5 * 2 ** (attempt - 1))
+        self.assertIsNone(policy.retry_delay(request, kw, 3, None))
+        self.assertIsNone(policy.retry_delay(make_request(), kw, 1, None))
+
+    def test_retry_delay_respects_deadline(self):
+        policy = RetryPolicy(base_delay=0)
+        request = make_request(response_code=503)
+        self.assertIsNone(policy.retry_delay(request, {'action': 'query'}, 1,
+                time.time() - 1))
+
+    def test_non_idempotent_write_retried_only_before_sending(self):
+        policy = RetryPolicy(base_delay=0)
+        kw = {'action': 'edit', 'md5': 'abc'}
+        self.assertIsNone(policy.retry_delay(
+                make_request('write', errno=28), kw, 1, None))
+        self.assertIsNone(policy.retry_delay(
+                make_request('write', response_code=502), kw, 1, None))
+        # could not connect, so the server never saw the request
+        self.assertEqual(policy.retry_delay(
+                make_request('write', errno=7), kw, 1, None), 0)
+
+    def test_request_timeout(self):
+        policy = RetryPolicy(timeout=120)
+        self.assertEqual(policy.request_timeout(None), 120)
+        self.assertEqual(policy.request_timeout(1000 + 30, now=1000), 30)
+        self.assertEqual(policy.request_timeout(1000 + 30, now=1000,
+                upload_size=16 * 1024 * 10), 40)
+        self.assertIsNone(RetryPolicy(timeout=None,
+                deadline=None).request_timeout(None))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        for i in range(2):
+            breaker.record_failure(now=1000)
+        self.assertEqual(breaker.get_state(), 'closed')
+        self.assertEqual(breaker.reserve(now=1000), 0)
+        breaker.record_failure(now=1000)
+        self.assertEqual(breaker.get_wait(now=1010), 20)
+        self.assertEqual(breaker.reserve(now=1010), 20)
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure(now=1000)
+        breaker.record_success()
+        breaker.record_failure(now=1000)
+        self.assertEqual(breaker.get_wait(now=1000), 0)
+
+    def test_single_probe_when_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure(now=1000)
+        self.assertEqual(breaker.reserve(now=1030), 0)
+        # the others wait for the outcome of the probe
+        self.assertTrue(breaker.reserve(now=1030) > 0)
+        breaker.record_success()
+        self.assertEqual(breaker.get_state(), 'closed')
+        self.assertEqual(breaker.reserve(now=1031), 0)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure(now=1000)
+        self.assertEqual(breaker.reserve(now=1030), 0)
+        breaker.record_failure(now=1030)
+        self.assertEqual(breaker.get_wait(now=1030), 30)
+        self.assertEqual(breaker.reserve(now=1059), 1)
+
+    def test_half_open_state(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.get_state(), 'half-open')
+
+
+class ClientRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeWikiServer(Corpus.synthetic(5, 100))
+        self.server.start()
+        self.client = WikiClient(self.server.get_api_url())
+        self.client.set_retry_policy(RetryPolicy(max_attempts=3,
+                base_delay=0.01))
+        self.client.login('FakeBot', 'secret')
+        self.title = 'Fakeplag/Fragment 001 01'
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_read_retried(self):
+        self.server.fail_next(2)
+        self.assertEqual(self.client.get_page_info(self.title)['title'],
+                self.title)
+
+    def test_read_gives_up_after_max_attempts(self):
+        self.server.fail_next(3)
+        self.assertRaises(WikiError, self.client.get_page_info, self.title)
+
+    def test_edit_without_base_not_retried(self):
+        self.client.request_edittoken()
+        self.server.fail_next(1, 500)
+        self.assertRaises(WikiError, self.client.edit, self.title, 'new text')
+
+    def test_edit_with_base_retried(self):
+        page = self.client.get_page_info(self.title)
+        basetimestamp = page['revisions'][0]['timestamp']
+        self.client.request_edittoken()
+        self.server.fail_next(1, 500)
+        self.client.edit(self.title, 'new text', basetimestamp=basetimestamp)
+        page = self.client.get_page_info(self.title)
+        self.assertEqual(page['revisions'][0]['*'], 'new text')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ease eventual Python 3 transition
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+from plagwiki.loaders.titleindex import TitleIndex, natsort_key
+
+
+class NatsortKeyTest(unittest.TestCase):
+
+    def test_numbers_sort_numerically(self):
+        titles = ['Seite 10', 'Seite 9', 'Seite 100', 'Seite 1']
+        self.assertEqual(sorted(titles, key=natsort_key),
+                ['Seite 1', 'Seite 9', 'Seite 10', 'Seite 100'])
+
+    def test_several_numbers(self):
+        titles = ['Fragment 12 01', 'Fragment 2 10', 'Fragment 2 9']
+        self.assertEqual(sorted(titles, key=natsort_key),
+                ['Fragment 2 9', 'Fragment 2 10', 'Fragment 12 01'])
+
+    def test_chunks(self):
+        self.assertEqual(natsort_key('a1b22'), ('a', 1, 'b', 22))
+        self.assertEqual(natsort_key('7'), (7,))
+        self.assertEqual(natsort_key(''), ())
+
+
+class TitleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.titles = ['Fragment %d %02d' % (page, line)
+                for page in (1, 2, 3, 9, 10, 11, 19, 20, 100, 101, 110)
+                for line in (1, 5, 10)]
+        self.titles += ['Fragment 007 01', 'Fragment 01 01', 'Fragment',
+                'Fragmente', 'Fragment x', 'Quelle:Meier 2001', 'Seite 1']
+
+    def sort_key(self, title):
+        # equal keys (e.g. with leading zeros) are ordered by title
+        return (natsort_key(title), title)
+
+    def make_index(self):
+        return TitleIndex([{'title': title, 'pageid': pageid}
+                for pageid, title in enumerate(reversed(self.titles), 1)])
+
+    def test_sorted(self):
+        index = self.make_index()
+        self.assertEqual(index.get_titles(),
+                sorted(self.titles, key=self.sort_key))
+        self.assertEqual(len(index), len(self.titles))
+
+    def test_prefix_matches_brute_force(self):
+        index = self.make_index()
+        expected_order = sorted(self.titles, key=self.sort_key)
+        for prefix in ('', 'F', 'Fragment', 'Fragment ', 'Fragment 1',
+                'Fragment 10', 'Fragment 1 ', 'Fragment 1 0', 'Fragment 11',
+                'Fragment 2', 'Fragment 0', 'Fragment 00', 'Fragment 007',
+                'Fragment 1000', 'Fragment x', 'Fragmente', 'Quelle:',
+                'Seite', 'Zzz'):
+            expected = [title for title in expected_order
+                    if title.startswith(prefix)]
+            self.assertEqual([item['title'] for item in index.get_prefix(prefix)],
+                    expected, prefix)
+
+    def test_lookups(self):
+        index = self.make_index()
+        self.assertTrue('Fragment 2 05' in index)
+        self.assertFalse('Fragment 2 5' in index)
+        item = index.get_by_title('Seite 1')
+        self.assertEqual(index.get_by_id(item['pageid']), item)
+        self.assertIsNone(index.get_by_title('Nothing'))
+
+    def test_add_and_merge_replace(self):
+        index = TitleIndex(['Seite 10', 'Seite 2'], title_key=None)
+        index.add('Seite 1')
+        index.merge(['Seite 3', 'Seite 2', 'Seite 20'])
+        self.assertEqual(index.get_titles(),
+                ['Seite 1', 'Seite 2', 'Seite 3', 'Seite 10', 'Seite 20'])
+
+    def test_replaced_item_updates_id(self):
+        index = TitleIndex([{'title': 'A', 'pageid': 1}])
+        index.merge([{'title': 'A', 'pageid': 2}])
+        self.assertEqual(len(index), 1)
+        self.assertIsNone(index.get_by_id(1))
+        self.assertEqual(index.get_by_id(2)['title'], 'A')
+
+
+if __name__ == '__main__':
+    unittest.main()